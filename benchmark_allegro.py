@@ -0,0 +1,240 @@
+''' Benchmarks of the perception and decision hot paths of robot_allegro.py on synthetic scenes.
+
+    Every benchmark times one step on a synthetic depth image or on synthetic grasp candidates, so the suite
+    runs without a camera, a robot or model weights. The benchmarks whose dependencies are not installed are
+    reported as skipped.
+
+    python benchmark_allegro.py --save logs/benchmark/baseline.json
+    python benchmark_allegro.py --compare logs/benchmark/baseline.json
+'''
+import os
+import sys
+import copy
+import argparse
+import numpy as np
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = BASE_DIR
+sys.path.append(os.path.join(ROOT_DIR, 'utils'))
+from grasp_benchmark import register, require, get_benchmarks, run_benchmarks, save_results, load_results, \
+                            compare_results, format_comparison, synthetic_depth, depth_to_cloud, synthetic_grasp_array, \
+                            synthetic_end_points, synthetic_templates
+from np_utils import sparse_quantize
+import pt_utils
+from pt_utils import decode_grasp_preds, canonicalize_grasp_preds_features
+from grasp_selection import select_top_per_type
+
+parser = argparse.ArgumentParser(description='Benchmark the grasp detection steps on synthetic scenes.')
+parser.add_argument('benchmarks', nargs='*', help='Run the benchmarks whose name holds one of these strings [default: all]')
+parser.add_argument('--list', action='store_true', help='List the benchmarks and exit.')
+parser.add_argument('--save', default=None, help='Json file to store the results as a baseline')
+parser.add_argument('--compare', default=None, help='Json baseline to compare the results to')
+parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown of the median counted as a regression [default: 0.2]')
+parser.add_argument('--min_time', type=float, default=0.5, help='Seconds every benchmark is timed at least [default: 0.5]')
+parser.add_argument('--min_rounds', type=int, default=5, help='Timed calls of every benchmark at least [default: 5]')
+parser.add_argument('--device', default='cpu', help='Torch device of the torch benchmarks [default: cpu]')
+parser.add_argument('--num_grasps', type=int, default=1024, help='Grasp candidates [default: 1024]')
+parser.add_argument('--num_candidates', type=int, default=256, help='Grasp candidates left for the collision check [default: 256]')
+parser.add_argument('--num_seed', type=int, default=2048, help='Seeds of the network per cloud [default: 2048]')
+parser.add_argument('--num_augment', type=int, default=11, help='Augmented clouds of a frame [default: 11]')
+parser.add_argument('--num_objects', type=int, default=12, help='Objects of the synthetic scene [default: 12]')
+parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic data [default: 0]')
+parser.add_argument('--Allegro_mesh_json_path', default='generate_mesh_and_pointcloud/allegro_urdf', help='Allegro meshes and json path')
+
+INTRINSICS = (913.232, 912.452, 628.847, 350.771)
+VOXEL_SIZE = 0.005
+MAX_GRASP_WIDTH = 0.11
+MIN_GRASP_WIDTH = 0.04
+Allegro_VOXElGRID = 0.003
+APPROACH_DISTANCE = 0.08
+# the arguments that change what is timed, a baseline is only comparable if they match
+SIZE_ARGS = ('device', 'num_grasps', 'num_candidates', 'num_seed', 'num_augment', 'num_objects', 'seed')
+
+_SCENES = dict()
+
+def get_scene(cfgs):
+    ''' Synthetic depth image, its points and its points down sampled as in get_grasps, built once per seed. '''
+    key = (cfgs.seed, cfgs.num_objects)
+    if key not in _SCENES:
+        depths = synthetic_depth(*(1280, 720) + INTRINSICS, num_objects=cfgs.num_objects, seed=cfgs.seed)
+        points = depth_to_cloud(depths, *INTRINSICS)
+        points_down = points[sparse_quantize(np.ascontiguousarray(points / VOXEL_SIZE, dtype=int))]
+        _SCENES[key] = {'depths': depths, 'points': points, 'points_down': points_down}
+    return _SCENES[key]
+
+def get_augment_mats(cfgs):
+    ''' The identity and num_augment - 1 random rotations about the camera axis, every other one flipped. '''
+    rng = np.random.default_rng(cfgs.seed)
+    augment_mats = [np.eye(4)]
+    for i in range(cfgs.num_augment - 1):
+        angle = rng.uniform(-np.pi / 6, np.pi / 6)
+        c, s = np.cos(angle), np.sin(angle)
+        augment_mat = np.array([[c, -s, 0, rng.uniform(-0.05, 0.05)], [s, c, 0, rng.uniform(-0.05, 0.05)],
+                                [0, 0, 1, 0], [0, 0, 0, 1]])
+        if i % 2 == 1:
+            augment_mat[:, 0] = -augment_mat[:, 0]
+        augment_mats.append(augment_mat)
+    return np.stack(augment_mats).astype(np.float32)
+
+def get_allegro_grasps(cfgs, num_grasps):
+    ''' Synthetic two-fingers GraspGroup on the scene and its AllegroGraspGroup of random grasp types. '''
+    graspnetAPI = require('graspnetAPI')
+    allegro = require('ur_toolbox.robot.Allegro.Allegro_grasp')
+    rng = np.random.default_rng(cfgs.seed)
+    ggarray = synthetic_grasp_array(num_grasps, get_scene(cfgs)['points_down'], seed=cfgs.seed)
+    two_fingers_ggarray = graspnetAPI.GraspGroup(ggarray.astype(np.float64))
+    allegro_types = rng.choice([int(t) for t in allegro.grasp_types], num_grasps)
+    Allegro_ggarray = allegro.AllegroGraspGroup().from_graspgroup(two_fingers_ggarray, allegro_types,
+                                                                  cfgs.Allegro_mesh_json_path)
+    Allegro_ggarray.depths = Allegro_ggarray.depths + rng.choice([0.0, 0.01, 0.02, 0.03], num_grasps)
+    return two_fingers_ggarray, Allegro_ggarray
+
+@register('deprojection')
+def bench_deprojection(cfgs):
+    camera = require('ur_toolbox.camera')
+    projector = camera.get_depth_projector(*INTRINSICS)
+    depths = get_scene(cfgs)['depths']
+    return lambda: projector.project(depths, z_range=(0.2, 0.65))
+
+@register('preprocess')
+def bench_preprocess(cfgs):
+    ''' The voxelization of the augmented clouds of get_grasps, up to the sparse tensor. '''
+    points = get_scene(cfgs)['points']
+    augment_mats = get_augment_mats(cfgs)
+    def run():
+        batch_ids = np.repeat(np.arange(len(augment_mats)), len(points))
+        points_batch = np.matmul(points[np.newaxis], augment_mats[:, :3, :3].transpose(0, 2, 1)) + augment_mats[:, np.newaxis, :3, 3]
+        points_batch = points_batch.reshape((-1, 3)).astype(np.float32)
+        coords = np.ascontiguousarray(points_batch / VOXEL_SIZE, dtype=int)
+        coords = np.concatenate([batch_ids[:, np.newaxis], coords], axis=1)
+        idxs = sparse_quantize(coords)
+        return torch.from_numpy(coords[idxs]).int(), torch.from_numpy(points_batch[idxs])
+    return run
+
+@register('sparse_quantize', params=('numpy', 'torch', 'minkowski', 'np.unique'))
+def bench_sparse_quantize(cfgs, backend):
+    ''' The voxel quantizers on the coords of one cloud. '''
+    coords = np.ascontiguousarray(get_scene(cfgs)['points'] / VOXEL_SIZE, dtype=int)
+    if backend == 'numpy':
+        return lambda: sparse_quantize(coords)
+    if backend == 'torch':
+        coords = torch.from_numpy(coords).to(cfgs.device)
+        return lambda: pt_utils.sparse_quantize(coords)
+    if backend == 'minkowski':
+        ME = require('MinkowskiEngine')
+        return lambda: ME.utils.sparse_quantize(coords, return_index=True)
+    return lambda: np.unique(coords, axis=0, return_index=True)
+
+@register('decode_grasp_preds')
+def bench_decode_grasp_preds(cfgs):
+    end_points = synthetic_end_points(batch_size=cfgs.num_augment, num_seed=cfgs.num_seed, device=cfgs.device,
+                                      seed=cfgs.seed)
+    return lambda: decode_grasp_preds(end_points, MAX_GRASP_WIDTH)
+
+@register('canonicalize_features', params=('numpy', 'torch'))
+def bench_canonicalize_features(cfgs, backend):
+    rng = np.random.default_rng(cfgs.seed)
+    grasp_preds_features = rng.random((cfgs.num_grasps, 480), dtype=np.float32)
+    grasp_angles = rng.integers(0, 48, cfgs.num_grasps)
+    if_flip = rng.random(cfgs.num_grasps) < 0.5
+    if backend == 'torch':
+        grasp_preds_features = torch.from_numpy(grasp_preds_features).to(cfgs.device)
+        grasp_angles = torch.from_numpy(grasp_angles).to(cfgs.device)
+        if_flip = torch.from_numpy(if_flip).to(cfgs.device)
+    return lambda: canonicalize_grasp_preds_features(grasp_preds_features, grasp_angles, if_flip)
+
+@register('select_top_per_type', params=(2, 8, 32, 128, 512))
+def bench_select_top_per_type(cfgs, num_types):
+    ''' The per-type selection of the scored grasps, for a growing number of grasp types. '''
+    grasp_types = np.random.default_rng(cfgs.seed).integers(0, num_types, cfgs.num_grasps)
+    max_nums = np.full(num_types, 50)
+    return lambda: select_top_per_type(grasp_types, max_nums)
+
+@register('graspgroupTR_2_TR')
+def bench_graspgroupTR_2_TR(cfgs):
+    two_fingers_ggarray, Allegro_ggarray = get_allegro_grasps(cfgs, cfgs.num_grasps)
+    return lambda: Allegro_ggarray.graspgroupTR_2_TR(two_fingers_ggarray, cfgs.Allegro_mesh_json_path)
+
+@register('load_meshes_pcls')
+def bench_load_meshes_pcls(cfgs):
+    collision_detector = require('collision_detector')
+    two_fingers_ggarray, Allegro_ggarray = get_allegro_grasps(cfgs, cfgs.num_candidates)
+    mfcdetector = collision_detector.ModelFreeCollisionDetectorMultifinger(get_scene(cfgs)['points_down'], voxel_size=0.001)
+    _, _, keys = mfcdetector.get_hand_transforms(two_fingers_ggarray, Allegro_ggarray)
+    meshes_pcls = synthetic_templates(keys, seed=cfgs.seed)
+    return lambda: mfcdetector.load_meshes_pcls(meshes_pcls, two_fingers_ggarray, Allegro_ggarray)
+
+@register('collision_count')
+def bench_collision_count(cfgs):
+    ''' The voxel collision engine alone, on synthetic templates of 10 grasp types x 8 widths. '''
+    collision_detector = require('collision_detector')
+    rng = np.random.default_rng(cfgs.seed)
+    points_down = get_scene(cfgs)['points_down']
+    ggarray = synthetic_grasp_array(cfgs.num_candidates, points_down, seed=cfgs.seed).astype(np.float64)
+    rotations = ggarray[:, 4:13].reshape((-1, 3, 3))
+    directions = rotations[:, :, 0]
+    transforms = np.tile(np.eye(4), (cfgs.num_candidates, 1, 1))
+    transforms[:, :3, :3] = rotations
+    transforms[:, :3, 3] = ggarray[:, 13:16] + directions * ggarray[:, 3:4]
+    keys = ['type{}_{}'.format(t, w) for t, w in zip(rng.integers(0, 10, cfgs.num_candidates),
+                                                      rng.choice([4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 11.0], cfgs.num_candidates))]
+    meshes_pcls = synthetic_templates(keys, seed=cfgs.seed)
+    def run():
+        engine = collision_detector.VoxelCollisionEngine(points_down, meshes_pcls, device=cfgs.device)
+        return engine.count(transforms, directions, keys, Allegro_VOXElGRID, APPROACH_DISTANCE)
+    return run
+
+@register('collision_detect')
+def bench_collision_detect(cfgs):
+    ''' ModelFreeCollisionDetectorMultifinger.detect as filter_collisions calls it, the grasps are copied first. '''
+    collision_detector = require('collision_detector')
+    two_fingers_ggarray, Allegro_ggarray = get_allegro_grasps(cfgs, cfgs.num_candidates)
+    points_down = get_scene(cfgs)['points_down']
+    mfcdetector = collision_detector.ModelFreeCollisionDetectorMultifinger(points_down, voxel_size=0.001)
+    keys = [t + '_' + str(round(w / 10.0, 1)) for t in set(Allegro_ggarray.get_graspgroup_types_with_finger_names())
+            for w in range(0, 121)]
+    meshes_pcls = synthetic_templates(keys, seed=cfgs.seed)
+    def run():
+        return mfcdetector.detect(copy.deepcopy(Allegro_ggarray), copy.deepcopy(two_fingers_ggarray),
+                                  cfgs.Allegro_mesh_json_path, meshes_pcls, min_grasp_width=MIN_GRASP_WIDTH,
+                                  VoxelGrid=Allegro_VOXElGRID, approach_dist=APPROACH_DISTANCE, collision_thresh=1,
+                                  adjust_gripper_centers=True, device=cfgs.device)
+    return run
+
+@register('ur5_ik', params=('batch', 'loop'))
+def bench_ur5_ik(cfgs, backend):
+    ''' Closest UR5 IK solutions of the tcp poses of the collision free candidates. '''
+    ur_ik = require('ur_toolbox.robot.ur_ik')
+    rng = np.random.default_rng(cfgs.seed)
+    joints = rng.uniform(-np.pi, np.pi, (cfgs.num_candidates, 6))
+    poses = np.array([ur_ik.transformRobotParameter(q) for q in joints])
+    current = joints[0]
+    ik = ur_ik.InverseKinematicsUR5()
+    if backend == 'batch':
+        return lambda: ik.findClosestIKBatch(poses, current)
+    return lambda: [ik.findClosestIK(pose, current) for pose in poses]
+
+def main(cfgs):
+    benchmarks = get_benchmarks(cfgs.benchmarks)
+    if cfgs.list:
+        print('\n'.join(benchmarks))
+        return 0
+    cfgs.Allegro_mesh_json_path = os.path.join(ROOT_DIR, cfgs.Allegro_mesh_json_path)
+    results = run_benchmarks(benchmarks, cfgs, min_rounds=cfgs.min_rounds, min_time=cfgs.min_time)
+    config = {key: getattr(cfgs, key) for key in SIZE_ARGS}
+    if cfgs.save is not None:
+        save_results(cfgs.save, results, config)
+        print('saved the results to {}'.format(cfgs.save))
+    if cfgs.compare is not None:
+        baseline = load_results(cfgs.compare)
+        if baseline['config'] != config:
+            print('warning: the baseline was run with a different config {}'.format(baseline['config']))
+        rows = compare_results(results, baseline, threshold=cfgs.threshold)
+        print(format_comparison(rows))
+        if any(row[4] == 'REGRESSION' for row in rows):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
@@ -17,14 +17,13 @@ else:
 from torch.utils.data import Dataset
 from tqdm import tqdm
 
-import MinkowskiEngine as ME
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 from collision_detector import CollisionType
 from np_utils import transform_point_cloud, remove_invisible_grasp_points,\
-    create_point_cloud_from_depth_image, get_workspace_mask
+    create_point_cloud_from_depth_image, get_workspace_mask, sparse_quantize
+from pt_utils import sparse_collate
 
 MAX_GRIPPER_WIDTH = 0.08
 MAX_MU = 1.0
@@ -263,7 +262,7 @@ class GraspNetVoxelizationDataset(Dataset):
         # voxelization
         # Upd Note. Make coords contiguous.
         coords = np.ascontiguousarray(cloud_masked / self.voxel_size, dtype=np.int32)
-        _, idxs = ME.utils.sparse_quantize(coords, return_index=True)
+        idxs = sparse_quantize(coords)
         coords = coords[idxs]
         cloud_voxeled = cloud_masked[idxs]
         color_voxeled = color_masked[idxs]
@@ -334,7 +333,7 @@ class GraspNetVoxelizationDataset(Dataset):
         # voxelization
         # Upd Note. Make coords contiguous.
         coords = np.ascontiguousarray(cloud_masked / self.voxel_size, dtype=np.int32)
-        _, idxs = ME.utils.sparse_quantize(coords, return_index=True)
+        idxs = sparse_quantize(coords)
 
         # remove objects randomly
         if np.random.uniform() < 0.2 and int(scene[-3:]) not in IGNORED_SCENES:
@@ -450,10 +449,10 @@ def collate_fn(batch):
         feats_batch = ret_dict['feats']
         if 'objectness_label' in ret_dict:
             labels_batch = ret_dict['objectness_label']
-            coords_batch, feats_batch, labels_batch = ME.utils.sparse_collate(coords_batch, feats_batch, labels_batch)
+            coords_batch, feats_batch, labels_batch = sparse_collate(coords_batch, feats_batch, labels_batch)
             ret_dict['objectness_label'] = labels_batch
         else:
-            coords_batch, feats_batch = ME.utils.sparse_collate(coords_batch, feats_batch)
+            coords_batch, feats_batch = sparse_collate(coords_batch, feats_batch)
         ret_dict['coords'] = coords_batch
         ret_dict['feats'] = feats_batch
         return ret_dict
@@ -485,10 +484,10 @@ def multigpu_collate_fn(batch):
             feats_batch = ret_dicts[i]['feats']
             if 'objectness_label' in ret_dicts[i]:
                 labels_batch = ret_dicts[i]['objectness_label']
-                coords_batch, feats_batch, labels_batch = ME.utils.sparse_collate(coords_batch, feats_batch, labels_batch)
+                coords_batch, feats_batch, labels_batch = sparse_collate(coords_batch, feats_batch, labels_batch)
                 ret_dicts[i]['objectness_label'] = labels_batch
             else:
-                coords_batch, feats_batch = ME.utils.sparse_collate(coords_batch, feats_batch)
+                coords_batch, feats_batch = sparse_collate(coords_batch, feats_batch)
             ret_dicts[i]['coords'] = coords_batch
             ret_dicts[i]['feats'] = feats_batch
         return ret_dicts
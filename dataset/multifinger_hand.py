@@ -9,7 +9,6 @@ import torch
 import random
 import shutil
 from scipy.spatial.transform import Rotation
-import copy
 TORCH_MAJOR = int(torch.__version__.split('.')[0])
 TORCH_MINOR = int(torch.__version__.split('.')[1])
 
@@ -26,6 +25,7 @@ from torch.utils.data import Dataset
 from tqdm import tqdm
 from np_utils import transform_point_cloud, remove_invisible_grasp_points,\
     create_point_cloud_from_depth_image, get_workspace_mask
+from pt_utils import canonicalize_grasp_preds_features
 import MinkowskiEngine as ME
 
 MAX_GRIPPER_WIDTH = 0.1
@@ -45,6 +45,82 @@ class CameraInfo():
         self.cy = cy
         self.scale = scale
 
+MULTIFINGER_KEY_PREFIX = {'Inspire': 'InspiredHandR', 'DH3': 'DH3', 'Allegro': 'Allegro'}
+COLUMNS = {'grasp_preds_features': (np.float32, (480,)),
+           'two_fingers_pose_angle_type': (np.int32, ()),
+           'two_fingers_pose_depth_type': (np.int32, ()),
+           'multifinger_pose_finger_type': (np.int32, ()),
+           'multifinger_pose_depth_type': (np.int32, ()),
+           'if_flip': (np.int32, ()),
+           'result': (np.int32, ())}
+
+def get_information_json_path(root, dataset_type):
+    if dataset_type == "train":
+        return os.path.join(root.split('train_sr')[0], 'obj140.json')
+    elif dataset_type == "test":
+        return os.path.join(root.split('test_sr')[0], 'test_single_point.json')
+    raise ValueError("dataset type must be \"test\" or \"train\"")
+
+def get_columns_dir(information_json_file_name, multifinger_type):
+    return os.path.splitext(information_json_file_name)[0] + '_' + multifinger_type + '_columns'
+
+def get_column_keys(multifinger_type):
+    """ Column name -> key of that field in a record of the information json. """
+    prefix = MULTIFINGER_KEY_PREFIX[multifinger_type]
+    return {'grasp_preds_features': 'grasp_preds_features',
+            'two_fingers_pose_angle_type': 'two_fingers_pose_angle_type',
+            'two_fingers_pose_depth_type': 'two_fingers_pose_depth_type',
+            'multifinger_pose_finger_type': prefix + '_pose_finger_type',
+            'multifinger_pose_depth_type': prefix + '_pose_depth_type',
+            'if_flip': 'if_flip',
+            'result': 'result'}
+
+def fill_columns(columns, informations, multifinger_type):
+    """ Write the records of informations, in order, into rows 0.. of the preallocated columns. """
+    keys = get_column_keys(multifinger_type)
+    for row, information in enumerate(informations):
+        columns['grasp_preds_features'][row] = np.asarray(information['grasp_preds_features'], dtype=np.float32)[:480]
+        for name in COLUMNS:
+            if name != 'grasp_preds_features':
+                columns[name][row] = int(information[keys[name]])
+
+def convert_json_to_columns(information_json_file_name, multifinger_type='Inspire', columns_dir=None):
+    """ Convert an information json (e.g. obj140.json) into the columnar format.
+
+        Every column in COLUMNS is written as <columns_dir>/<column>.npy with one row per record,
+        in the order of the json, and manifest.json records the row count, the column dtypes/shapes
+        and the source json. The directory is written next to the old one and swapped in at the end.
+    """
+    if columns_dir is None:
+        columns_dir = get_columns_dir(information_json_file_name, multifinger_type)
+    with open(information_json_file_name) as f:
+        informations = json.load(f)
+
+    tmp_dir = columns_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    num_rows = len(informations)
+    columns = {name: np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'), mode='w+',
+                                               dtype=dtype, shape=(num_rows,) + shape)
+               for name, (dtype, shape) in COLUMNS.items()}
+    fill_columns(columns, informations.values(), multifinger_type)
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    manifest = {'num_rows': num_rows,
+                'multifinger_type': multifinger_type,
+                'source': os.path.abspath(information_json_file_name),
+                'source_mtime': os.path.getmtime(information_json_file_name),
+                'columns': {name: {'dtype': np.dtype(dtype).str, 'shape': list(shape)} for name, (dtype, shape) in COLUMNS.items()}}
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as handle:
+        handle.write(json.dumps(manifest, indent=4))
+    if os.path.exists(columns_dir):
+        shutil.rmtree(columns_dir)
+    os.replace(tmp_dir, columns_dir)
+    return columns_dir
+
 class MultifingerDataset(Dataset):
     def __init__(self, root, multifinger_type = 'Inspire', dataset_type = "train", train_type = 0, num_multifinger_type = 1):
         self.root = root
@@ -53,12 +129,7 @@ class MultifingerDataset(Dataset):
         self.train_type = train_type
         self.num_multifinger_type = num_multifinger_type
 
-        if self.dataset_type == "train":
-            information_json_file_name = os.path.join(root.split('train_sr')[0], 'obj140.json')
-        elif self.dataset_type == "test":
-            information_json_file_name = os.path.join(root.split('test_sr')[0], 'test_single_point.json')
-        else:
-            raise ValueError("dataset type must be \"test\" or \"train\"")
+        information_json_file_name = get_information_json_path(root, dataset_type)
         
         with open(information_json_file_name) as f:
             self.informations = json.load(f)
@@ -118,6 +189,12 @@ class MultifingerDataset(Dataset):
     def __len__(self):
         return len(self.data)
 
+    def get_columns(self):
+        """ Raw (uncanonicalized) columns of all samples, in the order of self.data. """
+        columns = {name: np.zeros((len(self.data),) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+        fill_columns(columns, (self.informations[item_dir] for item_dir in self.data), self.multifinger_type)
+        return columns
+
     def __getitem__(self, index):
         item_dir = self.data[index]
 
@@ -141,22 +218,8 @@ class MultifingerDataset(Dataset):
         ret_dict['if_flip'] = np.array([information['if_flip']]).astype(np.int32) # 1 for Flip and 0 for not
         grasp_preds_features = np.array(information['grasp_preds_features'], dtype = np.float32)[:480] # [480]
 
-        if ret_dict['if_flip']:
-            first_half_scores = copy.deepcopy(grasp_preds_features[:120])
-            last_half_scores = copy.deepcopy(grasp_preds_features[120:240])
-            first_half_widths = copy.deepcopy(grasp_preds_features[240:360])
-            last_half_widths = copy.deepcopy(grasp_preds_features[360:480])
-            grasp_preds_features[:120] = last_half_scores
-            grasp_preds_features[120:240] = first_half_scores
-            grasp_preds_features[240:360] = last_half_widths
-            grasp_preds_features[360:480] = first_half_widths
-
         new_type = 12+information["two_fingers_pose_angle_type"]*2
-        grasp_preds_features_rot = np.zeros(grasp_preds_features.shape, dtype = np.float32)
-        grasp_preds_features_rot[:240-new_type*5] = grasp_preds_features[new_type*5:240]
-        grasp_preds_features_rot[240-new_type*5:240] = grasp_preds_features[0:new_type*5]
-        grasp_preds_features_rot[240:480-new_type*5] = grasp_preds_features[240+new_type*5:480]
-        grasp_preds_features_rot[480-new_type*5:480] = grasp_preds_features[240:240+new_type*5]
+        grasp_preds_features_rot = canonicalize_grasp_preds_features(grasp_preds_features, new_type, ret_dict['if_flip'][0])
         
         ret_dict['grasp_preds_features'] = grasp_preds_features_rot[:480] # [480]
         
@@ -165,6 +228,109 @@ class MultifingerDataset(Dataset):
 
 
 
+class MultifingerColumnarDataset(MultifingerDataset):
+    """ MultifingerDataset backed by the memory-mapped columns of convert_json_to_columns.
+
+        The columns are converted on first use (or when the json is newer) and opened lazily
+        in every process, so DataLoader workers share one page-cached mapping.
+        Rows are selected and shuffled exactly as in MultifingerDataset.
+    """
+    def __init__(self, root, multifinger_type = 'Inspire', dataset_type = "train", train_type = 0, num_multifinger_type = 1):
+        self.root = root
+        self.multifinger_type = multifinger_type
+        self.dataset_type = dataset_type
+        self.train_type = train_type
+        self.num_multifinger_type = num_multifinger_type
+
+        information_json_file_name = get_information_json_path(root, dataset_type)
+        self.columns_dir = get_columns_dir(information_json_file_name, multifinger_type)
+        manifest_path = os.path.join(self.columns_dir, 'manifest.json')
+        if not os.path.exists(manifest_path) or \
+                os.path.getmtime(information_json_file_name) > os.path.getmtime(manifest_path):
+            convert_json_to_columns(information_json_file_name, multifinger_type, self.columns_dir)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self._columns = None
+
+        true_number, false_number, grasp_type, selected = self.get_true_false_rate()
+        print(self.dataset_type, ' num, true, false, rate: ', true_number, false_number, true_number/false_number)
+        print('data grasp type distribution: \n', grasp_type)
+
+        self.data = np.flatnonzero(selected)
+        if self.dataset_type == "train":
+            self.data = self.data[:100]
+        print('len of dataset is:', len(self.data))
+        random.shuffle(self.data)
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = {name: np.load(os.path.join(self.columns_dir, name + '.npy'), mmap_mode='r')
+                             for name in self.manifest['columns']}
+        return self._columns
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = None
+        return state
+
+    def get_true_false_rate(self):
+        selected = self.columns['multifinger_pose_finger_type'] == int(self.train_type)
+        result = self.columns['result'][selected].astype(bool)
+        depth_type = self.columns['multifinger_pose_depth_type'][selected]
+        grasp_type = [[int(np.sum(result & (depth_type == d))), int(np.sum(~result & (depth_type == d))),
+                       int(np.sum(depth_type == d))] for d in range(4)]
+        return int(result.sum()), int((~result).sum()), grasp_type, selected
+
+    def get_columns(self):
+        return {name: np.asarray(column[self.data]) for name, column in self.columns.items()}
+
+    def get_rows(self, start, stop):
+        """ Zero-copy views of the raw columns for rows [start, stop) of the file. """
+        return {name: column[start:stop] for name, column in self.columns.items()}
+
+    def get_batch(self, index):
+        """ Samples self.data[index] as one batch: (B, 1) labels and (B, 480) canonicalized features. """
+        rows = self.data[index]
+        ret_dict = {name: np.asarray(column[rows]).reshape((len(rows), -1)) for name, column in self.columns.items()}
+        ret_dict['grasp_preds_features'] = canonicalize_grasp_preds_features(ret_dict['grasp_preds_features'],
+                                                                            12 + ret_dict['two_fingers_pose_angle_type'][:, 0] * 2,
+                                                                            ret_dict['if_flip'][:, 0])
+        return ret_dict
+
+    def __getitem__(self, index):
+        return {name: value[0] for name, value in self.get_batch(np.array([index])).items()}
+
+class ResidentMultifingerData():
+    """ A whole multifinger dataset held as contiguous tensors on one device.
+
+        The features are canonicalized once, as a single batched gather over all samples, and every
+        epoch is batched with an index permutation drawn on the device, so training needs no
+        DataLoader workers, collate_fn or host to device copies.
+    """
+    def __init__(self, dataset, device):
+        columns = dataset.get_columns()
+        self.device = torch.device(device)
+        self.tensors = {name: torch.from_numpy(column.reshape((len(column), -1))).to(self.device)
+                        for name, column in columns.items()}
+        self.tensors['grasp_preds_features'] = canonicalize_grasp_preds_features(
+            self.tensors['grasp_preds_features'],
+            12 + self.tensors['two_fingers_pose_angle_type'][:, 0] * 2,
+            self.tensors['if_flip'][:, 0]).contiguous()
+
+    def __len__(self):
+        return len(self.tensors['result'])
+
+    def batches(self, batch_size, shuffle=False):
+        """ Yield dicts of (B, 1) int32 labels and (B, 480) float32 features, like collate_fn on the device. """
+        if shuffle:
+            index = torch.randperm(len(self), device=self.device)
+        else:
+            index = torch.arange(len(self), device=self.device)
+        for batch_index in torch.split(index, batch_size):
+            yield {name: tensor.index_select(0, batch_index) for name, tensor in self.tensors.items()}
+
+
 def collate_fn(batch):
     if type(batch[0]).__module__ == 'numpy':
         return [torch.from_numpy(b) for b in batch]
@@ -192,3 +358,11 @@ def convert_data_to_gpu(data):
         ret_dict[key] = convert_data_to_device(data[key], "cuda:0")
     return ret_dict
 
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert an information json into the memory-mapped columnar format.')
+    parser.add_argument('json_path', help='information json, e.g. obj140.json or test_single_point.json')
+    parser.add_argument('--multifinger_type', default='Inspire', help='Inspire, DH3 or Allegro')
+    parser.add_argument('--columns_dir', default=None, help='output directory [default: <json>_<multifinger_type>_columns]')
+    args = parser.parse_args()
+    print(convert_json_to_columns(args.json_path, args.multifinger_type, args.columns_dir))
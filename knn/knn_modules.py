@@ -1,9 +1,6 @@
 import unittest
 import gc
-import operator as op
-import functools
 import torch
-from torch.autograd import Variable, Function
 from knn_pytorch import knn_pytorch
 # import knn_pytorch
 def knn(ref, query, k=1):
@@ -20,19 +17,27 @@ def knn(ref, query, k=1):
 class TestKNearestNeighbor(unittest.TestCase):
 
   def test_forward(self):
-    knn = KNearestNeighbor(2)
-    while(1):
-        D, N, M = 128, 100, 1000
-        ref = Variable(torch.rand(2, D, N))
-        query = Variable(torch.rand(2, D, M))
+    D, N, M, k = 3, 100, 1000, 2
+    ref = torch.rand(2, D, N)
+    query = torch.rand(2, D, M)
+    inds = knn(ref, query, k=k)
+    self.assertEqual(inds.shape, (2, k, M))
+    # the indices are 1-based
+    dists = torch.cdist(query.transpose(1, 2), ref.transpose(1, 2))
+    expected = torch.topk(dists, k, dim=2, largest=False)[1].transpose(1, 2) + 1
+    self.assertTrue(torch.equal(inds[:, 0], expected[:, 0]))
 
-        inds = knn(ref, query)
-        for obj in gc.get_objects():
-            if torch.is_tensor(obj):
-                print(functools.reduce(op.mul, obj.size()) if len(obj.size()) > 0 else 0, type(obj), obj.size())
-        #ref = ref.cpu()
-        #query = query.cpu()
-        print(inds)
+  def test_repeated_calls(self):
+    # repeated calls must not keep any tensor alive
+    ref = torch.rand(2, 128, 100)
+    query = torch.rand(2, 128, 1000)
+    knn(ref, query)
+    gc.collect()
+    num_tensors = sum(1 for obj in gc.get_objects() if torch.is_tensor(obj))
+    for _ in range(20):
+      knn(ref, query)
+    gc.collect()
+    self.assertLessEqual(sum(1 for obj in gc.get_objects() if torch.is_tensor(obj)), num_tensors)
 
 
 if __name__ == '__main__':
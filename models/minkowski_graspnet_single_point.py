@@ -71,18 +71,33 @@ class ViewEstimator(nn.Module):
             assert(obj_mask is not None)
             assert(heatmap is not None)
         coords, feats = sfeat.C, sfeat.F
-        seed_xyz = []
-        seed_inds = []
-        seed_features = []
-        for i in range(len(cloud_list)):
-            cloud_mask = (coords[:,0] == i)
-            seed_inds_i = self.sample_grasp_points(cloud_list[i], obj_mask[cloud_mask], heatmap[cloud_mask])
-            seed_xyz.append(cloud_list[i][seed_inds_i])
-            seed_inds.append(seed_inds_i)
-            seed_features.append(feats[cloud_mask][seed_inds_i])
-        seed_xyz = torch.stack(seed_xyz, dim=0) #(B, Ns, 3)
-        seed_inds = torch.stack(seed_inds, dim=0) #(B, Ns)
-        seed_features = torch.stack(seed_features, dim=0)
+        if self.num_samples < 0:
+            seed_xyz = []
+            seed_inds = []
+            seed_features = []
+            for i in range(len(cloud_list)):
+                cloud_mask = (coords[:,0] == i)
+                seed_inds_i = self.sample_grasp_points(cloud_list[i], obj_mask[cloud_mask], heatmap[cloud_mask])
+                seed_xyz.append(cloud_list[i][seed_inds_i])
+                seed_inds.append(seed_inds_i)
+                seed_features.append(feats[cloud_mask][seed_inds_i])
+            seed_xyz = torch.stack(seed_xyz, dim=0) #(B, Ns, 3)
+            seed_inds = torch.stack(seed_inds, dim=0) #(B, Ns)
+            seed_features = torch.stack(seed_features, dim=0)
+        else:
+            # rows of sfeat grouped by batch index, in the order of the points of cloud_list
+            points = torch.cat(cloud_list, dim=0)
+            rows = torch.argsort(coords[:,0].to(points.device), stable=True)
+            counts = torch.tensor([cloud.size(0) for cloud in cloud_list], device=points.device)
+            offsets = F.pad(torch.cumsum(counts, dim=0), (1, 0))
+            if obj_mask is not None:
+                obj_mask = obj_mask[rows]
+            if heatmap is not None:
+                heatmap = heatmap[rows]
+            seed_rows = self.sample_grasp_points_batch(points, offsets, obj_mask, heatmap) #(B, Ns)
+            seed_xyz = points[seed_rows] #(B, Ns, 3)
+            seed_inds = seed_rows - offsets[:-1].unsqueeze(1) #(B, Ns)
+            seed_features = feats[rows[seed_rows]]
         seed_features = seed_features.transpose(1, 2).contiguous() #(B, C, Ns)
         point_features = seed_features
 
@@ -95,6 +110,76 @@ class ViewEstimator(nn.Module):
 
         return out, seed_xyz, seed_inds, seed_features, point_features
 
+    def sample_grasp_points_batch(self, points, offsets, obj_mask=None, heatmap=None):
+        """ Seed sampling of all the clouds of a batch at once, same strategies as sample_grasp_points.
+
+        points: (N, 3) points of the clouds concatenated
+        offsets: (B+1,) the points of cloud i are points[offsets[i]:offsets[i+1]]
+        obj_mask, heatmap: (N,) in the order of points
+        return: (B, num_samples) seed indices into points
+        """
+        num_samples = self.num_samples
+        B = offsets.size(0) - 1
+        device = points.device
+        counts = offsets[1:] - offsets[:-1]
+        batch = torch.repeat_interleave(torch.arange(B, device=device), counts)
+        # per cloud: seeds ranked by a key, or sampled by FPS over the points in fps_mask
+        if 'heatmap' in self.sampling:
+            assert obj_mask is not None, "variable 'obj_mask' is required"
+            assert heatmap is not None, "variable 'heatmap' is required"
+            cand_mask = obj_mask & (heatmap > self.heatmap_th)
+            obj_counts = torch.bincount(batch[obj_mask], minlength=B)
+            cand_counts = torch.bincount(batch[cand_mask], minlength=B)
+            # fallback: top heatmap scores of the cloud, or of the object points if there are enough
+            fallback = (cand_counts <= num_samples)
+            obj_only = (obj_counts > num_samples)
+            key = heatmap.masked_fill(obj_only[batch] & ~obj_mask, float('-inf'))
+            num_valid = torch.where(obj_only, obj_counts, counts).clamp(max=num_samples)
+            if self.sampling == 'heatmap_fps':
+                ranked = fallback
+                fps_mask = cand_mask & ~fallback[batch]
+            elif self.sampling == 'heatmap_random':
+                ranked = torch.ones_like(fallback)
+                rand_key = torch.rand(points.size(0), device=device).masked_fill(~cand_mask, float('-inf'))
+                key = torch.where(fallback[batch], key, rand_key)
+                num_valid = torch.where(fallback, num_valid, num_samples)
+            else:
+                print('Unknown sampling strategy: %s. Exiting!'%(self.sampling))
+                exit()
+        elif self.sampling == 'fps':
+            ranked = torch.zeros_like(counts, dtype=torch.bool)
+            fps_mask = torch.ones_like(batch, dtype=torch.bool)
+            num_valid = torch.full_like(counts, num_samples)
+        elif self.sampling == 'random':
+            ranked = torch.ones_like(counts, dtype=torch.bool)
+            key = torch.rand(points.size(0), device=device)
+            num_valid = counts.clamp(max=num_samples)
+        else:
+            print('Unknown sampling strategy: %s. Exiting!'%(self.sampling))
+            exit()
+
+        slots = torch.arange(num_samples, device=device)
+        seed_inds = torch.zeros((B, num_samples), dtype=torch.long, device=device)
+        if not ranked.all():
+            # one FPS call over the points of all the clouds, segmented by cloud
+            fps_inds = torch.where(fps_mask)[0]
+            fps_offsets = F.pad(torch.cumsum(torch.bincount(batch[fps_inds], minlength=B), dim=0), (1, 0))
+            fps_local = pointnet2_utils.furthest_point_sample_segments(
+                points[fps_inds].contiguous(), fps_offsets.int(), num_samples).long()
+            fps_seeds = fps_inds[(fps_offsets[:-1].unsqueeze(1) + fps_local).clamp(max=fps_inds.size(0)-1)]
+            seed_inds = torch.where(ranked.unsqueeze(1), seed_inds, fps_seeds)
+            num_valid = torch.where(ranked, num_valid, num_samples)
+        if ranked.any():
+            # descending key within each cloud: sort by key, then stable sort by cloud
+            order = torch.argsort(key, descending=True)
+            order = order[torch.argsort(batch[order], stable=True)]
+            top = order[(offsets[:-1].unsqueeze(1) + slots).clamp(max=points.size(0)-1)]
+            seed_inds = torch.where(ranked.unsqueeze(1), top, seed_inds)
+        # pad the clouds with fewer seeds by repeating random seeds
+        padding = (torch.rand((B, num_samples), device=device) * num_valid.unsqueeze(1)).long()
+        seed_inds = torch.where(slots < num_valid.unsqueeze(1), seed_inds, torch.gather(seed_inds, 1, padding))
+        return seed_inds
+
     def sample_grasp_points(self, points, obj_mask=None, heatmap=None):
         # return all point indices if self.num_sample < 0
         if self.num_samples < 0:
@@ -354,3 +439,48 @@ class MinkowskiGraspNetMultifingerType1Inference(nn.Module):
         grasp_preds = F.relu(self.bn6(self.conv6(grasp_preds)), inplace=True)
         grasp_preds = F.relu((self.dropout3(self.bn7(self.conv7(grasp_preds)))), inplace=True).transpose(1,2).contiguous()
         return grasp_preds, grasp_preds_features
+
+class MinkowskiGraspNetMultifingerEnsembleInference(nn.Module):
+    """ Fused inference of N MinkowskiGraspNetMultifingerType1Inference models of the same shape.
+
+        BatchNorm is folded into the 1x1 convs and the weights of all members are stacked,
+        so every layer runs as one batched matmul over the members.
+        Outputs of members sharing a group id are averaged.
+    """
+    def __init__(self, models, groups=None):
+        super().__init__()
+        if groups is None:
+            groups = list(range(len(models)))
+        group_ids = sorted(set(groups))
+        group_weights = torch.zeros(len(group_ids), len(models))
+        for i, group in enumerate(groups):
+            group_weights[group_ids.index(group), i] = 1
+        self.register_buffer('group_weights', group_weights / group_weights.sum(dim=1, keepdim=True))
+
+        for k in range(1, 8):
+            weights, biases = zip(*[self.fold_conv_bn(getattr(model, 'conv%d' % k), getattr(model, 'bn%d' % k)) for model in models])
+            self.register_buffer('weight%d' % k, torch.stack(weights, dim=0)) # (G, C_in, C_out)
+            self.register_buffer('bias%d' % k, torch.stack(biases, dim=0).unsqueeze(1)) # (G, 1, C_out)
+
+    @staticmethod
+    def fold_conv_bn(conv, bn):
+        scale = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps)
+        weight = conv.weight.detach()[:, :, 0] * scale.unsqueeze(1)
+        bias = (conv.bias.detach() - bn.running_mean) * scale + bn.bias.detach()
+        return weight.t().contiguous(), bias
+
+    def layer(self, x, k):
+        return F.relu(torch.baddbmm(getattr(self, 'bias%d' % k), x, getattr(self, 'weight%d' % k)), inplace=True)
+
+    def forward(self, grasp_preds_features):
+        """ grasp_preds_features: (B, C_in) -> (B, num_groups, output_dim) """
+        B = grasp_preds_features.size()[0]
+        x = grasp_preds_features.view(1, B, -1).expand(self.weight1.size(0), -1, -1)
+        grasp_preds = self.layer(x, 1)
+        grasp_preds_res = self.layer(grasp_preds, 2)
+        grasp_preds = self.layer(grasp_preds_res, 3)
+        grasp_preds = self.layer(grasp_preds, 4)
+        grasp_preds = self.layer(grasp_preds + grasp_preds_res, 5)
+        grasp_preds = self.layer(grasp_preds, 6)
+        grasp_preds = self.layer(grasp_preds, 7) # (G, B, output_dim)
+        return torch.einsum('ng,gbo->bno', self.group_weights, grasp_preds)
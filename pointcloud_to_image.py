@@ -10,36 +10,37 @@ from PIL import Image
 import open3d as o3d
 import copy
 import math
+from ur_toolbox.camera import get_depth_projector
 
 def read_picture(path):
     color_path = os.path.join(path, 'color.png')
     depth_pth = os.path.join(path, 'depth.png')
-    color = np.array(Image.open(color_path), dtype=np.float32) / 255.0
+    color = np.array(Image.open(color_path))
     depth = np.array(Image.open(depth_pth))
 
-    fx, fy = 912.898, 912.258
-    cx, cy = 629.536, 351.637
-    s = 1000.0
-
-    xmap, ymap = np.arange(depth.shape[1]), np.arange(depth.shape[0])
-    xmap, ymap = np.meshgrid(xmap, ymap)
-
-    points_z = depth / s
-    points_x = (xmap - cx) / fx * points_z
-    points_y = (ymap - cy) / fy * points_z
-
-    mask = (points_z > 0.45) & (points_z < 0.88) & (points_x > -0.3) & (points_x < 0.3) & (points_y > -0.2) & (points_y < 0.3)
-
-
-    points = np.stack([points_x, points_y, points_z], axis=-1)
-    points = points[mask].astype(np.float32)
-    colors = color[mask].astype(np.float32)
+    projector = get_depth_projector(912.898, 912.258, 629.536, 351.637, depth.shape[1], depth.shape[0])
+    points, mask = projector.project(depth, z_range=(0.45, 0.88), workspace=(-0.3, 0.3, -0.2, 0.3))
+    colors = color[mask].astype(np.float32) / 255.0
     cloud = o3d.geometry.PointCloud()
     cloud.points = o3d.utility.Vector3dVector(points)
     
     cloud.colors = o3d.utility.Vector3dVector(colors)
     return cloud
     
+def load_session_array(data_path, information, key):
+    '''
+    **input:**
+    - data_path: the path of collected data
+    - information: the loaded information.json of data_path
+    - key: the name of the array
+    **output:**
+    - numpy array of <key>.npy, or of information[key] for data saved with the proposals in the json
+    '''
+    npy_path = os.path.join(data_path, key + '.npy')
+    if os.path.exists(npy_path):
+        return np.load(npy_path)
+    return np.array(information[key])
+
 def read_json(data_path, mesh_path, voxel_size, DEBUG=True):
     '''
     **input:**
@@ -66,10 +67,10 @@ def read_json(data_path, mesh_path, voxel_size, DEBUG=True):
     base_2_TwoFingersGripper_pose = information['base_2_TwoFingersGripper_pose']
     tcp_2_camera = information['tcp_2_camera']
     base_2_tcp_ready = information['base_2_tcp_ready']
-    two_fingers_ggarray_proposals = np.array(information['two_fingers_ggarray_proposals'])
-    InspireHandR_ggarray_proposals = np.array(information['InspireHandR_ggarray_proposals'])
-    two_fingers_ggarray_source_saved = np.array(information['two_fingers_ggarray_source'])
-    InspireHandR_ggarray_source_saved = np.array(information['InspireHandR_ggarray_source_saved'])
+    two_fingers_ggarray_proposals = load_session_array(data_path, information, 'two_fingers_ggarray_proposals')
+    InspireHandR_ggarray_proposals = load_session_array(data_path, information, 'InspireHandR_ggarray_proposals')
+    two_fingers_ggarray_source_saved = load_session_array(data_path, information, 'two_fingers_ggarray_source')
+    InspireHandR_ggarray_source_saved = load_session_array(data_path, information, 'InspireHandR_ggarray_source_saved')
 
     InspireHandR_grasp = InspireHandRGrasp(np.array(InspireHandR_grasp_json))
     two_fingers_grasp = Grasp(np.array(two_fingers_grasp_json))
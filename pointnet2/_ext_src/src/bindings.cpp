@@ -13,6 +13,8 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
   m.def("gather_points", &gather_points);
   m.def("gather_points_grad", &gather_points_grad);
   m.def("furthest_point_sampling", &furthest_point_sampling);
+  m.def("furthest_point_sampling_segments",
+        &furthest_point_sampling_segments);
 
   m.def("three_nn", &three_nn);
   m.def("three_interpolate", &three_interpolate);
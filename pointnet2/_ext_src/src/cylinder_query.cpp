@@ -9,6 +9,9 @@
 void query_cylinder_point_kernel_wrapper(int b, int n, int m, float radius, float hmin, float hmax,
                                      int nsample, const float *new_xyz,
                                      const float *xyz, const float *rot, int *idx);
+void query_cylinder_point_cpu(int b, int n, int m, float radius, float hmin, float hmax,
+                          int nsample, const float *new_xyz,
+                          const float *xyz, const float *rot, int *idx);
 
 at::Tensor cylinder_query(at::Tensor new_xyz, at::Tensor xyz, at::Tensor rot, const float radius, const float hmin, const float hmax,
                       const int nsample) {
@@ -29,11 +32,17 @@ at::Tensor cylinder_query(at::Tensor new_xyz, at::Tensor xyz, at::Tensor rot, co
                    at::device(new_xyz.device()).dtype(at::ScalarType::Int));
 
   if (new_xyz.type().is_cuda()) {
+#ifdef WITH_CUDA
     query_cylinder_point_kernel_wrapper(xyz.size(0), xyz.size(1), new_xyz.size(1),
                                     radius, hmin, hmax, nsample, new_xyz.data<float>(),
                                     xyz.data<float>(), rot.data<float>(), idx.data<int>());
+#else
+    TORCH_CHECK(false, "pointnet2 was built without CUDA");
+#endif
   } else {
-    TORCH_CHECK(false, "CPU not supported");
+    query_cylinder_point_cpu(xyz.size(0), xyz.size(1), new_xyz.size(1),
+                         radius, hmin, hmax, nsample, new_xyz.data<float>(),
+                         xyz.data<float>(), rot.data<float>(), idx.data<int>());
   }
 
   return idx;
@@ -0,0 +1,37 @@
+#include <ATen/Parallel.h>
+
+// input: new_xyz(b, m, 3) xyz(b, n, 3) rot_c2w(b, m, 9)
+// output: idx(b, m, nsample)
+void query_cylinder_point_cpu(int b, int n, int m, float radius, float hmin,
+                              float hmax, int nsample, const float *new_xyz,
+                              const float *xyz, const float *rot, int *idx) {
+  const float radius2 = radius * radius;
+  at::parallel_for(0, b * m, 64, [&](int64_t begin, int64_t end) {
+    for (int64_t bj = begin; bj < end; ++bj) {
+      const float *batch_xyz = xyz + (bj / m) * n * 3;
+      const float *r = rot + bj * 9;
+      int *out = idx + bj * nsample;
+      const float new_x = new_xyz[bj * 3 + 0];
+      const float new_y = new_xyz[bj * 3 + 1];
+      const float new_z = new_xyz[bj * 3 + 2];
+      for (int k = 0, cnt = 0; k < n && cnt < nsample; ++k) {
+        const float x = batch_xyz[k * 3 + 0] - new_x;
+        const float y = batch_xyz[k * 3 + 1] - new_y;
+        const float z = batch_xyz[k * 3 + 2] - new_z;
+        const float x_rot = r[0] * x + r[3] * y + r[6] * z;
+        const float y_rot = r[1] * x + r[4] * y + r[7] * z;
+        const float z_rot = r[2] * x + r[5] * y + r[8] * z;
+        const float d2 = y_rot * y_rot + z_rot * z_rot;
+        if (d2 < radius2 && x_rot > hmin && x_rot < hmax) {
+          if (cnt == 0) {
+            for (int l = 0; l < nsample; ++l) {
+              out[l] = k;
+            }
+          }
+          out[cnt] = k;
+          ++cnt;
+        }
+      }
+    }
+  });
+}
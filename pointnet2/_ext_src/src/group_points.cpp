@@ -9,10 +9,16 @@
 void group_points_kernel_wrapper(int b, int c, int n, int npoints, int nsample,
                                  const float *points, const int *idx,
                                  float *out);
+void group_points_cpu(int b, int c, int n, int npoints, int nsample,
+                      const float *points, const int *idx,
+                      float *out);
 
 void group_points_grad_kernel_wrapper(int b, int c, int n, int npoints,
                                       int nsample, const float *grad_out,
                                       const int *idx, float *grad_points);
+void group_points_grad_cpu(int b, int c, int n, int npoints,
+                           int nsample, const float *grad_out,
+                           const int *idx, float *grad_points);
 
 at::Tensor group_points(at::Tensor points, at::Tensor idx) {
   CHECK_CONTIGUOUS(points);
@@ -29,11 +35,17 @@ at::Tensor group_points(at::Tensor points, at::Tensor idx) {
                    at::device(points.device()).dtype(at::ScalarType::Float));
 
   if (points.type().is_cuda()) {
+#ifdef WITH_CUDA
     group_points_kernel_wrapper(points.size(0), points.size(1), points.size(2),
                                 idx.size(1), idx.size(2), points.data<float>(),
                                 idx.data<int>(), output.data<float>());
+#else
+    TORCH_CHECK(false, "pointnet2 was built without CUDA");
+#endif
   } else {
-    TORCH_CHECK(false, "CPU not supported");
+    group_points_cpu(points.size(0), points.size(1), points.size(2),
+                     idx.size(1), idx.size(2), points.data<float>(),
+                     idx.data<int>(), output.data<float>());
   }
 
   return output;
@@ -54,11 +66,17 @@ at::Tensor group_points_grad(at::Tensor grad_out, at::Tensor idx, const int n) {
                    at::device(grad_out.device()).dtype(at::ScalarType::Float));
 
   if (grad_out.type().is_cuda()) {
+#ifdef WITH_CUDA
     group_points_grad_kernel_wrapper(
         grad_out.size(0), grad_out.size(1), n, idx.size(1), idx.size(2),
         grad_out.data<float>(), idx.data<int>(), output.data<float>());
+#else
+    TORCH_CHECK(false, "pointnet2 was built without CUDA");
+#endif
   } else {
-    TORCH_CHECK(false, "CPU not supported");
+    group_points_grad_cpu(
+        grad_out.size(0), grad_out.size(1), n, idx.size(1), idx.size(2),
+        grad_out.data<float>(), idx.data<int>(), output.data<float>());
   }
 
   return output;
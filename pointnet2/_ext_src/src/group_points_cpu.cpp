@@ -0,0 +1,35 @@
+#include <ATen/Parallel.h>
+
+// input: points(b, c, n) idx(b, npoints, nsample)
+// output: out(b, c, npoints, nsample)
+void group_points_cpu(int b, int c, int n, int npoints, int nsample,
+                      const float *points, const int *idx, float *out) {
+  at::parallel_for(0, b * c, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t bc = begin; bc < end; ++bc) {
+      const int *batch_idx = idx + (bc / c) * npoints * nsample;
+      const float *row = points + bc * n;
+      float *out_row = out + bc * npoints * nsample;
+      for (int j = 0; j < npoints * nsample; ++j) {
+        out_row[j] = row[batch_idx[j]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, npoints, nsample), idx(b, npoints, nsample)
+// output: grad_points(b, c, n)
+void group_points_grad_cpu(int b, int c, int n, int npoints, int nsample,
+                           const float *grad_out, const int *idx,
+                           float *grad_points) {
+  // every (batch, channel) row of grad_points is accumulated by one thread
+  at::parallel_for(0, b * c, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t bc = begin; bc < end; ++bc) {
+      const int *batch_idx = idx + (bc / c) * npoints * nsample;
+      const float *grad_row = grad_out + bc * npoints * nsample;
+      float *row = grad_points + bc * n;
+      for (int j = 0; j < npoints * nsample; ++j) {
+        row[batch_idx[j]] += grad_row[j];
+      }
+    }
+  });
+}
@@ -0,0 +1,87 @@
+#include <ATen/Parallel.h>
+
+// input: unknown(b, n, 3) known(b, m, 3)
+// output: dist2(b, n, 3), idx(b, n, 3)
+void three_nn_cpu(int b, int n, int m, const float *unknown, const float *known,
+                  float *dist2, int *idx) {
+  at::parallel_for(0, b * n, 64, [&](int64_t begin, int64_t end) {
+    for (int64_t bj = begin; bj < end; ++bj) {
+      const float *batch_known = known + (bj / n) * m * 3;
+      const float ux = unknown[bj * 3 + 0];
+      const float uy = unknown[bj * 3 + 1];
+      const float uz = unknown[bj * 3 + 2];
+      double best1 = 1e40, best2 = 1e40, best3 = 1e40;
+      int besti1 = 0, besti2 = 0, besti3 = 0;
+      for (int k = 0; k < m; ++k) {
+        const float x = batch_known[k * 3 + 0];
+        const float y = batch_known[k * 3 + 1];
+        const float z = batch_known[k * 3 + 2];
+        const float d =
+            (ux - x) * (ux - x) + (uy - y) * (uy - y) + (uz - z) * (uz - z);
+        if (d < best1) {
+          best3 = best2;
+          besti3 = besti2;
+          best2 = best1;
+          besti2 = besti1;
+          best1 = d;
+          besti1 = k;
+        } else if (d < best2) {
+          best3 = best2;
+          besti3 = besti2;
+          best2 = d;
+          besti2 = k;
+        } else if (d < best3) {
+          best3 = d;
+          besti3 = k;
+        }
+      }
+      dist2[bj * 3 + 0] = best1;
+      dist2[bj * 3 + 1] = best2;
+      dist2[bj * 3 + 2] = best3;
+      idx[bj * 3 + 0] = besti1;
+      idx[bj * 3 + 1] = besti2;
+      idx[bj * 3 + 2] = besti3;
+    }
+  });
+}
+
+// input: points(b, c, m), idx(b, n, 3), weight(b, n, 3)
+// output: out(b, c, n)
+void three_interpolate_cpu(int b, int c, int m, int n, const float *points,
+                           const int *idx, const float *weight, float *out) {
+  at::parallel_for(0, b * c, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t bc = begin; bc < end; ++bc) {
+      const int64_t i = bc / c;
+      const int *batch_idx = idx + i * n * 3;
+      const float *batch_weight = weight + i * n * 3;
+      const float *row = points + bc * m;
+      for (int j = 0; j < n; ++j) {
+        out[bc * n + j] = row[batch_idx[j * 3 + 0]] * batch_weight[j * 3 + 0] +
+                          row[batch_idx[j * 3 + 1]] * batch_weight[j * 3 + 1] +
+                          row[batch_idx[j * 3 + 2]] * batch_weight[j * 3 + 2];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, n), idx(b, n, 3), weight(b, n, 3)
+// output: grad_points(b, c, m)
+void three_interpolate_grad_cpu(int b, int c, int n, int m,
+                                const float *grad_out, const int *idx,
+                                const float *weight, float *grad_points) {
+  // every (batch, channel) row of grad_points is accumulated by one thread
+  at::parallel_for(0, b * c, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t bc = begin; bc < end; ++bc) {
+      const int64_t i = bc / c;
+      const int *batch_idx = idx + i * n * 3;
+      const float *batch_weight = weight + i * n * 3;
+      float *row = grad_points + bc * m;
+      for (int j = 0; j < n; ++j) {
+        const float g = grad_out[bc * n + j];
+        row[batch_idx[j * 3 + 0]] += g * batch_weight[j * 3 + 0];
+        row[batch_idx[j * 3 + 1]] += g * batch_weight[j * 3 + 1];
+        row[batch_idx[j * 3 + 2]] += g * batch_weight[j * 3 + 2];
+      }
+    }
+  });
+}
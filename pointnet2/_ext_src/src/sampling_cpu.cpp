@@ -0,0 +1,125 @@
+#include <ATen/Parallel.h>
+#include <utility>
+
+// input: points(b, c, n) idx(b, m)
+// output: out(b, c, m)
+void gather_points_cpu(int b, int c, int n, int m, const float *points,
+                       const int *idx, float *out) {
+  at::parallel_for(0, b * c, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t bc = begin; bc < end; ++bc) {
+      const int i = bc / c;
+      for (int j = 0; j < m; ++j) {
+        out[bc * m + j] = points[bc * n + idx[i * m + j]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, m) idx(b, m)
+// output: grad_points(b, c, n)
+void gather_points_grad_cpu(int b, int c, int n, int m, const float *grad_out,
+                            const int *idx, float *grad_points) {
+  // every (batch, channel) row of grad_points is accumulated by one thread
+  at::parallel_for(0, b * c, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t bc = begin; bc < end; ++bc) {
+      const int i = bc / c;
+      for (int j = 0; j < m; ++j) {
+        grad_points[bc * n + idx[i * m + j]] += grad_out[bc * m + j];
+      }
+    }
+  });
+}
+
+// distance update of points [begin, end) to the last sample, returns the
+// furthest of them as (squared distance, index), the first one on ties
+static std::pair<float, int> furthest_point_update(
+    int64_t begin, int64_t end, const float *dataset, float *temp, int old) {
+  const float x1 = dataset[old * 3 + 0];
+  const float y1 = dataset[old * 3 + 1];
+  const float z1 = dataset[old * 3 + 2];
+  float best = -1;
+  int besti = 0;
+  for (int64_t k = begin; k < end; ++k) {
+    const float x2 = dataset[k * 3 + 0];
+    const float y2 = dataset[k * 3 + 1];
+    const float z2 = dataset[k * 3 + 2];
+    const float mag = (x2 * x2) + (y2 * y2) + (z2 * z2);
+    if (mag <= 1e-3) continue;
+    const float d =
+        (x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1) + (z2 - z1) * (z2 - z1);
+    const float d2 = std::min(d, temp[k]);
+    temp[k] = d2;
+    if (d2 > best) {
+      best = d2;
+      besti = k;
+    }
+  }
+  return {best, static_cast<int>(besti)};
+}
+
+static void furthest_point_sampling_single(int n, int m, const float *dataset,
+                                           float *temp, int *idxs,
+                                           bool parallel) {
+  if (m <= 0) return;
+  int old = 0;
+  idxs[0] = old;
+  for (int j = 1; j < m; ++j) {
+    std::pair<float, int> best;
+    if (parallel) {
+      best = at::parallel_reduce(
+          0, n, 4096, std::make_pair(-1.0f, 0),
+          [&](int64_t begin, int64_t end, std::pair<float, int> ident) {
+            return furthest_point_update(begin, end, dataset, temp, old);
+          },
+          [](std::pair<float, int> a, std::pair<float, int> b) {
+            if (b.first > a.first || (b.first == a.first && b.second < a.second))
+              return b;
+            return a;
+          });
+    } else {
+      best = furthest_point_update(0, n, dataset, temp, old);
+    }
+    old = best.second;
+    idxs[j] = old;
+  }
+}
+
+// Input dataset: (b, n, 3), tmp: (b, n)
+// Ouput idxs (b, m)
+void furthest_point_sampling_cpu(int b, int n, int m, const float *dataset,
+                                 float *temp, int *idxs) {
+  // the samples of one batch element are sequential, so the threads split the
+  // batch, or the points of each iteration for a single batch element
+  if (b == 1) {
+    furthest_point_sampling_single(n, m, dataset, temp, idxs, true);
+    return;
+  }
+  at::parallel_for(0, b, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      furthest_point_sampling_single(n, m, dataset + i * n * 3, temp + i * n,
+                                     idxs + i * m, false);
+    }
+  });
+}
+
+// Input dataset: (n, 3) of b segments of variable size, offsets: (b + 1)
+// tmp: (n)
+// Ouput idxs (b, m) local to each segment
+void furthest_point_sampling_segments_cpu(int b, int m, const float *dataset,
+                                          const int *offsets, float *temp,
+                                          int *idxs) {
+  if (b == 1) {
+    furthest_point_sampling_single(offsets[1] - offsets[0], m,
+                                   dataset + offsets[0] * 3, temp + offsets[0],
+                                   idxs, true);
+    return;
+  }
+  at::parallel_for(0, b, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int start = offsets[i];
+      furthest_point_sampling_single(offsets[i + 1] - start, m,
+                                     dataset + start * 3, temp + start,
+                                     idxs + i * m, false);
+    }
+  });
+}
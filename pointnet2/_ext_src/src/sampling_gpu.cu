@@ -71,17 +71,27 @@ __device__ void __update(float *__restrict__ dists, int *__restrict__ dists_i,
 
 // Input dataset: (b, n, 3), tmp: (b, n)
 // Ouput idxs (b, m)
+// With offsets (b + 1), dataset: (offsets[b], 3) holds b segments of
+// variable size and idxs are local to each segment
 template <unsigned int block_size>
 __global__ void furthest_point_sampling_kernel(
     int b, int n, int m, const float *__restrict__ dataset,
-    float *__restrict__ temp, int *__restrict__ idxs) {
+    const int *__restrict__ offsets, float *__restrict__ temp,
+    int *__restrict__ idxs) {
   if (m <= 0) return;
   __shared__ float dists[block_size];
   __shared__ int dists_i[block_size];
 
   int batch_index = blockIdx.x;
-  dataset += batch_index * n * 3;
-  temp += batch_index * n;
+  if (offsets != nullptr) {
+    const int start = offsets[batch_index];
+    n = offsets[batch_index + 1] - start;
+    dataset += start * 3;
+    temp += start;
+  } else {
+    dataset += batch_index * n * 3;
+    temp += batch_index * n;
+  }
   idxs += batch_index * m;
 
   int tid = threadIdx.x;
@@ -177,9 +187,11 @@ __global__ void furthest_point_sampling_kernel(
   }
 }
 
-void furthest_point_sampling_kernel_wrapper(int b, int n, int m,
-                                            const float *dataset, float *temp,
-                                            int *idxs) {
+// with offsets, n only bounds the segment sizes to pick the block size
+static void furthest_point_sampling_launch(int b, int n, int m,
+                                           const float *dataset,
+                                           const int *offsets, float *temp,
+                                           int *idxs) {
   unsigned int n_threads = opt_n_threads(n);
 
   cudaStream_t stream = at::cuda::getCurrentCUDAStream();
@@ -187,48 +199,61 @@ void furthest_point_sampling_kernel_wrapper(int b, int n, int m,
   switch (n_threads) {
     case 512:
       furthest_point_sampling_kernel<512>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 256:
       furthest_point_sampling_kernel<256>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 128:
       furthest_point_sampling_kernel<128>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 64:
       furthest_point_sampling_kernel<64>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 32:
       furthest_point_sampling_kernel<32>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 16:
       furthest_point_sampling_kernel<16>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 8:
       furthest_point_sampling_kernel<8>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 4:
       furthest_point_sampling_kernel<4>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 2:
       furthest_point_sampling_kernel<2>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     case 1:
       furthest_point_sampling_kernel<1>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
       break;
     default:
       furthest_point_sampling_kernel<512>
-          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, temp, idxs);
+          <<<b, n_threads, 0, stream>>>(b, n, m, dataset, offsets, temp, idxs);
   }
 
   CUDA_CHECK_ERRORS();
 }
+
+void furthest_point_sampling_kernel_wrapper(int b, int n, int m,
+                                            const float *dataset, float *temp,
+                                            int *idxs) {
+  furthest_point_sampling_launch(b, n, m, dataset, nullptr, temp, idxs);
+}
+
+void furthest_point_sampling_segments_kernel_wrapper(int b, int n, int m,
+                                                     const float *dataset,
+                                                     const int *offsets,
+                                                     float *temp, int *idxs) {
+  furthest_point_sampling_launch(b, n, m, dataset, offsets, temp, idxs);
+}
@@ -78,6 +78,37 @@ class FurthestPointSampling(Function):
 furthest_point_sample = FurthestPointSampling.apply
 
 
+class FurthestPointSamplingSegments(Function):
+    @staticmethod
+    def forward(ctx, xyz, offsets, npoint):
+        # type: (Any, torch.Tensor, torch.Tensor, int) -> torch.Tensor
+        r"""
+        Furthest point sampling of several point sets of variable size in one call
+
+        Parameters
+        ----------
+        xyz : torch.Tensor
+            (N, 3) tensor of the concatenated point sets
+        offsets : torch.Tensor
+            (B + 1) int32 tensor, the points of set i are xyz[offsets[i]:offsets[i+1]]
+        npoint : int32
+            number of features in each sampled set
+
+        Returns
+        -------
+        torch.Tensor
+            (B, npoint) tensor containing the sets, indices are local to each set
+        """
+        return _ext.furthest_point_sampling_segments(xyz, offsets, npoint)
+
+    @staticmethod
+    def backward(xyz, a=None):
+        return None, None, None
+
+
+furthest_point_sample_segments = FurthestPointSamplingSegments.apply
+
+
 class GatherOperation(Function):
     @staticmethod
     def forward(ctx, features, idx):
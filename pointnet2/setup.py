@@ -4,29 +4,40 @@
 # LICENSE file in the root directory of this source tree.
 
 from setuptools import setup
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+import torch
+from torch.utils.cpp_extension import BuildExtension, CUDAExtension, CppExtension, CUDA_HOME
 import glob
 import os
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
 _ext_src_root = "_ext_src"
-_ext_sources = glob.glob("{}/src/*.cpp".format(_ext_src_root)) + glob.glob(
-    "{}/src/*.cu".format(_ext_src_root)
-)
 _ext_headers = glob.glob("{}/include/*".format(_ext_src_root))
+_include = "-I{}".format("{}/{}/include".format(ROOT, _ext_src_root))
+
+# the CPU kernels are always built, the CUDA ones whenever a CUDA toolkit is found
+# (FORCE_CUDA=1 builds them on a machine without a visible GPU)
+if (torch.cuda.is_available() and CUDA_HOME is not None) or os.getenv("FORCE_CUDA", "0") == "1":
+    ext_module = CUDAExtension(
+        name='pointnet2._ext',
+        sources=glob.glob("{}/src/*.cpp".format(_ext_src_root)) + glob.glob("{}/src/*.cu".format(_ext_src_root)),
+        define_macros=[("WITH_CUDA", None)],
+        extra_compile_args={
+            "cxx": ["-O2", "-fopenmp", _include],
+            "nvcc": ["-O2", _include],
+        },
+        extra_link_args=["-fopenmp"],
+    )
+else:
+    ext_module = CppExtension(
+        name='pointnet2._ext',
+        sources=glob.glob("{}/src/*.cpp".format(_ext_src_root)),
+        extra_compile_args={"cxx": ["-O2", "-fopenmp", _include]},
+        extra_link_args=["-fopenmp"],
+    )
 
 setup(
     name='pointnet2',
-    ext_modules=[
-        CUDAExtension(
-            name='pointnet2._ext',
-            sources=_ext_sources,
-            extra_compile_args={
-                "cxx": ["-O2", "-I{}".format("{}/{}/include".format(ROOT, _ext_src_root))],
-                "nvcc": ["-O2", "-I{}".format("{}/{}/include".format(ROOT, _ext_src_root))],
-            },
-        )
-    ],
+    ext_modules=[ext_module],
     cmdclass={
         'build_ext': BuildExtension
     }
@@ -1,7 +1,6 @@
 import pdb
 
-from ur_toolbox.camera import RealSense
-from multiprocessing import shared_memory
+from ur_toolbox.camera import RealSense, FrameRing, get_depth_projector
 import numpy as np
 import cv2
 import os
@@ -14,23 +13,14 @@ save_path = "capture_b06"
 def click_event(event, x, y, flags, params):
     # checking for left mouse clicks
 
-    fx, fy = 910.673, 908.948
-    cx, cy = 655.339, 371.053
-    s = 1000.0
-
-    xmap, ymap = np.arange(depths.shape[1]), np.arange(depths.shape[0])
-    xmap, ymap = np.meshgrid(xmap, ymap)
-
-    points_z = depths / s
-    points_x = (xmap - cx) / fx * points_z
-    points_y = (ymap - cy) / fy * points_z
-    points = np.stack([points_x, points_y, points_z], axis=-1)
+    projector = get_depth_projector(910.673, 908.948, 655.339, 371.053, depths.shape[1], depths.shape[0])
+    point = projector.deproject_pixel(x, y, depths[y][x])
     # displaying the coordinates
     # on the image window
     font = cv2.FONT_HERSHEY_SIMPLEX
-    cv2.putText(colors, str(int(points[y][x][0]*1000)) + ',' +
-                str(int(points[y][x][1]*1000)) + ',' +
-                str(int(points[y][x][2]*1000)), (x,y), font,
+    cv2.putText(colors, str(int(point[0]*1000)) + ',' +
+                str(int(point[1]*1000)) + ',' +
+                str(int(point[2]*1000)), (x,y), font,
                 1, (255, 0, 0), 2)
     cv2.imshow('image', colors)
 
@@ -46,13 +36,9 @@ else:
         depths = camera.get_depth_image()
         
 
-shm_depth = shared_memory.SharedMemory(name='realsense_depth', create=True, size=depths.nbytes)
-depthbuf = np.ndarray(depths.shape, dtype=depths.dtype, buffer=shm_depth.buf)
-
-if DEBUG:
-    colors = (cv2.cvtColor(colors, cv2.COLOR_BGR2RGB) / 255.0).astype(np.float32)
-    shm_color = shared_memory.SharedMemory(name='realsense_color', create=True, size=colors.nbytes)
-    colorbuf = np.ndarray(colors.shape, dtype=colors.dtype, buffer=shm_color.buf)
+# consumers attach with FrameRing('realsense_frames') and wait for frames newer than their request
+ring = FrameRing('realsense_frames', create=True, depth_shape=depths.shape, depth_dtype=depths.dtype,
+                 color_shape=colors.shape if DEBUG else None, color_dtype=colors.dtype if DEBUG else np.uint8)
 
 try:
     cnt = 0
@@ -63,8 +49,8 @@ try:
         colors = None
         
         if DEBUG:
+            # published as the camera's uint8 BGR, consumers convert the pixels they color with colors_to_float
             colors, depths = camera.get_rgbd_image()
-            colors = (cv2.cvtColor(colors, cv2.COLOR_BGR2RGB) / 255.0).astype(np.float32)
             # cv2.imshow("image", colors)
             # cv2.setMouseCallback('image', click_event)
             # cv2.waitKey(1)
@@ -74,13 +60,11 @@ try:
 
             cnt += 1
             
-            colorbuf[:] = colors[:]
-            depthbuf[:] = depths[:]
+            ring.write(depths, colors)
         else:
-            print(shm_depth.name)
             depths = camera.get_depth_image()
 
-            depthbuf[:] = depths[:]
+            ring.write(depths)
 except KeyboardInterrupt:
-    shm_depth.unlink()
-    shm_color.unlink()
\ No newline at end of file
+    ring.close()
+    ring.unlink()
@@ -0,0 +1,106 @@
+''' Replay recorded grasp sessions through the perception, decision and collision stages of robot_allegro.py,
+    with stand-ins of the camera ring and of the robot, and report the latency of every stage.
+
+    The arguments that are not listed here are passed to robot_allegro.py, e.g.
+    python replay_allegro.py logs/data/allegro/allegro_test --checkpoint_path logs/model/checkpoint.tar.18 --use_graspnet_v2 \
+        --allegro_model_path logs/model/allegro_model/allegro_obj140
+'''
+import os
+import sys
+import json
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = BASE_DIR
+sys.path.append(os.path.join(ROOT_DIR, 'utils'))
+from grasp_replay import find_sessions, load_session, ReplayFrames, ReplayRobot
+from grasp_trace import get_tracer, span, format_summary
+from grasp_pipeline import GraspPipeline, run_stages
+
+parser = argparse.ArgumentParser(description='Replay recorded grasp sessions without a robot.')
+parser.add_argument('sessions', nargs='+', help='Session directories saved by save_grasp_information, or their parents')
+parser.add_argument('--repeat', type=int, default=1, help='Replays of every session [default: 1]')
+parser.add_argument('--warmup', type=int, default=1, help='Frames run before the timing starts [default: 1]')
+parser.add_argument('--pipeline', action='store_true', help='Plan in a GraspPipeline while the stand-in robot picks.')
+parser.add_argument('--motion_time', type=float, default=2.0, help='Seconds of a pick of the stand-in robot [default: 2.0]')
+parser.add_argument('--debug', action='store_true', help='Keep the DEBUG point clouds of robot_allegro.py.')
+parser.add_argument('--output', default=None, help='Json file of the report')
+parser.add_argument('--trace', default=None, help='Chrome trace json file of the spans of the replay')
+args, robot_argv = parser.parse_known_args()
+
+# robot_allegro.py parses the remaining arguments on import, the robot ip is never used in replay
+sys.argv = [os.path.join(ROOT_DIR, 'robot_allegro.py'), '--robot_ip', 'replay'] + robot_argv
+import robot_allegro
+robot_allegro.DEBUG = args.debug
+
+def replay_frames(capture, stages, num_frames):
+    ''' Run every frame through the stages on this thread, returns the number of plans. '''
+    plans = 0
+    for _ in range(num_frames):
+        with span('frame') as frame_span:
+            with span('capture'):
+                item = capture()
+            plan, _ = run_stages(item, stages)
+            frame_span.ok = plan is not None
+        plans += int(plan is not None)
+    return plans
+
+def replay_picks(capture, stages, robot, num_picks):
+    ''' Pick num_picks plans of a GraspPipeline with the stand-in robot, returns the number of picks. '''
+    pipeline = GraspPipeline(capture, stages)
+    pipeline.start()
+    try:
+        for _ in range(num_picks):
+            with span('wait_for_plan'):
+                plan = pipeline.get_plan(timeout=60.0)
+            with span('pick'):
+                robot.open_gripper(plan['Allegro_ggarray'][0].angle)
+                robot.grasp_and_throw(plan['Allegro_ggarray'][0], plan['two_fingers_ggarray'][0], plan['cloud'],
+                                      on_throw=pipeline.scene_changed)
+    finally:
+        pipeline.stop()
+    return num_picks
+
+def replay(cfgs):
+    sessions = [load_session(path) for path in find_sessions(args.sessions)]
+    print('replaying {} sessions'.format(len(sessions)))
+    frames = ReplayFrames(sessions, loop=True)
+    robot = ReplayRobot(motion_time=args.motion_time)
+    net = robot_allegro.get_net(cfgs.checkpoint_path, use_v2=cfgs.use_graspnet_v2)
+    allegro_models = robot_allegro.get_allegro_model(cfgs.allegro_model_path)
+    meshes_pcls = robot_allegro.load_meshes_pointcloud(cfgs.Allegro_mesh_json_path)
+    stages = robot_allegro.get_stages(net, allegro_models, meshes_pcls)
+    capture = lambda: robot_allegro.capture_frame(frames)
+
+    tracer = get_tracer()
+    tracer.enabled = True
+    for _ in range(args.warmup):
+        run_stages(capture(), stages)
+    tracer.clear()
+
+    num_frames = len(sessions) * args.repeat
+    start = time.perf_counter()
+    if args.pipeline:
+        plans = replay_picks(capture, stages, robot, num_frames)
+    else:
+        plans = replay_frames(capture, stages, num_frames)
+    elapsed = time.perf_counter() - start
+
+    report = {'sessions': len(sessions), 'frames': frames.published - args.warmup, 'plans': plans,
+              'pipeline': args.pipeline, 'elapsed_s': elapsed, 'plans_per_s': plans / elapsed,
+              'stages': tracer.summary()}
+    if args.pipeline:
+        report['mpph'] = 3600.0 * plans / elapsed
+    print(format_summary(report['stages']))
+    print('frames: {}  plans: {}  elapsed: {:.1f}s  plans/s: {:.2f}'.format(
+        report['frames'], plans, elapsed, report['plans_per_s']))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    if args.trace is not None:
+        tracer.export_chrome_trace(args.trace)
+    return report
+
+if __name__ == '__main__':
+    replay(robot_allegro.cfgs)
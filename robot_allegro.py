@@ -1,5 +1,4 @@
 import copy
-import json
 import os
 import sys
 import pdb
@@ -9,12 +8,10 @@ import random
 import argparse
 import torch
 import numpy as np
-import cv2
 import open3d as o3d
 
 from graspnetAPI import GraspGroup
 
-from multiprocessing import shared_memory
 from collections import OrderedDict
 import matplotlib.pyplot as plt
 import pickle
@@ -25,17 +22,25 @@ sys.path.append(os.path.join(ROOT_DIR, 'models'))
 sys.path.append(os.path.join(ROOT_DIR, 'dataset'))
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 from ur_toolbox.robot import UR_Camera_Gripper
+from ur_toolbox.camera import FrameRing, colors_to_float, get_depth_projector
 from ur_toolbox.robot.Allegro.Allegro_grasp import AllegroGraspGroup, grasp_types
-from np_utils import transform_point_cloud
-from pt_utils import batch_viewpoint_params_to_matrix
+from np_utils import transform_point_cloud, sparse_quantize
+from pt_utils import decode_grasp_preds, canonicalize_grasp_preds_features
+from grasp_selection import flip_grasp_rotations, sort_by_score, select_top_per_type
+from grasp_features import GraspFeatureBatch
 from collision_detector import ModelFreeCollisionDetectorMultifinger
+from template_store import HandTemplateStore
+from grasp_pipeline import GraspPipeline, run_stages, depth_changed
+from grasp_recorder import get_grasp_recorder
+from grasp_trace import get_tracer, span, format_summary
 import queue
 from itertools import count
 from threading import Thread
 from queue import Queue
 import multiprocessing as mp
 import MinkowskiEngine as ME
-from minkowski_graspnet_single_point import MinkowskiGraspNet, MinkowskiGraspNetMultifingerType1Inference
+from minkowski_graspnet_single_point import MinkowskiGraspNet, MinkowskiGraspNetMultifingerType1Inference, \
+                                            MinkowskiGraspNetMultifingerEnsembleInference
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--checkpoint_path', required=True, help='Model checkpoint path')
@@ -46,7 +51,14 @@ parser.add_argument('--robot_ip', required=True, help='Robot IP')
 parser.add_argument('--use_graspnet_v2', action='store_true', help='Whether to use graspnet v2 format')
 parser.add_argument('--half_views', action='store_true', help='Use only half views in network.')
 parser.add_argument('--global_camera', action='store_true', help='Use the settings for global camera.')
+parser.add_argument('--pipeline', action='store_true', help='Plan the next grasp while the arm throws, requires --global_camera.')
+parser.add_argument('--plan_timeout', type=float, default=60.0, help='Seconds to wait for a plan of the pipeline before stopping [default: 60.0]')
+parser.add_argument('--check_reachability', action='store_true', help='Drop the grasps without a UR5 IK solution with the collisions.')
+parser.add_argument('--max_joint_delta', type=float, default=None, help='Largest joint motion of a reachable grasp in radians, e.g. to reject wrist flips [default: None]')
+parser.add_argument('--trace_dir', default='logs/trace', help='Directory of the stage latency csv and Chrome trace')
 cfgs = parser.parse_args()
+if cfgs.pipeline and not cfgs.global_camera:
+    parser.error('--pipeline requires --global_camera')
 
 MAX_GRASP_WIDTH = 0.11
 MIN_GRASP_WIDTH = 0.04
@@ -56,90 +68,21 @@ NUM_OF_ALLEGRO_DEPTH = 4
 NUM_OF_ALLEGRO_TYPE = 10
 Allegro_VOXElGRID = 0.003
 POINTCLOUD_AUGMENT_NUM = 10
+BATCHED_AUGMENT = True
 DEFAULT_DEPTH = 0.00
 RANDOM = False
 
 def parse_preds(end_points, use_v2=False):
-    ## load preds
-    before_generator = end_points['before_generator']  # (B, Ns, 256)
-    point_features = end_points['point_features']  # (B, Ns, 512)
-    coords = end_points['sinput'].C  # (\Sigma Ni, 4)
-    objectness_pred = end_points['stage1_objectness_pred']  # (Sigma Ni, 2)
-    objectness_mask = torch.argmax(objectness_pred, dim=1).bool()  # (\Sigma Ni,)
-    seed_xyz = end_points['stage2_seed_xyz']  # (B, Ns, 3)
-    seed_inds = end_points['stage2_seed_inds']  # (B, Ns)
-    grasp_view_xyz = end_points['stage2_view_xyz']  # (B, Ns, 3)
-    grasp_view_inds = end_points['stage2_view_inds']
-    grasp_view_scores = end_points['stage2_view_scores']
-    grasp_scores = end_points['stage3_grasp_scores']  # (B, Ns, A, D)
-    grasp_features_two_finger = end_points['stage3_grasp_features'].view(grasp_scores.size()[0], grasp_scores.size()[1], -1) # (B, Ns, 3 + C)
-    grasp_widths = MAX_GRASP_WIDTH * end_points['stage3_normalized_grasp_widths']  # (B, Ns, A, D)
-    grasp_widths[grasp_widths > MAX_GRASP_WIDTH] = MAX_GRASP_WIDTH
-
-    grasp_preds = []
-    grasp_features = []
-    grasp_vdistance_list = []
-    for i in range(BATCH_SIZE):
-        
-        cloud_mask_i = (coords[:, 0] == i)
-        seed_inds_i = seed_inds[i]
-        objectness_mask_i = objectness_mask[cloud_mask_i][seed_inds_i]  # (Ns,)
-
-        if objectness_mask_i.any() == False:
-            continue
+    # (N, 17) grasps in ggarray layout of all the clouds of the batch, the feature rows are gathered lazily
+    return decode_grasp_preds(end_points, MAX_GRASP_WIDTH)
 
-        seed_xyz_i = seed_xyz[i] # [objectness_mask_i]  # (Ns', 3)
-        point_features_i = point_features[i] # [objectness_mask_i]
-        
-        seed_inds_i = seed_inds_i # [objectness_mask_i]
-        before_generator_i = before_generator[i] # [objectness_mask_i]
-        grasp_view_xyz_i = grasp_view_xyz[i] # [objectness_mask_i]  # (Ns', 3)
-        grasp_view_inds_i = grasp_view_inds[i] # [objectness_mask_i]
-        grasp_view_scores_i = grasp_view_scores[i] # [objectness_mask_i]
-        grasp_scores_i = grasp_scores[i] # [objectness_mask_i]  # (Ns', A, D)
-        grasp_widths_i = grasp_widths[i] # [objectness_mask_i] # (Ns', A, D)
-        
-        Ns, A, D = grasp_scores_i.size()
-        grasp_features_two_finger_i = grasp_features_two_finger[i] # [objectness_mask_i] # (Ns', 3 + C)
-        grasp_scores_i_A_D = copy.deepcopy(grasp_scores_i).view(Ns, -1)
-
-        grasp_scores_i = torch.minimum(grasp_scores_i[:,:24,:], grasp_scores_i[:,24:,:])
-
-        seed_inds_i = seed_inds_i.view(Ns, -1)
-        grasp_view_inds_i = grasp_view_inds_i.view(Ns, -1)
-        grasp_view_scores_i = grasp_view_scores_i.view(Ns, -1)
-
-        grasp_scores_i, grasp_angles_class_i = torch.max(grasp_scores_i, dim=1) # (Ns', D), (Ns', D)
-        grasp_angles_i = (grasp_angles_class_i.float()-12) / 24 * np.pi  # (Ns', topk, D)
-
-        # grasp width & vdistance
-        grasp_angles_class_i = grasp_angles_class_i.unsqueeze(1) # (Ns', 1, D)
-        grasp_widths_pos_i = torch.gather(grasp_widths_i, 1, grasp_angles_class_i).squeeze(1) # (Ns', D)
-        grasp_widths_neg_i = torch.gather(grasp_widths_i, 1, grasp_angles_class_i+24).squeeze(1) # (Ns', D)
-
-        ## slice preds by grasp score/depth
-        # grasp score & depth
-        grasp_scores_i, grasp_depths_class_i = torch.max(grasp_scores_i, dim=1, keepdims=True) # (Ns', 1), (Ns', 1)
-        grasp_depths_i = (grasp_depths_class_i.float() + 1) * 0.01  # (Ns'*topk, 1)
- 
-        grasp_depths_i -= 0.01
-        grasp_depths_i[grasp_depths_class_i==0] = 0.005
-        # grasp angle & width & vdistance
-        grasp_angles_i = torch.gather(grasp_angles_i, 1, grasp_depths_class_i) # (Ns', 1)
-        grasp_widths_pos_i = torch.gather(grasp_widths_pos_i, 1, grasp_depths_class_i) # (Ns', 1)
-        grasp_widths_neg_i = torch.gather(grasp_widths_neg_i, 1, grasp_depths_class_i) # (Ns', 1)
-
-        # convert to rotation matrix
-        rotation_matrices_i = batch_viewpoint_params_to_matrix(-grasp_view_xyz_i, grasp_angles_i.squeeze(1))
-        # # adjust gripper centers
-        grasp_widths_i = grasp_widths_pos_i + grasp_widths_neg_i
-        rotation_matrices_i = rotation_matrices_i.view(Ns, 9)
-
-        # merge preds
-        grasp_preds.append(torch.cat([grasp_scores_i, grasp_widths_i, grasp_depths_i, rotation_matrices_i, seed_xyz_i],axis=1))  # (Ns, 15)
-        grasp_features.append(torch.cat([grasp_scores_i_A_D, grasp_features_two_finger_i, before_generator_i, point_features_i, grasp_view_inds_i, grasp_view_scores_i, seed_inds_i, grasp_angles_i*24/np.pi+12, grasp_depths_i], axis=1)) # (Ns'*3, A, D)
-        
-    return grasp_preds, grasp_features
+def forward_net(net, end_points):
+    with span('net_forward'):
+        end_points = net(end_points)
+        # the forward pass is queued on the gpu, wait for it so that it is not accounted to the decoding
+        if torch.cuda.is_available() and get_tracer().enabled:
+            torch.cuda.synchronize()
+    return end_points
 
 def get_net(checkpoint_path, use_v2=False):
     if use_v2:
@@ -149,81 +92,36 @@ def get_net(checkpoint_path, use_v2=False):
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     net.to(device)
     net.eval()
-    checkpoint = torch.load(checkpoint_path)
+    checkpoint = torch.load(checkpoint_path, map_location=device)
     net.load_state_dict(checkpoint['model_state_dict'])
     return net
 
 def flip_ggarray(ggarray):
-    ggarray_rotations = ggarray[:, 4:13].reshape((-1, 3, 3))
-    tcp_x_axis_on_base_frame = ggarray_rotations[:, 1, 1]
-    if_flip = [False for _ in range(len(ggarray))]
-    for ids, y_x in enumerate(tcp_x_axis_on_base_frame):
-        if y_x < 0:
-            ggarray_rotations[ids, :3, 1:3] = -ggarray_rotations[ids, :3, 1:3]
-            if_flip[ids] = True
-    return ggarray, if_flip
+    # flip the grasps whose tcp x axis has a negative y on the base frame
+    return flip_grasp_rotations(ggarray, (1, 1), negative=True, columns=(1, 3))
 
 def flip_z_ggarray(ggarray, allegro_types):
-    ggarray_rotations = ggarray[:, 4:13].reshape((-1, 3, 3))
-    tcp_z_axis_on_base_frame = ggarray_rotations[:, 0, 2]
-    tcp_x_axis_on_base_frame = ggarray_rotations[:, 1, 1]
-    if_flip = [False for _ in range(len(ggarray))]
-    for ids, y_z in enumerate(tcp_z_axis_on_base_frame):
-        if y_z < 0 and allegro_types[ids] in [9]:
-            ggarray_rotations[ids, :3, 1:3] = -ggarray_rotations[ids, :3, 1:3]
-
-    ggarray[:, 4:13] = ggarray_rotations.reshape((-1, 9))
-    return ggarray, if_flip
-
-def get_grasp_features(grasp_features_array):
-    grasp_features = dict()
-    grasp_features['grasp_angles'] = int(grasp_features_array[-3]+0.1)
-    grasp_features['grasp_depths'] = int(grasp_features_array[-2]*100+0.1)
-    grasp_features['stage3_grasp_scores'] = grasp_features_array[:240].tolist()
-    grasp_features['grasp_preds_features'] = grasp_features_array[240:240+480].tolist()
-    grasp_features['stage3_grasp_features'] = grasp_features_array[240+480:240+480+512].tolist()
-    grasp_features['before_generator'] = grasp_features_array[240+480+512:240+480+512+512].tolist()
-    grasp_features['point_features'] = grasp_features_array[240+480+512+512:240+480+512+512+512].tolist()
-    grasp_features['point_id'] = int(grasp_features_array[-4])
-    grasp_features['if_flip'] = bool(int(grasp_features_array[-1]))
-    grasp_features['view_inds'] = bool(int(grasp_features_array[-6]))
-    grasp_features['view_score'] = bool(int(grasp_features_array[-5]))
-    return grasp_features
-
-def get_graspgroup_features(grasp_features_array, sinput):
-    grasp_features = dict()
-    grasp_features['grasp_angles'] = (grasp_features_array[:, -3]+0.1).astype(int)
-    grasp_features['grasp_depths'] = (grasp_features_array[:, -2]*100+0.1).astype(int)
-    grasp_features['stage3_grasp_scores'] = grasp_features_array[:, :240]
-    grasp_features['grasp_preds_features'] = grasp_features_array[:, 240:240+480]
-    grasp_features['stage3_grasp_features'] = grasp_features_array[:, 240+480:240+480+512]
-    grasp_features['before_generator'] = grasp_features_array[:, 240+480+512:240+480+512+512]
-    grasp_features['point_features'] = grasp_features_array[:, 240+480+512+512:240+480+512+512+512]
-    grasp_features['point_id'] = (grasp_features_array[:, -4]+0.1).astype(int)
-    grasp_features['if_flip'] = grasp_features_array[:, -1]
-    grasp_features['view_inds'] = (grasp_features_array[:, -6]+0.1).astype(int)
-    grasp_features['view_score'] = grasp_features_array[:, -5]
-    grasp_features['sinput'] = sinput
-
-    grasp_preds_features_rot = np.zeros(grasp_features['grasp_preds_features'].shape, dtype = np.float32)
-    new_type = grasp_features['grasp_angles']
-    for idx, if_flip in enumerate(grasp_features['if_flip']):
-        if if_flip:
-            first_half_scores = copy.deepcopy(grasp_features['grasp_preds_features'][idx, :120])
-            last_half_scores = copy.deepcopy(grasp_features['grasp_preds_features'][idx, 120:240])
-            first_half_widths = copy.deepcopy(grasp_features['grasp_preds_features'][idx, 240:360])
-            last_half_widths = copy.deepcopy(grasp_features['grasp_preds_features'][idx, 360:480])
-            grasp_features['grasp_preds_features'][idx, :120] = last_half_scores
-            grasp_features['grasp_preds_features'][idx, 120:240] = first_half_scores
-            grasp_features['grasp_preds_features'][idx, 240:360] = last_half_widths
-            grasp_features['grasp_preds_features'][idx, 360:480] = first_half_widths
-        grasp_preds_features_rot[idx, :240-new_type[idx]*5] = grasp_features['grasp_preds_features'][idx, new_type[idx]*5:240]
-        grasp_preds_features_rot[idx, 240-new_type[idx]*5:240] = grasp_features['grasp_preds_features'][idx, 0:new_type[idx]*5]
-        grasp_preds_features_rot[idx, 240:480-new_type[idx]*5] = grasp_features['grasp_preds_features'][idx, 240+new_type[idx]*5:480]
-        grasp_preds_features_rot[idx, 480-new_type[idx]*5:480] = grasp_features['grasp_preds_features'][idx, 240:240+new_type[idx]*5] 
-    grasp_features['grasp_preds_features'] = grasp_preds_features_rot
-
-    return grasp_features
+    # flip the grasps of type 9 whose tcp z axis has a negative x on the base frame
+    return flip_grasp_rotations(ggarray, (0, 2), negative=True, columns=(1, 3), candidates=np.asarray(allegro_types) == 9)
+
+def get_graspgroup_features(grasp_features, sinput):
+    '''
+    **Input:**
+    - grasp_features: GraspFeatureBatch of the grasps, with the if_flip column.
+    - sinput: list of the sparse input of the clouds.
+
+    **Output:**
+    - GraspFeatureBatch with the halves of grasp_preds_features of the flipped grasps swapped, as they are saved.
+    - dict of the inputs of the decision models, on the device of the features.
+    '''
+    grasp_preds_features = canonicalize_grasp_preds_features(grasp_features['grasp_preds_features'], 0, grasp_features['if_flip'])
+    grasp_features = grasp_features.with_column('grasp_preds_features', grasp_preds_features)
+    grasp_features_dic = dict()
+    grasp_features_dic['grasp_depths'] = grasp_features.depth_classes()
+    grasp_features_dic['grasp_preds_features'] = canonicalize_grasp_preds_features(grasp_preds_features,
+                                                                                   grasp_features['grasp_angles'], False)
+    grasp_features_dic['sinput'] = sinput
+    return grasp_features, grasp_features_dic
 
 def get_robot(robot_ip="192.168.2.102", use_rt=False, robot_debug=True, gripper_type='robotiq',
               gripper_port='192.168.1.29', global_cam=False):
@@ -233,16 +131,20 @@ def get_robot(robot_ip="192.168.2.102", use_rt=False, robot_debug=True, gripper_
     robot.set_payload(2.7, (0, 0, 0.12))
     return robot
 
-def get_depth(existing_shm_depth):
-    time.sleep(0.1)
-    depths_1 = np.copy(np.ndarray((720, 1280), dtype=np.uint16, buffer=existing_shm_depth.buf))
-    return depths_1
+def get_depth(existing_shm_depth, settle=False):
+    ''' Depth image of the first camera frame published after the call; with settle, of the first frame
+        of a still scene, instead of sleeping a fixed time after the arm or the hand moved.
+    '''
+    with span('depth_fetch'):
+        if settle:
+            return existing_shm_depth.wait_for_stable_frame(newer_than=time.time()).depths
+        return existing_shm_depth.wait_for_frame(newer_than=time.time()).copy().depths
 
 def save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids, Allegro_ggarray, 
                             two_fingers_ggarray_source, Allegro_ggarray_source, two_fingers_ggarray_object_ids_source,
                             two_fingers_grasp_used, Allegro_grasp_used, grasp_features_used, 
                             mat_pose, colors_saved, depths_saved, grasp_features, two_fingers_source_grasp_features,
-                            before_collision, after_collision, Allegro_grasp_type):
+                            Allegro_grasp_type):
     save_path = cfgs.save_information_path
 
     timeStamp = datetime.datetime.now().timestamp()
@@ -251,31 +153,12 @@ def save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids,
     save_path = os.path.join(save_path, grasp_types[str(int(Allegro_grasp_type))]['name'], otherStyleTime)
 
     information = OrderedDict()
-    two_fingers_ggarray_proposals = []
-    Allegro_ggarray_proposals = []
-    for idx, tfg in enumerate(two_fingers_ggarray):
-        two_fingers_ggarray_proposals.append(
-            [float(tfg.score), float(tfg.width), float(tfg.height), float(tfg.depth)] +
-            np.array(tfg.rotation_matrix).reshape((-1)).tolist() + list(tfg.translation.tolist()) +
-            [float(two_fingers_ggarray_object_ids[idx])])
-        Allegro_ggarray_proposals.append(list(Allegro_ggarray[idx].get_array_grasp()))
-
-
-    two_fingers_ggarray_source_saved = []
-    Allegro_ggarray_source_saved = []
-    for idx, tfg in enumerate(two_fingers_ggarray_source):
-        two_fingers_ggarray_source_saved.append(
-            [float(tfg.score), float(tfg.width), float(tfg.height), float(tfg.depth)] +
-            np.array(tfg.rotation_matrix).reshape((-1)).tolist() + list(tfg.translation.tolist()) +
-            [float(two_fingers_ggarray_object_ids_source[idx])])
-        Allegro_ggarray_source_saved.append(list(Allegro_ggarray_source[idx].get_array_grasp()))
-
     tfg = two_fingers_grasp_used
     two_fingers_array = [float(tfg.score), float(tfg.width), float(tfg.height), float(tfg.depth)] + \
                         np.array(tfg.rotation_matrix).reshape((-1)).tolist() + \
                         list(tfg.translation.reshape(-1).tolist()) + \
                         [float(Allegro_grasp_used.object_id)]
-    grasp_features_used = get_grasp_features(grasp_features_used)
+    grasp_features_used = grasp_features_used.record()
     restart = False
     print('Is the grasping successful? press 1 successfully, press 2 failed, restart grasping and press 3, exit press 4\n')
     if_success = input('The result is: ')
@@ -319,40 +202,16 @@ def save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids,
 
     information['camera_internal'] = [[631.119, 363.884], [919.835, 919.61]]
 
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
-
-    color_path = os.path.join(save_path, 'color.png')
-    depth_path = os.path.join(save_path, 'depth.png')
-    from PIL import Image
-    cv2.imwrite(color_path, (cv2.cvtColor(colors_saved, cv2.COLOR_RGB2BGR) * 255.0).astype(np.float32))
-    cv2.imwrite(depth_path, depths_saved)
-    json_path = os.path.join(save_path, 'information.json')
-
-    json_file = json.dumps(information, indent=4)
-    with open(json_path, 'w') as handle:
-        handle.write(json_file)
-    print('Saved successfully')
+    get_grasp_recorder().submit(save_path, information, color=colors_saved, depth=depths_saved)
 
-def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False, voxel_size=0.005):
-    fx, fy = 913.232, 912.452
-    cx, cy = 628.847, 350.771
-    s = 1000.0
-
-    xmap, ymap = np.arange(depths.shape[1]), np.arange(depths.shape[0])
-    xmap, ymap = np.meshgrid(xmap, ymap)
-
-    points_z = depths / s
-    points_x = (xmap - cx) / fx * points_z
-    points_y = (ymap - cy) / fy * points_z
-
-    mask = (points_z > 0.2) & (points_z < 0.65) # 23.4.26
-    points = np.stack([points_x, points_y, points_z], axis=-1)
-    points = points[mask].astype(np.float32)
+def depth_to_points(depths, colors=None):
+    ''' Camera points of depths, and with DEBUG their cloud colored by colors of the same frame. '''
+    projector = get_depth_projector(913.232, 912.452, 628.847, 350.771)
+    with span('deprojection'):
+        points, mask = projector.project(depths, z_range=(0.2, 0.65)) # 23.4.26
 
     if DEBUG:
-        colors = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-        colors = colors[mask].astype(np.float32)
+        colors = colors_to_float(colors, mask)
 
     cloud = None
     if DEBUG:
@@ -360,27 +219,29 @@ def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False
         cloud.points = o3d.utility.Vector3dVector(points)
         cloud.colors = o3d.utility.Vector3dVector(colors)
 
+    return points, cloud
+
+def get_grasp(net, depths, colors, augment_mat=np.eye(4), flip=False, voxel_size=0.005):
+    points, cloud = depth_to_points(depths, colors)
     points = transform_point_cloud(points, augment_mat).astype(np.float32)
     points = torch.from_numpy(points)
-    coords = np.ascontiguousarray(points / voxel_size, dtype=int)
-    # Upd Note. API change.
-    _, idxs = ME.utils.sparse_quantize(coords, return_index=True)
-    coords = coords[idxs]
-    points = points[idxs]
-    coords_batch, points_batch = ME.utils.sparse_collate([coords], [points])
-
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    sinput = ME.SparseTensor(points_batch, coords_batch, device=device)
+    with span('voxelization'):
+        coords = np.ascontiguousarray(points / voxel_size, dtype=int)
+        idxs = sparse_quantize(coords)
+        coords = coords[idxs]
+        points = points[idxs]
+        coords_batch, points_batch = ME.utils.sparse_collate([coords], [points])
+        sinput = ME.SparseTensor(points_batch, coords_batch, device=device)
 
     end_points = {'sinput': sinput, 'point_clouds': [sinput.F]}
     with torch.no_grad():
-        end_points = net(end_points)
-        preds, grasp_features = parse_preds(end_points, use_v2=cfgs.use_graspnet_v2)
+        end_points = forward_net(net, end_points)
+        with span('decoding'):
+            preds, _, grasp_features = parse_preds(end_points, use_v2=cfgs.use_graspnet_v2)
         if len(preds) == 0:
             print('No grasp detected')
-            return None, cloud, points.cuda(), None, [sinput]
-        else:
-            preds = preds[0]
+            return None, cloud, points.to(device), None, [sinput]
     # filter
     if flip:
         augment_mat[:, 0] = -augment_mat[:, 0]
@@ -388,41 +249,86 @@ def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False
     rotation = augment_mat_tensor[:3, :3].reshape((-1)).repeat((preds.size()[0], 1)).view((preds.size()[0], 3, 3))
     translation = augment_mat_tensor[:3, 3]
 
-    preds[:,12:15] = torch.matmul(rotation, preds[:,12:15].view((-1, 3, 1))).view(-1, 3) + translation
-    pose_rotation = torch.matmul(rotation, preds[:,3:12].view((-1, 3, 3)))
+    preds[:,13:16] = torch.matmul(rotation, preds[:,13:16].view((-1, 3, 1))).view(-1, 3) + translation
+    pose_rotation = torch.matmul(rotation, preds[:,4:13].view((-1, 3, 3)))
     if flip:
-        preds[:, 12] = -preds[:, 12]
+        preds[:, 13] = -preds[:, 13]
         pose_rotation[:, 0, :] = -pose_rotation[:, 0, :]
         pose_rotation[:, :, 1] = -pose_rotation[:, :, 1]
-    preds[:, 3:12] = pose_rotation.view((-1, 9))
+    preds[:, 4:13] = pose_rotation.view((-1, 9))
 
-    mask = (preds[:,9] > 0.93) & (preds[:,1] < MAX_GRASP_WIDTH) & (preds[:,1] > MIN_GRASP_WIDTH)
-    workspace_mask = (preds[:,12] > -0.2) & (preds[:,12] < 0.2) & (preds[:,13] > -0.20) & (preds[:,13] < 0.07) 
+    mask = (preds[:,10] > 0.93) & (preds[:,1] < MAX_GRASP_WIDTH) & (preds[:,1] > MIN_GRASP_WIDTH)
+    workspace_mask = (preds[:,13] > -0.2) & (preds[:,13] < 0.2) & (preds[:,14] > -0.20) & (preds[:,14] < 0.07) 
+
+    ggarray = preds[workspace_mask & mask]
+    grasp_features = grasp_features[workspace_mask & mask]
+    if len(ggarray) == 0:
+        print('No grasp detected after masking')
+        return None, cloud, points.to(device), None, [sinput]
 
-    preds = preds[workspace_mask & mask]
-    grasp_features = grasp_features[0][workspace_mask & mask]
+    points = points.to(device)
+
+    return ggarray, cloud, points, grasp_features, [sinput]
+
+def get_grasps(net, depths, colors, augment_mats, flips, voxel_size=0.005):
+    # test-time augmentation: all augmented copies of the cloud go through the net as one batch
+    points, cloud = depth_to_points(depths, colors)
+    augment_mats = np.stack(augment_mats).astype(np.float32)
+    num_augment = len(augment_mats)
+    batch_ids = np.repeat(np.arange(num_augment), len(points))
+    points = np.matmul(points[np.newaxis], augment_mats[:, :3, :3].transpose(0, 2, 1)) + augment_mats[:, np.newaxis, :3, 3]
+    points = points.reshape((-1, 3)).astype(np.float32)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    with span('voxelization'):
+        coords = np.ascontiguousarray(points / voxel_size, dtype=int)
+        coords = np.concatenate([batch_ids[:, np.newaxis], coords], axis=1)
+        idxs = sparse_quantize(coords)
+        coords_batch = torch.from_numpy(coords[idxs]).int()
+        points_batch = torch.from_numpy(points[idxs])
+        sinput = ME.SparseTensor(points_batch, coords_batch, device=device)
+    point_clouds = [sinput.F[sinput.C[:, 0] == i] for i in range(num_augment)]
+    points = points_batch[batch_ids[idxs] == 0]
+
+    end_points = {'sinput': sinput, 'point_clouds': point_clouds}
+    with torch.no_grad():
+        end_points = forward_net(net, end_points)
+        with span('decoding'):
+            preds, preds_batch_ids, grasp_features = parse_preds(end_points, use_v2=cfgs.use_graspnet_v2)
     if len(preds) == 0:
+        print('No grasp detected')
+        return None, cloud, points.to(device), None, [sinput]
+
+    # un-augment the preds of every copy at once
+    flips = np.asarray(flips, dtype=bool)
+    augment_mats[flips, :, 0] = -augment_mats[flips, :, 0]
+    augment_mats_tensor = torch.tensor(np.linalg.inv(augment_mats).astype(np.float32), device=device)
+    rotation = augment_mats_tensor[preds_batch_ids, :3, :3]
+    translation = augment_mats_tensor[preds_batch_ids, :3, 3]
+    flip_sign = 1 - 2 * torch.tensor(flips, dtype=torch.float32, device=device)[preds_batch_ids]
+
+    preds[:,13:16] = torch.matmul(rotation, preds[:,13:16].view((-1, 3, 1))).view(-1, 3) + translation
+    pose_rotation = torch.matmul(rotation, preds[:,4:13].view((-1, 3, 3)))
+    preds[:, 13] = preds[:, 13] * flip_sign
+    pose_rotation[:, 0, :] = pose_rotation[:, 0, :] * flip_sign.view((-1, 1))
+    pose_rotation[:, :, 1] = pose_rotation[:, :, 1] * flip_sign.view((-1, 1))
+    preds[:, 4:13] = pose_rotation.view((-1, 9))
+
+    mask = (preds[:,10] > 0.93) & (preds[:,1] < MAX_GRASP_WIDTH) & (preds[:,1] > MIN_GRASP_WIDTH)
+    workspace_mask = (preds[:,13] > -0.2) & (preds[:,13] < 0.2) & (preds[:,14] > -0.20) & (preds[:,14] < 0.07) 
+
+    ggarray = preds[workspace_mask & mask]
+    grasp_features = grasp_features[workspace_mask & mask]
+    if len(ggarray) == 0:
         print('No grasp detected after masking')
-        return None, cloud, points.cuda(), None, [sinput]
+        return None, cloud, points.to(device), None, [sinput]
 
-    points = points.cuda()
-    heights = 0.03 * torch.ones([preds.shape[0], 1]).cuda()
-    object_ids = -1 * torch.ones([preds.shape[0], 1]).cuda()
-    ggarray = torch.cat([preds[:, 0:2], heights, preds[:, 2:15], preds[:, 15:16], object_ids], axis=-1)
+    points = points.to(device)
 
     return ggarray, cloud, points, grasp_features, [sinput]
 
 def load_meshes_pointcloud(path):
-    meshes_pcls = dict()
     meshes_pcl_path = os.path.join(path, 'meshes/source_pointclouds/voxel_size_' + str(int(Allegro_VOXElGRID * 1000)))
-    for type in os.listdir(meshes_pcl_path):
-        type_path = os.path.join(meshes_pcl_path, type)
-        for name in os.listdir(type_path):
-            width = name[:-4]
-            name_path = os.path.join(type_path, name)
-            meshes_pcl = o3d.io.read_point_cloud(name_path)
-            meshes_pcls[type + '_' + width] = meshes_pcl
-    return meshes_pcls
+    return HandTemplateStore(meshes_pcl_path)
 
 def create_tale_pointcloud(width=0.5, height=0.005, depth=0.4, dx=-0.25, dy=-0.15, dz=-0.55, grid_size=0.005):
     xmap = np.linspace(0, width, int(width/grid_size))
@@ -444,24 +350,25 @@ def get_allegro_model(allegro_models_path):
     allegro_models = dict()
     for model_type in os.listdir(allegro_models_path):
         allegro_model_path = os.path.join(allegro_models_path, model_type)
-        for model_class in os.listdir(allegro_model_path):
-            allegro_models[model_type] = dict()
+        models = []
+        model_classes = []
+        for model_class in sorted(os.listdir(allegro_model_path)):
             model_classs_type = os.path.join(allegro_model_path, model_class)
             for model in os.listdir(model_classs_type):
                 allegro_model_type_path = os.path.join(model_classs_type, model)
                 allegro_model = MinkowskiGraspNetMultifingerType1Inference(input_num=int(model_type))
-                allegro_net = torch.load(allegro_model_type_path)
+                allegro_net = torch.load(allegro_model_type_path, map_location=device)
                 allegro_model.load_state_dict(allegro_net.state_dict())
-                allegro_model.to(device)
                 allegro_model.eval()
-                if model_class not in allegro_models.keys():
-                    allegro_models[model_type][model_class] = [allegro_model]
-                else:
-                    allegro_models[model_type][model_class].append(allegro_model)
+                models.append(allegro_model)
+                model_classes.append(model_class)
+        # one fused module per input type, members of a model class are averaged
+        allegro_models[model_type] = MinkowskiGraspNetMultifingerEnsembleInference(models, model_classes).to(device).eval()
     return allegro_models
 
 def get_allegro_depth_type(allegro_models, grasp_features_dic, ggarray, grasp_features):
     if RANDOM:
+        ggarray = ggarray.cpu().numpy()
         allegro_depth = (np.random.randint(0, NUM_OF_ALLEGRO_DEPTH, (len(ggarray),))) * 0.01
         allegro_type = (np.random.randint(0, NUM_OF_ALLEGRO_TYPE, (len(ggarray),)))
         scores = ggarray[:, 0] 
@@ -470,43 +377,35 @@ def get_allegro_depth_type(allegro_models, grasp_features_dic, ggarray, grasp_fe
     for k, v in grasp_features_dic.items():
         if k == 'point_id' or k == 'sinput':
             continue
-        grasp_features_dic[k] = torch.tensor(copy.deepcopy(v), device=device)
+        grasp_features_dic[k] = torch.as_tensor(v, device=device)
     allegro_depth_type_scores = []
     for model_type, allegro_model in allegro_models.items():
         if model_type == '240':
             continue
-            model_input = torch.cat([grasp_features_dic["stage3_grasp_scores"]], dim=1)
+            model_input = torch.cat([grasp_features["stage3_grasp_scores"]], dim=1)
         elif model_type == '480':
             print('use final model: ', model_type)
             model_input = torch.cat([grasp_features_dic["grasp_preds_features"]], dim=1)
 
-        allegro_model_sorted = OrderedDict(sorted(allegro_model.items(), key = lambda t : t[0]))
-        for model_class, sub_allegro_model in allegro_model_sorted.items():
-            allegro_depth_types = torch.tensor(0, device=device)
-            for sub_sub_allegro_model in sub_allegro_model:
-                with torch.no_grad():
-                    grasp_pred, _ = sub_sub_allegro_model(model_input) # (B, 1， NUM_OF_TWO_FINGER_DEPTH*NUM_OF_ALLEGRO_DEPTH)
-                    grasp_pred = grasp_pred.view(grasp_pred.shape[0], 5*NUM_OF_ALLEGRO_DEPTH)
-                two_fingers_depth = grasp_features_dic['grasp_depths'] # (B, )
-                base = torch.tensor(np.array([[i for i in range(NUM_OF_ALLEGRO_DEPTH)]
-                                    for _ in range(grasp_pred.size()[0])]), device=device) # (B, NUM_OF_ALLEGRO_DEPTH)
-                select_index = (two_fingers_depth).view(-1, 1) * NUM_OF_ALLEGRO_DEPTH + base
-                grasp_pred = grasp_pred.gather(1, select_index)
-                allegro_depth_types = allegro_depth_types + grasp_pred
-            allegro_depth_types = (allegro_depth_types / len(sub_allegro_model)).squeeze(1)
-            allegro_depth_type_scores.append(allegro_depth_types)
+        with torch.no_grad():
+            grasp_pred = allegro_model(model_input) # (B, NUM_OF_MODEL_CLASS, NUM_OF_TWO_FINGER_DEPTH*NUM_OF_ALLEGRO_DEPTH)
+        B, num_classes = grasp_pred.size()[:2]
+        grasp_pred = grasp_pred.view(B, num_classes, 5, NUM_OF_ALLEGRO_DEPTH)
+        two_fingers_depth = grasp_features_dic['grasp_depths'].long().view(B, 1, 1, 1).expand(-1, num_classes, 1, NUM_OF_ALLEGRO_DEPTH)
+        allegro_depth_types = grasp_pred.gather(2, two_fingers_depth).view(B, num_classes * NUM_OF_ALLEGRO_DEPTH)
+        allegro_depth_type_scores.append(allegro_depth_types)
                 
     allegro_depth_type_scores = torch.cat(allegro_depth_type_scores, axis=1).view(-1) # (B, NUM_OF_ALLEGRO_DEPTH*NUM_OF_ALLEGRO_TYPE)
     
     scores, index = allegro_depth_type_scores.topk(min(3000, allegro_depth_type_scores.size()[0]))
     pose_index = (index / (NUM_OF_ALLEGRO_DEPTH * NUM_OF_ALLEGRO_TYPE)).long()
-    ggarray = torch.tensor(copy.deepcopy(ggarray), device=device)[pose_index]
-    grasp_features = torch.tensor(copy.deepcopy(grasp_features), device=device)[pose_index]
+    ggarray = ggarray[pose_index]
+    grasp_features = grasp_features[pose_index]
     allegro_depth = ((index % (NUM_OF_ALLEGRO_DEPTH * NUM_OF_ALLEGRO_TYPE)) % NUM_OF_ALLEGRO_DEPTH).int() * 0.01
     allegro_type = ((index % (NUM_OF_ALLEGRO_DEPTH * NUM_OF_ALLEGRO_TYPE)) / NUM_OF_ALLEGRO_DEPTH).int()
 
     return allegro_depth.cpu().numpy(), allegro_type.cpu().numpy() + 1, scores.detach().cpu().numpy(), \
-                ggarray.cpu().numpy(), grasp_features.cpu().numpy()
+                ggarray.cpu().numpy(), grasp_features
 
 def augment_data(flip=False):
     flip_mat = np.identity(4)
@@ -537,8 +436,11 @@ def augment_data(flip=False):
     aug_mat = np.dot(trans_mat, np.dot(rot_mat, flip_mat).astype(np.float32)).astype(np.float32)
     return aug_mat
 
-def get_ggarray_features(existing_shm_depth, existing_shm_color, net):
-    depths = get_depth(existing_shm_depth)
+def get_ggarray_features(existing_shm_depth, net, depths=None, colors=None):
+    ''' Grasps of depths and colors of one frame, captured from existing_shm_depth if depths is None. '''
+    if depths is None:
+        frame = capture_frame(existing_shm_depth)
+        depths, colors = frame['depths'], frame['colors']
     augment_mat1 = np.eye(4)
     augment_mats = []
     for i in range(POINTCLOUD_AUGMENT_NUM):
@@ -548,12 +450,16 @@ def get_ggarray_features(existing_shm_depth, existing_shm_color, net):
             augment_mat = augment_data(flip=True)
         augment_mats.append(augment_mat)
 
-    ggarray, cloud, points_down, grasp_features, sinput = get_grasp(net, depths, existing_shm_color, augment_mat=augment_mat1)
+    if BATCHED_AUGMENT:
+        return get_grasps(net, depths, colors, [augment_mat1] + augment_mats,
+                          [False] + [i % 2 == 1 for i in range(POINTCLOUD_AUGMENT_NUM)])
+
+    ggarray, cloud, points_down, grasp_features, sinput = get_grasp(net, depths, colors, augment_mat=augment_mat1)
     for i in range(POINTCLOUD_AUGMENT_NUM):
         if i % 2 == 0:
-            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, existing_shm_color, augment_mat=augment_mats[i])
+            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, colors, augment_mat=augment_mats[i])
         else:
-            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, existing_shm_color, augment_mat=augment_mats[i], flip=True)
+            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, colors, augment_mat=augment_mats[i], flip=True)
         if ggarray2 is None:
             continue
         if ggarray is None:
@@ -563,301 +469,317 @@ def get_ggarray_features(existing_shm_depth, existing_shm_color, net):
         else:
             sinput.append(sinput2[0])
             ggarray = torch.cat([ggarray, ggarray2], axis=0)
-            grasp_features = torch.cat([grasp_features, grasp_features2], axis=0)
+            grasp_features = GraspFeatureBatch.cat([grasp_features, grasp_features2])
     return ggarray, cloud, points_down, grasp_features, sinput
 
 def select_grasp_type(allegro_gg):
-    select_gg_types = [[] for _ in range(NUM_OF_ALLEGRO_TYPE)]
-    for idx, score in enumerate(allegro_gg.scores):
-        grasp_type = allegro_gg.grasp_types[idx]
-        max_num = 50
-        if grasp_type in [4, 6]:
-            max_num = 5
-
-        if len(select_gg_types[int(grasp_type)-1]) < max_num:
-            select_gg_types[int(grasp_type)-1].append(idx)
-    print('select grasp type shape: ', [len(i) for i in select_gg_types])
-    gg_type_id = []
-    for gg_type in select_gg_types:
-        gg_type_id += gg_type
-    return gg_type_id
+    # at most 50 grasps of every type, 5 for the types 4 and 6, in the order of the grasp group
+    max_nums = np.full(NUM_OF_ALLEGRO_TYPE + 1, 50)
+    max_nums[[4, 6]] = 5
+    grasp_types = allegro_gg.grasp_types.astype(int)
+    index = select_top_per_type(grasp_types, max_nums)
+    print('select grasp type shape: ', np.bincount(grasp_types[index], minlength=NUM_OF_ALLEGRO_TYPE + 1)[1:].tolist())
+    return index
+
+def capture_frame(existing_shm_depth, settle=False):
+    ''' Depth and color of one camera frame, see get_depth. '''
+    with span('depth_fetch'):
+        if settle:
+            frame = existing_shm_depth.wait_for_stable_frame(newer_than=time.time())
+        else:
+            frame = existing_shm_depth.wait_for_frame(newer_than=time.time()).copy()
+    return {'depths': frame.depths, 'colors': frame.colors}
+
+def show_cloud(cloud):
+    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
+    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
+    o3d.visualization.draw_geometries([cloud, frame, sphere])
+
+def perceive(item, net):
+    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(None, net, depths=item['depths'],
+                                                                               colors=item['colors'])
+    item['cloud'] = cloud
+    if ggarray is None:
+        print('No grasp detected')
+        return None
+    item.update(ggarray=ggarray, points_down=points_down, grasp_features=grasp_features, sinput=sinput)
+    return item
+
+def score_grasps(item, allegro_models):
+    ggarray = item['ggarray']
+    # Prevent the robot arm from crossing the border, 
+    grasp_features = item['grasp_features']
+    two_fingers_source_grasp_features = grasp_features
+
+    ggarray, if_flip = flip_ggarray(ggarray)
+    grasp_features = grasp_features.with_column('if_flip', if_flip)
+
+    source_index = sort_by_score(ggarray[:, 0], 2000)
+    ggarray = ggarray[source_index]
+    grasp_features = grasp_features[source_index]
+
+    grasp_features, grasp_features_dic = get_graspgroup_features(grasp_features, item['sinput'])
+    with span('decision_scoring'):
+        allegro_depths, allegro_types, scores, ggarray, grasp_features = \
+                                        get_allegro_depth_type(allegro_models, grasp_features_dic,
+                                                                ggarray, grasp_features=grasp_features)
+    if not RANDOM:
+        score_thresh = 0.7
+        mask = (scores > score_thresh)
+        ggarray = ggarray[mask]
+        grasp_features = grasp_features[mask]
+        allegro_depths = allegro_depths[mask]
+        allegro_types = allegro_types[mask]
+        scores = scores[mask]
+    
+    ggarray, if_flip = flip_z_ggarray(ggarray, allegro_types)
+
+    if len(ggarray) == 0:
+        print('There is no grasp that score greater than 0.9 ')
+        return None
+
+    two_fingers_ggarray = GraspGroup(ggarray)
+    two_fingers_ggarray_object_ids_source = ggarray[:, 16]
+    two_fingers_ggarray_source = copy.deepcopy(two_fingers_ggarray)
+
+    Allegro_ggarray = AllegroGraspGroup() 
+    Allegro_ggarray.from_graspgroup(two_fingers_ggarray, allegro_types, cfgs.Allegro_mesh_json_path)
+    Allegro_ggarray.object_ids = two_fingers_ggarray_object_ids_source
+    Allegro_ggarray.scores = scores
+    Allegro_ggarray.depths = Allegro_ggarray.depths + allegro_depths + DEFAULT_DEPTH
+    Allegro_ggarray_source = copy.deepcopy(Allegro_ggarray)
+
+    two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids_source
+    if len(Allegro_ggarray) == 0:
+        print('No grasp detected after filter')
+        return None
+    
+    index_score = np.argsort(Allegro_ggarray.scores)[::-1]
+    Allegro_ggarray = Allegro_ggarray[index_score]
+    two_fingers_ggarray = two_fingers_ggarray[index_score]
+    grasp_features = grasp_features[index_score]
+    two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_score]
+
+    index_type = select_grasp_type(Allegro_ggarray)
+    Allegro_ggarray = Allegro_ggarray[index_type]
+    two_fingers_ggarray = two_fingers_ggarray[index_type]
+    grasp_features = grasp_features[index_type]
+    two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_type]
+
+    if len(Allegro_ggarray) == 0:
+        print('No grasp detected after filter')
+        return None
+    item.update(two_fingers_ggarray=two_fingers_ggarray, two_fingers_ggarray_object_ids=two_fingers_ggarray_object_ids,
+                Allegro_ggarray=Allegro_ggarray, grasp_features=grasp_features,
+                two_fingers_ggarray_source=two_fingers_ggarray_source, Allegro_ggarray_source=Allegro_ggarray_source,
+                two_fingers_ggarray_object_ids_source=two_fingers_ggarray_object_ids_source,
+                two_fingers_source_grasp_features=two_fingers_source_grasp_features)
+    return item
+
+def filter_collisions(item, meshes_pcls, approach_distance=0.08, reachability=None):
+    Allegro_ggarray = item['Allegro_ggarray']
+    two_fingers_ggarray = item['two_fingers_ggarray']
+    with span('collision_check'):
+        mfcdetector = ModelFreeCollisionDetectorMultifinger(item['points_down'].cpu().numpy(), voxel_size=0.001)
+        Allegro_ggarray, two_fingers_ggarray, empty_mask, min_width_index = mfcdetector.detect(Allegro_ggarray, two_fingers_ggarray,
+                                                              cfgs.Allegro_mesh_json_path, meshes_pcls, min_grasp_width=MIN_GRASP_WIDTH,
+                                                              VoxelGrid=Allegro_VOXElGRID, DEBUG=False, approach_dist=approach_distance,
+                                                              collision_thresh=1, adjust_gripper_centers=True,)
+
+    # proposals
+    Allegro_ggarray = Allegro_ggarray[empty_mask]
+    two_fingers_ggarray = two_fingers_ggarray[empty_mask]
+    two_fingers_ggarray_object_ids = item['two_fingers_ggarray_object_ids'][min_width_index][empty_mask]
+    grasp_features = item['grasp_features'][min_width_index][empty_mask]
+
+    if reachability is not None and len(Allegro_ggarray) > 0:
+        with span('reachability_check'):
+            reachable = reachability(Allegro_ggarray, two_fingers_ggarray, approach_distance)
+        Allegro_ggarray = Allegro_ggarray[reachable]
+        two_fingers_ggarray = two_fingers_ggarray[reachable]
+        two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[reachable]
+        grasp_features = grasp_features[reachable]
+
+    if len(Allegro_ggarray) == 0:
+        print('No Grasp detected after collision detection!')
+        return None
+
+    # sort
+    index_score = np.argsort(Allegro_ggarray.scores)[::-1][0:10]
+    item.update(two_fingers_ggarray_object_ids=two_fingers_ggarray_object_ids[index_score],
+                Allegro_ggarray=Allegro_ggarray[index_score], two_fingers_ggarray=two_fingers_ggarray[index_score],
+                grasp_features=grasp_features[index_score],
+                mfcdetector=mfcdetector, approach_distance=approach_distance)
+    return item
+
+def get_reachability(robot, start_joints, max_joint_delta=None):
+    ''' Callable(Allegro_ggarray, two_fingers_ggarray, approach_distance) -> mask of the grasps the arm can reach.
+
+        The grasps are solved from start_joints, where the arm starts the pick, not from getj(): with --pipeline
+        the check runs while the arm is still throwing.
+    '''
+    def reachability(Allegro_ggarray, two_fingers_ggarray, approach_distance):
+        reachable, _ = robot.get_reachable_grasps(Allegro_ggarray, two_fingers_ggarray, approach_dist=approach_distance,
+                                                  use_ready_pose=True, current_joints=start_joints,
+                                                  max_joint_delta=max_joint_delta)
+        return reachable
+    return reachability
+
+def get_stages(net, allegro_models, meshes_pcls, reachability=None):
+    ''' Perception, decision and collision stages of a captured frame, see run_stages and GraspPipeline. '''
+    tracer = get_tracer()
+    return [tracer.traced('perceive', lambda item: perceive(item, net)),
+            tracer.traced('score_grasps', lambda item: score_grasps(item, allegro_models)),
+            tracer.traced('filter_collisions', lambda item: filter_collisions(item, meshes_pcls, reachability=reachability))]
+
+def execute_plan(robot, plan, meshes_pcls, acc, vel, on_throw=None):
+    Allegro_ggarray = plan['Allegro_ggarray']
+    two_fingers_ggarray = plan['two_fingers_ggarray']
+    grasp_features = plan['grasp_features']
+    cloud = plan['cloud']
+
+    idx = random.randint(0, len(Allegro_ggarray)-1)
+    Allegro_grasp_used = Allegro_ggarray[idx]
+    two_fingers_grasp_used = two_fingers_ggarray[idx]
+    grasp_features_used = grasp_features[idx]
+
+
+    print('picked by scores rotations, translations: ', Allegro_grasp_used.rotation_matrix,
+          Allegro_grasp_used.translation, two_fingers_grasp_used.translation, two_fingers_grasp_used.rotation_matrix)
+    print('grasp score:', Allegro_grasp_used.score, two_fingers_grasp_used.score)
+    print('grasp width:', Allegro_grasp_used.width, two_fingers_grasp_used.width)
+    print('grasp depth:', Allegro_grasp_used.depth, two_fingers_grasp_used.depth)
+    print('grasp type:', Allegro_grasp_used.grasp_type)
+    print('grasp angle:', Allegro_grasp_used.angle)
+
+    ####################################
+    if DEBUG:
+        Allegro_pose = Allegro_grasp_used.load_mesh(cfgs.Allegro_mesh_json_path, two_fingers_grasp_used)
+        frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
+        sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
+        Allegro_pose.paint_uniform_color([1, 0, 0])
+        meshes_pointclouds = plan['mfcdetector'].load_meshes_pcls(meshes_pcls, two_fingers_ggarray[[idx]], Allegro_ggarray[[idx]])[0]
+        voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=meshes_pointclouds,
+                                                                    voxel_size=0.002)
+        scene_cloud = o3d.geometry.PointCloud()
+        scene_cloud.points = o3d.utility.Vector3dVector(plan['points_down'].cpu().numpy())
+
+        # scene_cloud.points = o3d.utility.Vector3dVector(np.vstack((points_down.cpu().numpy(), table_pointcloud)))
+        scene_cloud = scene_cloud.voxel_down_sample(0.001)
+        ps = scene_cloud.points
+        ps = o3d.utility.Vector3dVector(ps)
+        output = voxel_grid.check_if_included(ps)
+
+        o3d.visualization.draw_geometries(
+            [Allegro_pose, cloud, sphere, frame, two_fingers_grasp_used.to_open3d_geometry()])
+
+    gripper_time = 0.8
+    if Allegro_grasp_used.grasp_type == 8:
+        allegro_ready_pose = np.array([[0, 1.4, 1.4, 1.4], [0, 1.4, 1.4, 1.4], [0, 1.4, 1.4, 1.4], [0.5, 0, 0.2, 0]]).reshape(16)
+        with span('gripper'):
+            robot.open_gripper(allegro_ready_pose, sleep_time = gripper_time)
+
+    with span('gripper'):
+        robot.open_gripper(Allegro_grasp_used.angle, sleep_time = gripper_time)
+    print(Allegro_grasp_used.rotation_matrix, Allegro_grasp_used.translation)
+    with span('motion'):
+        mat_pose = robot.grasp_and_throw(Allegro_grasp_used, two_fingers_grasp_used, cloud, cfgs.Allegro_mesh_json_path,
+                                         acc=acc*2, vel=vel*3, approach_dist=plan['approach_distance'],
+                                         execute_grasp=True, use_ready_pose=True, gripper_time=gripper_time, on_throw=on_throw)
+
+        while robot.is_program_running():
+            pass
+
+    save_grasp_information(two_fingers_ggarray, plan['two_fingers_ggarray_object_ids'], Allegro_ggarray, 
+                    plan['two_fingers_ggarray_source'], plan['Allegro_ggarray_source'], plan['two_fingers_ggarray_object_ids_source'],
+                    two_fingers_grasp_used, Allegro_grasp_used, grasp_features_used, 
+                    mat_pose, plan['colors'], plan['depths'], grasp_features, plan['two_fingers_source_grasp_features'],
+                    Allegro_grasp_used.grasp_type)
 
 def robot_grasp(cfgs):
     net = get_net(cfgs.checkpoint_path, use_v2=cfgs.use_graspnet_v2)
     robot = get_robot(cfgs.robot_ip, robot_debug=True, gripper_type='Allegro', global_cam=cfgs.global_camera)
     allegro_models = get_allegro_model(cfgs.allegro_model_path)
     fail = 0
-    existing_shm_color = shared_memory.SharedMemory(name='realsense_color')
-    existing_shm_depth = shared_memory.SharedMemory(name='realsense_depth')
+    existing_shm_depth = FrameRing('realsense_frames')
+    existing_shm_color = existing_shm_depth
     meshes_pcls = load_meshes_pointcloud(cfgs.Allegro_mesh_json_path)
     table_pointcloud = create_tale_pointcloud()
+    reachability = None
+    if cfgs.check_reachability:
+        start_joints = robot.throwj2 if cfgs.global_camera else robot.readyj
+        reachability = get_reachability(robot, start_joints, cfgs.max_joint_delta)
+    stages = get_stages(net, allegro_models, meshes_pcls, reachability=reachability)
+    tracer = get_tracer()
+    os.makedirs(cfgs.trace_dir, exist_ok=True)
+    pipeline = None
     try:
         v = 0.01
         a = 0.01
         if cfgs.global_camera:
             robot.movej(robot.throwj2, acc=a*2,
                         vel=v*3)  # this v and a are anguler, so it should be larger than translational
-            t1 = time.time()
-            depths = get_depth(existing_shm_depth)
-            depths_saved = copy.deepcopy(depths)
-            colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-            ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth, existing_shm_color, net)
-
-            t3 = time.time()
-            print(f'Net Time:{t3 - t1}')
-
         else:
             robot.movel(robot.ready_pose(), acc=a*2,
                         vel=v*3)  # this v and a are anguler, so it should be larger than translational
 
+        if cfgs.pipeline:
+            # the arm is out of the view of the global camera while it throws, so the next pick is
+            # planned on a fresh frame during the throw and the labeling of the current one
+            pipeline = GraspPipeline(lambda: capture_frame(existing_shm_depth), stages,
+                                     is_stale=lambda plan: depth_changed(plan['depths'], get_depth(existing_shm_depth)))
+            pipeline.start()
+
         while True:
-            if not cfgs.global_camera:
-                t1 = time.time()
-                robot.movel(robot.ready_pose(), acc=a * 10, vel=v * 10,
-                            wait=True)  # this v and a are anguler, so it should be larger than translational
-                time.sleep(0.5)
-                print('movel')
-                robot.gripper_home()
-                print('gripper home')
-                time.sleep(0.7)
-                depths = get_depth(existing_shm_depth)
-                depths_saved = copy.deepcopy(depths)
-                colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth, existing_shm_color, net)
-
-                t3 = time.time()
-                print(f'Net Time:{t3 - t1}')
-
-            if ggarray is None:
-                fail = fail + 1
+            t1 = time.time()
+            if pipeline is not None:
+                with span('wait_for_plan'):
+                    try:
+                        plan = pipeline.get_plan(timeout=cfgs.plan_timeout)
+                    except queue.Empty:
+                        raise RuntimeError('No grasp planned in {} seconds'.format(cfgs.plan_timeout))
+            else:
                 if not cfgs.global_camera:
-                    while robot.is_program_running():
-                        robot.stopj(acc=10.0 * a)
-                    robot.movel(robot.ready_pose(), acc=a*10,
-                                vel=v*10)  # this v and a are anguler, so it should be larger than translational
+                    with span('motion'):
+                        robot.movel(robot.ready_pose(), acc=a * 10, vel=v * 10,
+                                    wait=True)  # this v and a are anguler, so it should be larger than translational
+                    time.sleep(0.5)
+                    print('movel')
+                    with span('gripper'):
+                        robot.gripper_home()
+                    print('gripper home')
+                with span('plan') as plan_span:
+                    plan, item = run_stages(capture_frame(existing_shm_depth, settle=not cfgs.global_camera), stages)
+                    plan_span.ok = plan is not None
+
+                if plan is None:
+                    fail = fail + 1
+                    if DEBUG and item.get('cloud') is not None:
+                        show_cloud(item['cloud'])
+                    if not cfgs.global_camera:
+                        while robot.is_program_running():
+                            robot.stopj(acc=10.0 * a)
+                        robot.movel(robot.ready_pose(), acc=a*10,
+                                    vel=v*10)  # this v and a are anguler, so it should be larger than translational
                     time.sleep(0.1)
-                else:
-                    depths = get_depth(existing_shm_depth)
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                       existing_shm_color, net)
-                    time.sleep(0.1)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-
-            ########## PROCESS GRASPS ##########
-            # collision detection
-            ggarray = ggarray.cpu().numpy()
-            # Prevent the robot arm from crossing the border, 
-            grasp_features = grasp_features.cpu().numpy()
-            two_fingers_source_grasp_features = copy.deepcopy(grasp_features)
-
-            ggarray, if_flip = flip_ggarray(ggarray)
-            grasp_features = np.c_[grasp_features, if_flip]
-
-            source_index = ggarray[:, 0].argsort()
-            ggarray = ggarray[source_index][::-1][:2000]
-            grasp_features = grasp_features[source_index][::-1][:2000]
-
-            grasp_features_dic = get_graspgroup_features(grasp_features, sinput)
-            allegro_depths, allegro_types, scores, ggarray, grasp_features = \
-                                            get_allegro_depth_type(allegro_models, grasp_features_dic,
-                                                                    ggarray, grasp_features=grasp_features)
-            if not RANDOM:
-                score_thresh = 0.7
-                mask = (scores > score_thresh)
-                ggarray = ggarray[mask]
-                grasp_features = grasp_features[mask]
-                allegro_depths = allegro_depths[mask]
-                allegro_types = allegro_types[mask]
-                scores = scores[mask]
-            
-            ggarray, if_flip = flip_z_ggarray(ggarray, allegro_types)
-
-            if len(ggarray) == 0:
-                print('There is no grasp that score greater than 0.9 ')
-                if cfgs.global_camera:
-                    depths = get_depth(existing_shm_depth)
-                    depths_saved = copy.deepcopy(depths)
-                    colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth, existing_shm_color, net)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-
-            two_fingers_ggarray = GraspGroup(ggarray)
-            two_fingers_ggarray_object_ids_source = ggarray[:, 16]
-            two_fingers_ggarray_source = copy.deepcopy(two_fingers_ggarray)
-
-            Allegro_ggarray = AllegroGraspGroup() 
-            Allegro_ggarray.from_graspgroup(two_fingers_ggarray, allegro_types, cfgs.Allegro_mesh_json_path)
-            Allegro_ggarray.object_ids = two_fingers_ggarray_object_ids_source
-            Allegro_ggarray.scores = scores
-            Allegro_ggarray.depths = Allegro_ggarray.depths + allegro_depths + DEFAULT_DEPTH
-            Allegro_ggarray_source = copy.deepcopy(Allegro_ggarray)
-
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids_source
-            before_collision = [copy.deepcopy(np.array(Allegro_ggarray.grasp_group_array).tolist()), 
-                                copy.deepcopy(np.array(two_fingers_ggarray.grasp_group_array).tolist()),
-                                copy.deepcopy(np.array(grasp_features).tolist())]
-            if len(Allegro_ggarray) == 0:
-                print('No grasp detected after filter')
-                if cfgs.global_camera:
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                       existing_shm_color, net)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-            
-            index_score = np.argsort(Allegro_ggarray.scores)[::-1]
-            Allegro_ggarray = Allegro_ggarray[index_score]
-            two_fingers_ggarray = two_fingers_ggarray[index_score]
-            grasp_features = grasp_features[index_score]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_score]
-
-            index_type = select_grasp_type(Allegro_ggarray)
-            Allegro_ggarray = Allegro_ggarray[index_type]
-            two_fingers_ggarray = two_fingers_ggarray[index_type]
-            grasp_features = grasp_features[index_type]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_type]
-
-            if len(Allegro_ggarray) == 0:
-                print('No grasp detected after filter')
-                if cfgs.global_camera:
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                       existing_shm_color, net)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-            approach_distance = 0.08
-
-            start_time = time.time()
-            mfcdetector = ModelFreeCollisionDetectorMultifinger(points_down.cpu().numpy(), voxel_size=0.001)
-            Allegro_ggarray, two_fingers_ggarray, empty_mask, min_width_index = mfcdetector.detect(Allegro_ggarray, two_fingers_ggarray,
-                                                                  cfgs.Allegro_mesh_json_path, meshes_pcls, min_grasp_width=MIN_GRASP_WIDTH,
-                                                                  VoxelGrid=Allegro_VOXElGRID, DEBUG=False, approach_dist=approach_distance,
-                                                                  collision_thresh=1, adjust_gripper_centers=True,)
-
-            # proposals
-            Allegro_ggarray = Allegro_ggarray[empty_mask]
-            two_fingers_ggarray = two_fingers_ggarray[empty_mask]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[min_width_index][empty_mask]
-            grasp_features = grasp_features[min_width_index][empty_mask]
-
-            after_collision = [copy.deepcopy(np.array(Allegro_ggarray.grasp_group_array).tolist()), 
-                                copy.deepcopy(np.array(two_fingers_ggarray.grasp_group_array).tolist()),
-                                copy.deepcopy(np.array(grasp_features).tolist())]
-
-            if len(Allegro_ggarray) == 0:
-                print('No Grasp detected after collision detection!')
-                fail = fail + 1
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                if not cfgs.global_camera:
-                    while robot.is_program_running():
-                        robot.stopj(acc=10.0 * a)
-                    robot.movel(robot.ready_pose(), acc=a*10,
-                                vel=v*10)  # this v and a are anguler, so it should be larger than translational
-                else:
-                    t1 = time.time()
-                    depths = get_depth(existing_shm_depth)
-                    depths_saved = copy.deepcopy(depths)
-                    colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                       existing_shm_color, net)
-                    t3 = time.time()
-                    print(f'Net Time:{t3 - t1}')
-                continue
-
-            # sort
-            index_score = np.argsort(Allegro_ggarray.scores)[::-1][0:10]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_score]
-            Allegro_ggarray = Allegro_ggarray[index_score]
-            two_fingers_ggarray = two_fingers_ggarray[index_score]
-            grasp_features = grasp_features[index_score]
-
-            idx = random.randint(0, len(index_score)-1)
-            Allegro_grasp_used = Allegro_ggarray[idx]
-            two_fingers_grasp_used = two_fingers_ggarray[idx]
-            grasp_features_used = grasp_features[idx]
-
-
-            print('picked by scores rotations, translations: ', Allegro_grasp_used.rotation_matrix,
-                  Allegro_grasp_used.translation, two_fingers_grasp_used.translation, two_fingers_grasp_used.rotation_matrix)
-            print('grasp score:', Allegro_grasp_used.score, two_fingers_grasp_used.score)
-            print('grasp width:', Allegro_grasp_used.width, two_fingers_grasp_used.width)
-            print('grasp depth:', Allegro_grasp_used.depth, two_fingers_grasp_used.depth)
-            print('grasp type:', Allegro_grasp_used.grasp_type)
-            print('grasp angle:', Allegro_grasp_used.angle)
-
-            t4 = time.time()
-            ####################################
-            if DEBUG:
-                Allegro_pose = Allegro_grasp_used.load_mesh(cfgs.Allegro_mesh_json_path, two_fingers_grasp_used)
-                frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                Allegro_pose.paint_uniform_color([1, 0, 0])
-                meshes_pointclouds = Allegro_grasp_used.load_mesh_pointclouds(cfgs.Allegro_mesh_json_path, two_fingers_grasp_used, voxel_size=0.002)
-                voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=meshes_pointclouds,
-                                                                            voxel_size=0.002)
-                scene_cloud = o3d.geometry.PointCloud()
-                scene_cloud.points = o3d.utility.Vector3dVector(points_down.cpu().numpy())
-
-                # scene_cloud.points = o3d.utility.Vector3dVector(np.vstack((points_down.cpu().numpy(), table_pointcloud)))
-                scene_cloud = scene_cloud.voxel_down_sample(0.001)
-                ps = scene_cloud.points
-                ps = o3d.utility.Vector3dVector(ps)
-                output = voxel_grid.check_if_included(ps)
-
-                o3d.visualization.draw_geometries(
-                    [Allegro_pose, cloud, sphere, frame, two_fingers_grasp_used.to_open3d_geometry()])
-
-            gripper_time = 0.8
-            if Allegro_grasp_used.grasp_type == 8:
-                allegro_ready_pose = np.array([[0, 1.4, 1.4, 1.4], [0, 1.4, 1.4, 1.4], [0, 1.4, 1.4, 1.4], [0.5, 0, 0.2, 0]]).reshape(16)
-                robot.open_gripper(allegro_ready_pose, sleep_time = gripper_time)
-
-            robot.open_gripper(Allegro_grasp_used.angle, sleep_time = gripper_time)
-            print(Allegro_grasp_used.rotation_matrix, Allegro_grasp_used.translation)
-            mat_pose = robot.grasp_and_throw(Allegro_grasp_used, two_fingers_grasp_used, cloud, cfgs.Allegro_mesh_json_path,
-                                             acc=a*2, vel=v*3, approach_dist=approach_distance,
-                                             execute_grasp=True, use_ready_pose=True, gripper_time=gripper_time)
-
-            while robot.is_program_running():
-                pass
-
-            t45 = time.time()
-
-            save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids, Allegro_ggarray, 
-                            two_fingers_ggarray_source, Allegro_ggarray_source, two_fingers_ggarray_object_ids_source,
-                            two_fingers_grasp_used, Allegro_grasp_used, grasp_features_used, 
-                            mat_pose, colors_saved, depths_saved, grasp_features, two_fingers_source_grasp_features,
-                            before_collision, after_collision, Allegro_grasp_used.grasp_type)
-            if cfgs.global_camera:
-                t1 = time.time()
-                depths = get_depth(existing_shm_depth)
-                depths_saved = copy.deepcopy(depths)
-                colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                ggarray, cloud, points_down, grasp_features = get_grasp(net, depths, existing_shm_color)
-                t3 = time.time()
-                print(f'Net Time:{t3 - t1}')
+                    continue
+
+            with span('execute'):
+                execute_plan(robot, plan, meshes_pcls, a, v,
+                             on_throw=pipeline.scene_changed if pipeline is not None else None)
 
             t5 = time.time()
-            print(f'ready time:{t5 - t45}')
-            print(f'Exec Time:{t5 - t4}')
             mpph = 3600 / (t5 - t1)
             print(f'\033[1;31mMPPH:{mpph}\033[0m\n--------------------')
+            if tracer.enabled:
+                tracer.write_csv(os.path.join(cfgs.trace_dir, 'spans.csv'))
     finally:
+        if pipeline is not None:
+            pipeline.stop()
+        if tracer.enabled and len(tracer.records) > 0:
+            tracer.write_csv(os.path.join(cfgs.trace_dir, 'spans.csv'))
+            tracer.export_chrome_trace(os.path.join(cfgs.trace_dir, 'trace.json'))
+            print(format_summary(tracer.summary()))
         robot.close()
         existing_shm_depth.close()
         if DEBUG:
@@ -1,5 +1,4 @@
 import copy
-import json
 import os
 import sys
 import time
@@ -8,13 +7,12 @@ import random
 import argparse
 import torch
 import numpy as np
-import cv2
 import open3d as o3d
 import MinkowskiEngine as ME
 from graspnetAPI import GraspGroup
 from ur_toolbox.robot import UR_Camera_Gripper
+from ur_toolbox.camera import FrameRing, colors_to_float, get_depth_projector
 from ur_toolbox.robot.InspireHandR_grasp import InspireHandRGraspGroup, grasp_types
-from multiprocessing import shared_memory
 from collections import OrderedDict
 import matplotlib.pyplot as plt
 import pickle
@@ -25,9 +23,14 @@ sys.path.append(os.path.join(ROOT_DIR, 'models'))
 sys.path.append(os.path.join(ROOT_DIR, 'dataset'))
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 from models.minkowski_graspnet_single_point import MinkowskiGraspNet, MinkowskiGraspNetMultifingerType1Inference
-from np_utils import transform_point_cloud
-from pt_utils import batch_viewpoint_params_to_matrix
+from np_utils import transform_point_cloud, sparse_quantize
+from pt_utils import decode_grasp_preds, canonicalize_grasp_preds_features
+from grasp_selection import flip_grasp_rotations, sort_by_score, select_top_per_type
+from grasp_features import GraspFeatureBatch
 from collision_detector import ModelFreeCollisionDetectorMultifinger, ModelFreeCollisionDetectorMultifinger
+from grasp_pipeline import GraspPipeline, run_stages, depth_changed
+from template_store import HandTemplateStore
+from grasp_recorder import get_grasp_recorder
 import queue
 from itertools import count
 from threading import Thread
@@ -43,7 +46,11 @@ parser.add_argument('--robot_ip', required=True, help='Robot IP')
 parser.add_argument('--use_graspnet_v2', action='store_true', help='Whether to use graspnet v2 format')
 parser.add_argument('--half_views', action='store_true', help='Use only half views in network.')
 parser.add_argument('--global_camera', action='store_true', help='Use the settings for global camera.')
+parser.add_argument('--pipeline', action='store_true', help='Plan the next grasp while the arm throws, requires --global_camera.')
+parser.add_argument('--plan_timeout', type=float, default=60.0, help='Seconds to wait for a plan of the pipeline before stopping [default: 60.0]')
 cfgs = parser.parse_args()
+if cfgs.pipeline and not cfgs.global_camera:
+    parser.error('--pipeline requires --global_camera')
 
 MAX_GRASP_WIDTH = 0.1
 MIN_GRASP_WIDTH = 0.01
@@ -60,86 +67,8 @@ POINTCLOUD_AUGMENT_NUM = 10
 RANDOM_GRASP = True
 
 def parse_preds(end_points, use_v2=False):
-    ## load preds
-    before_generator = end_points['before_generator']  # (B, Ns, 256)
-    point_features = end_points['point_features']  # (B, Ns, 512)
-    coords = end_points['sinput'].C  # (\Sigma Ni, 4)
-    objectness_pred = end_points['stage1_objectness_pred']  # (Sigma Ni, 2)
-    objectness_mask = torch.argmax(objectness_pred, dim=1).bool()  # (\Sigma Ni,)
-    seed_xyz = end_points['stage2_seed_xyz']  # (B, Ns, 3)
-    seed_inds = end_points['stage2_seed_inds']  # (B, Ns)
-    grasp_view_xyz = end_points['stage2_view_xyz']  # (B, Ns, 3)
-    grasp_view_inds = end_points['stage2_view_inds']
-    grasp_view_scores = end_points['stage2_view_scores']
-    grasp_scores = end_points['stage3_grasp_scores']  # (B, Ns, A, D)
-    grasp_features_two_finger = end_points['stage3_grasp_features'].view(grasp_scores.size()[0], grasp_scores.size()[1], -1) # (B, Ns, 3 + C)
-    grasp_widths = MAX_GRASP_WIDTH * end_points['stage3_normalized_grasp_widths']  # (B, Ns, A, D)
-    grasp_widths[grasp_widths > MAX_GRASP_WIDTH] = MAX_GRASP_WIDTH
-
-    grasp_preds = []
-    grasp_features = []
-    grasp_vdistance_list = []
-    for i in range(BATCH_SIZE):
-        
-        cloud_mask_i = (coords[:, 0] == i)
-        seed_inds_i = seed_inds[i]
-        objectness_mask_i = objectness_mask[cloud_mask_i][seed_inds_i]  # (Ns,)
-
-        if objectness_mask_i.any() == False:
-            continue
-
-        seed_xyz_i = seed_xyz[i] # [objectness_mask_i]  # (Ns', 3)
-        point_features_i = point_features[i] # [objectness_mask_i]
-        
-        seed_inds_i = seed_inds_i # [objectness_mask_i]
-        before_generator_i = before_generator[i] # [objectness_mask_i]
-        grasp_view_xyz_i = grasp_view_xyz[i] # [objectness_mask_i]  # (Ns', 3)
-        grasp_view_inds_i = grasp_view_inds[i] # [objectness_mask_i]
-        grasp_view_scores_i = grasp_view_scores[i] # [objectness_mask_i]
-        grasp_scores_i = grasp_scores[i] # [objectness_mask_i]  # (Ns', A, D)
-        grasp_widths_i = grasp_widths[i] # [objectness_mask_i] # (Ns', A, D)
-        
-        Ns, A, D = grasp_scores_i.size()
-        grasp_features_two_finger_i = grasp_features_two_finger[i] # [objectness_mask_i] # (Ns', 3 + C)
-        grasp_scores_i_A_D = copy.deepcopy(grasp_scores_i).view(Ns, -1)
-
-        grasp_scores_i = torch.minimum(grasp_scores_i[:,:24,:], grasp_scores_i[:,24:,:])
-        seed_inds_i = seed_inds_i.view(Ns, -1)
-        grasp_view_inds_i = grasp_view_inds_i.view(Ns, -1)
-        grasp_view_scores_i = grasp_view_scores_i.view(Ns, -1)
-
-        grasp_scores_i, grasp_angles_class_i = torch.max(grasp_scores_i, dim=1) # (Ns', D), (Ns', D)
-        grasp_angles_i = (grasp_angles_class_i.float()-12) / 24 * np.pi  # (Ns', topk, D)
-
-        # grasp width & vdistance
-        grasp_angles_class_i = grasp_angles_class_i.unsqueeze(1) # (Ns', 1, D)
-        grasp_widths_pos_i = torch.gather(grasp_widths_i, 1, grasp_angles_class_i).squeeze(1) # (Ns', D)
-        grasp_widths_neg_i = torch.gather(grasp_widths_i, 1, grasp_angles_class_i+24).squeeze(1) # (Ns', D)
-
-        ## slice preds by grasp score/depth
-        # grasp score & depth
-        grasp_scores_i, grasp_depths_class_i = torch.max(grasp_scores_i, dim=1, keepdims=True) # (Ns', 1), (Ns', 1)
-        grasp_depths_i = (grasp_depths_class_i.float() + 1) * 0.01  # (Ns'*topk, 1)
-
-        grasp_depths_i -= 0.01
-        grasp_depths_i[grasp_depths_class_i==0] = 0.005
-        # grasp angle & width & vdistance
-        grasp_angles_i = torch.gather(grasp_angles_i, 1, grasp_depths_class_i) # (Ns', 1)
-        grasp_widths_pos_i = torch.gather(grasp_widths_pos_i, 1, grasp_depths_class_i) # (Ns', 1)
-        grasp_widths_neg_i = torch.gather(grasp_widths_neg_i, 1, grasp_depths_class_i) # (Ns', 1)
-
-        # convert to rotation matrix
-        rotation_matrices_i = batch_viewpoint_params_to_matrix(-grasp_view_xyz_i, grasp_angles_i.squeeze(1))
-
-        # # adjust gripper centers
-        grasp_widths_i = grasp_widths_pos_i + grasp_widths_neg_i
-        rotation_matrices_i = rotation_matrices_i.view(Ns, 9)
-
-        # merge preds
-        grasp_preds.append(torch.cat([grasp_scores_i, grasp_widths_i, grasp_depths_i, rotation_matrices_i, seed_xyz_i],axis=1))  # (Ns, 15)
-        grasp_features.append(torch.cat([grasp_scores_i_A_D, grasp_features_two_finger_i, before_generator_i, point_features_i, grasp_view_inds_i, grasp_view_scores_i, seed_inds_i, grasp_angles_i*24/np.pi+12, grasp_depths_i], axis=1)) # (Ns'*3, A, D)
-        
-    return grasp_preds, grasp_features
+    # (N, 17) grasps in ggarray layout of all the clouds of the batch, the feature rows are gathered lazily
+    return decode_grasp_preds(end_points, MAX_GRASP_WIDTH)
 
 def get_net(checkpoint_path, use_v2=False):
     if use_v2:
@@ -154,65 +83,27 @@ def get_net(checkpoint_path, use_v2=False):
     return net
 
 def flip_ggarray(ggarray):
-    ggarray_rotations = ggarray[:, 4:13].reshape((-1, 3, 3))
-    tcp_x_axis_on_base_frame = ggarray_rotations[:, 1, 1]
-    if_flip = [False for _ in range(len(ggarray))]
-    for ids, y_x in enumerate(tcp_x_axis_on_base_frame):
-        if y_x < 0:
-            ggarray_rotations[ids, :3, 0:2] = -ggarray_rotations[ids, :3, 0:2]
-            if_flip[ids] = True
-    ggarray[:, 4:13] = ggarray_rotations.reshape((-1, 9))
-    return ggarray, if_flip
-
-def get_grasp_features(grasp_features_array):
-    grasp_features = dict()
-    grasp_features['grasp_angles'] = int(grasp_features_array[-3]+0.1)
-    grasp_features['grasp_depths'] = int(grasp_features_array[-2]*100+0.1)
-    grasp_features['stage3_grasp_scores'] = grasp_features_array[:240].tolist()
-    grasp_features['grasp_preds_features'] = grasp_features_array[240:240+480].tolist()
-    grasp_features['stage3_grasp_features'] = grasp_features_array[240+480:240+480+512].tolist()
-    grasp_features['before_generator'] = grasp_features_array[240+480+512:240+480+512+512].tolist()
-    grasp_features['point_features'] = grasp_features_array[240+480+512+512:240+480+512+512+512].tolist()
-    grasp_features['point_id'] = int(grasp_features_array[-4])
-    grasp_features['if_flip'] = bool(int(grasp_features_array[-1]))
-    grasp_features['view_inds'] = bool(int(grasp_features_array[-6]))
-    grasp_features['view_score'] = bool(int(grasp_features_array[-5]))
-    return grasp_features
-
-def get_graspgroup_features(grasp_features_array, sinput):
-    grasp_features = dict()
-    grasp_features['grasp_angles'] = (grasp_features_array[:, -3]+0.1).astype(int)
-    grasp_features['grasp_depths'] = (grasp_features_array[:, -2]*100+0.1).astype(int)
-    grasp_features['stage3_grasp_scores'] = grasp_features_array[:, :240]
-    grasp_features['grasp_preds_features'] = grasp_features_array[:, 240:240+480]
-    grasp_features['stage3_grasp_features'] = grasp_features_array[:, 240+480:240+480+512]
-    grasp_features['before_generator'] = grasp_features_array[:, 240+480+512:240+480+512+512]
-    grasp_features['point_features'] = grasp_features_array[:, 240+480+512+512:240+480+512+512+512]
-    grasp_features['point_id'] = (grasp_features_array[:, -4]+0.1).astype(int)
-    grasp_features['if_flip'] = grasp_features_array[:, -1]
-    grasp_features['view_inds'] = (grasp_features_array[:, -6]+0.1).astype(int)
-    grasp_features['view_score'] = grasp_features_array[:, -5]
-    grasp_features['sinput'] = sinput
-
-    grasp_preds_features_rot = np.zeros(grasp_features['grasp_preds_features'].shape, dtype = np.float32)
-    new_type = grasp_features['grasp_angles']
-    for idx, if_flip in enumerate(grasp_features['if_flip']):
-        if if_flip:
-            first_half_scores = copy.deepcopy(grasp_features['grasp_preds_features'][idx, :120])
-            last_half_scores = copy.deepcopy(grasp_features['grasp_preds_features'][idx, 120:240])
-            first_half_widths = copy.deepcopy(grasp_features['grasp_preds_features'][idx, 240:360])
-            last_half_widths = copy.deepcopy(grasp_features['grasp_preds_features'][idx, 360:480])
-            grasp_features['grasp_preds_features'][idx, :120] = last_half_scores
-            grasp_features['grasp_preds_features'][idx, 120:240] = first_half_scores
-            grasp_features['grasp_preds_features'][idx, 240:360] = last_half_widths
-            grasp_features['grasp_preds_features'][idx, 360:480] = first_half_widths
-        grasp_preds_features_rot[idx, :240-new_type[idx]*5] = grasp_features['grasp_preds_features'][idx, new_type[idx]*5:240]
-        grasp_preds_features_rot[idx, 240-new_type[idx]*5:240] = grasp_features['grasp_preds_features'][idx, 0:new_type[idx]*5]
-        grasp_preds_features_rot[idx, 240:480-new_type[idx]*5] = grasp_features['grasp_preds_features'][idx, 240+new_type[idx]*5:480]
-        grasp_preds_features_rot[idx, 480-new_type[idx]*5:480] = grasp_features['grasp_preds_features'][idx, 240:240+new_type[idx]*5] 
-    grasp_features['grasp_preds_features'] = grasp_preds_features_rot
-
-    return grasp_features
+    # flip the grasps whose tcp x axis has a negative y on the base frame
+    return flip_grasp_rotations(ggarray, (1, 1), negative=True, columns=(0, 2))
+
+def get_graspgroup_features(grasp_features, sinput):
+    '''
+    **Input:**
+    - grasp_features: GraspFeatureBatch of the grasps, with the if_flip column.
+    - sinput: list of the sparse input of the clouds.
+
+    **Output:**
+    - GraspFeatureBatch with the halves of grasp_preds_features of the flipped grasps swapped, as they are saved.
+    - dict of the inputs of the decision models, on the device of the features.
+    '''
+    grasp_preds_features = canonicalize_grasp_preds_features(grasp_features['grasp_preds_features'], 0, grasp_features['if_flip'])
+    grasp_features = grasp_features.with_column('grasp_preds_features', grasp_preds_features)
+    grasp_features_dic = dict()
+    grasp_features_dic['grasp_depths'] = grasp_features.depth_classes()
+    grasp_features_dic['grasp_preds_features'] = canonicalize_grasp_preds_features(grasp_preds_features,
+                                                                                   grasp_features['grasp_angles'], False)
+    grasp_features_dic['sinput'] = sinput
+    return grasp_features, grasp_features_dic
 
 def get_robot(robot_ip="192.168.2.102", use_rt=False, robot_debug=True, gripper_type='robotiq',
               gripper_port='/dev/ttyUSB1', global_cam=False):
@@ -222,10 +113,13 @@ def get_robot(robot_ip="192.168.2.102", use_rt=False, robot_debug=True, gripper_
     robot.set_payload(1.3, (0, 0, 0.09))
     return robot
 
-def get_depth(existing_shm_depth):
-    time.sleep(0.1)
-    depths_1 = np.copy(np.ndarray((720, 1280), dtype=np.uint16, buffer=existing_shm_depth.buf))
-    return depths_1
+def get_depth(existing_shm_depth, settle=False):
+    ''' Depth image of the first camera frame published after the call; with settle, of the first frame
+        of a still scene, instead of sleeping a fixed time after the arm or the hand moved.
+    '''
+    if settle:
+        return existing_shm_depth.wait_for_stable_frame(newer_than=time.time()).depths
+    return existing_shm_depth.wait_for_frame(newer_than=time.time()).copy().depths
 
 def save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids, InspireHandR_ggarray, 
                             two_fingers_ggarray_source, InspireHandR_ggarray_source, two_fingers_ggarray_object_ids_source,
@@ -239,31 +133,12 @@ def save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids,
     save_path = os.path.join(save_path, grasp_types[str(int(InspireHandR_grasp_used.grasp_type))]['name'], otherStyleTime)
 
     information = OrderedDict()
-    two_fingers_ggarray_proposals = []
-    InspireHandR_ggarray_proposals = []
-    for idx, tfg in enumerate(two_fingers_ggarray):
-        two_fingers_ggarray_proposals.append(
-            [float(tfg.score), float(tfg.width), float(tfg.height), float(tfg.depth)] +
-            np.array(tfg.rotation_matrix).reshape((-1)).tolist() + list(tfg.translation.tolist()) +
-            [float(two_fingers_ggarray_object_ids[idx])])
-        InspireHandR_ggarray_proposals.append(list(InspireHandR_ggarray[idx].get_array_grasp()))
-
-
-    two_fingers_ggarray_source_saved = []
-    InspireHandR_ggarray_source_saved = []
-    for idx, tfg in enumerate(two_fingers_ggarray_source):
-        two_fingers_ggarray_source_saved.append(
-            [float(tfg.score), float(tfg.width), float(tfg.height), float(tfg.depth)] +
-            np.array(tfg.rotation_matrix).reshape((-1)).tolist() + list(tfg.translation.tolist()) +
-            [float(two_fingers_ggarray_object_ids_source[idx])])
-        InspireHandR_ggarray_source_saved.append(list(InspireHandR_ggarray_source[idx].get_array_grasp()))
-
     tfg = two_fingers_grasp_used
     two_fingers_array = [float(tfg.score), float(tfg.width), float(tfg.height), float(tfg.depth)] + \
                         np.array(tfg.rotation_matrix).reshape((-1)).tolist() + \
                         list(tfg.translation.reshape(-1).tolist()) + \
                         [float(InspireHandR_grasp_used.object_id)]
-    grasp_features_used = get_grasp_features(grasp_features_used)
+    grasp_features_used = grasp_features_used.record()
     restart = False
     print('Is the grasping successful? press 1 successfully, press 2 failed, restart grasping and press 3, exit press 4\n')
     if_success = input('The result is: ')
@@ -310,40 +185,15 @@ def save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids,
 
     information['camera_internal'] = [[629.535, 351.636], [912.897, 912.258]]
 
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
+    get_grasp_recorder().submit(save_path, information, color=colors_saved, depth=depths_saved)
 
-    color_path = os.path.join(save_path, 'color.png')
-    depth_path = os.path.join(save_path, 'depth.png')
-    from PIL import Image
-    cv2.imwrite(color_path, (cv2.cvtColor(colors_saved, cv2.COLOR_RGB2BGR) * 255.0).astype(np.float32))
-    cv2.imwrite(depth_path, depths_saved)
-    json_path = os.path.join(save_path, 'information.json')
-
-    json_file = json.dumps(information, indent=4)
-    with open(json_path, 'w') as handle:
-        handle.write(json_file)
-    print('Saved successfully')
-
-def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False, voxel_size=0.005):
-    fx, fy = 919.835, 919.61
-    cx, cy = 631.119, 363.884
-    s = 1000.0
-
-    xmap, ymap = np.arange(depths.shape[1]), np.arange(depths.shape[0])
-    xmap, ymap = np.meshgrid(xmap, ymap)
-
-    points_z = depths / s
-    points_x = (xmap - cx) / fx * points_z
-    points_y = (ymap - cy) / fy * points_z
-
-    mask = (points_z > 0.35) & (points_z < 0.68)   
-    points = np.stack([points_x, points_y, points_z], axis=-1)
-    points = points[mask].astype(np.float32)
+def depth_to_points(depths, colors=None):
+    ''' Camera points of depths, and with DEBUG their cloud colored by colors of the same frame. '''
+    projector = get_depth_projector(919.835, 919.61, 631.119, 363.884)
+    points, mask = projector.project(depths, z_range=(0.35, 0.68))
 
     if DEBUG:
-        colors = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-        colors = colors[mask].astype(np.float32)
+        colors = colors_to_float(colors, mask)
 
     cloud = None
     if DEBUG:
@@ -351,11 +201,14 @@ def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False
         cloud.points = o3d.utility.Vector3dVector(points)
         cloud.colors = o3d.utility.Vector3dVector(colors)
 
+    return points, cloud
+
+def get_grasp(net, depths, colors, augment_mat=np.eye(4), flip=False, voxel_size=0.005):
+    points, cloud = depth_to_points(depths, colors)
     points = transform_point_cloud(points, augment_mat).astype(np.float32)
     points = torch.from_numpy(points)
     coords = np.ascontiguousarray(points / voxel_size, dtype=int)
-    # Upd Note. API change.
-    _, idxs = ME.utils.sparse_quantize(coords, return_index=True)
+    idxs = sparse_quantize(coords)
     coords = coords[idxs]
     points = points[idxs]
     coords_batch, points_batch = ME.utils.sparse_collate([coords], [points])
@@ -366,12 +219,10 @@ def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False
     end_points = {'sinput': sinput, 'point_clouds': [sinput.F]}
     with torch.no_grad():
         end_points = net(end_points)
-        preds, grasp_features = parse_preds(end_points, use_v2=cfgs.use_graspnet_v2)
+        preds, _, grasp_features = parse_preds(end_points, use_v2=cfgs.use_graspnet_v2)
         if len(preds) == 0:
             print('No grasp detected')
             return None, cloud, points.cuda(), None, None
-        else:
-            preds = preds[0]
     # filter
     if flip:
         augment_mat[:, 0] = -augment_mat[:, 0]
@@ -379,40 +230,29 @@ def get_grasp(net, depths, existing_shm_color, augment_mat=np.eye(4), flip=False
     rotation = augment_mat_tensor[:3, :3].reshape((-1)).repeat((preds.size()[0], 1)).view((preds.size()[0], 3, 3))
     translation = augment_mat_tensor[:3, 3]
 
-    preds[:,12:15] = torch.matmul(rotation, preds[:,12:15].view((-1, 3, 1))).view(-1, 3) + translation
-    pose_rotation = torch.matmul(rotation, preds[:,3:12].view((-1, 3, 3)))
+    preds[:,13:16] = torch.matmul(rotation, preds[:,13:16].view((-1, 3, 1))).view(-1, 3) + translation
+    pose_rotation = torch.matmul(rotation, preds[:,4:13].view((-1, 3, 3)))
     if flip:
-        preds[:, 12] = -preds[:, 12]
+        preds[:, 13] = -preds[:, 13]
         pose_rotation[:, 0, :] = -pose_rotation[:, 0, :]
         pose_rotation[:, :, 1] = -pose_rotation[:, :, 1]
-    preds[:, 3:12] = pose_rotation.view((-1, 9))
+    preds[:, 4:13] = pose_rotation.view((-1, 9))
 
-    mask = (preds[:,9] > 0.92) & (preds[:,1] < MAX_GRASP_WIDTH) & (preds[:,1] > MIN_GRASP_WIDTH)
-    workspace_mask = (preds[:,12] > -0.25) & (preds[:,12] < 0.25) & (preds[:,13] > -0.205) & (preds[:,13] < 0.03)
-    preds = preds[workspace_mask & mask]
-    grasp_features = grasp_features[0][workspace_mask & mask]
-    if len(preds) == 0:
+    mask = (preds[:,10] > 0.92) & (preds[:,1] < MAX_GRASP_WIDTH) & (preds[:,1] > MIN_GRASP_WIDTH)
+    workspace_mask = (preds[:,13] > -0.25) & (preds[:,13] < 0.25) & (preds[:,14] > -0.205) & (preds[:,14] < 0.03)
+    ggarray = preds[workspace_mask & mask]
+    grasp_features = grasp_features[workspace_mask & mask]
+    if len(ggarray) == 0:
         print('No grasp detected after masking')
         return None, cloud, points.cuda(), None, None
 
     points = points.cuda()
-    heights = 0.03 * torch.ones([preds.shape[0], 1]).cuda()
-    object_ids = -1 * torch.ones([preds.shape[0], 1]).cuda()
-    ggarray = torch.cat([preds[:, 0:2], heights, preds[:, 2:15], preds[:, 15:16], object_ids], axis=-1)
 
     return ggarray, cloud, points, grasp_features, [sinput]
 
 def load_meshes_pointcloud(path):
-    meshes_pcls = dict()
     meshes_pcl_path = os.path.join(path, 'source_pointclouds/voxel_size_' + str(int(INSPIREHANDR_VOXElGRID * 1000)))
-    for type in os.listdir(meshes_pcl_path):
-        type_path = os.path.join(meshes_pcl_path, type)
-        for name in os.listdir(type_path):
-            width = name[:-4]
-            name_path = os.path.join(type_path, name)
-            meshes_pcl = o3d.io.read_point_cloud(name_path)
-            meshes_pcls[type + '_' + width] = meshes_pcl
-    return meshes_pcls
+    return HandTemplateStore(meshes_pcl_path)
 
 def get_inspire_model(inspire_models_path):
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
@@ -434,6 +274,7 @@ def get_inspire_model(inspire_models_path):
 
 def get_inspire_depth_type(inspire_models, grasp_features_dic, ggarray, grasp_features):
     if RANDOM_GRASP:
+        ggarray = ggarray.cpu().numpy()
         inspire_type = np.random.randint(0, NUM_OF_INSPIRE_TYPE, (len(ggarray),))
         inspire_depth = (np.random.randint(0, 4, (len(ggarray),)))
         inspire_depth[inspire_type==5] = inspire_depth[inspire_type==5] + 2
@@ -444,13 +285,13 @@ def get_inspire_depth_type(inspire_models, grasp_features_dic, ggarray, grasp_fe
     for k, v in grasp_features_dic.items():
         if k == 'point_id' or k == 'sinput':
             continue
-        grasp_features_dic[k] = torch.tensor(copy.deepcopy(v), device=device)
+        grasp_features_dic[k] = torch.as_tensor(v, device=device)
 
     inspire_depth_type_scores = []
     for model_type, inspire_model in inspire_models.items():
         if model_type == '240':
             continue
-            model_input = torch.cat([grasp_features_dic["stage3_grasp_scores"]], dim=1)
+            model_input = torch.cat([grasp_features["stage3_grasp_scores"]], dim=1)
         elif model_type == '480':
             print('use final model: ', model_type)
             model_input = torch.cat([grasp_features_dic["grasp_preds_features"]], dim=1)
@@ -469,8 +310,8 @@ def get_inspire_depth_type(inspire_models, grasp_features_dic, ggarray, grasp_fe
     inspire_depth_type_scores = torch.cat(inspire_depth_type_scores, axis=1).view(-1) # (B, NUM_OF_INSPIRE_DEPTH*NUM_OF_INSPIRE_TYPE)
     scores, index = inspire_depth_type_scores.topk(min(3000, inspire_depth_type_scores.size()[0]))
     pose_index = (index / (NUM_OF_INSPIRE_DEPTH * NUM_OF_INSPIRE_TYPE)).long()
-    ggarray = torch.tensor(copy.deepcopy(ggarray), device=device)[pose_index]
-    grasp_features = torch.tensor(copy.deepcopy(grasp_features), device=device)[pose_index]
+    ggarray = ggarray[pose_index]
+    grasp_features = grasp_features[pose_index]
     inspire_depth = ((index % (NUM_OF_INSPIRE_DEPTH * NUM_OF_INSPIRE_TYPE)) % NUM_OF_INSPIRE_DEPTH).int()
     inspire_type = ((index % (NUM_OF_INSPIRE_DEPTH * NUM_OF_INSPIRE_TYPE)) / NUM_OF_INSPIRE_DEPTH).int()
 
@@ -478,7 +319,7 @@ def get_inspire_depth_type(inspire_models, grasp_features_dic, ggarray, grasp_fe
     inspire_depth = inspire_depth * 0.01
 
     return inspire_depth.cpu().numpy(), inspire_type.cpu().numpy() + 1, scores.detach().cpu().numpy(), \
-                ggarray.cpu().numpy(), grasp_features.cpu().numpy()
+                ggarray.cpu().numpy(), grasp_features
 
 def augment_data(flip=False):
     flip_mat = np.identity(4)
@@ -508,8 +349,7 @@ def augment_data(flip=False):
     aug_mat = np.dot(trans_mat, np.dot(rot_mat, flip_mat).astype(np.float32)).astype(np.float32)
     return aug_mat
 
-def get_ggarray_features(existing_shm_depth, existing_shm_color, net):
-    depths = get_depth(existing_shm_depth)
+def get_ggarray_features(net, depths, colors):
     augment_mat1 = np.eye(4)
     augment_mats = []
     
@@ -520,12 +360,12 @@ def get_ggarray_features(existing_shm_depth, existing_shm_color, net):
             augment_mat = augment_data(flip=True)
         augment_mats.append(augment_mat)
 
-    ggarray, cloud, points_down, grasp_features, sinput = get_grasp(net, depths, existing_shm_color, augment_mat=augment_mat1)
+    ggarray, cloud, points_down, grasp_features, sinput = get_grasp(net, depths, colors, augment_mat=augment_mat1)
     for i in range(POINTCLOUD_AUGMENT_NUM):
         if i % 2 == 0:
-            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, existing_shm_color, augment_mat=augment_mats[i])
+            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, colors, augment_mat=augment_mats[i])
         else:
-            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, existing_shm_color, augment_mat=augment_mats[i], flip=True)
+            ggarray2, _, _, grasp_features2, sinput2 = get_grasp(net, depths, colors, augment_mat=augment_mats[i], flip=True)
         if ggarray2 is None:
             continue
         if ggarray is None:
@@ -535,288 +375,259 @@ def get_ggarray_features(existing_shm_depth, existing_shm_color, net):
         else:
             sinput.append(sinput2[0])
             ggarray = torch.cat([ggarray, ggarray2], axis=0)
-            grasp_features = torch.cat([grasp_features, grasp_features2], axis=0)
+            grasp_features = GraspFeatureBatch.cat([grasp_features, grasp_features2])
     return ggarray, cloud, points_down, grasp_features, sinput
 
 def select_grasp_type(inspire_gg):
-    select_gg_types = [[] for _ in range(1, NUM_OF_INSPIRE_TYPE+1)]
-    for idx, score in enumerate(inspire_gg.scores):
-        grasp_type = inspire_gg.grasp_types[idx]
-        if grasp_type in [1]:
-            max_num = 10
-        else:
-            max_num = 50
-        if len(select_gg_types[int(grasp_type)]) < max_num:
-            select_gg_types[int(grasp_type)].append(idx)
-    gg_type_id = []
-    for gg_type in select_gg_types:
-        gg_type_id += gg_type
-    return gg_type_id
+    # at most 50 grasps of every type, 10 for the type 1, in the order of the grasp group
+    max_nums = np.full(NUM_OF_INSPIRE_TYPE, 50)
+    max_nums[1] = 10
+    return select_top_per_type(inspire_gg.grasp_types.astype(int), max_nums)
+
+def capture_frame(existing_shm_depth, settle=False):
+    ''' Depth and color of one camera frame, see get_depth. '''
+    if settle:
+        frame = existing_shm_depth.wait_for_stable_frame(newer_than=time.time())
+    else:
+        frame = existing_shm_depth.wait_for_frame(newer_than=time.time()).copy()
+    return {'depths': frame.depths, 'colors': frame.colors}
+
+def show_cloud(cloud):
+    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
+    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
+    o3d.visualization.draw_geometries([cloud, frame, sphere])
+
+def perceive(item, net):
+    t1 = time.time()
+    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(net, item['depths'], item['colors'])
+    print(f'Net Time:{time.time() - t1}')
+    item['cloud'] = cloud
+    if ggarray is None:
+        print('No grasp detected')
+        return None
+    item.update(ggarray=ggarray, points_down=points_down, grasp_features=grasp_features, sinput=sinput)
+    return item
+
+def score_grasps(item, inspire_models):
+    ggarray = item['ggarray']
+    # Prevent the robot arm from crossing the border, 
+    grasp_features = item['grasp_features']
+
+    ggarray, if_flip = flip_ggarray(ggarray)
+    grasp_features = grasp_features.with_column('if_flip', if_flip)
+    ggarray = ggarray[~if_flip]
+    grasp_features = grasp_features[~if_flip]
+
+    source_index = sort_by_score(ggarray[:, 0], 1000)
+    ggarray = ggarray[source_index]
+    grasp_features = grasp_features[source_index]
+    grasp_features, grasp_features_dic = get_graspgroup_features(grasp_features, item['sinput'])
+    
+    inspire_depth, inspire_type, scores, ggarray, grasp_features = \
+                                    get_inspire_depth_type(inspire_models, grasp_features_dic,
+                                                            ggarray, grasp_features=grasp_features)
+
+    if not RANDOM_GRASP:
+        score_thresh = 0.85
+        mask = (scores > score_thresh)
+        ggarray = ggarray[mask]
+        grasp_features = grasp_features[mask]
+        inspire_depth = inspire_depth[mask]
+        inspire_type = inspire_type[mask]
+        scores = scores[mask]
+    
+    if len(ggarray) == 0:
+        print('There is no grasp that score greater than 0.9 ')
+        return None
+
+    two_fingers_ggarray = GraspGroup(ggarray)
+    two_fingers_ggarray_object_ids_source = ggarray[:, 16]
+    two_fingers_ggarray_source = copy.deepcopy(two_fingers_ggarray)
+
+    InspireHandR_ggarray = InspireHandRGraspGroup() 
+    InspireHandR_ggarray.set_grasp_min_width(MIN_GRASP_WIDTH)
+    InspireHandR_ggarray.from_graspgroup(two_fingers_ggarray, inspire_type, cfgs.inspire_mesh_json_path)
+    InspireHandR_ggarray.object_ids = two_fingers_ggarray_object_ids_source
+    InspireHandR_ggarray.scores = scores
+    InspireHandR_ggarray.depths = InspireHandR_ggarray.depths + inspire_depth + INSPIREHANDR_DEFAULT_DEPTH
+    InspireHandR_ggarray_source = copy.deepcopy(InspireHandR_ggarray)
+
+    index_filter_by_z_axis = InspireHandR_ggarray.filter_grasp_group_by_z_axis(0.4)
+    two_fingers_ggarray = two_fingers_ggarray[index_filter_by_z_axis]
+    two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids_source[index_filter_by_z_axis]
+    grasp_features = grasp_features[index_filter_by_z_axis]
+
+    if len(InspireHandR_ggarray) == 0:
+        print('No grasp detected after filter')
+        return None
+    
+    index_score = np.argsort(InspireHandR_ggarray.scores)[::-1]
+    InspireHandR_ggarray = InspireHandR_ggarray[index_score]
+    two_fingers_ggarray = two_fingers_ggarray[index_score]
+    grasp_features = grasp_features[index_score]
+    two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_score]
+
+    index_type = select_grasp_type(InspireHandR_ggarray)
+    item.update(InspireHandR_ggarray=InspireHandR_ggarray[index_type], two_fingers_ggarray=two_fingers_ggarray[index_type],
+                grasp_features=grasp_features[index_type], two_fingers_ggarray_object_ids=two_fingers_ggarray_object_ids[index_type],
+                two_fingers_ggarray_source=two_fingers_ggarray_source, InspireHandR_ggarray_source=InspireHandR_ggarray_source,
+                two_fingers_ggarray_object_ids_source=two_fingers_ggarray_object_ids_source)
+    return item
+
+def filter_collisions(item, meshes_pcls, approach_distance=0.06):
+    t3 = time.time()
+    mfcdetector = ModelFreeCollisionDetectorMultifinger(item['points_down'].cpu().numpy(), voxel_size=0.001)
+    InspireHandR_ggarray, two_fingers_ggarray, empty_mask, min_width_index = mfcdetector.detect(item['InspireHandR_ggarray'], item['two_fingers_ggarray'],
+                                                          cfgs.inspire_mesh_json_path, meshes_pcls, min_grasp_width=MIN_GRASP_WIDTH,
+                                                          VoxelGrid=INSPIREHANDR_VOXElGRID, DEBUG=False, approach_dist=approach_distance,
+                                                          collision_thresh=0, adjust_gripper_centers=True,)
+
+    # proposals
+    InspireHandR_ggarray = InspireHandR_ggarray[empty_mask]
+    two_fingers_ggarray = two_fingers_ggarray[empty_mask]
+    two_fingers_ggarray_object_ids = item['two_fingers_ggarray_object_ids'][min_width_index][empty_mask]
+    grasp_features = item['grasp_features'][min_width_index][empty_mask]
+    print(f'Collision Processing Time:{time.time() - t3}')
+
+    if len(InspireHandR_ggarray) == 0:
+        print('No Grasp detected after collision detection!')
+        return None
+
+    # sort
+    index_score = np.argsort(InspireHandR_ggarray.scores)[::-1][:10]
+    item.update(two_fingers_ggarray_object_ids=two_fingers_ggarray_object_ids[index_score],
+                InspireHandR_ggarray=InspireHandR_ggarray[index_score], two_fingers_ggarray=two_fingers_ggarray[index_score],
+                grasp_features=grasp_features[index_score],
+                mfcdetector=mfcdetector, approach_distance=approach_distance)
+    return item
+
+def get_stages(net, inspire_models, meshes_pcls):
+    ''' Perception, decision and collision stages of a captured frame, see run_stages and GraspPipeline. '''
+    return [lambda item: perceive(item, net),
+            lambda item: score_grasps(item, inspire_models),
+            lambda item: filter_collisions(item, meshes_pcls)]
+
+def execute_plan(robot, plan, meshes_pcls, acc, vel, on_throw=None):
+    InspireHandR_ggarray = plan['InspireHandR_ggarray']
+    two_fingers_ggarray = plan['two_fingers_ggarray']
+    grasp_features = plan['grasp_features']
+    cloud = plan['cloud']
+
+    idx = random.randint(0, len(InspireHandR_ggarray)-1)
+    InspireHandR_grasp_used = InspireHandR_ggarray[idx]
+    two_fingers_grasp_used = two_fingers_ggarray[idx]
+    grasp_features_used = grasp_features[idx]
+
+
+    print('picked by scores rotations, translations: ', InspireHandR_grasp_used.rotation_matrix,
+          InspireHandR_grasp_used.translation, two_fingers_grasp_used.translation, two_fingers_grasp_used.rotation_matrix)
+    print('grasp score:', InspireHandR_grasp_used.score, two_fingers_grasp_used.score)
+    print('grasp width:', InspireHandR_grasp_used.width, two_fingers_grasp_used.width)
+    print('grasp depth:', InspireHandR_grasp_used.depth, two_fingers_grasp_used.depth)
+    print('grasp type:', InspireHandR_grasp_used.grasp_type)
+    print('grasp angle:', InspireHandR_grasp_used.angle)
+
+    ####################################
+    if DEBUG:
+        InspireHandR_pose = InspireHandR_grasp_used.load_mesh(cfgs.inspire_mesh_json_path, two_fingers_grasp_used)
+        frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
+        sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
+        InspireHandR_pose.paint_uniform_color([1, 0, 0])
+        meshes_pointclouds = plan['mfcdetector'].load_meshes_pcls(meshes_pcls, two_fingers_ggarray[[idx]], InspireHandR_ggarray[[idx]])[0]
+        voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=meshes_pointclouds,
+                                                                    voxel_size=0.002)
+        scene_cloud = o3d.geometry.PointCloud()
+        scene_cloud.points = o3d.utility.Vector3dVector(plan['points_down'].cpu().numpy())
+        scene_cloud = scene_cloud.voxel_down_sample(0.001)
+        ps = scene_cloud.points
+        ps = o3d.utility.Vector3dVector(ps)
+        output = voxel_grid.check_if_included(ps)
+
+        o3d.visualization.draw_geometries(
+            [InspireHandR_pose, cloud, sphere, frame, two_fingers_grasp_used.to_open3d_geometry()])
+
+    gripper_time = 0.4
+    robot.open_gripper(InspireHandR_grasp_used.angle)
+    mat_pose = robot.grasp_and_throw(InspireHandR_grasp_used, two_fingers_grasp_used, cloud, cfgs.inspire_mesh_json_path,
+                                     acc=acc*2, vel=vel*3, approach_dist=plan['approach_distance'],
+                                     execute_grasp=True, use_ready_pose=True, gripper_time=gripper_time, on_throw=on_throw)
+
+    while robot.is_program_running():
+        pass
+
+    if cfgs.global_camera:
+        robot.movej(robot.throwj2, acc=acc * 4, vel=vel * 5.5)  # this v and a are anguler, so it should be larger than translational
+        robot.open_gripper(InspireHandR_grasp_used.angle)
+
+    save_grasp_information(two_fingers_ggarray, plan['two_fingers_ggarray_object_ids'], InspireHandR_ggarray, 
+                    plan['two_fingers_ggarray_source'], plan['InspireHandR_ggarray_source'], plan['two_fingers_ggarray_object_ids_source'],
+                    two_fingers_grasp_used, InspireHandR_grasp_used, grasp_features_used, 
+                    mat_pose, plan['colors'], plan['depths'], grasp_features)
 
 def robot_grasp(cfgs):
     net = get_net(cfgs.checkpoint_path, use_v2=cfgs.use_graspnet_v2)
     robot = get_robot(cfgs.robot_ip, robot_debug=True, gripper_type='InspireHandR', global_cam=cfgs.global_camera)
     inspire_models = get_inspire_model(cfgs.inspire_model_path)
     fail = 0
-    existing_shm_color = shared_memory.SharedMemory(name='realsense_color')
-    existing_shm_depth = shared_memory.SharedMemory(name='realsense_depth')
+    existing_shm_depth = FrameRing('realsense_frames')
+    existing_shm_color = existing_shm_depth
     meshes_pcls = load_meshes_pointcloud(cfgs.inspire_mesh_json_path)
-
+    stages = get_stages(net, inspire_models, meshes_pcls)
+    pipeline = None
     try:
         v = 0.07
         a = 0.07
         if cfgs.global_camera:
             robot.movej(robot.throwj2, acc=a*2,
                         vel=v*3)  # this v and a are anguler, so it should be larger than translational
-            t1 = time.time()
-            depths = get_depth(existing_shm_depth)
-            depths_saved = copy.deepcopy(depths)
-            colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-            ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth, existing_shm_color, net)
-            t3 = time.time()
-            print(f'Net Time:{t3 - t1}')
-
         else:
             robot.movel(robot.ready_pose(), acc=a*2,
                         vel=v*3)  # this v and a are anguler, so it should be larger than translational
 
-        while True:
+        if cfgs.pipeline:
+            # the next pick is planned on a fresh frame while the hand throws and returns to the throw pose
+            pipeline = GraspPipeline(lambda: capture_frame(existing_shm_depth), stages,
+                                     is_stale=lambda plan: depth_changed(plan['depths'], get_depth(existing_shm_depth)))
+            pipeline.start()
 
-            if not cfgs.global_camera:
-                t1 = time.time()
-                robot.movel(robot.ready_pose(), acc=a * 2, vel=v * 3,
-                            wait=True)  # this v and a are anguler, so it should be larger than translational
-                time.sleep(0.5)
-                print('movel')
-                time.sleep(0.7)
-                depths = get_depth(existing_shm_depth)
-                depths_saved = copy.deepcopy(depths)
-                colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                t1 = time.time()
-                ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                   existing_shm_color, net)
-                t3 = time.time()
-                print(f'Net Time:{t3 - t1}')
-
-            if ggarray is None:
-                fail = fail + 1
+        while True:
+            t1 = time.time()
+            if pipeline is not None:
+                try:
+                    plan = pipeline.get_plan(timeout=cfgs.plan_timeout)
+                except queue.Empty:
+                    raise RuntimeError('No grasp planned in {} seconds'.format(cfgs.plan_timeout))
+            else:
                 if not cfgs.global_camera:
-                    while robot.is_program_running():
-                        robot.stopj(acc=10.0 * a)
-                    robot.movel(robot.ready_pose(), acc=a*10,
-                                vel=v*10)  # this v and a are anguler, so it should be larger than translational
+                    robot.movel(robot.ready_pose(), acc=a * 2, vel=v * 3,
+                                wait=True)  # this v and a are anguler, so it should be larger than translational
+                    time.sleep(0.5)
+                    print('movel')
+                plan, item = run_stages(capture_frame(existing_shm_depth, settle=not cfgs.global_camera), stages)
+
+                if plan is None:
+                    fail = fail + 1
+                    if DEBUG and item.get('cloud') is not None:
+                        show_cloud(item['cloud'])
+                    if not cfgs.global_camera:
+                        while robot.is_program_running():
+                            robot.stopj(acc=10.0 * a)
+                        robot.movel(robot.ready_pose(), acc=a*10,
+                                    vel=v*10)  # this v and a are anguler, so it should be larger than translational
                     time.sleep(0.1)
-                else:
-                    depths = get_depth(existing_shm_depth)
-                    depths_saved = copy.deepcopy(depths)
-                    colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                       existing_shm_color, net)
-                    time.sleep(0.1)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-
-            ########## PROCESS GRASPS ##########
-            # collision detection
-            ggarray = ggarray.cpu().numpy()
-            
-            # Prevent the robot arm from crossing the border, 
-            grasp_features = grasp_features.cpu().numpy()
-            two_fingers_source_grasp_features = copy.deepcopy(grasp_features)
-
-            ggarray, if_flip = flip_ggarray(ggarray)
-            grasp_features = np.c_[grasp_features, if_flip]
-            ggarray = ggarray[~np.array(if_flip)]
-            grasp_features = grasp_features[~np.array(if_flip)]
-
-            source_index = ggarray[:, 0].argsort()
-            ggarray = ggarray[source_index][::-1][:1000]
-            grasp_features = grasp_features[source_index][::-1][:1000]
-            t_multi = time.time()
-            grasp_features_dic = get_graspgroup_features(grasp_features, sinput)
-            
-            inspire_depth, inspire_type, scores, ggarray, grasp_features = \
-                                            get_inspire_depth_type(inspire_models, grasp_features_dic,
-                                                                    ggarray, grasp_features=grasp_features)
-
-            if not RANDOM_GRASP:
-                score_thresh = 0.85
-                mask = (scores > score_thresh)
-                ggarray = ggarray[mask]
-                grasp_features = grasp_features[mask]
-                inspire_depth = inspire_depth[mask]
-                inspire_type = inspire_type[mask]
-                scores = scores[mask]
-            
-            if len(ggarray) == 0:
-                print('There is no grasp that score greater than 0.9 ')
-                if cfgs.global_camera:
-                    depths = get_depth(existing_shm_depth)
-                    depths_saved = copy.deepcopy(depths)
-                    colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth, existing_shm_color, net)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-
-            two_fingers_ggarray = GraspGroup(ggarray)
-            two_fingers_ggarray_object_ids_source = ggarray[:, 16]
-            two_fingers_ggarray_source = copy.deepcopy(two_fingers_ggarray)
-
-            InspireHandR_ggarray = InspireHandRGraspGroup() 
-            InspireHandR_ggarray.set_grasp_min_width(MIN_GRASP_WIDTH)
-            InspireHandR_ggarray.from_graspgroup(two_fingers_ggarray, inspire_type, cfgs.inspire_mesh_json_path)
-            InspireHandR_ggarray.object_ids = two_fingers_ggarray_object_ids_source
-            InspireHandR_ggarray.scores = scores
-            InspireHandR_ggarray.depths = InspireHandR_ggarray.depths + inspire_depth + INSPIREHANDR_DEFAULT_DEPTH
-            InspireHandR_ggarray_source = copy.deepcopy(InspireHandR_ggarray)
-
-            index_filter_by_z_axis = InspireHandR_ggarray.filter_grasp_group_by_z_axis(0.4)
-            two_fingers_ggarray = two_fingers_ggarray[index_filter_by_z_axis]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids_source[index_filter_by_z_axis]
-            grasp_features = grasp_features[index_filter_by_z_axis]
-
-            if len(InspireHandR_ggarray) == 0:
-                print('No grasp detected after filter')
-                if cfgs.global_camera:
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth, existing_shm_color, net)
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                continue
-            
-            index_score = np.argsort(InspireHandR_ggarray.scores)[::-1]
-            InspireHandR_ggarray = InspireHandR_ggarray[index_score]
-            two_fingers_ggarray = two_fingers_ggarray[index_score]
-            grasp_features = grasp_features[index_score]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_score]
-
-            index_type = select_grasp_type(InspireHandR_ggarray)
-            InspireHandR_ggarray = InspireHandR_ggarray[index_type]
-            two_fingers_ggarray = two_fingers_ggarray[index_type]
-            grasp_features = grasp_features[index_type]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_type]
-
-            approach_distance = 0.06
-            start_time = time.time()
-            mfcdetector = ModelFreeCollisionDetectorMultifinger(points_down.cpu().numpy(), voxel_size=0.001)
-            InspireHandR_ggarray, two_fingers_ggarray, empty_mask, min_width_index = mfcdetector.detect(InspireHandR_ggarray, two_fingers_ggarray,
-                                                                  cfgs.inspire_mesh_json_path, meshes_pcls, min_grasp_width=MIN_GRASP_WIDTH,
-                                                                  VoxelGrid=INSPIREHANDR_VOXElGRID, DEBUG=False, approach_dist=approach_distance,
-                                                                  collision_thresh=0, adjust_gripper_centers=True,)
-
-            # proposals
-            InspireHandR_ggarray = InspireHandR_ggarray[empty_mask]
-            two_fingers_ggarray = two_fingers_ggarray[empty_mask]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[min_width_index][empty_mask]
-            grasp_features = grasp_features[min_width_index][empty_mask]
-
-            if len(InspireHandR_ggarray) == 0:
-                print('No Grasp detected after collision detection!')
-                fail = fail + 1
-                if DEBUG:
-                    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                    sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                    o3d.visualization.draw_geometries([cloud, frame, sphere])
-                if not cfgs.global_camera:
-                    while robot.is_program_running():
-                        robot.stopj(acc=10.0 * a)
-                    robot.movel(robot.ready_pose(), acc=a*10,
-                                vel=v*10)  # this v and a are anguler, so it should be larger than translational
-                else:
-                    t1 = time.time()
-                    depths = get_depth(existing_shm_depth)
-                    depths_saved = copy.deepcopy(depths)
-                    colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                    ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                       existing_shm_color, net)
-                    t3 = time.time()
-                    print(f'Net Time:{t3 - t1}')
-                continue
-
-            # sort
-            index_score = np.argsort(InspireHandR_ggarray.scores)[::-1][:10]
-            two_fingers_ggarray_object_ids = two_fingers_ggarray_object_ids[index_score]
-            InspireHandR_ggarray = InspireHandR_ggarray[index_score]
-            two_fingers_ggarray = two_fingers_ggarray[index_score]
-            grasp_features = grasp_features[index_score]
-
-            idx = random.randint(0, len(index_score)-1)
-            InspireHandR_grasp_used = InspireHandR_ggarray[idx]
-            two_fingers_grasp_used = two_fingers_ggarray[idx]
-            grasp_features_used = grasp_features[idx]
-
-
-            print('picked by scores rotations, translations: ', InspireHandR_grasp_used.rotation_matrix,
-                  InspireHandR_grasp_used.translation, two_fingers_grasp_used.translation, two_fingers_grasp_used.rotation_matrix)
-            print('grasp score:', InspireHandR_grasp_used.score, two_fingers_grasp_used.score)
-            print('grasp width:', InspireHandR_grasp_used.width, two_fingers_grasp_used.width)
-            print('grasp depth:', InspireHandR_grasp_used.depth, two_fingers_grasp_used.depth)
-            print('grasp type:', InspireHandR_grasp_used.grasp_type)
-            print('grasp angle:', InspireHandR_grasp_used.angle)
+                    continue
 
             t4 = time.time()
-            print(f'Collision Processing Time:{t4 - t3}')
-            ####################################
-            if DEBUG:
-                InspireHandR_pose = InspireHandR_grasp_used.load_mesh(cfgs.inspire_mesh_json_path, two_fingers_grasp_used)
-                frame = o3d.geometry.TriangleMesh.create_coordinate_frame(0.1)
-                sphere = o3d.geometry.TriangleMesh.create_sphere(0.002, 20).translate([0, 0, 0.490])
-                InspireHandR_pose.paint_uniform_color([1, 0, 0])
-                meshes_pointclouds = InspireHandR_grasp_used.load_mesh_pointclouds(cfgs.inspire_mesh_json_path, two_fingers_grasp_used, voxel_size=0.002)
-                voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=meshes_pointclouds,
-                                                                            voxel_size=0.002)
-                scene_cloud = o3d.geometry.PointCloud()
-                scene_cloud.points = o3d.utility.Vector3dVector(points_down.cpu().numpy())
-                scene_cloud = scene_cloud.voxel_down_sample(0.001)
-                ps = scene_cloud.points
-                ps = o3d.utility.Vector3dVector(ps)
-                output = voxel_grid.check_if_included(ps)
-
-                o3d.visualization.draw_geometries(
-                    [InspireHandR_pose, cloud, sphere, frame, two_fingers_grasp_used.to_open3d_geometry()])
-
-            gripper_time = 0.4
-            robot.open_gripper(InspireHandR_grasp_used.angle)
-            mat_pose = robot.grasp_and_throw(InspireHandR_grasp_used, two_fingers_grasp_used, cloud, cfgs.inspire_mesh_json_path,
-                                             acc=a*2, vel=v*3, approach_dist=approach_distance,
-                                             execute_grasp=True, use_ready_pose=True, gripper_time=gripper_time)
-
-            while robot.is_program_running():
-                pass
-
-            t45 = time.time()
-            if cfgs.global_camera:
-                robot.movej(robot.throwj2, acc=a * 4, vel=v * 5.5)  # this v and a are anguler, so it should be larger than translational
-                robot.open_gripper(InspireHandR_grasp_used.angle)
-
-            save_grasp_information(two_fingers_ggarray, two_fingers_ggarray_object_ids, InspireHandR_ggarray, 
-                            two_fingers_ggarray_source, InspireHandR_ggarray_source, two_fingers_ggarray_object_ids_source,
-                            two_fingers_grasp_used, InspireHandR_grasp_used, grasp_features_used, 
-                            mat_pose, colors_saved, depths_saved, grasp_features)
-
-            if cfgs.global_camera:
-                t1 = time.time()
-                depths = get_depth(existing_shm_depth)
-                depths_saved = copy.deepcopy(depths)
-                colors_saved = np.copy(np.ndarray((720, 1280, 3), dtype=np.float32, buffer=existing_shm_color.buf))
-                ggarray, cloud, points_down, grasp_features, sinput = get_ggarray_features(existing_shm_depth,
-                                                                                   existing_shm_color, net)
-                t3 = time.time()
-                print(f'Net Time:{t3 - t1}')
+            execute_plan(robot, plan, meshes_pcls, a, v,
+                         on_throw=pipeline.scene_changed if pipeline is not None else None)
 
             t5 = time.time()
-            print(f'ready time:{t5 - t45}')
             print(f'Exec Time:{t5 - t4}')
             mpph = 3600 / (t5 - t1)
             print(f'\033[1;31mMPPH:{mpph}\033[0m\n--------------------')
     finally:
+        if pipeline is not None:
+            pipeline.stop()
         robot.close()
         existing_shm_depth.close()
         if DEBUG:
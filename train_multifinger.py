@@ -24,7 +24,7 @@ ROOT_DIR = BASE_DIR
 sys.path.append(os.path.join(ROOT_DIR, 'models'))
 sys.path.append(os.path.join(ROOT_DIR, 'dataset'))
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
-from multifinger_hand import MultifingerDataset, collate_fn, convert_data_to_gpu
+from multifinger_hand import MultifingerDataset, MultifingerColumnarDataset, ResidentMultifingerData, collate_fn, convert_data_to_gpu
 from solvers import PolyLR, StepLR
 from loss import MultifingerType1Loss
 from param import *
@@ -42,6 +42,8 @@ parser.add_argument('--weight_decay', type=float, default=0.0005, help='Optimiza
 # parser.add_argument('--bn_decay_rate', type=float, default=0.5, help='Decay rate for BN decay [default: 0.5]')
 # parser.add_argument('--lr_decay_steps', default='20,40,60', help='When to decay the learning rate (in epochs) [default: 40,60,80]')
 # parser.add_argument('--lr_decay_rates', default='0.1,0.1,0.1', help='Decay rates for lr decay [default: 0.1,0.1,0.1]')
+parser.add_argument('--columnar_data', action='store_true', help='Read the memory-mapped columnar dataset instead of the json (converted on first use).')
+parser.add_argument('--resident_data', action='store_true', help='Keep the whole dataset as tensors on the training device and batch it there.')
 parser.add_argument('--overwrite', action='store_true', help='Overwrite existing log and dump folders.')
 
 FLAGS = parser.parse_args()
@@ -59,6 +61,7 @@ BASE_LEARNING_RATE = FLAGS.learning_rate
 GRIPPER_TYPE = FLAGS.gripper_type
 MULTIFINGER_TYPE = FLAGS.train_multifinger_type
 WEIGHT_DECAY = FLAGS.weight_decay
+DATASET = MultifingerColumnarDataset if FLAGS.columnar_data else MultifingerDataset
 
 LOG_DIR = FLAGS.log_dir
 
@@ -90,11 +93,11 @@ def my_worker_init_fn(worker_id):
     pass
 
 # Create Dataset and Dataloader
-TRAIN_DATASET = MultifingerDataset(root = DATASET_ROOT_TRAIN, multifinger_type = GRIPPER_TYPE, 
+TRAIN_DATASET = DATASET(root = DATASET_ROOT_TRAIN, multifinger_type = GRIPPER_TYPE, 
                                    dataset_type = "train", train_type = MULTIFINGER_TYPE, num_multifinger_type = NUM_MULTIFINGER_TYPE)
 TRAIN_DATALOADER = DataLoader(TRAIN_DATASET, batch_size=BATCH_SIZE, shuffle=True,
                               num_workers=16, worker_init_fn=my_worker_init_fn, collate_fn=collate_fn)
-TEST_DATASET = MultifingerDataset(root = DATASET_ROOT_TEST, multifinger_type = GRIPPER_TYPE, 
+TEST_DATASET = DATASET(root = DATASET_ROOT_TEST, multifinger_type = GRIPPER_TYPE, 
                                   dataset_type = "test", train_type = MULTIFINGER_TYPE, num_multifinger_type = NUM_MULTIFINGER_TYPE)
 TEST_DATALOADER = DataLoader(TEST_DATASET, batch_size=BATCH_SIZE, shuffle=False,
                              num_workers=16, worker_init_fn=my_worker_init_fn, collate_fn=collate_fn)
@@ -110,6 +113,12 @@ multifinger_net = MODEL.MinkowskiGraspNetMultifingerType1(num_multifinger_type =
                                                       num_two_finger_depth = NUM_TWO_FINGER_DEPTH)
 multifinger_net.to(device)
 
+if FLAGS.resident_data:
+    TRAIN_RESIDENT = ResidentMultifingerData(TRAIN_DATASET, device)
+    TEST_RESIDENT = ResidentMultifingerData(TEST_DATASET, device)
+else:
+    TRAIN_RESIDENT = TEST_RESIDENT = None
+
 criterion = MultifingerType1Loss(num_multifinger_type = NUM_MULTIFINGER_TYPE, 
                                  num_multifinger_depth = NUM_MULTIFINGER_DEPTH,
                                  num_two_finger_angle = NUM_TWO_FINGER_ANGLE,
@@ -153,6 +162,11 @@ def save_model(epoch, mean_indicators, best_indicators):
         torch.save(multifinger_net, model_path)
     return best_indicators
 
+def get_batches(dataloader, resident_data, shuffle):
+    if resident_data is not None:
+        return resident_data.batches(BATCH_SIZE, shuffle=shuffle)
+    return (convert_data_to_gpu(batch_data_label) for batch_data_label in dataloader)
+
 def train_one_epoch():
     # adjust_learning_rate(optimizer, EPOCH_CNT)
     # bnm_scheduler.step() # decay BN momentum
@@ -168,8 +182,7 @@ def train_one_epoch():
     f1s = []
     indicator_detachs = []
     every_indicator_detachs = []
-    for batch_idx, batch_data_label in enumerate(TRAIN_DATALOADER):
-        batch_data_label = convert_data_to_gpu(batch_data_label)
+    for batch_idx, batch_data_label in enumerate(get_batches(TRAIN_DATALOADER, TRAIN_RESIDENT, shuffle=True)):
         if batch_data_label["result"].shape[0] == 1:
             continue
         weights.append(batch_data_label["result"].shape[0])
@@ -269,8 +282,7 @@ def eval_one_epoch():
     f1s = []
     indicator_detachs = []
     every_indicator_detachs = []
-    for batch_idx, batch_data_label in enumerate(TEST_DATALOADER):
-        batch_data_label = convert_data_to_gpu(batch_data_label)
+    for batch_idx, batch_data_label in enumerate(get_batches(TEST_DATALOADER, TEST_RESIDENT, shuffle=False)):
         weights.append(batch_data_label["result"].shape[0])
         toc = time.time()
         data_time += toc - tic
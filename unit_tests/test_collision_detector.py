@@ -0,0 +1,75 @@
+import os
+import sys
+import copy
+import unittest
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, 'utils'))
+
+try:
+    import open3d as o3d
+    from collision_detector import VoxelCollisionEngine
+except ImportError:
+    o3d = None
+
+VOXEL_SIZE = 0.003
+APPROACH_DIST = 0.08
+
+def random_rotations(rng, num):
+    q = rng.normal(size=(num, 4))
+    w, x, y, z = (q / np.linalg.norm(q, axis=1, keepdims=True)).T
+    return np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+                     2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+                     2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1).reshape((-1, 3, 3))
+
+def reference_count(template, transform, direction, scene_points):
+    ''' Scene points in the swept hand voxel grid, as the per-grasp open3d loop of the baseline detect. '''
+    hand = copy.deepcopy(template)
+    hand.transform(transform)
+    for i in range(2, int(APPROACH_DIST * 100)+1, 3):
+        cache = copy.deepcopy(hand)
+        back = np.eye(4)
+        back[:3, 3] = -direction * i * 0.01
+        hand = hand + cache.transform(back)
+    hand = hand.voxel_down_sample(VOXEL_SIZE)
+    voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=hand, voxel_size=VOXEL_SIZE)
+    return int(np.sum(voxel_grid.check_if_included(o3d.utility.Vector3dVector(scene_points))))
+
+@unittest.skipIf(o3d is None, 'open3d is not installed')
+class collision_detector_Tests(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # a table and a few boxes of points
+        table = np.concatenate([rng.uniform(-0.15, 0.15, (3000, 2)), np.full((3000, 1), 0.5)], axis=1)
+        boxes = [rng.uniform(-0.03, 0.03, (800, 3)) + center for center in rng.uniform([-0.1, -0.1, 0.44], [0.1, 0.1, 0.47], (4, 3))]
+        self.scene_points = np.concatenate([table] + boxes, axis=0)
+        self.meshes_pcls = dict()
+        for key in ['type1_5.0', 'type2_8.0', 'type3_11.0']:
+            pcl = o3d.geometry.PointCloud()
+            pcl.points = o3d.utility.Vector3dVector(rng.uniform([-0.02, -0.06, -0.03], [0.08, 0.06, 0.03], (600, 3)))
+            self.meshes_pcls[key] = pcl
+        num_grasps = 40
+        rotations = random_rotations(rng, num_grasps)
+        self.transforms = np.tile(np.eye(4), (num_grasps, 1, 1))
+        self.transforms[:, :3, :3] = rotations
+        self.transforms[:, :3, 3] = rng.uniform([-0.15, -0.15, 0.3], [0.15, 0.15, 0.5], (num_grasps, 3))
+        self.directions = rotations[:, :, 0]
+        self.keys = [list(self.meshes_pcls)[i] for i in rng.integers(0, 3, num_grasps)]
+
+    def test_counts_match_reference(self):
+        engine = VoxelCollisionEngine(self.scene_points, self.meshes_pcls, batch_size=16)
+        counts = engine.count(self.transforms, self.directions, self.keys, VOXEL_SIZE, APPROACH_DIST)
+        expected = np.array([reference_count(self.meshes_pcls[key], transform, direction, self.scene_points)
+                             for key, transform, direction in zip(self.keys, self.transforms, self.directions)])
+        # the scene is chosen so that both colliding and free grasps are checked
+        self.assertTrue(np.any(expected > 1) and np.any(expected == 0))
+        self.assertTrue(np.array_equal(counts, expected))
+        for collision_thresh in [1, 10]:
+            self.assertTrue(np.array_equal(counts > collision_thresh, expected > collision_thresh))
+
+    def test_numpy_templates(self):
+        engine = VoxelCollisionEngine(self.scene_points, self.meshes_pcls)
+        numpy_engine = VoxelCollisionEngine(self.scene_points, {key: np.asarray(pcl.points) for key, pcl in self.meshes_pcls.items()})
+        self.assertTrue(np.array_equal(engine.count(self.transforms, self.directions, self.keys, VOXEL_SIZE, APPROACH_DIST),
+                                       numpy_engine.count(self.transforms, self.directions, self.keys, VOXEL_SIZE, APPROACH_DIST)))
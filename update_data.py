@@ -1,96 +1,230 @@
 import copy
+import hashlib
 import json
 import os
 import sys
 import time
+import numpy as np
+
+GRASP_TYPE_MAPPINGS = {
+    'dh3': {0:1,1:2,2:3,3:4},
+    'inspire': {0:1,1:2,2:3,3:4,4:5,5:-1,6:6,7:7,8:-1,9:8,10:-1,11:-1},
+    'allegro': {0:1,1:2,2:3,3:4,4:5,5:6,6:-1,7:-1,8:7,9:8,10:9,11:-1,12:10},
+}
+GRIPPER_NAMES = {'dh3': 'DH3', 'inspire': 'InspiredHandR', 'allegro': 'Allegro'}
+# set on the records relabeled by relabel_records, the mappings are not idempotent
+RELABELED_KEY = 'finger_type_relabeled'
+MERGE_EXCLUDED_KEYS = ['two_fingers_pose_AD', 'two_fingers_pose_features', 'two_fingers_pose_features_before_generator',
+                       'point_features', 'before_collision', 'after_collision', 'base_2_tcp1', 'base_2_tcp1_backup',
+                       'tcp_2_gripper', 'base_2_TwoFingersGripper_pose', 'tcp_2_camera', 'base_2_tcp_ready',
+                       'camera_internal', 'two_fingers_ggarray_proposals', '{}_ggarray_proposals',
+                       'two_fingers_ggarray_informations_proposals', 'two_fingers_ggarray_source', '{}_ggarray_source_saved']
+
+def get_mapping_table(gripper):
+    ''' Dense lookup table of GRASP_TYPE_MAPPINGS[gripper], old type -> new type (-1 for removed types). '''
+    mapping = GRASP_TYPE_MAPPINGS[gripper]
+    table = np.full(max(mapping) + 1, -1, dtype=np.int64)
+    table[list(mapping.keys())] = list(mapping.values())
+    return table
+
+def relabel_records(records, gripper):
+    ''' Remap the finger types of records in place with one table lookup per list.
+
+        Records and collision_grasp_feature entries whose type maps to -1 are dropped. The kept records are
+        marked with RELABELED_KEY and skipped by later calls, e.g. when sessions were appended to a relabeled file.
+        Returns the list of the kept records.
+    '''
+    table = get_mapping_table(gripper)
+    key = GRIPPER_NAMES[gripper] + '_pose_finger_type'
+
+    def lookup(types):
+        # the table wraps negative indices, an unknown type raises as the dict lookup did
+        types = np.array(types, dtype=np.int64)
+        unknown = (types < 0) | (types >= len(table))
+        if np.any(unknown):
+            raise KeyError(int(types[unknown][0]))
+        return table[types]
+    pose_key = GRIPPER_NAMES[gripper] + '_pose'
+    pending = [record for record in records if not record.get(RELABELED_KEY, False)]
+    labeled = [record for record in pending if key in record]
+    new_types = lookup([record[key] for record in labeled])
+    for record, new_type in zip(labeled, new_types.tolist()):
+        record[key] = new_type
+    for record in pending:
+        if 'collision_grasp_feature' in record:
+            collisions = record['collision_grasp_feature']
+            labeled_collisions = [c for c in collisions if key in c]
+            new_collision_types = lookup([c[key] for c in labeled_collisions])
+            for collision, t in zip(labeled_collisions, new_collision_types.tolist()):
+                collision[key] = t
+            record['collision_grasp_feature'] = [c for c in collisions if c.get(key) != -1]
+        if key in record and pose_key in record:
+            record[pose_key][2] = record[key]
+        record[RELABELED_KEY] = True
+    return [record for record in records if record.get(key) != -1]
 
 def update_grasp_type(json_path, gripper):
-    dh3_mapping = {0:1,1:2,2:3,3:4}
-    inspire_mapping = {0:1,1:2,2:3,3:4,4:5,5:-1,6:6,7:7,8:-1,9:8,10:-1,11:-1}
-    allegro_mapping = {0:1,1:2,2:3,3:4,4:5,5:6,6:-1,7:-1,8:7,9:8,10:9,11:-1,12:10}
-    if gripper == 'dh3':
-        gripper_mapping = dh3_mapping
-        from ur_toolbox.robot.DH3.DH3_grasp import grasp_types
-        name = 'DH3'
-    elif gripper == 'allegro':
-        gripper_mapping = allegro_mapping
-        from ur_toolbox.robot.Allegro.Allegro_grasp import grasp_types
-        name = 'Allegro'
-    elif gripper == 'inspire':
-        gripper_mapping = inspire_mapping   
-        from ur_toolbox.robot.Inspire.InspireHandR_grasp import grasp_types 
-        name = 'InspiredHandR'
     with open(json_path, 'r') as f:
         information = json.load(f)
-    remove_item = []
-    for date, date_info in information.items():
-        for k,v in date_info.items():
-            if k == name + '_pose_finger_type':
-                information[date][k] = int(gripper_mapping[information[date][k]])
-                if information[date][k] == -1:
-                    remove_item.append(date)
-            if k == 'collision_grasp_feature':
-                remove_item_c = []
-                for idx, collision_item in enumerate(v):
-                    for k_c, v_c in collision_item.items():
-                        if k_c == name + '_pose_finger_type':
-                            information[date][k][idx][k_c] = int(gripper_mapping[information[date][k][idx][k_c]])
-                            if information[date][k][idx][k_c] == -1:
-                                remove_item_c.append(collision_item)
-                        for k_c, v_c in collision_item.items():
-                            if k == '_pose':
-                                information[date][k][idx][k_c][2] = information[date][k][idx][name + '_pose_finger_type']
-                for x in remove_item_c:
-                    information[date][k].remove(x)
-        for k,v in date_info.items():            
-            if k == name + '_pose':
-                information[date][k][2] = information[date][name + '_pose_finger_type']
-    for x in remove_item:
-        information.pop(x)   
+    kept = set(map(id, relabel_records(list(information.values()), gripper)))
+    information = {date: date_info for date, date_info in information.items() if id(date_info) in kept}
     json_file = json.dumps(information, indent=4)
     with open(json_path, 'w') as handle:
         handle.write(json_file)
 
-            
-def read_files(path, gripper):
+def file_signature(path, entry=None):
+    ''' (changed, entry) of path against its manifest entry {'mtime', 'size', 'sha1'}.
+
+        The file is only hashed if its mtime or size differ from entry, so unchanged files cost one stat.
+    '''
+    stat = os.stat(path)
+    if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+        return False, entry
+    with open(path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    new_entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': sha1}
+    return entry is None or entry['sha1'] != sha1, new_entry
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return dict()
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    with open(manifest_path + '.tmp', 'w') as handle:
+        handle.write(json.dumps(manifest))
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def read_files(path, gripper, manifest_path=None):
+    ''' Relabel every json under path, skipping the ones already relabeled according to the manifest.
+
+        The manifests of merge_data_incremental (*.manifest.json) are not data and are skipped.
+    '''
+    if manifest_path is None:
+        manifest_path = os.path.join(path, '.relabel_manifest.json')
+    manifest = load_manifest(manifest_path)
     for fpathe,dirs,fs in os.walk(path):
         for f in fs:
             json_path = os.path.join(fpathe,f)
+            if os.path.abspath(json_path) == os.path.abspath(manifest_path) or f.endswith('.manifest.json'):
+                continue
+            changed, _ = file_signature(json_path, manifest.get(json_path))
+            if not changed:
+                continue
             print(json_path)
             update_grasp_type(json_path, gripper)
+            manifest[json_path] = file_signature(json_path)[1]
+            save_manifest(manifest_path, manifest)
 
-def merge_data(in_path, out_path, gripper='Allegro'):
-    informations = dict()
-    grasp_types = os.listdir(in_path)
-    for grasp_type in grasp_types:
+def strip_information(information, gripper):
+    for key in MERGE_EXCLUDED_KEYS:
+        information.pop(key.format(gripper), None)
+    return information
+
+def list_sessions(in_path):
+    ''' {information.json path: date} of the sessions under in_path/<grasp type>/<date>/. '''
+    sessions = dict()
+    for grasp_type in sorted(os.listdir(in_path)):
         grasp_type_path = os.path.join(in_path, grasp_type)
-        for date in os.listdir(grasp_type_path):
+        if not os.path.isdir(grasp_type_path):
+            continue
+        for date in sorted(os.listdir(grasp_type_path)):
             date_path = os.path.join(grasp_type_path, date, 'information.json')
-            with open(date_path, 'r') as f:
-                information = json.load(f)
-            informations[date] = information
-            del information['two_fingers_pose_AD']
-            del information['two_fingers_pose_features']
-            del information['two_fingers_pose_features_before_generator']
-            del information['point_features']
-            del information['before_collision']
-            del information['after_collision']
-            del information['base_2_tcp1']
-            del information['base_2_tcp1_backup']
-            del information['tcp_2_gripper']
-            del information['base_2_TwoFingersGripper_pose']
-            del information['tcp_2_camera']
-            del information['base_2_tcp_ready']
-            del information['camera_internal']
-            del information['two_fingers_ggarray_proposals']
-            del information[gripper+'_ggarray_proposals']
-            del information['two_fingers_ggarray_informations_proposals']
-            del information['two_fingers_ggarray_source']
-            del information[gripper+'_ggarray_source_saved']
-    json_file = json.dumps(informations, indent=4)
+            if os.path.exists(date_path):
+                sessions[date_path] = date
+    return sessions
+
+def merge_data(in_path, out_path, gripper='Allegro'):
+    informations = dict()
+    for date_path, date in list_sessions(in_path).items():
+        with open(date_path, 'r') as f:
+            information = json.load(f)
+        informations[date] = strip_information(information, gripper)
+    json_file = json.dumps(informations)
     with open(out_path, 'w') as handle:
         handle.write(json_file)
 
+def append_json_records(json_path, records):
+    ''' Append records to the json object in json_path in place, without reading or rewriting it.
+
+        The closing brace is overwritten by the new members. The keys of records must not be in the file yet,
+        a key appended again would leave the stale member in the file.
+    '''
+    if len(records) == 0:
+        return
+    members = json.dumps(records)[1:-1]
+    if not os.path.exists(json_path) or os.path.getsize(json_path) == 0:
+        with open(json_path, 'w') as handle:
+            handle.write('{' + members + '}')
+        return
+    with open(json_path, 'r+b') as handle:
+        # find the closing brace and whether the object is empty, reading back from the end
+        pos = handle.seek(0, os.SEEK_END)
+        chunk = b''
+        while pos > 0:
+            step = min(pos, 4096)
+            pos -= step
+            handle.seek(pos)
+            chunk = handle.read(step) + chunk
+            stripped = chunk.rstrip()
+            if len(stripped) >= 2 and stripped[:-1].rstrip():
+                break
+        stripped = chunk.rstrip()
+        if not stripped.endswith(b'}'):
+            raise ValueError('{} is not a json object'.format(json_path))
+        close = pos + len(stripped) - 1
+        empty = stripped[:-1].rstrip().endswith(b'{')
+        handle.seek(close)
+        handle.truncate()
+        handle.write(((' ' if empty else ', ') + members + '}').encode())
+
+def merge_data_incremental(in_path, out_path, gripper='Allegro', manifest_path=None):
+    ''' Bring out_path up to date with the sessions under in_path, processing only new or changed sessions.
+
+        The manifest (out_path + '.manifest.json' by default) records the mtime, size and sha1 of every
+        merged information.json and of out_path itself. New sessions are appended to out_path in place.
+        out_path is rewritten if a session was changed or deleted, so it never holds a key twice, or if it
+        was modified outside of this function.
+    '''
+    if manifest_path is None:
+        manifest_path = out_path + '.manifest.json'
+    manifest = load_manifest(manifest_path)
+    sessions = manifest.get('sessions', dict())
+    rebuild = not os.path.exists(out_path) or file_signature(out_path, manifest.get('out'))[0]
+    if rebuild:
+        sessions = dict()
+
+    current = list_sessions(in_path)
+    merged_dates = set(entry['date'] for entry in sessions.values())
+    new_records = dict()
+    for date_path, date in current.items():
+        changed, entry = file_signature(date_path, sessions.get(date_path))
+        if changed:
+            with open(date_path, 'r') as f:
+                new_records[date] = strip_information(json.load(f), gripper)
+        sessions[date_path] = dict(entry, date=date)
+    removed = [date_path for date_path in sessions if date_path not in current]
+    superseded = [date for date in new_records if date in merged_dates]
+
+    if rebuild or len(removed) > 0 or len(superseded) > 0:
+        informations = dict()
+        if not rebuild:
+            with open(out_path, 'r') as f:
+                informations = json.load(f)
+        for date_path in removed:
+            informations.pop(sessions.pop(date_path)['date'], None)
+        informations.update(new_records)
+        with open(out_path + '.tmp', 'w') as handle:
+            handle.write(json.dumps(informations))
+        os.replace(out_path + '.tmp', out_path)
+    else:
+        append_json_records(out_path, new_records)
+    print('merged {} new, {} changed, {} removed sessions into {}'.format(len(new_records) - len(superseded),
+                                                                         len(superseded), len(removed), out_path))
+
+    save_manifest(manifest_path, {'out': file_signature(out_path)[1], 'sessions': sessions})
+
 
 if __name__ == '__main__':
     # inspire_path = 'logs/data/decision_model/inspire'
@@ -101,5 +235,4 @@ if __name__ == '__main__':
     # read_files(allegro_path, 'allegro')
     in_path = 'logs/data/decision_model/allegro/obj140/collect'
     out_path = 'logs/data/decision_model/allegro/obj140.json'
-    merge_data(in_path, out_path, 'Allegro')
-    
\ No newline at end of file
+    merge_data_incremental(in_path, out_path, 'Allegro')
@@ -0,0 +1,73 @@
+from ur_toolbox.transformation.se3 import translations_rotations_2_matrices, inverse_matrices, transform_points, \
+    rotation_vectors_2_rotations, rotations_2_rotation_vectors, rotations_2_quaternions, quaternions_2_rotations, \
+    pose_arrays_2_matrices, matrices_2_pose_arrays, orthonormalize_rotations
+from ur_toolbox.transformation.pose import pose_array_2_matrix, pose_matrix_2_array, translation_rotation_2_array
+import unittest
+import numpy as np
+
+class se3_Tests(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        axes = rng.normal(size=(64, 3))
+        axes = axes / np.linalg.norm(axes, axis=1, keepdims=True)
+        # the angles include 0, tiny ones and ones close to pi
+        angles = np.concatenate((np.array([0, 1e-9, 1e-5, np.pi - 1e-3]), rng.uniform(0, np.pi, 60)))
+        self.rotation_vectors = axes * angles[:, np.newaxis]
+        self.translations = rng.normal(size=(64, 3))
+        self.matrices = pose_arrays_2_matrices(np.concatenate((self.translations, self.rotation_vectors), axis=1))
+
+    def test_batch_matches_single(self):
+        for pose, matrix in zip(np.concatenate((self.translations, self.rotation_vectors), axis=1), self.matrices):
+            self.assertTrue(np.allclose(pose_array_2_matrix(pose), matrix, atol=1e-12))
+            self.assertTrue(np.allclose(pose_matrix_2_array(matrix), pose, atol=1e-9))
+
+    def test_rotations(self):
+        rotations = rotation_vectors_2_rotations(self.rotation_vectors)
+        self.assertTrue(np.allclose(rotations @ rotations.swapaxes(1, 2), np.eye(3), atol=1e-12))
+        self.assertTrue(np.allclose(np.linalg.det(rotations), 1))
+        self.assertTrue(np.allclose(rotations_2_rotation_vectors(rotations), self.rotation_vectors, atol=1e-9))
+        self.assertTrue(np.allclose(quaternions_2_rotations(rotations_2_quaternions(rotations)), rotations, atol=1e-12))
+
+    def test_orthonormalize(self):
+        rotations = rotation_vectors_2_rotations(self.rotation_vectors)
+        self.assertTrue(np.allclose(orthonormalize_rotations(rotations), rotations, atol=1e-12))
+        # off by up to about 1% as the rotations of the width json
+        noisy = rotations + np.random.default_rng(2).normal(scale=0.005, size=rotations.shape)
+        fixed = orthonormalize_rotations(noisy)
+        self.assertTrue(np.allclose(fixed @ fixed.swapaxes(1, 2), np.eye(3), atol=1e-12))
+        self.assertTrue(np.allclose(np.linalg.det(fixed), 1))
+        self.assertTrue(np.allclose(fixed, rotations, atol=0.05))
+        # the rotation vectors of pose.translation_rotation_2_array are the ones of the closest rotations
+        poses = [pose_array_2_matrix(translation_rotation_2_array(np.zeros(3), rotation)) for rotation in noisy]
+        self.assertTrue(np.allclose(np.array(poses)[:, :3, :3], fixed, atol=1e-9))
+        try:
+            import cv2
+        except ImportError:
+            return
+        self.assertTrue(np.allclose([cv2.Rodrigues(cv2.Rodrigues(rotation)[0])[0] for rotation in noisy], fixed, atol=1e-9))
+
+    def test_inverse(self):
+        self.assertTrue(np.allclose(inverse_matrices(self.matrices), np.linalg.inv(self.matrices), atol=1e-12))
+        self.assertTrue(np.allclose(inverse_matrices(self.matrices) @ self.matrices, np.eye(4), atol=1e-12))
+        self.assertTrue(np.allclose(matrices_2_pose_arrays(self.matrices)[:, :3], self.translations))
+
+    def test_transform_points(self):
+        points = np.random.default_rng(1).normal(size=(64, 10, 3))
+        homogeneous = np.concatenate((points, np.ones((64, 10, 1))), axis=2)
+        expected = (self.matrices @ homogeneous.swapaxes(1, 2)).swapaxes(1, 2)[..., :3]
+        self.assertTrue(np.allclose(transform_points(points, self.matrices), expected))
+        # one transform broadcast to every cloud
+        self.assertTrue(np.allclose(transform_points(points, self.matrices[0]),
+                                    transform_points(points, np.broadcast_to(self.matrices[0], (64, 4, 4)))))
+
+    def test_torch(self):
+        try:
+            import torch
+        except ImportError:
+            self.skipTest('torch is not installed')
+        rotation_vectors = torch.tensor(self.rotation_vectors)
+        matrices = translations_rotations_2_matrices(torch.tensor(self.translations), rotation_vectors_2_rotations(rotation_vectors))
+        self.assertTrue(torch.is_tensor(matrices))
+        self.assertTrue(np.allclose(matrices.numpy(), self.matrices, atol=1e-12))
+        self.assertTrue(np.allclose(inverse_matrices(matrices).numpy(), inverse_matrices(self.matrices), atol=1e-12))
+        self.assertTrue(np.allclose(rotations_2_rotation_vectors(matrices[:, :3, :3]).numpy(), self.rotation_vectors, atol=1e-9))
@@ -0,0 +1,35 @@
+from ur_toolbox.robot.ur_ik import InverseKinematicsUR5, transformRobotParameter
+import unittest
+import numpy as np
+
+class ur_ik_Tests(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.joints = rng.uniform(-np.pi, np.pi, (100, 6))
+        self.poses = np.array([transformRobotParameter(q) for q in self.joints])
+        self.ik = InverseKinematicsUR5()
+
+    def test_batch_matches_single(self):
+        Q, valid = self.ik.solveIKBatch(self.poses)
+        self.assertEqual(Q.shape, (100, 8, 6))
+        for pose, q, v in zip(self.poses, Q, valid):
+            single = self.ik.solveIK(pose)
+            self.assertEqual(len(single), np.sum(v))
+            self.assertTrue(np.allclose(single, q[v], atol=1e-8))
+
+    def test_closest(self):
+        # every pose is reached from its own joints, compared per candidate by broadcasting
+        closest, found = self.ik.findClosestIKBatch(self.poses, self.joints[:, np.newaxis], max_joint_delta=1e-6)
+        self.assertTrue(np.all(found))
+        self.assertTrue(np.allclose(closest, self.joints, atol=1e-6))
+        far = self.poses.copy()
+        far[:, :3, 3] = [2.0, 2.0, 2.0]
+        closest, found = self.ik.findClosestIKBatch(far, self.joints[0])
+        self.assertFalse(np.any(found))
+        self.assertTrue(np.all(np.isnan(closest)))
+
+    def test_joint_limits(self):
+        self.ik.setJointLimits(np.array([-np.pi] * 5 + [-1.0]), np.array([np.pi] * 5 + [1.0]))
+        Q, valid = self.ik.solveIKBatch(self.poses)
+        self.assertTrue(np.all(np.abs(Q[valid][:, 5]) <= 1.0))
+        self.assertTrue(np.all(np.abs(Q[valid]) <= np.pi))
@@ -1,3 +1,5 @@
 from .realsense import RealSense
+from .frame_ring import FrameRing, Frame, FrameOverwritten, colors_to_float
+from .projector import DepthProjector, get_depth_projector
 
-__all__ = ('RealSense',)
\ No newline at end of file
+__all__ = ('RealSense', 'FrameRing', 'Frame', 'FrameOverwritten', 'colors_to_float', 'DepthProjector', 'get_depth_projector')
\ No newline at end of file
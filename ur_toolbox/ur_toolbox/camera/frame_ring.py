@@ -0,0 +1,250 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+FRAME_RING_MAGIC = 0x5552464d52494e47
+HEADER_DTYPE = np.dtype([('magic', '<u8'), ('num_slots', '<i8'), ('latest', '<i8'),
+                         ('depth_shape', '<i8', (2,)), ('depth_dtype', 'S8'),
+                         ('color_shape', '<i8', (3,)), ('color_dtype', 'S8')])
+SLOT_DTYPE = np.dtype([('seq', '<i8'), ('timestamp', '<f8')])
+ALIGNMENT = 64
+
+def _aligned(nbytes):
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def colors_to_float(colors, mask=None):
+    '''
+    **Input:**
+    - colors: np.array of shape (H, W, 3) of the uint8 BGR image as published by the camera.
+    - mask: optional np.array of bool of shape (H, W), only these pixels are converted.
+
+    **Output:**
+    - np.array of float32 RGB colors in [0, 1], of shape (H, W, 3), or (M, 3) with a mask.
+    '''
+    if mask is not None:
+        colors = colors[mask]
+    return colors[..., ::-1].astype(np.float32) * np.float32(1.0 / 255.0)
+
+class FrameOverwritten(RuntimeError):
+    pass
+
+class Frame():
+    def __init__(self, ring, slot, seq, timestamp, depths, colors):
+        '''
+        **Input:**
+        - ring: FrameRing the frame belongs to, None for a copied frame.
+        - slot: int of the slot of the frame in the ring.
+        - seq: int of the sequence number of the frame, starting from 1.
+        - timestamp: float of the time.time() the frame was published.
+        - depths: np.array of the depth image.
+        - colors: np.array of the color image or None.
+        '''
+        self.ring = ring
+        self.slot = slot
+        self.seq = seq
+        self.timestamp = timestamp
+        self.depths = depths
+        self.colors = colors
+
+    def is_valid(self):
+        '''
+        **Output:**
+        - bool, whether the views of the frame still hold the frame, i.e. its slot has not been rewritten since.
+        '''
+        return self.ring is None or self.ring.slots[self.slot]['seq'] == 2 * self.seq
+
+    def copy(self):
+        '''
+        **Output:**
+        - Frame owning copies of the images, raises FrameOverwritten if the slot was rewritten during the copy.
+        '''
+        depths = np.copy(self.depths)
+        colors = None if self.colors is None else np.copy(self.colors)
+        if not self.is_valid():
+            raise FrameOverwritten('frame {} was overwritten while copied'.format(self.seq))
+        return Frame(None, self.slot, self.seq, self.timestamp, depths, colors)
+
+class FrameRing():
+    ''' Ring of the latest num_slots depth (and color) frames in one SharedMemory block.
+
+        The single writer publishes frame seq into slot seq % num_slots seqlock style: the slot
+        sequence counter is odd (2 * seq - 1) while the slot is written and even (2 * seq) once
+        it is complete, and only then the header's latest counter is advanced. Readers get
+        zero-copy views of a complete frame without any lock; a view stays valid until the writer
+        comes back to its slot, num_slots - 1 frames later, which Frame.is_valid() checks.
+    '''
+    def __init__(self, name='realsense_frames', create=False, depth_shape=(720, 1280), depth_dtype=np.uint16,
+                 color_shape=None, color_dtype=np.uint8, num_slots=8):
+        '''
+        **Input:**
+        - name: string of the SharedMemory name.
+        - create: bool, True for the writer, which creates the block; readers attach to it and read the layout from it.
+        - depth_shape, depth_dtype: shape and dtype of the depth images (writer only).
+        - color_shape, color_dtype: shape and dtype of the color images, None for a depth only ring (writer only).
+          Colors are kept as the camera's uint8 BGR, see colors_to_float.
+        - num_slots: int of the number of frames kept (writer only).
+        '''
+        self.name = name
+        if create:
+            header = np.zeros((), dtype=HEADER_DTYPE)
+            header['magic'] = FRAME_RING_MAGIC
+            header['num_slots'] = num_slots
+            header['depth_shape'] = depth_shape
+            header['depth_dtype'] = np.dtype(depth_dtype).str.encode()
+            if color_shape is not None:
+                header['color_shape'] = color_shape
+                header['color_dtype'] = np.dtype(color_dtype).str.encode()
+            layout = self._layout(header)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=layout['size'])
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+            if header['magic'][()] != FRAME_RING_MAGIC:
+                raise ValueError('{} is not a frame ring'.format(name))
+            layout = self._layout(header)
+
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        if create:
+            self.header[()] = header
+        self.num_slots = int(self.header['num_slots'])
+        self.slots = np.ndarray((self.num_slots,), dtype=SLOT_DTYPE, buffer=self.shm.buf, offset=layout['slots'])
+        self.depth_slots = [np.ndarray(layout['depth_shape'], dtype=layout['depth_dtype'], buffer=self.shm.buf,
+                                       offset=layout['data'] + i * layout['slot_size'])
+                            for i in range(self.num_slots)]
+        if layout['color_shape'] is None:
+            self.color_slots = [None] * self.num_slots
+        else:
+            self.color_slots = [np.ndarray(layout['color_shape'], dtype=layout['color_dtype'], buffer=self.shm.buf,
+                                           offset=layout['data'] + i * layout['slot_size'] + layout['color_offset'])
+                                for i in range(self.num_slots)]
+
+    @staticmethod
+    def _layout(header):
+        header = header[()]
+        depth_shape = tuple(int(d) for d in header['depth_shape'])
+        depth_dtype = np.dtype(header['depth_dtype'].decode())
+        depth_bytes = _aligned(int(np.prod(depth_shape)) * depth_dtype.itemsize)
+        color_shape, color_dtype, color_bytes = None, None, 0
+        if header['color_dtype']:
+            color_shape = tuple(int(d) for d in header['color_shape'])
+            color_dtype = np.dtype(header['color_dtype'].decode())
+            color_bytes = _aligned(int(np.prod(color_shape)) * color_dtype.itemsize)
+        num_slots = int(header['num_slots'])
+        slots = _aligned(HEADER_DTYPE.itemsize)
+        data = slots + _aligned(num_slots * SLOT_DTYPE.itemsize)
+        slot_size = depth_bytes + color_bytes
+        return {'depth_shape': depth_shape, 'depth_dtype': depth_dtype, 'color_shape': color_shape, 'color_dtype': color_dtype,
+                'slots': slots, 'data': data, 'slot_size': slot_size, 'color_offset': depth_bytes,
+                'size': data + num_slots * slot_size}
+
+    def latest_seq(self):
+        '''
+        **Output:**
+        - int of the sequence number of the latest complete frame, 0 before the first one.
+        '''
+        return int(self.header['latest'])
+
+    def write(self, depths, colors=None, timestamp=None):
+        '''
+        **Input:**
+        - depths: np.array of the depth image.
+        - colors: np.array of the color image, ignored for a depth only ring.
+        - timestamp: float of the capture time, time.time() if None.
+
+        **Output:**
+        - int of the sequence number of the published frame.
+        '''
+        seq = self.latest_seq() + 1
+        slot = seq % self.num_slots
+        self.slots[slot]['seq'] = 2 * seq - 1
+        self.depth_slots[slot][...] = depths
+        if self.color_slots[slot] is not None and colors is not None:
+            self.color_slots[slot][...] = colors
+        self.slots[slot]['timestamp'] = time.time() if timestamp is None else timestamp
+        self.slots[slot]['seq'] = 2 * seq
+        self.header['latest'] = seq
+        return seq
+
+    def read(self, seq=None):
+        '''
+        **Input:**
+        - seq: int of the sequence number of the frame, the latest frame if None.
+
+        **Output:**
+        - Frame of zero-copy views of the frame, None if there is no frame yet or frame seq has been overwritten.
+        '''
+        if seq is None:
+            seq = self.latest_seq()
+        if seq <= 0:
+            return None
+        slot = seq % self.num_slots
+        timestamp = float(self.slots[slot]['timestamp'])
+        frame = Frame(self, slot, seq, timestamp, self.depth_slots[slot], self.color_slots[slot])
+        return frame if frame.is_valid() else None
+
+    def read_copy(self, seq=None):
+        '''
+        **Output:**
+        - Frame owning copies of the images of frame seq (the latest if None), None if there is no such frame.
+        '''
+        while True:
+            frame = self.read(seq)
+            if frame is None:
+                return None
+            try:
+                return frame.copy()
+            except FrameOverwritten:
+                if seq is not None:
+                    return None
+
+    def wait_for_frame(self, after_seq=0, newer_than=None, timeout=5.0, poll_interval=0.002):
+        '''
+        **Input:**
+        - after_seq: int, only frames with a larger sequence number are returned.
+        - newer_than: float of a time.time(), only frames published after it are returned.
+        - timeout: float of the seconds to wait before raising TimeoutError.
+
+        **Output:**
+        - Frame of zero-copy views of the first matching frame.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            frame = self.read()
+            if frame is not None and frame.seq > after_seq and (newer_than is None or frame.timestamp > newer_than):
+                return frame
+            if time.time() > deadline:
+                raise TimeoutError('no new frame in {} within {}s'.format(self.name, timeout))
+            time.sleep(poll_interval)
+
+    def wait_for_stable_frame(self, newer_than=None, min_diff=10, max_ratio=0.01, timeout=3.0):
+        '''
+        **Input:**
+        - newer_than: float of a time.time(), only frames published after it are considered.
+        - min_diff: a depth pixel moved if it changed by more than min_diff (in depth units).
+        - max_ratio: float, the scene is still once at most max_ratio of the valid pixels moved between two frames.
+        - timeout: float of the seconds after which the latest frame is returned anyway.
+
+        **Output:**
+        - Frame copy of the first frame equal to its predecessor, i.e. of a scene that has settled.
+        '''
+        deadline = time.time() + timeout
+        previous = self.wait_for_frame(newer_than=newer_than, timeout=timeout).copy()
+        while True:
+            try:
+                frame = self.wait_for_frame(after_seq=previous.seq, timeout=max(deadline - time.time(), 0.1)).copy()
+            except TimeoutError:
+                return previous
+            valid = (frame.depths > 0) & (previous.depths > 0)
+            moved = np.abs(frame.depths.astype(np.int32) - previous.depths.astype(np.int32)) > min_diff
+            if (valid.any() and moved[valid].mean() <= max_ratio) or time.time() > deadline:
+                return frame
+            previous = frame
+
+    def close(self):
+        if self.header is None:
+            return
+        self.header = self.slots = self.depth_slots = self.color_slots = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
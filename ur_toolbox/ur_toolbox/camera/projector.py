@@ -0,0 +1,75 @@
+import functools
+import numpy as np
+
+class DepthProjector():
+    ''' Deprojection of depth images of one camera into float32 point clouds.
+
+        The normalized ray of pixel (v, u) is ((u - cx) / fx, (v - cy) / fy, 1), which is separable, so
+        only one row and one column of rays are kept. project() selects the pixels in the depth range
+        on the raw depth image, and only deprojects, crops and quantizes the selected pixels.
+    '''
+    def __init__(self, fx, fy, cx, cy, width=1280, height=720, scale=1000.0):
+        '''
+        **Input:**
+        - fx, fy, cx, cy: float of the camera intrinsics in pixels.
+        - width, height: int of the resolution of the depth images.
+        - scale: float of the depth units per meter.
+        '''
+        self.fx, self.fy, self.cx, self.cy = fx, fy, cx, cy
+        self.width, self.height = width, height
+        self.scale = scale
+        self.x_rays = ((np.arange(width) - cx) / fx).astype(np.float32)
+        self.y_rays = ((np.arange(height) - cy) / fy).astype(np.float32)
+
+    def project(self, depths, z_range=None, workspace=None, voxel_size=None):
+        '''
+        **Input:**
+        - depths: np.array of shape (height, width) of the depth image.
+        - z_range: tuple of (z_min, z_max) in meters, pixels with z_min < z < z_max are kept. All the valid pixels if None.
+        - workspace: optional tuple of (x_min, x_max, y_min, y_max) in meters of the camera frame, points outside are dropped.
+        - voxel_size: float, if given the voxel coordinates of the points are returned as well.
+
+        **Output:**
+        - points: np.array of shape (N, 3) of float32 of the points in the camera frame, in row major pixel order.
+        - mask: np.array of bool of shape (height, width) of the pixels of the points, to pick their colors.
+        - coords: np.array of shape (N, 3) of int of points / voxel_size, only if voxel_size is given.
+        '''
+        assert depths.shape == (self.height, self.width)
+        if z_range is None:
+            mask = depths > 0
+        else:
+            mask = (depths > z_range[0] * self.scale) & (depths < z_range[1] * self.scale)
+        pixels = np.flatnonzero(mask)
+        rows, cols = np.divmod(pixels, self.width)
+        points = np.empty((len(pixels), 3), dtype=np.float32)
+        z = points[:, 2]
+        np.multiply(depths.reshape(-1)[pixels], np.float32(1.0 / self.scale), out=z, casting='unsafe')
+        np.multiply(self.x_rays[cols], z, out=points[:, 0])
+        np.multiply(self.y_rays[rows], z, out=points[:, 1])
+        if workspace is not None:
+            x_min, x_max, y_min, y_max = workspace
+            x, y = points[:, 0], points[:, 1]
+            inside = (x > x_min) & (x < x_max) & (y > y_min) & (y < y_max)
+            mask.reshape(-1)[pixels[~inside]] = False
+            points = points[inside]
+        if voxel_size is None:
+            return points, mask
+        coords = np.ascontiguousarray(points / voxel_size, dtype=int)
+        return points, mask, coords
+
+    def deproject_pixel(self, u, v, depth):
+        '''
+        **Input:**
+        - u, v: int of the column and the row of the pixel.
+        - depth: depth of the pixel in depth units.
+
+        **Output:**
+        - np.array of shape (3,) of the point in meters in the camera frame.
+        '''
+        z = depth / self.scale
+        return np.array([self.x_rays[u] * z, self.y_rays[v] * z, z])
+
+@functools.lru_cache(maxsize=None)
+def get_depth_projector(fx, fy, cx, cy, width=1280, height=720, scale=1000.0):
+    ''' DepthProjector shared by every caller with the same intrinsics and resolution. '''
+    return DepthProjector(fx, fy, cx, cy, width, height, scale)
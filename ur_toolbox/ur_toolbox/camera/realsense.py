@@ -1,7 +1,8 @@
 import pyrealsense2 as rs
 import numpy as np
 import open3d as o3d
-import cv2
+from .frame_ring import colors_to_float
+from .projector import get_depth_projector
 
 class RealSense():
     def __init__(self, serial = '035622060973', frame_rate = 30, resolution = (1280,720)):
@@ -117,26 +118,9 @@ class RealSense():
 
 
         if return_pcd:
-            colors = cv2.cvtColor(color_image, cv2.COLOR_BGR2RGB) / 255.0
-            depths = depth_image
-            param = o3d.camera.PinholeCameraParameters()
-            param.intrinsic.set_intrinsics(1280,720, 908.435, 908.679, 650.366, 367.277)
-            intrinsics = param.intrinsic.intrinsic_matrix
-            fx, fy = intrinsics[0,0], intrinsics[1,1]
-            cx, cy = intrinsics[0,2], intrinsics[1,2]
-            s = 1000.0
-            
-            xmap, ymap = np.arange(colors.shape[1]), np.arange(colors.shape[0])
-            xmap, ymap = np.meshgrid(xmap, ymap)
-
-            points_z = depths / s
-            points_x = (xmap - cx) / fx * points_z
-            points_y = (ymap - cy) / fy * points_z
-
-            mask = (points_z > 0)
-            points = np.stack([points_x, points_y, points_z], axis=-1)
-            points = points[mask]
-            colors = colors[mask]
+            projector = get_depth_projector(908.435, 908.679, 650.366, 367.277, depth_image.shape[1], depth_image.shape[0])
+            points, mask = projector.project(depth_image)
+            colors = colors_to_float(color_image, mask)
             cloud = o3d.geometry.PointCloud()
             cloud.points = o3d.utility.Vector3dVector(points)
             cloud.colors = o3d.utility.Vector3dVector(colors)
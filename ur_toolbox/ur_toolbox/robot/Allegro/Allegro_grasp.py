@@ -1,9 +1,10 @@
 import os
-import json
 import numpy as np
 import open3d as o3d
 import copy
 import math
+from ..width_pose_table import get_width_pose_table, width_bounds, clip_widths
+from ...transformation.se3 import translations_rotations_2_matrices
 
 grasp_types = {'1':{'name': 'Large_Diameter',          'facenet_thumb': [[22524, 2]], 'facenet_index': [[7342, 2], [11614, 2]], 'width':[0, 0.12],
                     'close_pose_matrix': np.array([[0, 1.4, 0.6, 0.5], [0, 1.4, 0.6, 0.5], [0, 1.4, 0.6, 0.5], [1.496, 0, 0.75, 0.5]]),
@@ -40,6 +41,7 @@ MAX_GRASP_WIDTH = 0.12
 MIN_GRASP_WIDTH = 0.04
 Allegro_DEFAULT_DEPTH = 0.0
 Allegro_ARRAY_LEN = 33
+WIDTH_BOUNDS = width_bounds(grasp_types, MIN_GRASP_WIDTH, MAX_GRASP_WIDTH)
 
 class AllegroGrasp():
     def __init__(self, *args):
@@ -202,7 +204,7 @@ class AllegroGrasp():
         **input:**
         - float of the width.
         '''
-        min_width, max_width = grasp_types[str(self.grasp_type)]['width']
+        min_width, max_width = grasp_types[str(int(self.grasp_type))]['width']
         width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
         self.grasp_array[32] = width
 
@@ -242,26 +244,7 @@ class AllegroGrasp():
         finger_type = self.get_grasp_type_with_finger_name()
         source_mesh_pointclouds_path = os.path.join(source_mesh_pointclouds_path, finger_type, name)
         source_mesh_pointclouds = o3d.io.read_point_cloud(source_mesh_pointclouds_path)
-        translation = self.translation.reshape(3, 1)
-        rotation = self.rotation_matrix.reshape(3, 3)
-        depth = self.depth
-
-        t = two_fingers_grasp.translation.reshape(3, 1)
-        r = two_fingers_grasp.rotation_matrix.reshape(3, 3)
-
-        transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-        grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-        grasp_direction = np.array(grasp_direction).reshape(3)
-        grasp_direction = grasp_direction - two_fingers_grasp.translation.reshape((3))
-        grasp_direction = self.normalize(grasp_direction)
-        grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                [0, 1, 0, grasp_direction[1] * depth],
-                                [0, 0, 1, grasp_direction[2] * depth],
-                                [0, 0, 0, 1]], dtype=np.float32)
-
-        transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-        source_mesh_pointclouds.transform(transform_mat)
-        source_mesh_pointclouds.transform(grasp_depth)
+        source_mesh_pointclouds.transform(self.get_hand_pose(two_fingers_grasp))
         return source_mesh_pointclouds
 
     def load_mesh(self, path_mesh, two_fingers_grasp):
@@ -285,28 +268,21 @@ class AllegroGrasp():
         finger_type = self.get_grasp_type_with_finger_name()
         source_mesh_path = os.path.join(source_mesh_path, finger_type, name)
         source_mesh = o3d.io.read_triangle_mesh(source_mesh_path)
-        translation = self.translation.reshape(3, 1)
-        rotation = self.rotation_matrix.reshape(3, 3)
-        depth = self.depth
-
-        t = two_fingers_grasp.translation.reshape(3, 1)
-        r = two_fingers_grasp.rotation_matrix.reshape(3, 3)
-
-        transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-        grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-        grasp_direction = np.array(grasp_direction).reshape(3)
-        grasp_direction = grasp_direction - two_fingers_grasp.translation.reshape((3))
-        grasp_direction = self.normalize(grasp_direction)
-        grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                [0, 1, 0, grasp_direction[1] * depth],
-                                [0, 0, 1, grasp_direction[2] * depth],
-                                [0, 0, 0, 1]], dtype=np.float32)
-
-        transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-        source_mesh.transform(transform_mat)
-        source_mesh.transform(grasp_depth)
+        source_mesh.transform(self.get_hand_pose(two_fingers_grasp))
         return source_mesh
 
+    def get_hand_pose(self, two_fingers_grasp):
+        '''
+        **Input:**
+        - two_fingers_grasp: graspnetAPI.Grasp of the grasp.
+
+        **Output:**
+        - np.array of shape (4, 4) of the pose of the hand mesh, moved by the depth along the approach of two_fingers_grasp.
+        '''
+        direction = self.normalize(two_fingers_grasp.rotation_matrix.reshape(3, 3)[:, 0])
+        return translations_rotations_2_matrices(self.translation.reshape(3) + direction * self.depth,
+                                                 self.rotation_matrix.reshape(3, 3))
+
     def normalize(self, x):
         return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
 
@@ -319,31 +295,14 @@ class AllegroGrasp():
         - Allegro_rotation: the rotations of the end of the robotic arm
         - Allegro_angle: the angle of Allegro
         '''
-        width = two_fingers_grasp.width
-        min_width, max_width = grasp_types[str(self.grasp_type)]['width']
-        width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
-        translation = two_fingers_grasp.translation
-        rotation = two_fingers_grasp.rotation_matrix
-
-        mesh_information_path = os.path.join(path_json, 'width_16D_angle.json')
-        with open(mesh_information_path, 'r', encoding='UTF-8') as f:
-            width_16D_angle = json.load(f)
-
-        matrix_two_fingers = np.vstack(
-            (np.hstack((rotation, np.array(translation).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-        translation_Allegro = width_16D_angle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['translation']
-        rotation_Allegro = width_16D_angle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['rotation']
-        matrix_Allegro = np.vstack(
-            (np.hstack((rotation_Allegro, np.array(translation_Allegro).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-        mat_two_fingers_2_Allegro = np.dot(matrix_two_fingers, np.linalg.inv(matrix_Allegro))
-        Allegro_translation = np.array([mat_two_fingers_2_Allegro[0,3], mat_two_fingers_2_Allegro[1,3], mat_two_fingers_2_Allegro[2,3]])
-        Allegro_rotation = np.array([mat_two_fingers_2_Allegro[0,0:3], mat_two_fingers_2_Allegro[1,0:3], mat_two_fingers_2_Allegro[2,0:3]])
-
-        angle = width_16D_angle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['16d']
-        self.width = width
-        self.translation = Allegro_translation
-        self.rotation_matrix = Allegro_rotation
-        self.angle = angle
+        width = clip_widths(WIDTH_BOUNDS, [self.grasp_type], [two_fingers_grasp.width])
+        width_16D_angle = get_width_pose_table(os.path.join(path_json, 'width_16D_angle.json'), grasp_types, '16d')
+        Allegro_rotation, Allegro_translation, angle = width_16D_angle.transform([self.grasp_type], width,
+                                                                  two_fingers_grasp.rotation_matrix, two_fingers_grasp.translation)
+        self.width = float(width[0])
+        self.translation = Allegro_translation[0]
+        self.rotation_matrix = Allegro_rotation[0]
+        self.angle = angle[0]
 
     def from_grasp(self, two_fingers_grasp, Allegrotype, path_json):
         """Grasp to AllegroGrasp Transformation.
@@ -561,9 +520,7 @@ class AllegroGraspGroup():
         - widths: numpy array of shape (-1, ) of the widths.
         '''
         assert widths.size == len(self)
-        for idx, width in enumerate(widths):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[idx]))]['width']
-            widths[idx] = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), widths[idx]))
+        widths[:] = clip_widths(WIDTH_BOUNDS, self.grasp_types, widths)
         self.grasp_group_array[:, 32] = copy.deepcopy(widths)
 
     def get_graspgroup_types_with_finger_names(self):
@@ -585,41 +542,14 @@ class AllegroGraspGroup():
         - Allegro_rotations: the rotations of the end of the robotic arm
         - Allegro_angles: the angle of Allegro
         '''
-        widths = graspgroup.widths
-        translations = graspgroup.translations
-        rotations = graspgroup.rotation_matrices
-
-        mesh_information_path = os.path.join(path_json, 'width_16D_angle.json')
-        with open(mesh_information_path, 'r', encoding='UTF-8') as f:
-            width_16D_angle = json.load(f)
-
-        Allegro_translations = []
-        Allegro_rotations = []
-        Allegro_angles = []
-        Allegro_widths = []
-        for idx, width in enumerate(widths):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[idx]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
-            Allegro_widths.append(width)
-            translation_two_fingers = translations[idx]
-            rotation_two_fingers = rotations[idx]
-            matrix_two_fingers = np.vstack(
-                (np.hstack((rotation_two_fingers, np.array(translation_two_fingers).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-            translation_Allegro = width_16D_angle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['translation']
-            rotation_Allegro = width_16D_angle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['rotation']
-            matrix_Allegro = np.vstack(
-                (np.hstack((rotation_Allegro, np.array(translation_Allegro).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-            mat_two_fingers_2_Allegro = np.dot(matrix_two_fingers, np.linalg.inv(matrix_Allegro))
-            Allegro_translations.append([mat_two_fingers_2_Allegro[0,3], mat_two_fingers_2_Allegro[1,3], mat_two_fingers_2_Allegro[2,3]])
-            rotation = np.array([mat_two_fingers_2_Allegro[0,0:3], mat_two_fingers_2_Allegro[1,0:3], mat_two_fingers_2_Allegro[2,0:3]])
-            Allegro_rotations.append(rotation)
-
-            angle = width_16D_angle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['16d']
-            Allegro_angles.append(np.array(angle).reshape(16))
-        self.widths = np.array(Allegro_widths)
-        self.translations = np.array(Allegro_translations)
-        self.rotation_matrices = np.array(Allegro_rotations)
-        self.angles = np.array(Allegro_angles)
+        Allegro_widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, graspgroup.widths)
+        width_16D_angle = get_width_pose_table(os.path.join(path_json, 'width_16D_angle.json'), grasp_types, '16d')
+        Allegro_rotations, Allegro_translations, Allegro_angles = width_16D_angle.transform(self.grasp_types, Allegro_widths,
+                                                                                 graspgroup.rotation_matrices, graspgroup.translations)
+        self.widths = Allegro_widths
+        self.translations = Allegro_translations
+        self.rotation_matrices = Allegro_rotations
+        self.angles = Allegro_angles
 
     def from_npy(self, npy_file_path):
         '''
@@ -662,36 +592,15 @@ class AllegroGraspGroup():
         **Output:**
             source_mesh: simplied Allegro mesh
         '''
+        hand_poses = self.get_hand_poses(two_fingers_ggarray)
+        widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, self.widths)
+        finger_types = self.get_graspgroup_types_with_finger_names()
         source_meshes_pointclouds_Allegro = []
         for id in range(self.__len__()):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[idx]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), self.widths[id]))
-            name = str(round(width * 100, 1)) + '.ply'
-            finger_type = self.get_graspgroup_types_with_finger_names()[id]
-            source_mesh_pointclouds_path = os.path.join(source_meshes_pointclouds_path, finger_type, name)
+            name = str(round(widths[id] * 100, 1)) + '.ply'
+            source_mesh_pointclouds_path = os.path.join(source_meshes_pointclouds_path, finger_types[id], name)
             source_mesh_pointclouds = o3d.io.read_point_cloud(source_mesh_pointclouds_path)
-
-            translation = self.translations[id].reshape(3, 1)
-            rotation = self.rotation_matrices[id].reshape(3, 3)
-            depth = self.depths[id]
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh_pointclouds.transform(transform_mat)
-            source_mesh_pointclouds.transform(grasp_depth)
+            source_mesh_pointclouds.transform(hand_poses[id])
             source_meshes_pointclouds_Allegro.append(source_mesh_pointclouds)
         return np.array(source_meshes_pointclouds_Allegro)
 
@@ -712,39 +621,32 @@ class AllegroGraspGroup():
         **Output:**
             source_meshes_Allegro: simplied Allegro meshes
         '''
-        source_meshes_Allegro  = []
+        hand_poses = self.get_hand_poses(two_fingers_ggarray)
+        widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, self.widths)
+        finger_types = self.get_graspgroup_types_with_finger_names()
+        source_meshes_Allegro = []
         for id in range(self.__len__()):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[idx]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), self.widths[id]))
-            name = str(round(width * 100, 1)) + '.STL'
-            finger_type = self.get_graspgroup_types_with_finger_names()[id]
-            source_mesh_path = os.path.join(source_meshes_path, finger_type, name)
+            name = str(round(widths[id] * 100, 1)) + '.STL'
+            source_mesh_path = os.path.join(source_meshes_path, finger_types[id], name)
             source_mesh = o3d.io.read_triangle_mesh(source_mesh_path)
-
-            translation = self.translations[id].reshape(3, 1)
-            rotation = self.rotation_matrices[id].reshape(3, 3)
-            depth = self.depths[id]
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh.transform(transform_mat)
-            source_mesh.transform(np.array(grasp_depth))
+            source_mesh.transform(hand_poses[id])
             source_meshes_Allegro.append(source_mesh)
         return np.array(source_meshes_Allegro)
 
+    def get_hand_poses(self, two_fingers_ggarray):
+        '''
+        **Input:**
+        - two_fingers_ggarray: graspnetAPI.GraspGroup of the grasps, in the same order.
+
+        **Output:**
+        - np.array of shape (-1, 4, 4) of the poses of the hand meshes, moved by the depths along the approaches of
+          two_fingers_ggarray.
+        '''
+        directions = two_fingers_ggarray.rotation_matrices[:, :, 0]
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        return translations_rotations_2_matrices(self.translations + directions * self.depths[:, np.newaxis],
+                                                 self.rotation_matrices)
+
     def normalize(self, x):
         return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
 
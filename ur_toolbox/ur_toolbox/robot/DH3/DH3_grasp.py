@@ -1,9 +1,10 @@
 import os
-import json
 import numpy as np
 import open3d as o3d
 import copy
 import math
+from ..width_pose_table import get_width_pose_table, width_bounds, clip_widths
+from ...transformation.se3 import translations_rotations_2_matrices
 
 grasp_types = {'1':{'name': 'pose1', 'facenet_thumb': [60388], 'facenet_index': [69638, 51138], 'width':[0, 0.099]},
                 '2':{'name': 'pose2', 'facenet_thumb': [60388], 'facenet_index': [69638, 51138], 'width':[0.007, 0.09]},
@@ -15,6 +16,7 @@ MIN_GRASP_WIDTH = 0.01
 MAX_GRASP_WIDTH = 0.099
 DH3_DEFAULT_DEPTH = 0.0
 DH3_ARRAY_LEN = 19
+WIDTH_BOUNDS = width_bounds(grasp_types, MIN_GRASP_WIDTH, MAX_GRASP_WIDTH)
 
 class DH3Grasp():
     def __init__(self, *args):
@@ -217,26 +219,7 @@ class DH3Grasp():
         finger_type = self.get_grasp_type_with_finger_name()
         source_mesh_pointclouds_path = os.path.join(source_mesh_pointclouds_path, finger_type, name)
         source_mesh_pointclouds = o3d.io.read_point_cloud(source_mesh_pointclouds_path)
-        translation = self.translation.reshape(3, 1)
-        rotation = self.rotation_matrix.reshape(3, 3)
-        depth = self.depth
-
-        t = two_fingers_grasp.translation.reshape(3, 1)
-        r = two_fingers_grasp.rotation_matrix.reshape(3, 3)
-
-        transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-        grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-        grasp_direction = np.array(grasp_direction).reshape(3)
-        grasp_direction = grasp_direction - two_fingers_grasp.translation.reshape((3))
-        grasp_direction = self.normalize(grasp_direction)
-        grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                [0, 1, 0, grasp_direction[1] * depth],
-                                [0, 0, 1, grasp_direction[2] * depth],
-                                [0, 0, 0, 1]], dtype=np.float32)
-
-        transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-        source_mesh_pointclouds.transform(transform_mat)
-        source_mesh_pointclouds.transform(grasp_depth)
+        source_mesh_pointclouds.transform(self.get_hand_pose(two_fingers_grasp))
         return source_mesh_pointclouds
 
     def load_mesh(self, path_mesh, two_fingers_grasp):
@@ -260,28 +243,21 @@ class DH3Grasp():
         finger_type = self.get_grasp_type_with_finger_name()
         source_mesh_path = os.path.join(source_mesh_path, finger_type, name)
         source_mesh = o3d.io.read_triangle_mesh(source_mesh_path)
-        translation = self.translation.reshape(3, 1)
-        rotation = self.rotation_matrix.reshape(3, 3)
-        depth = self.depth
-
-        t = two_fingers_grasp.translation.reshape(3, 1)
-        r = two_fingers_grasp.rotation_matrix.reshape(3, 3)
-
-        transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-        grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-        grasp_direction = np.array(grasp_direction).reshape(3)
-        grasp_direction = grasp_direction - two_fingers_grasp.translation.reshape((3))
-        grasp_direction = self.normalize(grasp_direction)
-        grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                [0, 1, 0, grasp_direction[1] * depth],
-                                [0, 0, 1, grasp_direction[2] * depth],
-                                [0, 0, 0, 1]], dtype=np.float32)
-
-        transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-        source_mesh.transform(transform_mat)
-        source_mesh.transform(grasp_depth)
+        source_mesh.transform(self.get_hand_pose(two_fingers_grasp))
         return source_mesh
 
+    def get_hand_pose(self, two_fingers_grasp):
+        '''
+        **Input:**
+        - two_fingers_grasp: graspnetAPI.Grasp of the grasp.
+
+        **Output:**
+        - np.array of shape (4, 4) of the pose of the hand mesh, moved by the depth along the approach of two_fingers_grasp.
+        '''
+        direction = self.normalize(two_fingers_grasp.rotation_matrix.reshape(3, 3)[:, 0])
+        return translations_rotations_2_matrices(self.translation.reshape(3) + direction * self.depth,
+                                                 self.rotation_matrix.reshape(3, 3))
+
     def normalize(self, x):
         return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
 
@@ -294,32 +270,14 @@ class DH3Grasp():
         - DH3_rotation: the rotations of the end of the robotic arm
         - DH3_angle: the angle of DH3
         '''
-        width = two_fingers_grasp.width
-        min_width, max_width = grasp_types[str(self.grasp_type)]['width']
-        width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
-        translation = two_fingers_grasp.translation
-        rotation = two_fingers_grasp.rotation_matrix
-
-        mesh_information_path = os.path.join(path_json, 'width_12D_angle_2D_angle.json')
-        with open(mesh_information_path, 'r', encoding='UTF-8') as f:
-            width_12D_angle_2D_angle = json.load(f)
-
-        matrix_two_fingers = np.vstack(
-            (np.hstack((rotation, np.array(translation).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-        translation_DH3 = width_12D_angle_2D_angle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['translation']
-        rotation_DH3 = width_12D_angle_2D_angle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['rotation']
-        matrix_DH3 = np.vstack(
-            (np.hstack((rotation_DH3, np.array(translation_DH3).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-        mat_two_fingers_2_DH3 = np.dot(matrix_two_fingers, np.linalg.inv(matrix_DH3))
-        DH3_translation = np.array([mat_two_fingers_2_DH3[0,3], mat_two_fingers_2_DH3[1,3], mat_two_fingers_2_DH3[2,3]])
-        DH3_rotation = np.array([mat_two_fingers_2_DH3[0,0:3], mat_two_fingers_2_DH3[1,0:3], mat_two_fingers_2_DH3[2,0:3]])
-
-        angle = width_12D_angle_2D_angle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['2d']
-        self.width = width
-        self.translation = DH3_translation
-        self.rotation_matrix = DH3_rotation
-        self.angle = angle
-        # return DH3_translation, DH3_rotation, angle
+        width = clip_widths(WIDTH_BOUNDS, [self.grasp_type], [two_fingers_grasp.width])
+        width_12D_angle_2D_angle = get_width_pose_table(os.path.join(path_json, 'width_12D_angle_2D_angle.json'), grasp_types, '2d')
+        DH3_rotation, DH3_translation, angle = width_12D_angle_2D_angle.transform([self.grasp_type], width,
+                                                                  two_fingers_grasp.rotation_matrix, two_fingers_grasp.translation)
+        self.width = float(width[0])
+        self.translation = DH3_translation[0]
+        self.rotation_matrix = DH3_rotation[0]
+        self.angle = angle[0]
 
     def from_grasp(self, two_fingers_grasp, DH3type, path_json):
         """Grasp to DH3Grasp Transformation.
@@ -537,9 +495,7 @@ class DH3GraspGroup():
         - widths: numpy array of shape (-1, ) of the widths.
         '''
         assert widths.size == len(self)
-        for ids, width in enumerate(widths):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[ids]))]['width']
-            widths[ids] = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), widths[ids]))
+        widths[:] = clip_widths(WIDTH_BOUNDS, self.grasp_types, widths)
         self.grasp_group_array[:, 18] = copy.deepcopy(widths)
 
     def set_grasp_min_width(self, MIN_GRASP_WIDTH):
@@ -567,41 +523,14 @@ class DH3GraspGroup():
         - DH3_rotations: the rotations of the end of the robotic arm
         - DH3_angles: the angle of DH3
         '''
-        widths = graspgroup.widths
-        translations = graspgroup.translations
-        rotations = graspgroup.rotation_matrices
-
-        mesh_information_path = os.path.join(path_json, 'width_12D_angle_2D_angle.json')
-        with open(mesh_information_path, 'r', encoding='UTF-8') as f:
-            width_12D_angle_2D_angle = json.load(f)
-
-        DH3_translations = []
-        DH3_rotations = []
-        DH3_angles = []
-        DH3_widths = []
-        for idx, width in enumerate(widths):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[idx]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
-            translation_two_fingers = translations[idx]
-            rotation_two_fingers = rotations[idx]
-            DH3_widths.append(width)
-            matrix_two_fingers = np.vstack(
-                (np.hstack((rotation_two_fingers, np.array(translation_two_fingers).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-            translation_DH3 = width_12D_angle_2D_angle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['translation']
-            rotation_DH3 = width_12D_angle_2D_angle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['rotation']
-            matrix_DH3 = np.vstack(
-                (np.hstack((rotation_DH3, np.array(translation_DH3).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-            mat_two_fingers_2_DH3 = np.dot(matrix_two_fingers, np.linalg.inv(matrix_DH3))
-            DH3_translations.append([mat_two_fingers_2_DH3[0,3], mat_two_fingers_2_DH3[1,3], mat_two_fingers_2_DH3[2,3]])
-            rotation = np.array([mat_two_fingers_2_DH3[0,0:3], mat_two_fingers_2_DH3[1,0:3], mat_two_fingers_2_DH3[2,0:3]])
-            DH3_rotations.append(rotation)
-
-            angle = width_12D_angle_2D_angle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['2d']
-            DH3_angles.append(angle)
-        self.widths = np.array(DH3_widths)
-        self.translations = np.array(DH3_translations)
-        self.rotation_matrices = np.array(DH3_rotations)
-        self.angles = np.array(DH3_angles)
+        DH3_widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, graspgroup.widths)
+        width_12D_angle_2D_angle = get_width_pose_table(os.path.join(path_json, 'width_12D_angle_2D_angle.json'), grasp_types, '2d')
+        DH3_rotations, DH3_translations, DH3_angles = width_12D_angle_2D_angle.transform(self.grasp_types, DH3_widths,
+                                                                                 graspgroup.rotation_matrices, graspgroup.translations)
+        self.widths = DH3_widths
+        self.translations = DH3_translations
+        self.rotation_matrices = DH3_rotations
+        self.angles = DH3_angles
 
     def from_npy(self, npy_file_path):
         '''
@@ -644,36 +573,15 @@ class DH3GraspGroup():
         **Output:**
             source_mesh: simplied DH3 mesh
         '''
+        hand_poses = self.get_hand_poses(two_fingers_ggarray)
+        widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, self.widths)
+        finger_types = self.get_graspgroup_types_with_finger_names()
         source_meshes_pointclouds_DH3 = []
         for id in range(self.__len__()):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[id]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), self.widths[id]))
-            name = str(round(width * 100, 1)) + '.ply'
-            finger_type = self.get_graspgroup_types_with_finger_names()[id]
-            source_mesh_pointclouds_path = os.path.join(source_meshes_pointclouds_path, finger_type, name)
+            name = str(round(widths[id] * 100, 1)) + '.ply'
+            source_mesh_pointclouds_path = os.path.join(source_meshes_pointclouds_path, finger_types[id], name)
             source_mesh_pointclouds = o3d.io.read_point_cloud(source_mesh_pointclouds_path)
-
-            translation = self.translations[id].reshape(3, 1)
-            rotation = self.rotation_matrices[id].reshape(3, 3)
-            depth = self.depths[id]
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh_pointclouds.transform(transform_mat)
-            source_mesh_pointclouds.transform(grasp_depth)
+            source_mesh_pointclouds.transform(hand_poses[id])
             source_meshes_pointclouds_DH3.append(source_mesh_pointclouds)
         return np.array(source_meshes_pointclouds_DH3)
 
@@ -694,39 +602,32 @@ class DH3GraspGroup():
         **Output:**
             source_meshes_DH3: simplied DH3 meshes
         '''
-        source_meshes_DH3  = []
+        hand_poses = self.get_hand_poses(two_fingers_ggarray)
+        widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, self.widths)
+        finger_types = self.get_graspgroup_types_with_finger_names()
+        source_meshes_DH3 = []
         for id in range(self.__len__()):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[id]))]['width']
-            widths[ids] = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), self.widths[id]))
-            name = str(round(width * 100, 1)) + '.STL'
-            finger_type = self.get_graspgroup_types_with_finger_names()[id]
-            source_mesh_path = os.path.join(source_meshes_path, finger_type, name)
+            name = str(round(widths[id] * 100, 1)) + '.STL'
+            source_mesh_path = os.path.join(source_meshes_path, finger_types[id], name)
             source_mesh = o3d.io.read_triangle_mesh(source_mesh_path)
-
-            translation = self.translations[id].reshape(3, 1)
-            rotation = self.rotation_matrices[id].reshape(3, 3)
-            depth = self.depths[id]
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh.transform(transform_mat)
-            source_mesh.transform(np.array(grasp_depth))
+            source_mesh.transform(hand_poses[id])
             source_meshes_DH3.append(source_mesh)
         return np.array(source_meshes_DH3)
 
+    def get_hand_poses(self, two_fingers_ggarray):
+        '''
+        **Input:**
+        - two_fingers_ggarray: graspnetAPI.GraspGroup of the grasps, in the same order.
+
+        **Output:**
+        - np.array of shape (-1, 4, 4) of the poses of the hand meshes, moved by the depths along the approaches of
+          two_fingers_ggarray.
+        '''
+        directions = two_fingers_ggarray.rotation_matrices[:, :, 0]
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        return translations_rotations_2_matrices(self.translations + directions * self.depths[:, np.newaxis],
+                                                 self.rotation_matrices)
+
     def normalize(self, x):
         return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
 
@@ -1,9 +1,10 @@
 import os
-import json
 import numpy as np
 import open3d as o3d
 import copy
 import math
+from ..width_pose_table import get_width_pose_table, width_bounds, clip_widths
+from ...transformation.se3 import translations_rotations_2_matrices
 
 grasp_types = { '1':{'name': 'Ring', 'facenet_thumb': [[207598, 207599]], 'facenet_index': [[146358, 146357], [53344, 53345]], 'width':[0, 0.11]},
                 '2':{'name': 'Prismatic_2_Finger', 'facenet_thumb': [[207598, 207599]], 'facenet_index': [[146358, 146357], [53344, 53345]], 'width':[0, 0.11]},
@@ -19,6 +20,7 @@ MIN_GRASP_WIDTH = 0.025
 MAX_GRASP_WIDTH = 0.10
 INSPIREHANDR_DEFAULT_DEPTH = 0.0
 INSPIREHANDR_ARRAY_LEN = 23
+WIDTH_BOUNDS = width_bounds(grasp_types, MIN_GRASP_WIDTH, MAX_GRASP_WIDTH)
 
 class InspireHandRGrasp():
     def __init__(self, *args):
@@ -181,7 +183,7 @@ class InspireHandRGrasp():
         **input:**
         - float of the width.
         '''
-        min_width, max_width = grasp_types[str(self.grasp_type)]['width']
+        min_width, max_width = grasp_types[str(int(self.grasp_type))]['width']
         width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
         self.grasp_array[22] = width
 
@@ -221,26 +223,7 @@ class InspireHandRGrasp():
         finger_type = self.get_grasp_type_with_finger_name()
         source_mesh_pointclouds_path = os.path.join(source_mesh_pointclouds_path, finger_type, name)
         source_mesh_pointclouds = o3d.io.read_point_cloud(source_mesh_pointclouds_path)
-        translation = self.translation.reshape(3, 1)
-        rotation = self.rotation_matrix.reshape(3, 3)
-        depth = self.depth
-
-        t = two_fingers_grasp.translation.reshape(3, 1)
-        r = two_fingers_grasp.rotation_matrix.reshape(3, 3)
-
-        transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-        grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-        grasp_direction = np.array(grasp_direction).reshape(3)
-        grasp_direction = grasp_direction - two_fingers_grasp.translation.reshape((3))
-        grasp_direction = self.normalize(grasp_direction)
-        grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                [0, 1, 0, grasp_direction[1] * depth],
-                                [0, 0, 1, grasp_direction[2] * depth],
-                                [0, 0, 0, 1]], dtype=np.float32)
-
-        transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-        source_mesh_pointclouds.transform(transform_mat)
-        source_mesh_pointclouds.transform(grasp_depth)
+        source_mesh_pointclouds.transform(self.get_hand_pose(two_fingers_grasp))
         return source_mesh_pointclouds
 
     def load_mesh(self, path_mesh, two_fingers_grasp):
@@ -264,28 +247,21 @@ class InspireHandRGrasp():
         finger_type = self.get_grasp_type_with_finger_name()
         source_mesh_path = os.path.join(source_mesh_path, finger_type, name)
         source_mesh = o3d.io.read_triangle_mesh(source_mesh_path)
-        translation = self.translation.reshape(3, 1)
-        rotation = self.rotation_matrix.reshape(3, 3)
-        depth = self.depth
-
-        t = two_fingers_grasp.translation.reshape(3, 1)
-        r = two_fingers_grasp.rotation_matrix.reshape(3, 3)
-
-        transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-        grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-        grasp_direction = np.array(grasp_direction).reshape(3)
-        grasp_direction = grasp_direction - two_fingers_grasp.translation.reshape((3))
-        grasp_direction = self.normalize(grasp_direction)
-        grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                [0, 1, 0, grasp_direction[1] * depth],
-                                [0, 0, 1, grasp_direction[2] * depth],
-                                [0, 0, 0, 1]], dtype=np.float32)
-
-        transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-        source_mesh.transform(transform_mat)
-        source_mesh.transform(grasp_depth)
+        source_mesh.transform(self.get_hand_pose(two_fingers_grasp))
         return source_mesh
 
+    def get_hand_pose(self, two_fingers_grasp):
+        '''
+        **Input:**
+        - two_fingers_grasp: graspnetAPI.Grasp of the grasp.
+
+        **Output:**
+        - np.array of shape (4, 4) of the pose of the hand mesh, moved by the depth along the approach of two_fingers_grasp.
+        '''
+        direction = self.normalize(two_fingers_grasp.rotation_matrix.reshape(3, 3)[:, 0])
+        return translations_rotations_2_matrices(self.translation.reshape(3) + direction * self.depth,
+                                                 self.rotation_matrix.reshape(3, 3))
+
     def normalize(self, x):
         return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
 
@@ -312,31 +288,14 @@ class InspireHandRGrasp():
         - InspireHandR_rotation: the rotations of the end of the robotic arm
         - InspireHandR_angle: the angle of InspireHandR
         '''
-        width = two_fingers_grasp.width
-        min_width, max_width = grasp_types[str(self.grasp_type)]['width']
-        width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
-        translation = two_fingers_grasp.translation
-        rotation = two_fingers_grasp.rotation_matrix
-
-        mesh_information_path = os.path.join(path_json, 'width_12Dangle_6Dangle.json')
-        with open(mesh_information_path, 'r', encoding='UTF-8') as f:
-            width_12Dangle_6Dangle = json.load(f)
-
-        matrix_two_fingers = np.vstack(
-            (np.hstack((rotation, np.array(translation).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-        translation_InspireHandR = width_12Dangle_6Dangle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['translation']
-        rotation_InspireHandR = width_12Dangle_6Dangle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['rotation']
-        matrix_InspireHandR = np.vstack(
-            (np.hstack((rotation_InspireHandR, np.array(translation_InspireHandR).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-        mat_two_fingers_2_InspireHandR = np.dot(matrix_two_fingers, np.linalg.inv(matrix_InspireHandR))
-        InspireHandR_translation = np.array([mat_two_fingers_2_InspireHandR[0,3], mat_two_fingers_2_InspireHandR[1,3], mat_two_fingers_2_InspireHandR[2,3]])
-        InspireHandR_rotation = np.array([mat_two_fingers_2_InspireHandR[0,0:3], mat_two_fingers_2_InspireHandR[1,0:3], mat_two_fingers_2_InspireHandR[2,0:3]])
-
-        error_angle = width_12Dangle_6Dangle[self.get_grasp_type_with_finger_name()][str(np.round(width * 100, 1))]['6d']
-        self.width = width
-        self.translation = InspireHandR_translation
-        self.rotation_matrix = InspireHandR_rotation
-        self.angle = error_angle
+        width = clip_widths(WIDTH_BOUNDS, [self.grasp_type], [two_fingers_grasp.width])
+        width_12Dangle_6Dangle = get_width_pose_table(os.path.join(path_json, 'width_12Dangle_6Dangle.json'), grasp_types, '6d')
+        InspireHandR_rotation, InspireHandR_translation, angle = width_12Dangle_6Dangle.transform([self.grasp_type], width,
+                                                                  two_fingers_grasp.rotation_matrix, two_fingers_grasp.translation)
+        self.width = float(width[0])
+        self.translation = InspireHandR_translation[0]
+        self.rotation_matrix = InspireHandR_rotation[0]
+        self.angle = angle[0]
 
     def from_grasp(self, two_fingers_grasp, InspireHandRtype, path_json):
         """Grasp to InspireHandRGrasp Transformation.
@@ -554,9 +513,7 @@ class InspireHandRGraspGroup():
         - widths: numpy array of shape (-1, ) of the widths.
         '''
         assert widths.size == len(self)
-        for ids, width in enumerate(widths):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[ids]))]['width']
-            widths[ids] = np.minimum(min(max_width, MAX_GRASP_WIDTH), np.maximum(max(min_width, MIN_GRASP_WIDTH), widths[ids]))
+        widths[:] = clip_widths(WIDTH_BOUNDS, self.grasp_types, widths)
         self.grasp_group_array[:, 22] = copy.deepcopy(widths)
 
 
@@ -585,41 +542,14 @@ class InspireHandRGraspGroup():
         - InspireHandR_rotations: the rotations of the end of the robotic arm
         - InspireHandR_angles: the angle of InspireHandR
         '''
-        widths = graspgroup.widths
-        translations = graspgroup.translations
-        rotations = graspgroup.rotation_matrices
-
-        mesh_information_path = os.path.join(path_json, 'width_12Dangle_6Dangle.json')
-        with open(mesh_information_path, 'r', encoding='UTF-8') as f:
-            width_12Dangle_6Dangle = json.load(f)
-
-        InspireHandR_translations = []
-        InspireHandR_rotations = []
-        InspireHandR_angles = []
-        InspireHandR_widths = []
-        for idx, width in enumerate(widths):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[idx]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), width))
-            InspireHandR_widths.append(width)
-            translation_two_fingers = translations[idx]
-            rotation_two_fingers = rotations[idx]
-            matrix_two_fingers = np.vstack(
-                (np.hstack((rotation_two_fingers, np.array(translation_two_fingers).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-            translation_InspireHandR = width_12Dangle_6Dangle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['translation']
-            rotation_InspireHandR = width_12Dangle_6Dangle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['rotation']
-            matrix_InspireHandR = np.vstack(
-                (np.hstack((rotation_InspireHandR, np.array(translation_InspireHandR).reshape((3, 1)))), np.array((0, 0, 0, 1))))
-            mat_two_fingers_2_InspireHandR = np.dot(matrix_two_fingers, np.linalg.inv(matrix_InspireHandR))
-            InspireHandR_translations.append([mat_two_fingers_2_InspireHandR[0,3], mat_two_fingers_2_InspireHandR[1,3], mat_two_fingers_2_InspireHandR[2,3]])
-            rotation = np.array([mat_two_fingers_2_InspireHandR[0,0:3], mat_two_fingers_2_InspireHandR[1,0:3], mat_two_fingers_2_InspireHandR[2,0:3]])
-            InspireHandR_rotations.append(rotation)
-
-            error_angle = width_12Dangle_6Dangle[self.get_graspgroup_types_with_finger_names()[idx]][str(np.round(width * 100, 1))]['6d']
-            InspireHandR_angles.append(error_angle)
-        self.widths = np.array(InspireHandR_widths)
-        self.translations = np.array(InspireHandR_translations)
-        self.rotation_matrices = np.array(InspireHandR_rotations)
-        self.angles = np.array(InspireHandR_angles)
+        InspireHandR_widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, graspgroup.widths)
+        width_12Dangle_6Dangle = get_width_pose_table(os.path.join(path_json, 'width_12Dangle_6Dangle.json'), grasp_types, '6d')
+        InspireHandR_rotations, InspireHandR_translations, InspireHandR_angles = width_12Dangle_6Dangle.transform(self.grasp_types, InspireHandR_widths,
+                                                                                 graspgroup.rotation_matrices, graspgroup.translations)
+        self.widths = InspireHandR_widths
+        self.translations = InspireHandR_translations
+        self.rotation_matrices = InspireHandR_rotations
+        self.angles = InspireHandR_angles
 
     def from_npy(self, npy_file_path):
         '''
@@ -662,36 +592,15 @@ class InspireHandRGraspGroup():
         **Output:**
             source_mesh: simplied InspireHandR mesh
         '''
+        hand_poses = self.get_hand_poses(two_fingers_ggarray)
+        widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, self.widths)
+        finger_types = self.get_graspgroup_types_with_finger_names()
         source_meshes_pointclouds_InspireHandR = []
         for id in range(self.__len__()):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[id]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), self.widths[id]))
-            name = str(round(width * 100, 1)) + '.ply'
-            finger_type = self.get_graspgroup_types_with_finger_names()[id]
-            source_mesh_pointclouds_path = os.path.join(source_meshes_pointclouds_path, finger_type, name)
+            name = str(round(widths[id] * 100, 1)) + '.ply'
+            source_mesh_pointclouds_path = os.path.join(source_meshes_pointclouds_path, finger_types[id], name)
             source_mesh_pointclouds = o3d.io.read_point_cloud(source_mesh_pointclouds_path)
-
-            translation = self.translations[id].reshape(3, 1)
-            rotation = self.rotation_matrices[id].reshape(3, 3)
-            depth = self.depths[id]
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh_pointclouds.transform(transform_mat)
-            source_mesh_pointclouds.transform(grasp_depth)
+            source_mesh_pointclouds.transform(hand_poses[id])
             source_meshes_pointclouds_InspireHandR.append(source_mesh_pointclouds)
         return np.array(source_meshes_pointclouds_InspireHandR)
 
@@ -712,39 +621,32 @@ class InspireHandRGraspGroup():
         **Output:**
             source_meshes_InspireHandR: simplied InspireHandR meshes
         '''
-        source_meshes_InspireHandR  = []
+        hand_poses = self.get_hand_poses(two_fingers_ggarray)
+        widths = clip_widths(WIDTH_BOUNDS, self.grasp_types, self.widths)
+        finger_types = self.get_graspgroup_types_with_finger_names()
+        source_meshes_InspireHandR = []
         for id in range(self.__len__()):
-            min_width, max_width = grasp_types[str(int(self.grasp_types[id]))]['width']
-            width = min(min(max_width, MAX_GRASP_WIDTH), max(max(min_width, MIN_GRASP_WIDTH), self.widths[id]))
-            name = str(round(width * 100, 1)) + '.STL'
-            finger_type = self.get_graspgroup_types_with_finger_names()[id]
-            source_mesh_path = os.path.join(source_meshes_path, finger_type, name)
+            name = str(round(widths[id] * 100, 1)) + '.STL'
+            source_mesh_path = os.path.join(source_meshes_path, finger_types[id], name)
             source_mesh = o3d.io.read_triangle_mesh(source_mesh_path)
-
-            translation = self.translations[id].reshape(3, 1)
-            rotation = self.rotation_matrices[id].reshape(3, 3)
-            depth = self.depths[id]
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh.transform(transform_mat)
-            source_mesh.transform(np.array(grasp_depth))
+            source_mesh.transform(hand_poses[id])
             source_meshes_InspireHandR.append(source_mesh)
         return np.array(source_meshes_InspireHandR)
 
+    def get_hand_poses(self, two_fingers_ggarray):
+        '''
+        **Input:**
+        - two_fingers_ggarray: graspnetAPI.GraspGroup of the grasps, in the same order.
+
+        **Output:**
+        - np.array of shape (-1, 4, 4) of the poses of the hand meshes, moved by the depths along the approaches of
+          two_fingers_ggarray.
+        '''
+        directions = two_fingers_ggarray.rotation_matrices[:, :, 0]
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        return translations_rotations_2_matrices(self.translations + directions * self.depths[:, np.newaxis],
+                                                 self.rotation_matrices)
+
     def normalize(self, x):
         return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
 
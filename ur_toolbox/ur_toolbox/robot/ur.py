@@ -11,12 +11,14 @@ import xlrd2
 from ..camera import RealSense
 from ..transformation.pose import pose_array_2_matrix, pose_matrix_2_array, translation_rotation_2_matrix, \
     translation_rotation_2_array
+from ..transformation.se3 import inverse_matrices, translations_rotations_2_matrices, orthonormalize_rotations
 
 from .robotiq import Robotiq
 from .wsg import WSG
 from .Inspire.InspireHandR import InspireHandR
 from .DH3.DH3 import DH3
 from .Allegro.Allegro import Allegro
+from .ur_ik import InverseKinematicsUR5
 # import ikfastpy
 
 from graspnetAPI import Grasp
@@ -106,6 +108,9 @@ class UR_Camera_Gripper(urx.Robot):
         self.throwj2 = np.array([0.6649638414382935, -1.4355509916888636, 1.5572257041931152, -2.7616093794452112, 
                                 -1.4952309767352503, -1.3120296637164515])
 
+        # analytic IK of the tcp poses of getl, call self.ik.setTCPOffset if a tcp offset is set on the teach pendant
+        self.ik = InverseKinematicsUR5()
+
     def get_camera_tcp_matrix(self):
         '''
         **Output:**
@@ -173,7 +178,7 @@ class UR_Camera_Gripper(urx.Robot):
                 ),
                 gripper_camera_pose  # camera / gripper
             ),
-            np.linalg.inv(self.get_gripper_tcp_matrix())  # (tcp2 / gripper)^(-1)
+            inverse_matrices(self.get_gripper_tcp_matrix())  # (tcp2 / gripper)^(-1)
         )
 
         return tcp_pose
@@ -188,8 +193,8 @@ class UR_Camera_Gripper(urx.Robot):
         return np.dot(
             np.dot(
                 np.dot(
-                    np.linalg.inv(self.get_camera_tcp_matrix()),  # tcp 1/ camera
-                    np.linalg.inv(self.get_tcp_base_matrix())  # base / tcp1
+                    inverse_matrices(self.get_camera_tcp_matrix()),  # tcp 1/ camera
+                    inverse_matrices(self.get_tcp_base_matrix())  # base / tcp1
                 ),
                 tcp_base_pose  # base / tcp2
             ),
@@ -332,7 +337,7 @@ class UR_Camera_Gripper(urx.Robot):
         self.movel(tcp_pose, acc=acc, vel=vel)
 
     def grasp_and_throw(self, multifinger_grasp_used, two_fingers_grasp_used, cloud, multifinger_mesh_json_path, acc=0.05, vel=0.05, approach_dist=0.07, camera_pose=True,
-                        execute_grasp=True, use_ready_pose=False, gripper_time=0.2):
+                        execute_grasp=True, use_ready_pose=False, gripper_time=0.2, on_throw=None):
         '''
         **Input:**
         - grasp: Grasp instance or numpy array of shape (4,4) or numpy array of shape (6,) in camera coordinate
@@ -340,6 +345,7 @@ class UR_Camera_Gripper(urx.Robot):
         - vel: float of the maximum velocity.
         - approach_dist: float of the distance to move along the z axis of tcp coordinate.
         - camera_pose: If true, grasp pose is given in camera coordinate. Else, it is given in tcp coordinate.
+        - on_throw: callable called without arguments once the object has been carried out of the scene to the throw pose.
 ss        **Output:**
         - No output but the robot moves to the ready pose first, and then moves to the given pose along the z axis of the tcp coordinate. Maybe it will close the gripper and move up to away pose and finally throw the object.
         '''
@@ -352,29 +358,26 @@ ss        **Output:**
         if isinstance(multifinger_grasp_used, Grasp) or isinstance(multifinger_grasp_used, InspireHandRGrasp) \
             or isinstance(multifinger_grasp_used, DH3Grasp) or isinstance(multifinger_grasp_used, AllegroGrasp):
             multifinger_translation = multifinger_grasp_used.translation
-            multifinger_rotation = multifinger_grasp_used.rotation_matrix
+            # the rotations of the width json are not exactly orthonormal
+            multifinger_rotation = orthonormalize_rotations(multifinger_grasp_used.rotation_matrix)
 
-            pose = translation_rotation_2_array(multifinger_translation, multifinger_rotation)
+            pose = translation_rotation_2_matrix(multifinger_translation, multifinger_rotation)
         elif isinstance(multifinger_grasp_used, np.ndarray):
             if multifinger_grasp_used.shape == (4, 4):
-                pose = pose_matrix_2_array(multifinger_grasp_used)
+                pose = np.array(multifinger_grasp_used, dtype=np.float64)
+                pose[:3, :3] = orthonormalize_rotations(pose[:3, :3])
             elif multifinger_grasp_used.shape == (6,):
-                pose = multifinger_grasp_used
+                pose = pose_array_2_matrix(multifinger_grasp_used)
             else:
                 raise ValueError('Shape of Grasp Array must be (4,4) or (6,), but it is {}'.format(multifinger_grasp_used.shape))
         else:
             raise ValueError('execute must be called with Grasp or numpy array, but it is {}'.format(type(multifinger_grasp_used)))
-        pose = pose_array_2_matrix(pose)
         if camera_pose:
             tcp_pose = self.gripper_camera_pose_2_tcp_base_pose(pose, use_ready_pose=use_ready_pose)
         else:
             tcp_pose = copy.deepcopy(pose)
         target_gripper_pose = self.normalize(self.get_target_gripper_base_pose(two_fingers_grasp_matrix, use_ready_pose=use_ready_pose)[:3, 0])
-        if self.gripper_type in ['InspireHandR', 'Allegro']:
-            tcp_pose[:3, 3] = tcp_pose[:3, 3] + (multifinger_grasp_used.depth+0.014) * target_gripper_pose
-        elif self.gripper_type == 'DH3':
-            back_dis = self.angle[0] / 100 * 0.005
-            tcp_pose[:3, 3] = tcp_pose[:3, 3] + (multifinger_grasp_used.depth - back_dis) * target_gripper_pose
+        tcp_pose[:3, 3] = tcp_pose[:3, 3] + self.get_approach_depths(multifinger_grasp_used.depth, self.angle) * target_gripper_pose
 
         tcp_pre_pose = copy.deepcopy(tcp_pose)
         tcp_pre_pose[:3, 3] = tcp_pre_pose[:3, 3] - approach_dist * target_gripper_pose
@@ -404,6 +407,8 @@ ss        **Output:**
             time.sleep(0.1)
             self.movel(tcp_pre_pose, acc=acc, vel=vel)
             self.throw(acc=acc, vel=vel)
+            if on_throw is not None:
+                on_throw()
             self.open_gripper(multifinger_grasp_used.angle, sleep_time=gripper_time)
             if self.gripper_type == 'Allegro':
                 self.set_torque(np.zeros(16))
@@ -415,6 +420,73 @@ ss        **Output:**
                self.get_target_gripper_base_pose(two_fingers_grasp_matrix),  \
                self.get_camera_tcp_matrix(), self.get_tcp_base_matrix(use_ready_pose=use_ready_pose)]
 
+    def get_approach_depths(self, depths, angles):
+        '''
+        **Input:**
+        - depths: float or np.array of shape (-1,) of the depths of the multifinger grasps.
+        - angles: np.array of shape (2,) or (-1,2) of the angles of the same grasps.
+        **Output:**
+        - float or np.array of shape (-1,) of the distance the tcp moves along the approaching direction from the hand pose,
+          shared by grasp_and_throw and get_grasp_tcp_poses.
+        '''
+        if self.gripper_type in ['InspireHandR', 'Allegro']:
+            return depths + 0.014
+        elif self.gripper_type == 'DH3':
+            # the DH3 backs off as its fingers open
+            back_dis = np.asarray(angles)[..., 0] / 100 * 0.005
+            return depths - back_dis
+        return np.zeros_like(depths)
+
+    def get_grasp_tcp_poses(self, multifinger_ggarray, two_fingers_ggarray, approach_dist=0.07, use_ready_pose=False):
+        '''
+        **Input:**
+        - multifinger_ggarray: InspireHandRGraspGroup, DH3GraspGroup or AllegroGraspGroup in camera coordinate.
+        - two_fingers_ggarray: graspnetAPI.GraspGroup of the same grasps.
+        - approach_dist: float of the distance to move along the approaching direction.
+        - use_ready_pose: if True, the camera pose is the one of the ready pose.
+        **Output:**
+        - tcp_poses: np.array of shape (-1,4,4) of the grasp tcp poses in base coordinate, as in grasp_and_throw.
+        - tcp_pre_poses: np.array of shape (-1,4,4) of the tcp poses before the approach.
+        '''
+        camera_base_matrix = np.dot(self.get_tcp_base_matrix(use_ready_pose=use_ready_pose), self.get_camera_tcp_matrix())
+        poses = translations_rotations_2_matrices(multifinger_ggarray.translations,
+                                                  orthonormalize_rotations(multifinger_ggarray.rotation_matrices))
+        tcp_poses = np.matmul(np.matmul(camera_base_matrix, poses), inverse_matrices(self.get_gripper_tcp_matrix()))
+        directions = np.dot(two_fingers_ggarray.rotation_matrices[:, :, 0], camera_base_matrix[:3, :3].T)
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        approach_depths = self.get_approach_depths(multifinger_ggarray.depths, multifinger_ggarray.angles)
+        tcp_poses[:, :3, 3] += np.reshape(approach_depths, (-1, 1)) * directions
+        tcp_pre_poses = copy.deepcopy(tcp_poses)
+        tcp_pre_poses[:, :3, 3] -= approach_dist * directions
+        return tcp_poses, tcp_pre_poses
+
+    def get_reachable_grasps(self, multifinger_ggarray, two_fingers_ggarray, approach_dist=0.07, use_ready_pose=False,
+                             current_joints=None, max_joint_delta=None):
+        '''
+        **Input:**
+        - multifinger_ggarray, two_fingers_ggarray, approach_dist, use_ready_pose: see get_grasp_tcp_poses.
+        - current_joints: np.array of shape (6,) of the joints the arm starts from, getj() if None.
+        - max_joint_delta: optional float or np.array of shape (6,) of the largest motion of a joint, to reject e.g. the
+          grasps flipping the wrist.
+        **Output:**
+        - reachable: np.array of shape (-1,) of bool, True if the pre-grasp and the grasp tcp poses have IK solutions
+          within the joint limits and max_joint_delta of the previous joints.
+        - joints: np.array of shape (-1,6) of the joints at the grasp tcp poses, nan where it is not reachable.
+        '''
+        if current_joints is None:
+            current_joints = self.getj()
+        tcp_poses, tcp_pre_poses = self.get_grasp_tcp_poses(multifinger_ggarray, two_fingers_ggarray,
+                                                            approach_dist=approach_dist, use_ready_pose=use_ready_pose)
+        # no tolerance, the poses a little bit out of reach are unreachable
+        pre_joints, pre_found = self.ik.findClosestIKBatch(tcp_pre_poses, current_joints, max_joint_delta=max_joint_delta,
+                                                           tolerance=1.0)
+        # the approach is a linear move, so the grasp joints are the ones closest to the pre-grasp joints
+        joints, found = self.ik.findClosestIKBatch(tcp_poses, pre_joints[:, np.newaxis], max_joint_delta=max_joint_delta,
+                                                   tolerance=1.0)
+        reachable = pre_found & found
+        joints[~reachable] = np.nan
+        return reachable, joints
+
     def get_tcp_base_matrix(self, use_ready_pose=False):
         '''
         **Output:**
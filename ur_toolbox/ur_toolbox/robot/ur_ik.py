@@ -2,6 +2,7 @@
 # import tf_conversions.posemath
 from math import *
 import numpy as np
+from ..transformation.se3 import inverse_matrices
 
 def invTransform(Transform):
 	T = np.matrix(Transform)
@@ -21,6 +22,26 @@ def transformDHParameter(a,d,alpha,theta):
 		])
 	return T
 
+def transformDHParameters(a,d,alpha,theta):
+	# Batched transformDHParameter, theta is an array of any shape and the output has the shape theta.shape + (4,4)
+	theta = np.asarray(theta, dtype=np.float64)
+	c = np.cos(theta)
+	s = np.sin(theta)
+	T = np.zeros(theta.shape + (4,4))
+	T[...,0,0] = c
+	T[...,0,1] = -s*cos(alpha)
+	T[...,0,2] = s*sin(alpha)
+	T[...,0,3] = a*c
+	T[...,1,0] = s
+	T[...,1,1] = c*cos(alpha)
+	T[...,1,2] = -c*sin(alpha)
+	T[...,1,3] = a*s
+	T[...,2,1] = sin(alpha)
+	T[...,2,2] = cos(alpha)
+	T[...,2,3] = d
+	T[...,3,3] = 1
+	return T
+
 def transformRobotParameter(theta):
 	d = [0.089159,0,0,0.10915,0.09465,0.0823]
 	a = [0,-0.425,-0.39225,0,0,0]
@@ -90,12 +111,16 @@ class InverseKinematicsUR5:
 
 	def setJointWeights(self, weights):
 		# This function will assign weights list for each joint
-		self.joint_weight = np.array(weights)
+		self.joint_weights = np.array(weights)
 
 	def setEERotationOffset(self,r_offset_3x3):
 		# This function will assign rotation offset to the ee. r_offset_3x3 should be a numpy array
 		self.ee_offset[0:3,0:3] = r_offset_3x3
 
+	def setTCPOffset(self,tcp_offset_4x4):
+		# This function will assign the tcp offset from the flange, so that solveIK takes tcp poses as reported by getl
+		self.ee_offset = inverse_matrices(np.asarray(tcp_offset_4x4, dtype=np.float64))
+
 	def setEERotationOffsetROS(self):
 		# This function will assign proper tool orientation offset for ROS ur5's urdf.
 		r_offset_3x3 = np.array( [[ 0, 0, 1],[-1, 0, 0],[ 0,-1, 0]] )
@@ -110,6 +135,12 @@ class InverseKinematicsUR5:
 			normalized += 2* pi
 		return normalized
 
+	def normalizeBatch(self,values):
+		# Batched normalize, the joint limits can be scalars or arrays of the 6 joints
+		values = values - 2 * pi * np.ceil(np.maximum(values - self.limit_max, 0) / (2 * pi))
+		values = values + 2 * pi * np.ceil(np.maximum(self.limit_min - values, 0) / (2 * pi))
+		return values
+
 	def getFlags(self,nominator,denominator):
 		# This function is used to check whether the joint value will be valid or not
 		if denominator == 0:
@@ -306,4 +337,86 @@ class InverseKinematicsUR5:
 				print('Closest IK solution: ', Q[closest_ik_index,:])
 			return Q[closest_ik_index,:]
 		else:
-			return None
\ No newline at end of file
+			return None
+
+	def solveIKBatch(self,forward_kinematics,tolerance=1.01):
+		# This function solves the 8 branches of N target poses at once, see solveIK for a single pose.
+		# forward_kinematics: (N,4,4) poses. Returns Q of shape (N,8,6), the branches in the (i,j,k) order of solveIK,
+		# and valid of shape (N,8), False if a branch has no real solution or is out of the joint limits.
+		# tolerance: acos arguments up to this ratio are clipped to 1 as in solveIK, 1 keeps only the exact solutions.
+		gd = np.asarray(forward_kinematics, dtype=np.float64).reshape((-1,4,4)).dot(self.ee_offset)
+		d, a, alpha = self.d, self.a, self.alpha
+		# joint 1, (N,2)
+		p05 = gd[:,0:3,3] - d[5] * gd[:,0:3,2]
+		psi = np.arctan2(p05[:,1], p05[:,0])
+		L = np.hypot(p05[:,0], p05[:,1])
+		flags1 = abs(d[3]) < tolerance * L
+		phi = np.arccos(d[3] / np.maximum(L, abs(d[3])))
+		theta1 = np.stack((psi + phi + pi/2, psi - phi + pi/2), axis=1)
+
+		# joint 5, (N,2,2), the flags are (N,2)
+		p06 = gd[:,0:3,3]
+		p16z = p06[:,0:1] * np.sin(theta1) - p06[:,1:2] * np.cos(theta1)
+		flags5 = np.abs(p16z - d[3]) < tolerance * d[5]
+		theta5 = np.arccos(np.clip((p16z - d[3]) / d[5], -1, 1))
+		theta5 = np.stack((theta5, -theta5), axis=2)
+
+		# joint 6, (N,2,2)
+		T1 = transformDHParameters(a[0], d[0], alpha[0], theta1)
+		T16 = np.matmul(inverse_matrices(T1), gd[:,np.newaxis])
+		T61 = inverse_matrices(T16)
+		s5 = np.sin(theta5)
+		singular = s5 == 0
+		s5 = np.where(singular, 1, s5)
+		theta6 = np.where(singular, 0, np.arctan2(-T61[:,:,np.newaxis,1,2] / s5, T61[:,:,np.newaxis,0,2] / s5))
+
+		# joints 2 and 3, (N,2,2,2)
+		T45 = transformDHParameters(a[4], d[4], alpha[4], theta5)
+		T56 = transformDHParameters(a[5], d[5], alpha[5], theta6)
+		T14 = np.matmul(T16[:,:,np.newaxis], inverse_matrices(np.matmul(T45, T56)))
+		P13 = T14[...,0:3,3] - d[3] * T14[...,0:3,1]
+		P13_norm = np.linalg.norm(P13, axis=-1)
+		cos3 = (np.sum(P13 * P13, axis=-1) - a[1]**2 - a[2]**2) / (2 * a[1] * a[2])
+		flags3 = np.repeat((np.abs(cos3) < tolerance)[...,np.newaxis], 2, axis=-1)
+		theta3 = np.arccos(np.clip(cos3, -1, 1))
+		theta3 = np.stack((theta3, -theta3), axis=-1)
+		theta2 = -np.arctan2(P13[...,1], -P13[...,0])[...,np.newaxis] + np.arcsin(np.clip(
+			a[2] * np.sin(theta3) / P13_norm[...,np.newaxis], -1, 1))
+
+		# joint 4, (N,2,2,2)
+		T13 = np.matmul(transformDHParameters(a[1], d[1], alpha[1], theta2), transformDHParameters(a[2], d[2], alpha[2], theta3))
+		T34 = np.matmul(inverse_matrices(T13), T14[:,:,:,np.newaxis])
+		theta4 = np.arctan2(T34[...,1,0], T34[...,0,0])
+
+		shape = theta4.shape
+		Q = np.stack((np.broadcast_to(theta1[:,:,np.newaxis,np.newaxis], shape), theta2, theta3, theta4,
+					  np.broadcast_to(theta5[:,:,:,np.newaxis], shape), np.broadcast_to(theta6[:,:,:,np.newaxis], shape)), axis=-1)
+		Q = self.normalizeBatch(Q.reshape((-1,8,6)))
+		valid = (flags1[:,np.newaxis,np.newaxis,np.newaxis] & flags5[:,:,np.newaxis,np.newaxis] & flags3).reshape((-1,8))
+		valid &= np.all((Q >= self.limit_min) & (Q <= self.limit_max), axis=-1) & np.all(np.isfinite(Q), axis=-1)
+		if self.debug:
+			print('Number of solutions: ', np.sum(valid, axis=1))
+		return Q, valid
+
+	def findClosestIKBatch(self,forward_kinematics,current_joint_configuration,max_joint_delta=None,tolerance=1.01):
+		# This function finds the valid branch closest to the current joints for N target poses at once,
+		# current_joint_configuration can also be of shape (N,1,6) to compare every pose to its own joints.
+		# max_joint_delta: optional scalar or array of the 6 joints, the largest motion allowed for a joint, e.g. to
+		# reject the branches that flip the wrist. Returns Q of shape (N,6), nan where there is no solution, and
+		# found of shape (N,).
+		Q, valid = self.solveIKBatch(forward_kinematics, tolerance=tolerance)
+		current_joint = np.asarray(current_joint_configuration, dtype=np.float64)
+		# a joint reaches the same angle one turn further if the limits allow it, take the turn closest to the current joint
+		shifted = Q - 2 * pi * np.round((Q - current_joint) / (2 * pi))
+		Q = np.where((shifted >= self.limit_min) & (shifted <= self.limit_max), shifted, Q)
+		delta_Q = np.absolute(Q - current_joint)
+		if max_joint_delta is not None:
+			valid = valid & np.all(delta_Q <= max_joint_delta, axis=-1)
+		delta_Q_weights = np.where(valid, np.sum(delta_Q * self.joint_weights, axis=-1), np.inf)
+		closest_ik_index = np.argmin(delta_Q_weights, axis=1)
+		found = np.any(valid, axis=1)
+		closest = Q[np.arange(len(Q)), closest_ik_index]
+		closest[~found] = np.nan
+		if self.debug:
+			print('Closest IK solutions: ', closest)
+		return closest, found
@@ -0,0 +1,136 @@
+import os
+import json
+import numpy as np
+from ..transformation.se3 import translations_rotations_2_matrices
+
+_WIDTH_POSE_TABLES = dict()
+
+def width_bounds(grasp_types, min_grasp_width, max_grasp_width):
+    '''
+    **Input:**
+    - grasp_types: dict of the grasp types of a hand, keyed by str(int type).
+    - min_grasp_width, max_grasp_width: float of the width limits of the hand.
+
+    **Output:**
+    - np.array of shape (max_type + 1, 2) of the [min, max] width of every grasp type.
+    '''
+    bounds = np.zeros((max(int(t) for t in grasp_types) + 1, 2), dtype=np.float64)
+    for t, grasp_type in grasp_types.items():
+        min_width, max_width = grasp_type['width']
+        bounds[int(t)] = [max(min_width, min_grasp_width), min(max_width, max_grasp_width)]
+    return bounds
+
+def clip_widths(bounds, types, widths):
+    '''
+    **Input:**
+    - bounds: np.array of shape (max_type + 1, 2) from width_bounds.
+    - types: np.array of shape (-1, ) of the grasp types.
+    - widths: np.array of shape (-1, ) of the widths.
+
+    **Output:**
+    - np.array of shape (-1, ) of the widths clipped to the range of their grasp type.
+    '''
+    types = np.asarray(types).astype(np.int64)
+    return np.minimum(bounds[types, 1], np.maximum(bounds[types, 0], widths))
+
+def width_bins(widths):
+    '''
+    **Input:**
+    - widths: np.array of the widths in meters.
+
+    **Output:**
+    - np.array of int of the 0.1cm bins, the same rounding as str(np.round(width * 100, 1)).
+    '''
+    return np.rint(np.asarray(widths, dtype=np.float64) * 100 * 10).astype(np.int64)
+
+class WidthPoseTable():
+    ''' Dense (grasp type, width bin) -> hand pose table of a width json.
+
+        The json maps grasp type name -> str(np.round(width * 100, 1)) -> {'translation', 'rotation', <angle keys>}.
+        It is parsed once into inv_poses, the inverse of the 4x4 hand offset of every bin, and angles,
+        the flattened joint angles of every bin, both indexed by [int grasp type, width bin].
+    '''
+    def __init__(self, json_path, grasp_types, angle_key):
+        '''
+        **Input:**
+        - json_path: string of the width json path.
+        - grasp_types: dict of the grasp types of the hand, keyed by str(int type).
+        - angle_key: string of the joint angle key of a width entry, e.g. '16d'.
+        '''
+        with open(json_path, 'r', encoding='UTF-8') as f:
+            width_information = json.load(f)
+
+        num_types = max(int(t) for t in grasp_types) + 1
+        num_bins = 1 + max(int(round(float(width) * 10)) for t in grasp_types.values() if t['name'] in width_information
+                           for width in width_information[t['name']])
+        sample = next(iter(next(iter(width_information.values())).values()))
+        angle_dim = np.asarray(sample[angle_key], dtype=np.float64).size
+
+        self.names = [''] * num_types
+        self.valid = np.zeros((num_types, num_bins), dtype=bool)
+        rotations = np.tile(np.eye(3), (num_types, num_bins, 1, 1))
+        translations = np.zeros((num_types, num_bins, 3), dtype=np.float64)
+        self.angles = np.zeros((num_types, num_bins, angle_dim), dtype=np.float64)
+        for t, grasp_type in grasp_types.items():
+            self.names[int(t)] = grasp_type['name']
+            for width, information in width_information.get(grasp_type['name'], dict()).items():
+                b = int(round(float(width) * 10))
+                rotations[int(t), b] = np.asarray(information['rotation'], dtype=np.float64).reshape((3, 3))
+                translations[int(t), b] = np.asarray(information['translation'], dtype=np.float64).reshape(3)
+                self.angles[int(t), b] = np.asarray(information[angle_key], dtype=np.float64).reshape(angle_dim)
+                self.valid[int(t), b] = True
+        # a general inverse, the rotations of the json are rounded and not exactly orthonormal
+        self.inv_poses = np.linalg.inv(translations_rotations_2_matrices(translations, rotations))
+
+    def lookup(self, types, widths):
+        '''
+        **Input:**
+        - types: np.array of shape (-1, ) of the grasp types.
+        - widths: np.array of shape (-1, ) of the widths.
+
+        **Output:**
+        - inv_poses: np.array of shape (-1, 4, 4) of the inverse hand offsets.
+        - angles: np.array of shape (-1, angle_dim) of the joint angles.
+        '''
+        types = np.asarray(types).astype(np.int64).reshape(-1)
+        bins = width_bins(widths).reshape(-1)
+        found = (bins >= 0) & (bins < self.valid.shape[1])
+        found[found] = self.valid[types[found], bins[found]]
+        if not found.all():
+            idx = np.flatnonzero(~found)[0]
+            raise KeyError('no {} entry of width {}'.format(self.names[types[idx]], str(bins[idx] / 10)))
+        return self.inv_poses[types, bins], self.angles[types, bins]
+
+    def transform(self, types, widths, rotations, translations):
+        '''
+        **Input:**
+        - types: np.array of shape (-1, ) of the grasp types.
+        - widths: np.array of shape (-1, ) of the (clipped) widths.
+        - rotations: np.array of shape (-1, 3, 3) of the two-fingers rotations.
+        - translations: np.array of shape (-1, 3) of the two-fingers translations.
+
+        **Output:**
+        - rotations: np.array of shape (-1, 3, 3) of the rotations of the end of the robotic arm.
+        - translations: np.array of shape (-1, 3) of the translations of the end of the robotic arm.
+        - angles: np.array of shape (-1, angle_dim) of the joint angles of the hand.
+        '''
+        inv_poses, angles = self.lookup(types, widths)
+        matrices_two_fingers = translations_rotations_2_matrices(np.asarray(translations, dtype=np.float64).reshape((-1, 3)),
+                                                                 np.asarray(rotations, dtype=np.float64).reshape((-1, 3, 3)))
+        matrices_hand = np.matmul(matrices_two_fingers, inv_poses)
+        return matrices_hand[:, :3, :3], matrices_hand[:, :3, 3], angles
+
+def get_width_pose_table(json_path, grasp_types, angle_key):
+    '''
+    **Input:**
+    - json_path: string of the width json path.
+    - grasp_types: dict of the grasp types of the hand.
+    - angle_key: string of the joint angle key of a width entry.
+
+    **Output:**
+    - WidthPoseTable of the json, built on first use and shared by the whole process.
+    '''
+    key = (os.path.abspath(json_path), angle_key)
+    if key not in _WIDTH_POSE_TABLES:
+        _WIDTH_POSE_TABLES[key] = WidthPoseTable(json_path, grasp_types, angle_key)
+    return _WIDTH_POSE_TABLES[key]
@@ -1,5 +1,6 @@
 import numpy as np
-import cv2
+from .se3 import translations_rotations_2_matrices, rotations_2_rotation_vectors, rotation_vectors_2_rotations, \
+    orthonormalize_rotations
 
 def translation_rotation_2_matrix(translation, rotation):
     '''
@@ -13,7 +14,7 @@ def translation_rotation_2_matrix(translation, rotation):
 
     - Homogeneous transformation matrix of shape (4,4).
     '''
-    return np.vstack((np.hstack((rotation, translation.reshape((3,1)))), np.array((0,0,0,1.0))))
+    return translations_rotations_2_matrices(np.asarray(translation, dtype=np.float64).reshape(3), rotation)
 
 def matrix_2_translation_rotation(matrix):
     '''
@@ -43,8 +44,8 @@ def translation_rotation_2_array(translation, rotation):
 
     - pose array of shape (6,).
     '''
-    rotation_vector = cv2.Rodrigues(rotation)[0].reshape(3)
-    # print(f't:{translation}, r:{rotation_vector}')
+    # as cv2.Rodrigues, of the closest rotation
+    rotation_vector = rotations_2_rotation_vectors(orthonormalize_rotations(np.asarray(rotation, dtype=np.float64)))
     return np.concatenate((translation, rotation_vector))
 
 def pose_array_2_matrix(pose):
@@ -57,10 +58,8 @@ def pose_array_2_matrix(pose):
 
     - Homogeneous transformation matrix of shape (4,4).
     '''
-    pose = pose.astype(np.float32)
-    translation = pose[:3]
-    rotation = cv2.Rodrigues(pose[3:])[0]
-    return translation_rotation_2_matrix(translation, rotation)
+    pose = np.asarray(pose, dtype=np.float64)
+    return translations_rotations_2_matrices(pose[:3], rotation_vectors_2_rotations(pose[3:]))
 
 def pose_matrix_2_array(matrix):
     '''
@@ -74,5 +73,5 @@ def pose_matrix_2_array(matrix):
     '''
     translation = matrix[:3,3].reshape(3)
     rotation_matrix = matrix[:3,:3]
-    rotation_vector = cv2.Rodrigues(rotation_matrix)[0].reshape(3)
+    rotation_vector = rotations_2_rotation_vectors(orthonormalize_rotations(np.asarray(rotation_matrix, dtype=np.float64)))
     return np.concatenate((translation, rotation_vector))
\ No newline at end of file
@@ -0,0 +1,213 @@
+''' Batched rigid transforms.
+
+    Every function takes numpy arrays or torch tensors with any leading batch dimensions and returns the same
+    type, on the same device. Rotation vectors are axis * angle as in cv2.Rodrigues, quaternions are (w, x, y, z).
+'''
+import numpy as np
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+def _is_tensor(x):
+    return torch is not None and torch.is_tensor(x)
+
+def _norm(x):
+    if _is_tensor(x):
+        return torch.linalg.norm(x, dim=-1)
+    return np.linalg.norm(x, axis=-1)
+
+def _cat(arrays):
+    if _is_tensor(arrays[0]):
+        return torch.cat(arrays, dim=-1)
+    return np.concatenate(arrays, axis=-1)
+
+def _stack_matrices(entries, batch_shape):
+    ''' (..., 3, 3) matrices of the 9 row major entries. '''
+    if _is_tensor(entries[0]):
+        return torch.stack(entries, dim=-1).reshape(tuple(batch_shape) + (3, 3))
+    return np.stack(entries, axis=-1).reshape(tuple(batch_shape) + (3, 3))
+
+def translations_rotations_2_matrices(translations, rotations):
+    '''
+    **Input:**
+    - translations: array of shape (..., 3).
+    - rotations: array of shape (..., 3, 3), broadcast against translations.
+
+    **Output:**
+    - array of shape (..., 4, 4) of the homogeneous transformation matrices.
+    '''
+    if _is_tensor(rotations):
+        translations = torch.as_tensor(translations, dtype=rotations.dtype, device=rotations.device)
+        batch_shape = torch.broadcast_shapes(translations.shape[:-1], rotations.shape[:-2])
+        matrices = torch.zeros(batch_shape + (4, 4), dtype=rotations.dtype, device=rotations.device)
+    else:
+        translations, rotations = np.asarray(translations), np.asarray(rotations)
+        batch_shape = np.broadcast_shapes(translations.shape[:-1], rotations.shape[:-2])
+        matrices = np.zeros(batch_shape + (4, 4), dtype=np.result_type(translations, rotations, np.float32))
+    matrices[..., :3, :3] = rotations
+    matrices[..., :3, 3] = translations
+    matrices[..., 3, 3] = 1
+    return matrices
+
+def matrices_2_translations_rotations(matrices):
+    '''
+    **Input:**
+    - matrices: array of shape (..., 4, 4) of homogeneous transformation matrices.
+
+    **Output:**
+    - translations: array of shape (..., 3).
+    - rotations: array of shape (..., 3, 3).
+    '''
+    return matrices[..., :3, 3], matrices[..., :3, :3]
+
+def compose_matrices(*matrices):
+    '''
+    **Input:**
+    - matrices: arrays of shape (..., 4, 4), broadcast against each other.
+
+    **Output:**
+    - array of shape (..., 4, 4) of the product matrices[0] @ matrices[1] @ ..., the last one is applied first.
+    '''
+    composed = matrices[0]
+    for matrix in matrices[1:]:
+        composed = composed @ matrix
+    return composed
+
+def inverse_matrices(matrices):
+    '''
+    **Input:**
+    - matrices: array of shape (..., 4, 4) of rigid transformation matrices.
+
+    **Output:**
+    - array of shape (..., 4, 4) of the inverse transforms, (R^T, -R^T t) instead of a general inverse.
+    '''
+    rotations = matrices[..., :3, :3].swapaxes(-1, -2)
+    translations = -(rotations @ matrices[..., :3, 3:4])[..., 0]
+    return translations_rotations_2_matrices(translations, rotations)
+
+def transform_points(points, matrices):
+    '''
+    **Input:**
+    - points: array of shape (..., N, 3).
+    - matrices: array of shape (..., 4, 4), broadcast against the batch dimensions of points.
+
+    **Output:**
+    - array of shape (..., N, 3) of the transformed points.
+    '''
+    return points @ matrices[..., :3, :3].swapaxes(-1, -2) + matrices[..., np.newaxis, :3, 3]
+
+def rotation_vectors_2_rotations(rotation_vectors):
+    '''
+    **Input:**
+    - rotation_vectors: array of shape (..., 3) of axis * angle.
+
+    **Output:**
+    - array of shape (..., 3, 3) of the rotation matrices, by the Rodrigues formula.
+    '''
+    xp = torch if _is_tensor(rotation_vectors) else np
+    x, y, z = rotation_vectors[..., 0], rotation_vectors[..., 1], rotation_vectors[..., 2]
+    theta2 = x * x + y * y + z * z
+    theta = xp.sqrt(theta2)
+    # sin(theta) / theta and (1 - cos(theta)) / theta^2, by their series near 0
+    small = theta2 < 1e-8
+    safe_theta = xp.where(small, xp.ones_like(theta), theta)
+    a = xp.where(small, 1 - theta2 / 6, xp.sin(safe_theta) / safe_theta)
+    b = xp.where(small, 0.5 - theta2 / 24, (1 - xp.cos(safe_theta)) / (safe_theta * safe_theta))
+    c = 1 - b * theta2
+    return _stack_matrices([c + b * x * x, b * x * y - a * z, b * x * z + a * y,
+                            b * x * y + a * z, c + b * y * y, b * y * z - a * x,
+                            b * x * z - a * y, b * y * z + a * x, c + b * z * z], rotation_vectors.shape[:-1])
+
+def rotations_2_quaternions(rotations):
+    '''
+    **Input:**
+    - rotations: array of shape (..., 3, 3) of rotation matrices.
+
+    **Output:**
+    - array of shape (..., 4) of the unit quaternions (w, x, y, z), with w >= 0.
+    '''
+    xp = torch if _is_tensor(rotations) else np
+    r = [[rotations[..., i, j] for j in range(3)] for i in range(3)]
+    trace = r[0][0] + r[1][1] + r[2][2]
+    # the candidate of the largest of (trace, r00, r11, r22) is the best conditioned one
+    candidates = [xp.stack([1 + trace, r[2][1] - r[1][2], r[0][2] - r[2][0], r[1][0] - r[0][1]], -1),
+                  xp.stack([r[2][1] - r[1][2], 1 + r[0][0] - r[1][1] - r[2][2], r[0][1] + r[1][0], r[0][2] + r[2][0]], -1),
+                  xp.stack([r[0][2] - r[2][0], r[0][1] + r[1][0], 1 - r[0][0] + r[1][1] - r[2][2], r[1][2] + r[2][1]], -1),
+                  xp.stack([r[1][0] - r[0][1], r[0][2] + r[2][0], r[1][2] + r[2][1], 1 - r[0][0] - r[1][1] + r[2][2]], -1)]
+    best = xp.stack([trace, r[0][0], r[1][1], r[2][2]], -1).argmax(-1)[..., np.newaxis]
+    quaternions = xp.where(best == 0, candidates[0], xp.where(best == 1, candidates[1],
+                                                              xp.where(best == 2, candidates[2], candidates[3])))
+    quaternions = quaternions / _norm(quaternions)[..., np.newaxis]
+    return xp.where(quaternions[..., :1] < 0, -quaternions, quaternions)
+
+def quaternions_2_rotations(quaternions):
+    '''
+    **Input:**
+    - quaternions: array of shape (..., 4) of quaternions (w, x, y, z), normalized here.
+
+    **Output:**
+    - array of shape (..., 3, 3) of the rotation matrices.
+    '''
+    quaternions = quaternions / _norm(quaternions)[..., np.newaxis]
+    w, x, y, z = quaternions[..., 0], quaternions[..., 1], quaternions[..., 2], quaternions[..., 3]
+    return _stack_matrices([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+                            2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+                            2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], quaternions.shape[:-1])
+
+def rotations_2_rotation_vectors(rotations):
+    '''
+    **Input:**
+    - rotations: array of shape (..., 3, 3) of rotation matrices.
+
+    **Output:**
+    - array of shape (..., 3) of axis * angle, with the angle in [0, pi].
+    '''
+    xp = torch if _is_tensor(rotations) else np
+    quaternions = rotations_2_quaternions(rotations)
+    w, v = quaternions[..., 0], quaternions[..., 1:]
+    s = _norm(v)
+    # angle / sin(angle / 2), 2 / w near the identity
+    small = s < 1e-8
+    safe_s = xp.where(small, xp.ones_like(s), s)
+    scale = xp.where(small, 2 / w, 2 * xp.arctan2(s, w) / safe_s)
+    return v * scale[..., np.newaxis]
+
+def orthonormalize_rotations(rotations):
+    '''
+    **Input:**
+    - rotations: array of shape (..., 3, 3) of nearly orthonormal rotation matrices.
+
+    **Output:**
+    - array of shape (..., 3, 3) of the closest rotation matrices in the Frobenius norm, by SVD as cv2.Rodrigues.
+    '''
+    if _is_tensor(rotations):
+        u, _, vt = torch.linalg.svd(rotations)
+        det = torch.linalg.det(torch.matmul(u, vt))
+    else:
+        u, _, vt = np.linalg.svd(rotations)
+        det = np.linalg.det(np.matmul(u, vt))
+    # flip the last singular direction of the reflections
+    u = _cat([u[..., :2], u[..., 2:] * det[..., np.newaxis, np.newaxis]])
+    return u @ vt
+
+def pose_arrays_2_matrices(poses):
+    '''
+    **Input:**
+    - poses: array of shape (..., 6) of the translations and rotation vectors.
+
+    **Output:**
+    - array of shape (..., 4, 4) of the homogeneous transformation matrices.
+    '''
+    return translations_rotations_2_matrices(poses[..., :3], rotation_vectors_2_rotations(poses[..., 3:]))
+
+def matrices_2_pose_arrays(matrices):
+    '''
+    **Input:**
+    - matrices: array of shape (..., 4, 4) of homogeneous transformation matrices.
+
+    **Output:**
+    - array of shape (..., 6) of the translations and rotation vectors.
+    '''
+    return _cat([matrices[..., :3, 3], rotations_2_rotation_vectors(matrices[..., :3, :3])])
@@ -1,194 +1,355 @@
-__version__ = '1.0'
-
-import copy
-import math
-import numpy as np
-import open3d as o3d
-
-from graspnetAPI import GraspGroup
-
-class CollisionType:
-    NONE    = 0B00000000
-    SELF    = 0B00000001
-    OTHERS  = 0B00000010
-    TABLE   = 0B00000100
-    BOX     = 0B00001000
-    ANY     = 0B11111111
-    
-class ModelFreeCollisionDetectorMultifinger():
-    def __init__(self, scene_points, voxel_size=0.001):
-        ''' Init function. Current finger width and length are fixed.
-            Input:
-                scene_points: [numpy.ndarray, (N,3), numpy.float32]
-                        the scene points to detect
-                voxel_size: [float]
-                        used for downsample
-        '''
-        self.finger_width = 0.02
-        self.finger_length = 0.06
-        self.voxel_size = voxel_size
-        scene_cloud = o3d.geometry.PointCloud()
-        scene_cloud.points = o3d.utility.Vector3dVector(scene_points)
-        self.scene_cloud = scene_cloud
-        self.scene_points = np.array(scene_cloud.points, dtype=np.float32)
-
-    def _adjust_gripper_centers(self, grasp_group, targets, heights, depths, widths):
-        targets = np.array(targets, dtype=np.float32)
-        ## get point masks
-        # height mask
-        mask1 = ((targets[:, :, 2] > -heights / 2) & (targets[:, :, 2] < heights / 2))
-        # left finger mask
-        mask2 = ((targets[:, :, 0] > depths - self.finger_length) & (targets[:, :, 0] < depths))
-        mask4 = (targets[:, :, 1] < -widths / 2)
-        # right finger mask
-        mask6 = (targets[:, :, 1] > widths / 2)
-        # get inner mask of each point
-        inner_mask = (mask1 & mask2 & (~mask4) & (~mask6))
-
-        ## adjust targets and gripper centers
-        # get point bounds
-        targets_y = targets[:, :, 1].copy()
-        targets_y[~inner_mask] = 0
-        ymin = targets_y.min(axis=1)
-        ymax = targets_y.max(axis=1)
-        # get offsets
-        offsets = np.zeros([targets.shape[0], 3], dtype=targets.dtype)
-        offsets[:, 1] = (ymin + ymax) / 2
-        # adjust targets
-        targets[:, :, 1] -= offsets[:, np.newaxis, 1]
-        # adjust gripper centers
-        R = grasp_group.rotation_matrices
-        grasp_group.widths = np.maximum(0.025 * np.ones(ymax.shape), 1.7 * (ymax - ymin))
-        grasp_group.translations += np.matmul(R, offsets[:, :, np.newaxis]).squeeze(2)
-        return grasp_group, targets
-
-    def normalize(self, x):
-        return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
-
-    def load_meshes_pcls(self, meshes_pcls, two_fingers_ggarray, multifinger_ggarray):
-        multifinger_pcls = []
-        for id, multifinger_grasp in enumerate(multifinger_ggarray):
-            grasp_type = multifinger_grasp.get_grasp_type_with_finger_name()
-            width = multifinger_grasp.width
-            width = str(round(width * 100, 1))
-            key = grasp_type + '_' + width
-
-            translation = multifinger_grasp.translation.reshape(3, 1)
-            rotation = multifinger_grasp.rotation_matrix.reshape(3, 3)
-            depth = multifinger_grasp.depth
-
-            t = two_fingers_ggarray.translations[id].reshape(3, 1)
-            r = two_fingers_ggarray.rotation_matrices[id].reshape(3, 3)
-
-            transform_mat_two_fingers = np.vstack((np.hstack((r, t)), np.array([0, 0, 0, 1])))
-
-            grasp_direction = np.dot(transform_mat_two_fingers, np.array([[0.01], [0], [0], [1]]))[:3]
-            grasp_direction = np.array(grasp_direction).reshape(3)
-            grasp_direction = grasp_direction - two_fingers_ggarray.translations[id].reshape((3))
-            grasp_direction = self.normalize(grasp_direction)
-            grasp_depth = np.array([[1, 0, 0, grasp_direction[0] * depth],
-                                    [0, 1, 0, grasp_direction[1] * depth],
-                                    [0, 0, 1, grasp_direction[2] * depth],
-                                    [0, 0, 0, 1]], dtype=np.float32)
-
-            transform_mat = np.vstack((np.hstack((rotation, translation)), np.array([0, 0, 0, 1])))
-            source_mesh_pointclouds = copy.deepcopy(meshes_pcls[key])
-            source_mesh_pointclouds.transform(transform_mat)
-            source_mesh_pointclouds.transform(grasp_depth)
-            multifinger_pcls.append(source_mesh_pointclouds)
-        return multifinger_pcls
-
-    def detect(self, multifinger_ggarray, two_fingers_ggarray, path_mesh_json, meshes_pcls, min_grasp_width=0.05, VoxelGrid=0.03, approach_dist=0.04, collision_thresh=10,
-               adjust_gripper_centers=False, DEBUG=False):
-        ''' Detect collision of grasps.
-            Input:
-                multifinger_ggarray(class multifingerGraspGroup()): [multifinger_ggarray, M grasps]
-                        the grasps to check
-                two_fingers_ggarray(class graspnetAPI.GraspGroup): [GraspGroup, M grasps]
-                approach_dist: [float]
-                        the distance for a gripper to move along approaching direction before grasping
-                        this shifting space requires no point either
-                collision_thresh: [float]
-                        if global collision iou is greater than this threshold,
-                        a collision is detected
-                adjust_gripper_centers: [bool]
-                        if True, add an offset to grasp which makes grasp point closer to object center
-            Output:
-                empty_mask: [numpy.ndarray, (M,), numpy.bool]
-                        True implies empty grasp
-                        only returned when [return_empty_grasp] is True
-        '''
-
-        T = two_fingers_ggarray.translations
-        R = two_fingers_ggarray.rotation_matrices
-        heights = two_fingers_ggarray.heights[:, np.newaxis]
-        depths = two_fingers_ggarray.depths[:, np.newaxis]
-        widths = two_fingers_ggarray.widths[:, np.newaxis]
-        targets = self.scene_points[np.newaxis, :, :] - T[:, np.newaxis, :]
-        targets = np.matmul(targets, R)
-
-        ## adjust gripper centers
-        if adjust_gripper_centers:
-            two_fingers_ggarray, targets = self._adjust_gripper_centers(two_fingers_ggarray, targets, heights, depths,
-                                                                        widths)
-        two_fingers_ggarray.widths = two_fingers_ggarray.widths * 1.7
-        min_width_index = two_fingers_ggarray.widths > min_grasp_width
-        multifinger_ggarray = multifinger_ggarray[two_fingers_ggarray.widths > min_grasp_width]
-        two_fingers_ggarray = two_fingers_ggarray[two_fingers_ggarray.widths > min_grasp_width]
-
-        if len(multifinger_ggarray) == 0:
-            print('min_grasp_width filter 0 ')
-            return multifinger_ggarray, two_fingers_ggarray, [], min_width_index
-        multifinger_ggarray.graspgroupTR_2_TR(two_fingers_ggarray, path_mesh_json)
-
-        meshes_pointclouds_multifinger = self.load_meshes_pcls(meshes_pcls, two_fingers_ggarray, multifinger_ggarray)
-        collision_mask = []
-        empty_mask = []
-
-        ps = self.scene_cloud.points
-        ps = o3d.utility.Vector3dVector(ps)
-        st = time.time()
-        for idx, grasp in enumerate(multifinger_ggarray):
-            meshes_pointclouds = meshes_pointclouds_multifinger[idx]
-            grasp_direction = two_fingers_ggarray.rotation_matrices[idx].reshape(3, 3)[:3,0]
-            for i in range(2, int(approach_dist * 100)+1, 3):
-                meshes_pointclouds_cache = copy.deepcopy(meshes_pointclouds)
-                back_distince = [[1, 0, 0, -grasp_direction[0] * i * 0.01],
-                                    [0, 1, 0, -grasp_direction[1] * i * 0.01],
-                                    [0, 0, 1, -grasp_direction[2] * i * 0.01],
-                                    [0, 0, 0, 1]]
-                meshes_pointclouds_cache.transform(np.array(back_distince, dtype=np.float32)).paint_uniform_color([0, 1, 0])
-                meshes_pointclouds = meshes_pointclouds + meshes_pointclouds_cache
-            st3 = time.time()
-            meshes_pointclouds = meshes_pointclouds.voxel_down_sample(VoxelGrid)
-
-            voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=meshes_pointclouds, voxel_size=VoxelGrid)
-            output = voxel_grid.check_if_included(ps)
-
-            if DEBUG:
-                print('transformed mesh')
-                FOR_base = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.1, origin=[0, 0, 0])
-                o3d.visualization.draw_geometries(
-                    [self.scene_cloud, meshes_pointclouds, FOR_base, two_fingers_ggarray[int(idx)].to_open3d_geometry()])
-
-            if np.array(output).astype(int).sum() > collision_thresh:
-                empty_mask.append(False)
-                collision_mask.append(output)
-                if DEBUG:
-                    print("collision")
-                    collision_point_cloud = o3d.geometry.PointCloud()
-                    collision_point_cloud.points = o3d.utility.Vector3dVector(
-                        np.array(self.scene_cloud.points)[np.array(output)])
-                    collision_point_cloud.paint_uniform_color([1, 0, 0])
-                    normal_point_cloud = o3d.geometry.PointCloud()
-                    normal_point_cloud.points = o3d.utility.Vector3dVector(
-                        np.array(self.scene_cloud.points)[~(np.array(output))])
-                    normal_point_cloud.paint_uniform_color([0, 0, 1])
-                    o3d.visualization.draw_geometries([normal_point_cloud, collision_point_cloud, FOR_base, two_fingers_ggarray[int(idx)].to_open3d_geometry()])
-            else:
-                empty_mask.append(True)
-                collision_mask.append(output)
-                
-        collision_mask = np.array(collision_mask)
-        empty_mask = np.array(empty_mask)
-        return multifinger_ggarray, two_fingers_ggarray, empty_mask, min_width_index
+__version__ = '1.0'
+
+import copy
+import math
+import numpy as np
+import open3d as o3d
+import torch
+
+from graspnetAPI import GraspGroup
+from grasp_trace import span
+
+class CollisionType:
+    NONE    = 0B00000000
+    SELF    = 0B00000001
+    OTHERS  = 0B00000010
+    TABLE   = 0B00000100
+    BOX     = 0B00001000
+    ANY     = 0B11111111
+
+def template_points(template):
+    ''' (K,3) points of a hand template given as open3d.geometry.PointCloud or numpy.ndarray. '''
+    return np.asarray(getattr(template, 'points', template), dtype=np.float64).reshape(-1, 3)
+
+class VoxelCollisionEngine():
+    ''' Batched collision checker between swept hand templates and the scene.
+
+        The scene is hashed once into a sorted table of voxel keys. The hand template points of
+        all grasps and all approach offsets are transformed together, voxelized with the rules of
+        open3d voxel_down_sample + VoxelGrid.create_from_point_cloud, and every occupied hand voxel
+        is matched against the scene table. The counts equal the number of scene points reported
+        by VoxelGrid.check_if_included in the per-grasp open3d loop.
+    '''
+    HAND_BITS = 16
+    SCENE_BITS = 16
+
+    def __init__(self, scene_points, meshes_pcls, device=None, num_threads=None, batch_size=64):
+        ''' Init function.
+            Input:
+                scene_points: [numpy.ndarray, (N,3)]
+                        the scene points to detect
+                meshes_pcls: [dict or HandTemplateStore]
+                        hand template point clouds keyed by '<grasp type name>_<width in cm>',
+                        values are open3d.geometry.PointCloud or numpy.ndarray of shape (K,3)
+                device: [torch.device]
+                        cuda:0 if available and cpu otherwise when not given
+                num_threads: [int]
+                        number of threads used by torch when running on cpu
+                batch_size: [int]
+                        number of grasps processed together, bounds the memory usage
+        '''
+        if device is None:
+            device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.device = torch.device(device)
+        if num_threads is not None and self.device.type == 'cpu':
+            torch.set_num_threads(num_threads)
+        self.batch_size = batch_size
+        self.scene_points = torch.as_tensor(np.asarray(scene_points, dtype=np.float64).reshape(-1, 3), device=self.device)
+        self.meshes_pcls = meshes_pcls
+        self._scene_tables = dict()
+        neighbors = torch.arange(2, device=self.device)
+        self._neighbors = torch.stack(torch.meshgrid(neighbors, neighbors, neighbors, indexing='ij'), dim=-1).view(-1, 3)
+
+    @staticmethod
+    def approach_offsets(approach_dist):
+        ''' Distances the hand is shifted back along the approaching direction.
+            The per-grasp loop adds a shifted copy of the accumulated cloud at every step,
+            so the swept cloud holds one copy for every subset of the steps.
+        '''
+        offsets = np.zeros(1)
+        for i in range(2, int(approach_dist * 100)+1, 3):
+            offsets = np.concatenate([offsets, offsets + i * 0.01])
+        return offsets
+
+    @staticmethod
+    def _pack(cells, bits, prefix=None):
+        keys = (cells[:, 0] << (2 * bits)) | (cells[:, 1] << bits) | cells[:, 2]
+        if prefix is not None:
+            keys = keys | (prefix << (3 * bits))
+        return keys
+
+    @staticmethod
+    def _unpack(keys, bits):
+        mask = (1 << bits) - 1
+        return torch.stack([(keys >> (2 * bits)) & mask, (keys >> bits) & mask, keys & mask], dim=1)
+
+    @staticmethod
+    def _ranges(begins, lengths):
+        ''' Concatenation of arange(begin, begin + length) for every range. '''
+        total = int(lengths.sum())
+        ends = torch.cumsum(lengths, dim=0)
+        return torch.arange(total, device=lengths.device) + torch.repeat_interleave(begins - ends + lengths, lengths)
+
+    @staticmethod
+    def _segment_min(points, ids, num_segments):
+        mins = points.new_full((num_segments, 3), float('inf'))
+        return mins.scatter_reduce(0, ids.unsqueeze(1).expand(-1, 3), points, reduce='amin', include_self=True)
+
+    def _get_template_bank(self, keys):
+        # only the templates used by the grasps are gathered and moved to the device
+        keys = list(dict.fromkeys(keys))
+        points = [template_points(self.meshes_pcls[key]) for key in keys]
+        lengths = np.array([len(p) for p in points], dtype=np.int64)
+        bank = torch.as_tensor(np.concatenate(points, axis=0), dtype=torch.float64, device=self.device)
+        return ({key: idx for idx, key in enumerate(keys)}, bank,
+                torch.as_tensor(np.cumsum(lengths) - lengths, device=self.device), torch.as_tensor(lengths, device=self.device))
+
+    def _get_scene_table(self, voxel_size):
+        if voxel_size not in self._scene_tables:
+            origin = self.scene_points.min(dim=0).values
+            cells = torch.floor((self.scene_points - origin) / (2 * voxel_size)).long()
+            keys, order = torch.sort(self._pack(cells, self.SCENE_BITS))
+            self._scene_tables[voxel_size] = (origin, keys, self.scene_points[order])
+        return self._scene_tables[voxel_size]
+
+    def count(self, transforms, directions, keys, voxel_size, approach_dist):
+        ''' Count the scene points inside the swept hand voxel grid of every grasp.
+            Input:
+                transforms: [numpy.ndarray, (M,4,4)]
+                        the pose of the hand template of each grasp
+                directions: [numpy.ndarray, (M,3)]
+                        the approaching direction of each grasp
+                keys: [list of str]
+                        the hand template key of each grasp
+                voxel_size: [float]
+                        the voxel size of the hand voxel grid
+                approach_dist: [float]
+                        the distance for a gripper to move along approaching direction before grasping
+            Output:
+                collision_counts: [numpy.ndarray, (M,), numpy.int64]
+        '''
+        num_grasps = len(keys)
+        if num_grasps == 0 or len(self.scene_points) == 0:
+            return np.zeros(num_grasps, dtype=np.int64)
+        key_index, bank, starts, lengths = self._get_template_bank(keys)
+        template_ids = torch.as_tensor([key_index[key] for key in keys], dtype=torch.long, device=self.device)
+        transforms = torch.as_tensor(np.asarray(transforms, dtype=np.float64), device=self.device)
+        directions = torch.as_tensor(np.asarray(directions, dtype=np.float64), device=self.device)
+        offsets = torch.as_tensor(self.approach_offsets(approach_dist), device=self.device)
+        scene_table = self._get_scene_table(voxel_size)
+
+        collision_counts = torch.zeros(num_grasps, dtype=torch.long, device=self.device)
+        for begin in range(0, num_grasps, self.batch_size):
+            end = min(begin + self.batch_size, num_grasps)
+            ids = template_ids[begin:end]
+            points, grasp_ids = self._swept_points(bank[self._ranges(starts[ids], lengths[ids])],
+                                                   torch.repeat_interleave(torch.arange(end - begin, device=self.device), lengths[ids]),
+                                                   transforms[begin:end], directions[begin:end], offsets)
+            origins, voxel_keys = self._voxelize(points, grasp_ids, end - begin, voxel_size)
+            collision_counts[begin:end] = self._count_included(origins, voxel_keys, end - begin, voxel_size, scene_table)
+        return collision_counts.cpu().numpy()
+
+    def _swept_points(self, points, grasp_ids, transforms, directions, offsets):
+        points = torch.einsum('pij,pj->pi', transforms[grasp_ids, :3, :3], points) + transforms[grasp_ids, :3, 3]
+        points = points.unsqueeze(0) - offsets.view(-1, 1, 1) * directions[grasp_ids].unsqueeze(0)
+        return points.view(-1, 3), grasp_ids.repeat(len(offsets))
+
+    def _voxelize(self, points, grasp_ids, num_grasps, voxel_size):
+        # voxel_down_sample: mean of the points in each voxel
+        min_bounds = self._segment_min(points, grasp_ids, num_grasps) - voxel_size / 2
+        cells = torch.floor((points - min_bounds[grasp_ids]) / voxel_size).long()
+        keys, inverse, counts = torch.unique(self._pack(cells, self.HAND_BITS, grasp_ids), return_inverse=True, return_counts=True)
+        centers = points.new_zeros((len(keys), 3)).index_add_(0, inverse, points) / counts.unsqueeze(1)
+        center_grasp_ids = keys >> (3 * self.HAND_BITS)
+        # VoxelGrid.create_from_point_cloud on the downsampled points
+        origins = self._segment_min(centers, center_grasp_ids, num_grasps) - voxel_size / 2
+        cells = torch.floor((centers - origins[center_grasp_ids]) / voxel_size).long()
+        return origins, torch.unique(self._pack(cells, self.HAND_BITS, center_grasp_ids))
+
+    def _count_included(self, origins, voxel_keys, num_grasps, voxel_size, scene_table):
+        # scene cells are twice the voxel size, so a hand voxel overlaps at most 2x2x2 of them
+        scene_origin, scene_keys, scene_points = scene_table
+        voxels = self._unpack(voxel_keys, self.HAND_BITS)
+        voxel_grasp_ids = voxel_keys >> (3 * self.HAND_BITS)
+        corners = (origins[voxel_grasp_ids] + voxels.double() * voxel_size - scene_origin) / (2 * voxel_size)
+        cells = torch.floor(corners - 1e-6).long() + 1
+        valid = ((cells >= 0) & (cells < (1 << self.SCENE_BITS) - 1)).all(dim=1)
+        cell_keys = torch.unique(self._pack(cells[valid], self.SCENE_BITS, voxel_grasp_ids[valid]))
+        grasp_ids = cell_keys >> (3 * self.SCENE_BITS)
+        cells = self._unpack(cell_keys, self.SCENE_BITS) - 1
+        cells = (cells.unsqueeze(1) + self._neighbors.unsqueeze(0)).view(-1, 3)
+        grasp_ids = grasp_ids.repeat_interleave(len(self._neighbors))
+        valid = ((cells >= 0) & (cells < (1 << self.SCENE_BITS))).all(dim=1)
+        cell_keys = torch.unique(self._pack(cells[valid], self.SCENE_BITS, grasp_ids[valid]))
+        grasp_ids = cell_keys >> (3 * self.SCENE_BITS)
+        cell_keys = cell_keys & ((1 << (3 * self.SCENE_BITS)) - 1)
+        begins = torch.searchsorted(scene_keys, cell_keys)
+        lengths = torch.searchsorted(scene_keys, cell_keys, right=True) - begins
+        grasp_ids = torch.repeat_interleave(grasp_ids, lengths)
+        # VoxelGrid.check_if_included on the scene points near the hand
+        scene_cells = torch.floor((scene_points[self._ranges(begins, lengths)] - origins[grasp_ids]) / voxel_size).long()
+        valid = ((scene_cells >= 0) & (scene_cells < (1 << self.HAND_BITS))).all(dim=1)
+        grasp_ids = grasp_ids[valid]
+        query_keys = self._pack(scene_cells[valid], self.HAND_BITS, grasp_ids)
+        index = torch.searchsorted(voxel_keys, query_keys).clamp(max=len(voxel_keys) - 1)
+        included = (voxel_keys[index] == query_keys)
+        return torch.bincount(grasp_ids[included], minlength=num_grasps)
+
+
+class ModelFreeCollisionDetectorMultifinger():
+    def __init__(self, scene_points, voxel_size=0.001):
+        ''' Init function. Current finger width and length are fixed.
+            Input:
+                scene_points: [numpy.ndarray, (N,3), numpy.float32]
+                        the scene points to detect
+                voxel_size: [float]
+                        used for downsample
+        '''
+        self.finger_width = 0.02
+        self.finger_length = 0.06
+        self.voxel_size = voxel_size
+        scene_cloud = o3d.geometry.PointCloud()
+        scene_cloud.points = o3d.utility.Vector3dVector(scene_points)
+        self.scene_cloud = scene_cloud
+        self.scene_points = np.array(scene_cloud.points, dtype=np.float32)
+
+    def _adjust_gripper_centers(self, grasp_group, targets, heights, depths, widths):
+        targets = np.array(targets, dtype=np.float32)
+        ## get point masks
+        # height mask
+        mask1 = ((targets[:, :, 2] > -heights / 2) & (targets[:, :, 2] < heights / 2))
+        # left finger mask
+        mask2 = ((targets[:, :, 0] > depths - self.finger_length) & (targets[:, :, 0] < depths))
+        mask4 = (targets[:, :, 1] < -widths / 2)
+        # right finger mask
+        mask6 = (targets[:, :, 1] > widths / 2)
+        # get inner mask of each point
+        inner_mask = (mask1 & mask2 & (~mask4) & (~mask6))
+
+        ## adjust targets and gripper centers
+        # get point bounds
+        targets_y = targets[:, :, 1].copy()
+        targets_y[~inner_mask] = 0
+        ymin = targets_y.min(axis=1)
+        ymax = targets_y.max(axis=1)
+        # get offsets
+        offsets = np.zeros([targets.shape[0], 3], dtype=targets.dtype)
+        offsets[:, 1] = (ymin + ymax) / 2
+        # adjust targets
+        targets[:, :, 1] -= offsets[:, np.newaxis, 1]
+        # adjust gripper centers
+        R = grasp_group.rotation_matrices
+        grasp_group.widths = np.maximum(0.025 * np.ones(ymax.shape), 1.7 * (ymax - ymin))
+        grasp_group.translations += np.matmul(R, offsets[:, :, np.newaxis]).squeeze(2)
+        return grasp_group, targets
+
+    def normalize(self, x):
+        return np.array([x[0], x[1], x[2]]) / math.sqrt(np.power(x[0], 2) + np.power(x[1], 2) + np.power(x[2], 2))
+
+    def get_hand_transforms(self, two_fingers_ggarray, multifinger_ggarray):
+        ''' Hand template poses of the grasps.
+            Output:
+                transforms: [numpy.ndarray, (M,4,4)]
+                        the multifinger pose moved forward by the grasp depth along the approaching direction
+                directions: [numpy.ndarray, (M,3)]
+                        the approaching directions
+                keys: [list of str]
+                        the hand template keys
+        '''
+        directions = two_fingers_ggarray.rotation_matrices[:, :, 0]
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        transforms = multifinger_ggarray.get_hand_poses(two_fingers_ggarray)
+        keys = [grasp_type + '_' + str(round(float(width) * 100, 1)) for grasp_type, width in
+                zip(multifinger_ggarray.get_graspgroup_types_with_finger_names(), multifinger_ggarray.widths)]
+        return transforms, directions, keys
+
+    def load_meshes_pcls(self, meshes_pcls, two_fingers_ggarray, multifinger_ggarray):
+        transforms, _, keys = self.get_hand_transforms(two_fingers_ggarray, multifinger_ggarray)
+        multifinger_pcls = []
+        for key, transform_mat in zip(keys, transforms):
+            source_mesh_pointclouds = o3d.geometry.PointCloud()
+            source_mesh_pointclouds.points = o3d.utility.Vector3dVector(template_points(meshes_pcls[key]))
+            source_mesh_pointclouds.transform(transform_mat)
+            multifinger_pcls.append(source_mesh_pointclouds)
+        return multifinger_pcls
+
+    def detect(self, multifinger_ggarray, two_fingers_ggarray, path_mesh_json, meshes_pcls, min_grasp_width=0.05, VoxelGrid=0.03, approach_dist=0.04, collision_thresh=10,
+               adjust_gripper_centers=False, DEBUG=False, device=None, num_threads=None):
+        ''' Detect collision of grasps.
+            Input:
+                multifinger_ggarray(class multifingerGraspGroup()): [multifinger_ggarray, M grasps]
+                        the grasps to check
+                two_fingers_ggarray(class graspnetAPI.GraspGroup): [GraspGroup, M grasps]
+                approach_dist: [float]
+                        the distance for a gripper to move along approaching direction before grasping
+                        this shifting space requires no point either
+                collision_thresh: [float]
+                        if global collision iou is greater than this threshold,
+                        a collision is detected
+                adjust_gripper_centers: [bool]
+                        if True, add an offset to grasp which makes grasp point closer to object center
+                device: [torch.device]
+                        device of the collision engine, cuda:0 if available and cpu otherwise when not given
+                num_threads: [int]
+                        number of threads used by the collision engine on cpu
+            Output:
+                empty_mask: [numpy.ndarray, (M,), numpy.bool]
+                        True implies empty grasp
+                        only returned when [return_empty_grasp] is True
+            The number of scene points colliding with each remaining grasp is kept in self.collision_counts.
+        '''
+
+        with span('collision_adjust'):
+            T = two_fingers_ggarray.translations
+            R = two_fingers_ggarray.rotation_matrices
+            heights = two_fingers_ggarray.heights[:, np.newaxis]
+            depths = two_fingers_ggarray.depths[:, np.newaxis]
+            widths = two_fingers_ggarray.widths[:, np.newaxis]
+            targets = self.scene_points[np.newaxis, :, :] - T[:, np.newaxis, :]
+            targets = np.matmul(targets, R)
+
+            ## adjust gripper centers
+            if adjust_gripper_centers:
+                two_fingers_ggarray, targets = self._adjust_gripper_centers(two_fingers_ggarray, targets, heights, depths,
+                                                                            widths)
+        two_fingers_ggarray.widths = two_fingers_ggarray.widths * 1.7
+        min_width_index = two_fingers_ggarray.widths > min_grasp_width
+        multifinger_ggarray = multifinger_ggarray[two_fingers_ggarray.widths > min_grasp_width]
+        two_fingers_ggarray = two_fingers_ggarray[two_fingers_ggarray.widths > min_grasp_width]
+
+        if len(multifinger_ggarray) == 0:
+            print('min_grasp_width filter 0 ')
+            return multifinger_ggarray, two_fingers_ggarray, [], min_width_index
+        with span('collision_templates'):
+            multifinger_ggarray.graspgroupTR_2_TR(two_fingers_ggarray, path_mesh_json)
+            transforms, directions, keys = self.get_hand_transforms(two_fingers_ggarray, multifinger_ggarray)
+        with span('collision_count'):
+            engine = VoxelCollisionEngine(self.scene_points, meshes_pcls, device=device, num_threads=num_threads)
+            self.collision_counts = engine.count(transforms, directions, keys, VoxelGrid, approach_dist)
+        empty_mask = (self.collision_counts <= collision_thresh)
+
+        if DEBUG:
+            meshes_pointclouds_multifinger = self.load_meshes_pcls(meshes_pcls, two_fingers_ggarray, multifinger_ggarray)
+            FOR_base = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.1, origin=[0, 0, 0])
+            for idx in range(len(multifinger_ggarray)):
+                meshes_pointclouds = meshes_pointclouds_multifinger[idx]
+                for offset in VoxelCollisionEngine.approach_offsets(approach_dist)[1:]:
+                    meshes_pointclouds_cache = copy.deepcopy(meshes_pointclouds_multifinger[idx])
+                    meshes_pointclouds_cache.translate(-directions[idx] * offset).paint_uniform_color([0, 1, 0])
+                    meshes_pointclouds = meshes_pointclouds + meshes_pointclouds_cache
+                meshes_pointclouds = meshes_pointclouds.voxel_down_sample(VoxelGrid)
+                print('transformed mesh, collision points: ', self.collision_counts[idx])
+                o3d.visualization.draw_geometries(
+                    [self.scene_cloud, meshes_pointclouds, FOR_base, two_fingers_ggarray[int(idx)].to_open3d_geometry()])
+                if not empty_mask[idx]:
+                    print("collision")
+                    voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(input=meshes_pointclouds, voxel_size=VoxelGrid)
+                    output = np.array(voxel_grid.check_if_included(self.scene_cloud.points))
+                    collision_point_cloud = o3d.geometry.PointCloud()
+                    collision_point_cloud.points = o3d.utility.Vector3dVector(self.scene_points[output])
+                    collision_point_cloud.paint_uniform_color([1, 0, 0])
+                    normal_point_cloud = o3d.geometry.PointCloud()
+                    normal_point_cloud.points = o3d.utility.Vector3dVector(self.scene_points[~output])
+                    normal_point_cloud.paint_uniform_color([0, 0, 1])
+                    o3d.visualization.draw_geometries([normal_point_cloud, collision_point_cloud, FOR_base, two_fingers_ggarray[int(idx)].to_open3d_geometry()])
+        return multifinger_ggarray, two_fingers_ggarray, empty_mask, min_width_index
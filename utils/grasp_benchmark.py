@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import platform
+from collections import OrderedDict
+import numpy as np
+import torch
+
+_BENCHMARKS = OrderedDict()
+
+class SkipBenchmark(Exception):
+    ''' Raised by the setup of a benchmark that cannot run here, e.g. a missing optional dependency. '''
+    pass
+
+def register(name, params=None):
+    '''
+    Decorator registering a benchmark setup(cfgs[, param]) -> callable, only the callable is timed.
+
+    **Input:**
+    - name: string of the benchmark.
+    - params: optional list of parameters, one benchmark 'name[param]' is registered for each of them.
+    '''
+    def decorator(setup):
+        if params is None:
+            _BENCHMARKS[name] = setup
+        else:
+            for param in params:
+                _BENCHMARKS['{}[{}]'.format(name, param)] = (lambda cfgs, param=param: setup(cfgs, param))
+        return setup
+    return decorator
+
+def get_benchmarks(patterns=None):
+    '''
+    **Input:**
+    - patterns: optional list of substrings, a benchmark is kept if its name holds one of them.
+
+    **Output:**
+    - OrderedDict of the name -> setup of the registered benchmarks, in registration order.
+    '''
+    if not patterns:
+        return OrderedDict(_BENCHMARKS)
+    return OrderedDict((name, setup) for name, setup in _BENCHMARKS.items() if any(p in name for p in patterns))
+
+def require(module_name):
+    ''' Import module_name, or skip the benchmark if it is not installed. '''
+    try:
+        return __import__(module_name, fromlist=['_'])
+    except ImportError as e:
+        raise SkipBenchmark('{} is not available: {}'.format(module_name, e))
+
+def time_callable(func, min_rounds=5, min_time=0.5, max_rounds=1000, warmup=1, sync=False):
+    '''
+    **Input:**
+    - func: callable without arguments.
+    - min_rounds, max_rounds: int bounds of the number of timed calls.
+    - min_time: float of the seconds the timed calls should last at least.
+    - warmup: int of the calls run before the timing.
+    - sync: bool, wait for the cuda queue after every call.
+
+    **Output:**
+    - dict of the rounds and of the min, max, mean, stddev, median and iqr of the calls in milliseconds.
+    '''
+    for _ in range(warmup):
+        func()
+    if sync:
+        torch.cuda.synchronize()
+    times = []
+    start = time.perf_counter_ns()
+    while len(times) < max_rounds and (len(times) < min_rounds or time.perf_counter_ns() - start < min_time * 1e9):
+        t0 = time.perf_counter_ns()
+        func()
+        if sync:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter_ns() - t0)
+    times = np.array(times, dtype=np.float64) / 1e6
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'rounds': len(times), 'min_ms': float(times.min()), 'max_ms': float(times.max()),
+            'mean_ms': float(times.mean()), 'stddev_ms': float(times.std()), 'median_ms': float(median),
+            'iqr_ms': float(q3 - q1)}
+
+def machine_info():
+    ''' dict describing the host and the library versions, stored with the results. '''
+    return {'node': platform.node(), 'machine': platform.machine(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'torch': torch.__version__, 'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None}
+
+def run_benchmarks(benchmarks, cfgs, min_rounds=5, min_time=0.5, log=print):
+    '''
+    **Input:**
+    - benchmarks: OrderedDict of name -> setup from get_benchmarks.
+    - cfgs: configuration passed to every setup.
+    - min_rounds, min_time: see time_callable.
+    - log: callable printing the progress, or None.
+
+    **Output:**
+    - OrderedDict of name -> stats of time_callable, or {'skipped': reason}.
+    '''
+    sync = torch.cuda.is_available() and getattr(cfgs, 'device', 'cpu').startswith('cuda')
+    results = OrderedDict()
+    for name, setup in benchmarks.items():
+        try:
+            func = setup(cfgs)
+        except SkipBenchmark as e:
+            results[name] = {'skipped': str(e)}
+        else:
+            results[name] = time_callable(func, min_rounds=min_rounds, min_time=min_time, sync=sync)
+        if log is not None:
+            log(format_results(OrderedDict([(name, results[name])]), header=len(results) == 1))
+    return results
+
+def save_results(path, results, config=None):
+    ''' Write the results with the machine info and config as a json baseline. '''
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as handle:
+        json.dump({'machine_info': machine_info(), 'config': config or dict(), 'benchmarks': results}, handle, indent=2)
+
+def load_results(path):
+    with open(path, 'r') as handle:
+        return json.load(handle)
+
+def compare_results(results, baseline, threshold=0.2, stat='median_ms'):
+    '''
+    **Input:**
+    - results: OrderedDict of run_benchmarks.
+    - baseline: dict of load_results.
+    - threshold: float, a benchmark regressed if it is more than (1 + threshold) times slower than the baseline.
+    - stat: string of the compared statistic.
+
+    **Output:**
+    - list of (name, baseline ms, current ms, ratio, status) with status in 'ok', 'faster', 'REGRESSION',
+      'new' or 'skipped'; baseline or current ms is None when missing.
+    '''
+    rows = []
+    reference = baseline['benchmarks']
+    for name, stats in results.items():
+        before = reference.get(name, dict()).get(stat)
+        after = stats.get(stat)
+        if after is None:
+            rows.append((name, before, None, None, 'skipped'))
+        elif before is None:
+            rows.append((name, None, after, None, 'new'))
+        else:
+            ratio = after / before
+            status = 'REGRESSION' if ratio > 1 + threshold else 'faster' if ratio < 1 / (1 + threshold) else 'ok'
+            rows.append((name, before, after, ratio, status))
+    return rows
+
+def format_results(results, header=True):
+    ''' Text table of run_benchmarks. '''
+    lines = ['{:<36s} {:>7s} {:>10s} {:>10s} {:>10s} {:>10s}'.format(
+        'benchmark', 'rounds', 'min ms', 'median ms', 'mean ms', 'iqr ms')] if header else []
+    for name, stats in results.items():
+        if 'skipped' in stats:
+            lines.append('{:<36s} skipped: {}'.format(name, stats['skipped']))
+        else:
+            lines.append('{:<36s} {:>7d} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                name, stats['rounds'], stats['min_ms'], stats['median_ms'], stats['mean_ms'], stats['iqr_ms']))
+    return '\n'.join(lines)
+
+def format_comparison(rows):
+    ''' Text table of compare_results. '''
+    lines = ['{:<36s} {:>12s} {:>12s} {:>8s}  {}'.format('benchmark', 'baseline ms', 'current ms', 'ratio', 'status')]
+    for name, before, after, ratio, status in rows:
+        lines.append('{:<36s} {:>12s} {:>12s} {:>8s}  {}'.format(
+            name, '-' if before is None else '{:.3f}'.format(before), '-' if after is None else '{:.3f}'.format(after),
+            '-' if ratio is None else '{:.2f}'.format(ratio), status))
+    return '\n'.join(lines)
+
+def random_rotations(num, rng):
+    '''
+    **Input:**
+    - num: int of the number of rotations.
+    - rng: np.random.Generator.
+
+    **Output:**
+    - np.array of shape (num, 3, 3) of float64 of uniformly random rotation matrices.
+    '''
+    q = rng.normal(size=(num, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+                     2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+                     2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1).reshape((num, 3, 3))
+
+def synthetic_depth(width=1280, height=720, fx=913.232, fy=912.452, cx=628.847, cy=350.771, num_objects=12,
+                    table_depth=0.55, seed=0):
+    '''
+    Depth image of a table seen from above with boxes and spheres on it.
+
+    **Input:**
+    - width, height, fx, fy, cx, cy: the camera resolution and intrinsics, the robot camera by default.
+    - num_objects: int of the number of objects.
+    - table_depth: float of the distance of the table to the camera in meters.
+    - seed: int of the random seed.
+
+    **Output:**
+    - np.array of shape (height, width) of uint16 of the depths in millimeters, with a few dropped pixels.
+    '''
+    rng = np.random.default_rng(seed)
+    x = ((np.arange(width) - cx) / fx)[np.newaxis, :]
+    y = ((np.arange(height) - cy) / fy)[:, np.newaxis]
+    depths = np.full((height, width), table_depth)
+    for _ in range(num_objects):
+        center = rng.uniform([-0.15, -0.12], [0.15, 0.12])
+        size = rng.uniform(0.02, 0.08)
+        top = table_depth - rng.uniform(0.03, 0.15)
+        if rng.random() < 0.5:
+            inside = (np.abs(x * top - center[0]) < size) & (np.abs(y * top - center[1]) < size)
+            surface = np.where(inside, top, np.inf)
+        else:
+            r2 = (x * top - center[0]) ** 2 + (y * top - center[1]) ** 2
+            surface = np.where(r2 < size ** 2, top + size - np.sqrt(np.maximum(size ** 2 - r2, 0)), np.inf)
+        depths = np.minimum(depths, surface)
+    depths += rng.normal(scale=0.001, size=depths.shape)
+    depths[rng.random(depths.shape) < 0.02] = 0
+    return np.round(depths * 1000).astype(np.uint16)
+
+def depth_to_cloud(depths, fx=913.232, fy=912.452, cx=628.847, cy=350.771, z_range=(0.2, 0.65)):
+    ''' (N, 3) float32 points of the pixels of depths in z_range, the reference pinhole deprojection. '''
+    height, width = depths.shape
+    v, u = np.nonzero((depths > z_range[0] * 1000) & (depths < z_range[1] * 1000))
+    z = depths[v, u].astype(np.float32) / 1000.0
+    return np.stack([(u - cx) / fx * z, (v - cy) / fy * z, z], axis=1).astype(np.float32)
+
+def synthetic_grasp_array(num_grasps, points=None, seed=0):
+    '''
+    **Input:**
+    - num_grasps: int of the number of grasps.
+    - points: optional np.array of shape (N, 3), the grasp centers are sampled among them.
+    - seed: int of the random seed.
+
+    **Output:**
+    - np.array of shape (num_grasps, 17) of float32 of grasps in the GraspGroup layout
+      [score, width, height, depth, rotation (9), center (3), object_id].
+    '''
+    rng = np.random.default_rng(seed)
+    ggarray = np.zeros((num_grasps, 17), dtype=np.float32)
+    ggarray[:, 0] = rng.random(num_grasps)
+    ggarray[:, 1] = rng.uniform(0.04, 0.11, num_grasps)
+    ggarray[:, 2] = 0.03
+    ggarray[:, 3] = rng.choice([0.005, 0.01, 0.02, 0.03, 0.04], num_grasps)
+    ggarray[:, 4:13] = random_rotations(num_grasps, rng).reshape((num_grasps, 9))
+    if points is None:
+        ggarray[:, 13:16] = rng.uniform([-0.15, -0.12, 0.4], [0.15, 0.12, 0.55], (num_grasps, 3))
+    else:
+        ggarray[:, 13:16] = points[rng.integers(0, len(points), num_grasps)]
+    ggarray[:, 16] = -1
+    return ggarray
+
+class _SparseCoords():
+    ''' The coordinates of a sparse tensor, all decode_grasp_preds reads of end_points['sinput']. '''
+    def __init__(self, C):
+        self.C = C
+
+def synthetic_end_points(batch_size=1, num_points=20000, num_seed=1024, num_angle=48, num_depth=5, feature_dim=512,
+                         device='cpu', seed=0):
+    '''
+    Inference outputs of MinkowskiGraspNet with random values, in the shapes decode_grasp_preds expects.
+
+    **Input:**
+    - batch_size: int of the number of clouds.
+    - num_points: int of the number of voxels of every cloud.
+    - num_seed, num_angle, num_depth, feature_dim: the sizes of the network.
+    - device: string of the torch device.
+    - seed: int of the random seed.
+
+    **Output:**
+    - dict of the end_points.
+    '''
+    generator = torch.Generator().manual_seed(seed)
+    rand = lambda *size: torch.rand(size, generator=generator)
+    B, Ns, A, D = batch_size, num_seed, num_angle, num_depth
+    coords = torch.cat([torch.arange(B).repeat_interleave(num_points).unsqueeze(1),
+                        torch.randint(0, 200, (B * num_points, 3), generator=generator)], dim=1).int()
+    views = torch.nn.functional.normalize(rand(B, Ns, 3) - 0.5, dim=2)
+    end_points = {'sinput': _SparseCoords(coords.to(device)),
+                  'stage1_objectness_pred': rand(B * num_points, 2),
+                  'stage2_seed_inds': torch.randint(0, num_points, (B, Ns), generator=generator),
+                  'stage2_seed_xyz': rand(B, Ns, 3) * 0.3,
+                  'stage2_view_xyz': views,
+                  'stage2_view_inds': torch.randint(0, 300, (B, Ns), generator=generator),
+                  'stage2_view_scores': rand(B, Ns),
+                  'stage3_grasp_scores': rand(B, Ns, A, D),
+                  'stage3_normalized_grasp_widths': rand(B, Ns, A, D),
+                  'stage3_grasp_features': rand(B, Ns, 2 * A * D + feature_dim),
+                  'before_generator': rand(B, Ns, feature_dim),
+                  'point_features': rand(B, Ns, feature_dim)}
+    return {key: value if key == 'sinput' else value.to(device) for key, value in end_points.items()}
+
+def synthetic_templates(keys, num_points=2000, seed=0):
+    '''
+    **Input:**
+    - keys: list of strings of the hand template keys '<grasp type name>_<width in cm>'.
+    - num_points: int of the number of points of every template.
+    - seed: int of the random seed.
+
+    **Output:**
+    - dict of key -> np.array of shape (num_points, 3) of float32, points in a hand sized box.
+    '''
+    rng = np.random.default_rng(seed)
+    return {key: rng.uniform([-0.12, -0.06, -0.04], [0.02, 0.06, 0.04], (num_points, 3)).astype(np.float32)
+            for key in dict.fromkeys(keys)}
@@ -0,0 +1,200 @@
+import io
+import numpy as np
+import torch
+
+# columns of the saved feature matrix, in order; the 1-d ones take one column each
+FEATURE_COLUMNS = ('stage3_grasp_scores', 'grasp_preds_features', 'stage3_grasp_features', 'before_generator',
+                   'point_features', 'view_inds', 'view_score', 'point_id', 'grasp_angles', 'grasp_depths', 'if_flip')
+
+class GraspFeatureBatch():
+    ''' Per-grasp features of the two-fingers grasps as a structure of named columns.
+
+        The columns are np.array or torch.Tensor of shape (M, ...) sharing their first dimension. Selecting
+        grasps with an index, a mask or a slice only composes a row index into the shared columns; the rows
+        of a column are gathered on its device when it is read, so a column that is never read is never
+        copied. Columns added with with_column() are stored per selected grasp instead.
+    '''
+    __slots__ = ('_sources', '_index', '_columns')
+
+    def __init__(self, sources, index=None, columns=None):
+        '''
+        **Input:**
+        - sources: dict of name -> array of shape (M, ...), all of the same backend and device.
+        - index: optional int array of shape (N,) of the rows of the grasps in sources, all the rows if None.
+        - columns: optional dict of name -> array of shape (N, ...) of per grasp columns.
+        '''
+        self._sources = sources
+        self._index = index
+        self._columns = dict() if columns is None else columns
+
+    def _any_source(self):
+        return next(iter(self._sources.values()))
+
+    @property
+    def is_torch(self):
+        return torch.is_tensor(self._any_source())
+
+    @property
+    def device(self):
+        return self._any_source().device if self.is_torch else None
+
+    @property
+    def names(self):
+        ''' Names of the columns, in the order of the saved feature matrix. '''
+        present = set(self._sources) | set(self._columns)
+        return [name for name in FEATURE_COLUMNS if name in present] + \
+               sorted(name for name in present if name not in FEATURE_COLUMNS)
+
+    def __len__(self):
+        if self._index is not None:
+            return len(self._index)
+        return len(self._any_source())
+
+    def __contains__(self, name):
+        return name in self._sources or name in self._columns
+
+    def __getattr__(self, name):
+        # only called for names that are not slots or methods
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self.column(name)
+        except KeyError:
+            raise AttributeError(name)
+
+    def column(self, name):
+        '''
+        **Input:**
+        - name: string of the column.
+
+        **Output:**
+        - array of shape (N, ...) of the column for the selected grasps.
+        '''
+        if name in self._columns:
+            return self._columns[name]
+        source = self._sources[name]
+        return source if self._index is None else source[self._index]
+
+    def _selection(self, key):
+        # key as an int index of the backend of the columns
+        if isinstance(key, (int, np.integer)):
+            key = np.array([key])
+        elif isinstance(key, slice):
+            key = np.arange(len(self))[key]
+        if torch.is_tensor(key):
+            if key.dtype == torch.bool:
+                key = torch.nonzero(key).flatten()
+            return key.to(self.device) if self.is_torch else key.cpu().numpy()
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = np.ascontiguousarray(key, dtype=np.int64)
+        return torch.from_numpy(key).to(self.device) if self.is_torch else key
+
+    def __getitem__(self, key):
+        ''' Column of a string key, otherwise the GraspFeatureBatch of the selected grasps; an int keeps one row. '''
+        if isinstance(key, str):
+            return self.column(key)
+        selection = self._selection(key)
+        index = selection if self._index is None else self._index[selection]
+        columns = {name: values[selection] for name, values in self._columns.items()}
+        return GraspFeatureBatch(self._sources, index, columns)
+
+    def with_column(self, name, values):
+        '''
+        **Input:**
+        - name: string of the column.
+        - values: array of shape (N, ...), converted to the backend and device of the batch.
+
+        **Output:**
+        - GraspFeatureBatch with the column added or replaced, the batch itself is left unchanged.
+        '''
+        if self.is_torch:
+            values = torch.as_tensor(np.asarray(values) if not torch.is_tensor(values) else values, device=self.device)
+        else:
+            values = values.cpu().numpy() if torch.is_tensor(values) else np.asarray(values)
+        assert len(values) == len(self), 'column {} has {} rows for {} grasps'.format(name, len(values), len(self))
+        columns = dict(self._columns)
+        columns[name] = values
+        sources = {k: v for k, v in self._sources.items() if k != name}
+        if len(sources) == 0:
+            return GraspFeatureBatch(columns)
+        return GraspFeatureBatch(sources, self._index, columns)
+
+    def compact(self):
+        ''' GraspFeatureBatch of the gathered columns of the selected grasps only. '''
+        return GraspFeatureBatch({name: self.column(name) for name in self.names})
+
+    def to(self, device):
+        ''' torch GraspFeatureBatch on device, only the rows of the selected grasps are moved. '''
+        columns = dict()
+        for name in self.names:
+            values = self.column(name)
+            columns[name] = (values if torch.is_tensor(values) else torch.from_numpy(np.ascontiguousarray(values))).to(device)
+        return GraspFeatureBatch(columns)
+
+    def numpy(self):
+        ''' np.array GraspFeatureBatch of the selected grasps. '''
+        columns = dict()
+        for name in self.names:
+            values = self.column(name)
+            columns[name] = values.cpu().numpy() if torch.is_tensor(values) else values
+        return GraspFeatureBatch(columns)
+
+    def depth_classes(self):
+        ''' Two-fingers depth classes of the grasps, the depths in centimeters. '''
+        depths = self.column('grasp_depths')
+        return (depths * 100 + 0.1).long() if torch.is_tensor(depths) else (depths * 100 + 0.1).astype(int)
+
+    def to_matrix(self):
+        '''
+        **Output:**
+        - np.array of shape (N, C) of float32 of the columns side by side in the order of FEATURE_COLUMNS,
+          the layout of the saved feature matrices.
+        '''
+        batch = self.numpy()
+        columns = [batch.column(name).reshape((len(batch), -1)).astype(np.float32) for name in batch.names]
+        return np.concatenate(columns, axis=1)
+
+    def record(self, i=0):
+        '''
+        **Input:**
+        - i: int of the grasp.
+
+        **Output:**
+        - dict of the json serializable features of the grasp, as saved in the grasp information.
+        '''
+        row = self[i].numpy()
+        record = dict()
+        record['grasp_angles'] = int(row.column('grasp_angles')[0] + 0.1)
+        record['grasp_depths'] = int(row.depth_classes()[0])
+        for name in ('stage3_grasp_scores', 'grasp_preds_features', 'stage3_grasp_features', 'before_generator', 'point_features'):
+            record[name] = row.column(name)[0].tolist()
+        record['point_id'] = int(row.column('point_id')[0])
+        record['view_inds'] = int(row.column('view_inds')[0])
+        record['view_score'] = float(row.column('view_score')[0])
+        if 'if_flip' in row:
+            record['if_flip'] = bool(row.column('if_flip')[0])
+        return record
+
+    def tobytes(self):
+        ''' Binary serialization of the columns of the selected grasps, as an npz archive. '''
+        buffer = io.BytesIO()
+        batch = self.numpy()
+        np.savez(buffer, **{name: batch.column(name) for name in batch.names})
+        return buffer.getvalue()
+
+    @classmethod
+    def frombytes(cls, data):
+        ''' np.array GraspFeatureBatch of the output of tobytes(). '''
+        with np.load(io.BytesIO(data)) as archive:
+            return cls({name: archive[name] for name in archive.files})
+
+    @classmethod
+    def cat(cls, batches):
+        ''' GraspFeatureBatch of the grasps of all batches, which must have the same columns and backend. '''
+        batches = [batch for batch in batches if batch is not None]
+        names = batches[0].names
+        if batches[0].is_torch:
+            return cls({name: torch.cat([batch.column(name) for batch in batches], dim=0) for name in names})
+        return cls({name: np.concatenate([batch.column(name) for batch in batches], axis=0) for name in names})
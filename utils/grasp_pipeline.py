@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+import traceback
+import numpy as np
+
+def depth_changed(depths_a, depths_b, min_diff=10, max_ratio=0.01):
+    ''' If more than max_ratio of the pixels valid in both uint16 depth images moved by more than min_diff (mm).
+
+        Without any pixel valid in both, e.g. a blocked camera, there is nothing to compare and the scene counts
+        as unchanged, otherwise a plan would never be handed out.
+    '''
+    valid = (depths_a > 0) & (depths_b > 0)
+    if not valid.any():
+        return False
+    diff = np.abs(depths_a.astype(np.int32) - depths_b.astype(np.int32)) > min_diff
+    return diff[valid].mean() > max_ratio
+
+def run_stages(item, stages):
+    ''' Run the stages in sequence on the calling thread.
+
+        Returns (plan, item): plan is None if a stage rejected the item, and item is the last one seen,
+        so the caller can still visualize what was rejected.
+    '''
+    for stage in stages:
+        result = stage(item)
+        if result is None:
+            return None, item
+        item = result
+    return item, item
+
+class GraspPipeline():
+    ''' Perception and planning workers that prepare the next pick while the arm executes the current one.
+
+        capture() grabs a frame, then every stage(item) -> item or None runs on its own thread, joined to
+        the next by a bounded queue; a stage returning None rejects the candidate set and a new frame is
+        captured. The motion loop takes plans with get_plan() and calls scene_changed() as soon as a pick
+        has left the scene, which captures a fresh frame and drops every plan of the frames before it.
+        An exception of capture() or a stage is printed and a new frame is captured; after max_failures
+        consecutive exceptions of the same step the workers stop and get_plan re-raises the last one.
+    '''
+    def __init__(self, capture, stages, is_stale=None, max_pending=1, max_failures=3):
+        '''
+        **Input:**
+        - capture: callable returning a new frame.
+        - stages: list of callables, each taking the output of the previous one (the frame for the first).
+        - is_stale: optional callable(plan) -> bool, checked by get_plan before a plan is handed out.
+        - max_pending: int of the maximum number of items waiting between two stages.
+        - max_failures: int of the number of consecutive exceptions of capture() or of a stage that stops the pipeline.
+        '''
+        self.capture = capture
+        self.stages = stages
+        self.is_stale = is_stale
+        self.epoch = 0
+        self.capture_request = threading.Event()
+        self.queues = [queue.Queue(maxsize=max_pending) for _ in range(len(stages) + 1)]
+        self.max_failures = max_failures
+        # consecutive exceptions of capture() (index 0) and of every stage
+        self.failures = [0] * (len(stages) + 1)
+        self.error = None
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._capture_loop, daemon=True)] + \
+                       [threading.Thread(target=self._stage_loop, args=(i,), daemon=True) for i in range(len(self.stages))]
+        for thread in self.threads:
+            thread.start()
+        self.capture_request.set()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def scene_changed(self):
+        ''' Drop the plans of the current frames and capture a new one. '''
+        self.epoch += 1
+        self.capture_request.set()
+
+    def get_plan(self, timeout=None):
+        ''' Block until a plan of the current scene is ready. Raises queue.Empty after timeout seconds,
+            or the exception that stopped the pipeline.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.error is not None:
+                raise self.error
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.time())
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                epoch, plan = self.queues[-1].get(timeout=wait)
+            except queue.Empty:
+                continue
+            if epoch != self.epoch:
+                continue
+            if self.is_stale is not None and self.is_stale(plan):
+                print('Scene changed, replanning')
+                self.scene_changed()
+                continue
+            return plan
+
+    def _put(self, i, item):
+        while self.running:
+            try:
+                self.queues[i].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if item[0] != self.epoch:
+                    return
+
+    def _call(self, step, fn, *args):
+        ''' fn(*args), or None if it raised. The max_failures-th consecutive exception of a step stops the workers. '''
+        try:
+            result = fn(*args)
+        except Exception as e:
+            traceback.print_exc()
+            self.failures[step] += 1
+            if self.failures[step] >= self.max_failures:
+                self.error = e
+                self.running = False
+            return None
+        self.failures[step] = 0
+        return result
+
+    def _capture_loop(self):
+        while self.running:
+            if not self.capture_request.wait(timeout=0.1):
+                continue
+            self.capture_request.clear()
+            epoch = self.epoch
+            frame = self._call(0, self.capture)
+            if frame is None:
+                self.capture_request.set()
+                continue
+            self._put(0, (epoch, frame))
+
+    def _stage_loop(self, i):
+        while self.running:
+            try:
+                epoch, item = self.queues[i].get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if epoch != self.epoch:
+                continue
+            result = self._call(i + 1, self.stages[i], item)
+            if result is None:
+                self.capture_request.set()
+                continue
+            self._put(i + 1, (epoch, result))
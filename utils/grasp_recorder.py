@@ -0,0 +1,87 @@
+import os
+import json
+import queue
+import atexit
+import threading
+import numpy as np
+import cv2
+
+_GRASP_RECORDER = None
+
+def grasp_group_rows(ggarray, object_ids):
+    ''' (N,17) float64 copy of the rows of a two-fingers GraspGroup with the object ids in the last column,
+        [score, width, height, depth, rotation(9), translation(3), object id].
+    '''
+    rows = np.array(ggarray.grasp_group_array[:, :17], dtype=np.float64)
+    rows[:, 16] = np.asarray(object_ids, dtype=np.float64).reshape(-1)
+    return rows
+
+class GraspRecorder():
+    ''' Background writer of grasp sessions.
+
+        submit() only enqueues references to the arrays of a session; a writer thread saves every array
+        as <name>.npy, color.png and depth.png, and last information.json, the small metadata, which is
+        renamed into place so a session directory is only picked up by update_data.py once complete.
+        The queue holds at most max_pending sessions, submit() only waits if the disk falls that far behind.
+    '''
+    def __init__(self, max_pending=4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, save_path, information, arrays=None, color=None, depth=None):
+        '''
+        **Input:**
+        - save_path: string of the session directory.
+        - information: dict of json serializable metadata, saved as information.json.
+        - arrays: dict of name -> np.array, saved as <name>.npy. They must not be modified after the call.
+        - color: np.array of shape (H, W, 3) of the uint8 BGR camera image (or an RGB float image in [0, 1]), saved as color.png.
+        - depth: np.array of shape (H, W) of the uint16 depth, saved as depth.png.
+        '''
+        self.queue.put((save_path, information, arrays or dict(), color, depth))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                print('GraspRecorder: failed to save {}: {}'.format(item[0], e))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, save_path, information, arrays, color, depth):
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(save_path, name + '.npy'), array)
+        if color is not None:
+            if color.dtype != np.uint8:
+                color = (cv2.cvtColor(color, cv2.COLOR_RGB2BGR) * 255.0).astype(np.float32)
+            cv2.imwrite(os.path.join(save_path, 'color.png'), color)
+        if depth is not None:
+            cv2.imwrite(os.path.join(save_path, 'depth.png'), depth)
+        json_path = os.path.join(save_path, 'information.json')
+        with open(json_path + '.tmp', 'w') as handle:
+            handle.write(json.dumps(information))
+        os.replace(json_path + '.tmp', json_path)
+        print('Saved successfully')
+
+    def flush(self):
+        ''' Wait until every submitted session is on disk. '''
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+def get_grasp_recorder():
+    ''' GraspRecorder shared by the whole process, started on first use. '''
+    global _GRASP_RECORDER
+    if _GRASP_RECORDER is None:
+        _GRASP_RECORDER = GraspRecorder()
+    return _GRASP_RECORDER
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+def find_sessions(paths):
+    '''
+    **Input:**
+    - paths: list of strings of session directories or of directories holding them at any depth.
+
+    **Output:**
+    - sorted list of the session directories, the directories holding a depth.png.
+    '''
+    sessions = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if 'depth.png' in files:
+                sessions.append(root)
+    return sorted(sessions)
+
+def load_session(session_dir):
+    '''
+    **Input:**
+    - session_dir: string of a directory saved by the GraspRecorder.
+
+    **Output:**
+    - dict with the uint16 'depths', the uint8 BGR 'colors' (None if missing), the 'information' dict
+      (empty if missing) and the 'path' of the session.
+    '''
+    depths = cv2.imread(os.path.join(session_dir, 'depth.png'), cv2.IMREAD_UNCHANGED)
+    if depths is None:
+        raise IOError('cannot read the depth image of {}'.format(session_dir))
+    colors = cv2.imread(os.path.join(session_dir, 'color.png'), cv2.IMREAD_COLOR)
+    information = dict()
+    json_path = os.path.join(session_dir, 'information.json')
+    if os.path.exists(json_path):
+        with open(json_path) as handle:
+            information = json.load(handle)
+    return {'depths': depths, 'colors': colors, 'information': information, 'path': session_dir}
+
+class ReplayFrame():
+    ''' Frame of a ReplayFrames, with the attributes of a FrameRing frame. '''
+    def __init__(self, seq, timestamp, depths, colors, path):
+        self.ring = None
+        self.slot = 0
+        self.seq = seq
+        self.timestamp = timestamp
+        self.depths = depths
+        self.colors = colors
+        self.path = path
+
+    def is_valid(self):
+        return True
+
+    def copy(self):
+        colors = None if self.colors is None else np.copy(self.colors)
+        return ReplayFrame(self.seq, self.timestamp, np.copy(self.depths), colors, self.path)
+
+class ReplayFrames():
+    ''' Stand-in of a FrameRing reader that publishes the frames of recorded sessions.
+
+        Every wait_for_frame() publishes the next recorded frame, stamped with the current time, so the
+        capture code of the robot scripts runs unchanged. Without loop, wait_for_frame() raises
+        TimeoutError once every session has been published, like a camera that stopped.
+    '''
+    def __init__(self, sessions, loop=False):
+        '''
+        **Input:**
+        - sessions: list of dicts of load_session.
+        - loop: bool, start again from the first session after the last one.
+        '''
+        if len(sessions) == 0:
+            raise ValueError('no session to replay')
+        self.name = 'replay'
+        self.sessions = sessions
+        self.loop = loop
+        self.latest = None
+        self.published = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def exhausted(self):
+        return not self.loop and self.published >= len(self.sessions)
+
+    def latest_seq(self):
+        return 0 if self.latest is None else self.latest.seq
+
+    def _publish(self):
+        with self.lock:
+            if self.exhausted():
+                raise TimeoutError('no new frame in {}, all {} sessions were replayed'.format(self.name, len(self.sessions)))
+            session = self.sessions[self.published % len(self.sessions)]
+            self.published += 1
+            self.latest = ReplayFrame(self.published, time.time(), session['depths'], session['colors'], session['path'])
+            return self.latest
+
+    def read(self, seq=None):
+        if self.latest is None or (seq is not None and seq != self.latest.seq):
+            return None
+        return self.latest
+
+    def read_copy(self, seq=None):
+        frame = self.read(seq)
+        return None if frame is None else frame.copy()
+
+    def wait_for_frame(self, after_seq=0, newer_than=None, timeout=5.0, poll_interval=0.002):
+        return self._publish()
+
+    def wait_for_stable_frame(self, newer_than=None, min_diff=10, max_ratio=0.01, timeout=3.0):
+        # a recorded scene is still
+        return self._publish().copy()
+
+    def close(self):
+        pass
+
+class ReplayRobot():
+    ''' Stand-in of UR_Camera_Gripper that does not move, every motion takes motion_time seconds.
+
+        grasp_and_throw() calls on_throw half way through, as the arm leaves the view of the global camera.
+    '''
+    def __init__(self, motion_time=0.0):
+        self.motion_time = motion_time
+        self.calls = OrderedDict()
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def movel(self, *args, **kwargs):
+        self._call('movel')
+
+    def movej(self, *args, **kwargs):
+        self._call('movej')
+
+    def stopj(self, *args, **kwargs):
+        self._call('stopj')
+
+    def gripper_home(self, *args, **kwargs):
+        self._call('gripper_home')
+
+    def open_gripper(self, *args, **kwargs):
+        self._call('open_gripper')
+
+    def is_program_running(self):
+        return False
+
+    def ready_pose(self):
+        return np.eye(4)
+
+    def grasp_and_throw(self, *args, on_throw=None, **kwargs):
+        self._call('grasp_and_throw')
+        time.sleep(self.motion_time / 2)
+        if on_throw is not None:
+            on_throw()
+        time.sleep(self.motion_time / 2)
+        return np.eye(4)
+
+    def close(self):
+        pass
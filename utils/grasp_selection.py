@@ -0,0 +1,73 @@
+import numpy as np
+import torch
+
+def flip_grasp_rotations(ggarray, axis, negative=True, columns=(1, 3), candidates=None):
+    '''
+    Negate in place two rotation columns of the grasps whose tcp axis points the wrong way.
+
+    **Input:**
+    - ggarray: np.array or torch.Tensor of shape (N, 17) in the GraspGroup layout, rotation in columns 4:13.
+    - axis: (row, col) of the rotation entry that decides the flip.
+    - negative: bool, flip the grasps whose entry is negative if True, positive otherwise.
+    - columns: (start, end) of the rotation columns that are negated.
+    - candidates: optional bool array of shape (N,) of the grasps that may be flipped.
+
+    **Output:**
+    - ggarray, flipped in place.
+    - if_flip: bool array of shape (N,) of the backend and device of ggarray.
+    '''
+    entry = ggarray[:, 4 + 3 * axis[0] + axis[1]]
+    if_flip = entry < 0 if negative else entry > 0
+    if candidates is not None:
+        if_flip = if_flip & (torch.as_tensor(candidates, device=ggarray.device) if torch.is_tensor(ggarray) else candidates)
+    flip_columns = [4 + 3 * row + col for row in range(3) for col in range(*columns)]
+    # multiply by a sign per grasp, no masked gather and no sync with the host
+    sign = 1 - 2 * if_flip.to(ggarray.dtype) if torch.is_tensor(ggarray) else 1 - 2 * if_flip.astype(ggarray.dtype)
+    ggarray[:, flip_columns] *= sign[:, None]
+    return ggarray, if_flip
+
+def sort_by_score(scores, k=None):
+    '''
+    **Input:**
+    - scores: np.array or torch.Tensor of shape (N,).
+    - k: optional int, number of grasps to keep.
+
+    **Output:**
+    - int array of shape (min(N, k),) of the best grasps, by decreasing score, ties kept in order.
+    '''
+    if torch.is_tensor(scores):
+        index = torch.sort(scores, descending=True, stable=True)[1]
+    else:
+        index = np.argsort(-scores, kind='stable')
+    return index if k is None else index[:k]
+
+def select_top_per_type(grasp_types, max_nums):
+    '''
+    Keep the first max_nums[t] grasps of every type t, for grasps already sorted by score.
+
+    **Input:**
+    - grasp_types: int np.array or torch.Tensor of shape (N,) of the types, in [0, len(max_nums)).
+    - max_nums: int array of shape (T,) of the cap of every type.
+
+    **Output:**
+    - int array of shape (M,) of the kept grasps, grouped by increasing type and in order within a type.
+    '''
+    if torch.is_tensor(grasp_types):
+        grasp_types = grasp_types.long()
+        max_nums = torch.as_tensor(max_nums, device=grasp_types.device).long()
+        order = torch.sort(grasp_types, stable=True)[1]
+        counts = torch.bincount(grasp_types, minlength=len(max_nums))
+        starts = torch.cumsum(counts, 0) - counts
+        sorted_types = grasp_types[order]
+        rank = torch.arange(len(order), device=order.device) - starts[sorted_types]
+        return order[rank < max_nums[sorted_types]]
+    grasp_types = np.asarray(grasp_types).astype(np.int64)
+    max_nums = np.asarray(max_nums)
+    # the stable sort of 16 bits integers is a radix sort, linear in N whatever the number of types
+    sort_types = grasp_types.astype(np.int16) if len(max_nums) <= np.iinfo(np.int16).max else grasp_types
+    order = np.argsort(sort_types, kind='stable')
+    counts = np.bincount(grasp_types, minlength=len(max_nums))
+    starts = np.cumsum(counts) - counts
+    sorted_types = grasp_types[order]
+    rank = np.arange(len(order)) - starts[sorted_types]
+    return order[rank < max_nums[sorted_types]]
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import threading
+import itertools
+from collections import deque, OrderedDict
+import numpy as np
+
+_TRACER = None
+
+class Span():
+    ''' Context manager timing a block with the monotonic clock, see Tracer.span. '''
+    __slots__ = ('tracer', 'name', 'start', 'ok')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.ok = True
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        tracer = self.tracer
+        tracer.records.append((self.name, self.start, end - self.start, threading.get_ident(),
+                               self.ok and exc_type is None, next(tracer.sequence)))
+        return False
+
+class _NoSpan():
+    ''' Span of a disabled Tracer. '''
+    __slots__ = ('ok',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class Tracer():
+    ''' Spans of the stages of the grasp loop in a ring buffer of the latest capacity records.
+
+        A record is (name, start ns, duration ns, thread id, ok, sequence number) on the time.perf_counter_ns
+        clock; ok is False for a span left by an exception or marked failed, e.g. a stage that rejected its frame.
+        Appending to the deque is atomic, so the spans of all threads go to one buffer without a lock.
+        Spans time the host: asynchronous cuda work is accounted to the span that waits for it.
+    '''
+    def __init__(self, capacity=100000, enabled=True):
+        self.records = deque(maxlen=capacity)
+        self.enabled = enabled
+        self.origin = time.perf_counter_ns()
+        self.sequence = itertools.count()
+        self.csv_written = -1
+        self.pid = os.getpid()
+
+    def span(self, name):
+        '''
+        **Input:**
+        - name: string of the span.
+
+        **Output:**
+        - context manager recording the span on exit, set its ok attribute to False to mark it failed.
+        '''
+        if not self.enabled:
+            return _NoSpan()
+        return Span(self, name)
+
+    def traced(self, name, stage):
+        '''
+        **Input:**
+        - name: string of the span.
+        - stage: callable(item) -> item or None.
+
+        **Output:**
+        - callable running stage in a span, which is marked failed if stage returns None.
+        '''
+        def run(item):
+            with self.span(name) as span:
+                result = stage(item)
+                span.ok = result is not None
+            return result
+        return run
+
+    def snapshot(self):
+        ''' List of the records in the buffer, oldest first. '''
+        while True:
+            try:
+                return list(self.records)
+            except RuntimeError:
+                # the deque was appended to by another thread during the copy
+                continue
+
+    def clear(self):
+        self.records.clear()
+
+    def summary(self, records=None):
+        '''
+        **Input:**
+        - records: optional list of records, the buffer if None.
+
+        **Output:**
+        - OrderedDict of span name -> dict of the count, failed count and the mean, p50, p95, p99 and max
+          durations in milliseconds, in the order of the first record of every name.
+        '''
+        durations = OrderedDict()
+        failed = dict()
+        for name, start, duration, thread, ok, seq in (self.snapshot() if records is None else records):
+            durations.setdefault(name, []).append(duration)
+            failed[name] = failed.get(name, 0) + int(not ok)
+        summary = OrderedDict()
+        for name, values in durations.items():
+            values = np.array(values, dtype=np.float64) / 1e6
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[name] = {'count': len(values), 'failed': failed[name], 'mean_ms': float(values.mean()),
+                             'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+                             'max_ms': float(values.max())}
+        return summary
+
+    def export_chrome_trace(self, path):
+        ''' Write the buffer as a Chrome trace json, to open in chrome://tracing or Perfetto. '''
+        events = [{'name': name, 'ph': 'X', 'pid': self.pid, 'tid': thread, 'ts': (start - self.origin) / 1000.0,
+                   'dur': duration / 1000.0, 'args': {'ok': ok}}
+                  for name, start, duration, thread, ok, seq in self.snapshot()]
+        with open(path + '.tmp', 'w') as handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+        os.replace(path + '.tmp', path)
+
+    def write_csv(self, path, max_bytes=64 * 1024 * 1024):
+        '''
+        Append the records not written yet to a csv file, which is moved to path.1 once larger than max_bytes.
+
+        **Input:**
+        - path: string of the csv file.
+        - max_bytes: int of the size after which the file is rolled over.
+        '''
+        records = [record for record in self.snapshot() if record[5] > self.csv_written]
+        if len(records) == 0:
+            return
+        if os.path.exists(path) and os.path.getsize(path) > max_bytes:
+            os.replace(path, path + '.1')
+        new_file = not os.path.exists(path)
+        with open(path, 'a') as handle:
+            if new_file:
+                handle.write('name,start_ms,duration_ms,thread,ok\n')
+            for name, start, duration, thread, ok, seq in records:
+                handle.write('{},{:.3f},{:.3f},{},{:d}\n'.format(name, (start - self.origin) / 1e6, duration / 1e6,
+                                                                 thread, ok))
+        self.csv_written = max(record[5] for record in records)
+
+def format_summary(summary):
+    ''' Text table of Tracer.summary(). '''
+    lines = ['{:<24s} {:>6s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}'.format(
+        'span', 'count', 'failed', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+    for name, stats in summary.items():
+        lines.append('{:<24s} {:>6d} {:>6d} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            name, stats['count'], stats['failed'], stats['mean_ms'], stats['p50_ms'], stats['p95_ms'],
+            stats['p99_ms'], stats['max_ms']))
+    return '\n'.join(lines)
+
+def get_tracer():
+    ''' Tracer shared by the process, enabled unless the GRASP_TRACE environment variable is 0. '''
+    global _TRACER
+    if _TRACER is None:
+        _TRACER = Tracer(enabled=os.environ.get('GRASP_TRACE', '1') != '0')
+    return _TRACER
+
+def span(name):
+    ''' Span of the shared tracer, e.g. with span('net_forward'): ... '''
+    return get_tracer().span(name)
@@ -6,10 +6,7 @@ def transform_point_cloud(cloud, transform, format='4x4'):
     if format == '3x3':
         cloud_transformed = np.dot(transform, cloud.T).T
     elif format == '4x4' or format == '3x4':
-        ones = np.ones(cloud.shape[0])[:, np.newaxis]
-        cloud_ = np.concatenate([cloud, ones], axis=1)
-        cloud_transformed = np.dot(transform, cloud_.T).T
-        cloud_transformed = cloud_transformed[:, :3]
+        cloud_transformed = np.dot(cloud, transform[:3, :3].T) + transform[:3, 3]
     return cloud_transformed
 
 def compute_point_dists(A, B):
@@ -81,4 +78,78 @@ def batch_viewpoint_params_to_matrix(batch_towards, batch_angle):
     R1 = R1.reshape([-1,3,3])
     R2 = np.stack([axis_x, axis_y, axis_z], axis=-1)
     matrix = np.matmul(R2, R1)
-    return matrix.astype(np.float32)
\ No newline at end of file
+    return matrix.astype(np.float32)
+
+
+def voxel_keys(coords):
+    ''' int64 key of every row of the integer voxel coords (N, D), equal keys for equal rows.
+
+        The coords are offset by their minimum and packed in mixed radix of their extent along each axis.
+    '''
+    coords = np.asarray(coords)
+    # per column reductions, much faster than along axis 0 of the (N, D) array
+    lower = np.array([coords[:, i].min() for i in range(coords.shape[1])], dtype=np.int64)
+    upper = np.array([coords[:, i].max() for i in range(coords.shape[1])], dtype=np.int64)
+    extents = upper - lower + 1
+    if np.prod(extents.astype(np.float64)) >= 2.0 ** 63:
+        raise ValueError('voxel coords span too many voxels to be packed in 64 bits')
+    keys = coords[:, 0].astype(np.int64) - lower[0]
+    for i in range(1, coords.shape[1]):
+        keys *= extents[i]
+        keys += coords[:, i]
+        keys -= lower[i]
+    return keys
+
+def sparse_quantize(coords, reduction='first', feats=None, return_inverse=False):
+    '''
+    **Input:**
+    - coords: np.array of shape (N, D) of the integer voxel coords of the points.
+    - reduction: 'first' keeps the first point of every voxel, 'random' a random one, 'mean' the first one
+      and averages feats over the voxel.
+    - feats: np.array of shape (N, C), only used by 'mean'.
+    - return_inverse: bool, whether to return the voxel of every point.
+
+    **Output:**
+    - idxs: np.array of shape (M,) of int64 of one point per voxel, in the order of first appearance of the
+      voxels, so coords[idxs] are unique, like the indices of ME.utils.sparse_quantize(coords, return_index=True).
+    - feats: np.array of shape (M, C) of the mean feats of every voxel, only for 'mean'.
+    - inverse: np.array of shape (N,) of int64, idxs[inverse] is the kept point of the voxel of every point,
+      only if return_inverse.
+    '''
+    if reduction not in ('first', 'random', 'mean'):
+        raise ValueError('Unknown reduction {}, only support \'first\', \'random\' or \'mean\'.'.format(reduction))
+    if reduction == 'mean' and feats is None:
+        raise ValueError('reduction \'mean\' needs feats.')
+    num_points = len(coords)
+    if num_points == 0:
+        idxs = np.zeros(0, dtype=np.int64)
+        ret = (idxs,)
+        if reduction == 'mean':
+            ret += (np.asarray(feats)[:0],)
+        if return_inverse:
+            ret += (np.zeros(0, dtype=np.int64),)
+        return ret[0] if len(ret) == 1 else ret
+    keys = voxel_keys(coords)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]))
+    # voxels in order of their first point
+    firsts = np.minimum.reduceat(order, starts)
+    voxel_order = np.argsort(firsts)
+    idxs = firsts[voxel_order]
+    if reduction == 'random':
+        counts = np.diff(np.append(starts, num_points))
+        picks = starts + (np.random.random(len(starts)) * counts).astype(np.int64)
+        idxs = order[picks][voxel_order]
+    ret = (idxs,)
+    if reduction == 'mean':
+        counts = np.diff(np.append(starts, num_points))
+        sums = np.add.reduceat(np.asarray(feats)[order], starts, axis=0)
+        ret += ((sums / counts[:, np.newaxis].astype(sums.dtype))[voxel_order],)
+    if return_inverse:
+        voxel_rank = np.empty(len(starts), dtype=np.int64)
+        voxel_rank[voxel_order] = np.arange(len(starts))
+        inverse = np.empty(num_points, dtype=np.int64)
+        inverse[order] = np.repeat(voxel_rank, np.diff(np.append(starts, num_points)))
+        ret += (inverse,)
+    return ret[0] if len(ret) == 1 else ret
@@ -1,16 +1,15 @@
 import torch
 import numpy as np
 
+from grasp_features import GraspFeatureBatch
+
 def transform_point_cloud(cloud, transform, format='4x4'):
     if not (format == '3x3' or format == '4x4' or format == '3x4'):
         raise ValueError('Unknown transformation format, only support \'3x3\' or \'4x4\' or \'3x4\'.')
     if format == '3x3':
         cloud_transformed = torch.matmul(transform, cloud.T).T
     elif format == '4x4' or format == '3x4':
-        ones = cloud.new_ones(cloud.size(0), device=cloud.device).unsqueeze(-1)
-        cloud_ = torch.cat([cloud, ones], dim=1)
-        cloud_transformed = torch.matmul(transform, cloud_.T).T
-        cloud_transformed = cloud_transformed[:, :3]
+        cloud_transformed = torch.matmul(cloud, transform[:3, :3].T) + transform[:3, 3]
     return cloud_transformed
 
 def huber_loss(error, delta=1.0):
@@ -67,4 +66,172 @@ def generate_grasp_views(N=300, phi=(np.sqrt(5)-1)/2, center=np.zeros(3), r=1):
         yi = np.sqrt(1 - zi**2) * np.sin(2 * i * np.pi * phi)
         points.append([xi, yi, zi])
     points = r * np.array(points) + center
-    return torch.from_numpy(points.astype(np.float32))
\ No newline at end of file
+    return torch.from_numpy(points.astype(np.float32))
+
+_CANONICAL_FEATURE_INDEX = dict()
+
+def get_canonical_feature_index(num_angle=48, num_depth=5, device=None):
+    """ Gather index of the grasp_preds_features canonicalization.
+        Returns:
+            index: (2, num_angle, 2*num_angle*num_depth) int64 table, index[if_flip, angle]
+                gives the source position of every output feature
+    """
+    key = (num_angle, num_depth, None if device is None else str(device))
+    if key not in _CANONICAL_FEATURE_INDEX:
+        block = num_angle * num_depth
+        j = np.arange(2 * block)
+        shift = num_depth * np.arange(num_angle).reshape(1, -1, 1)
+        flip = (block // 2) * np.arange(2).reshape(-1, 1, 1)
+        index = (j // block) * block + ((j % block + shift) % block + flip) % block
+        _CANONICAL_FEATURE_INDEX[key] = index if device is None else torch.from_numpy(index).to(device)
+    return _CANONICAL_FEATURE_INDEX[key]
+
+def canonicalize_grasp_preds_features(grasp_preds_features, grasp_angles, if_flip, num_angle=48, num_depth=5):
+    """ Bring grasp_preds_features to the frame of the chosen two-finger grasp.
+
+        The score and width blocks (num_angle*num_depth each) are first swapped half for half
+        if the grasp is flipped, then rolled left by grasp_angles*num_depth.
+        Args:
+            grasp_preds_features: numpy array or torch tensor (B, 2*num_angle*num_depth) or (2*num_angle*num_depth,)
+            grasp_angles: int (B,) or scalar, the roll in angle classes
+            if_flip: bool/int (B,) or scalar
+        Returns:
+            the canonicalized features, same type, device and shape as grasp_preds_features
+    """
+    if torch.is_tensor(grasp_preds_features):
+        index = get_canonical_feature_index(num_angle, num_depth, grasp_preds_features.device)
+        grasp_angles = torch.as_tensor(grasp_angles, device=index.device).long() % num_angle
+        if_flip = torch.as_tensor(if_flip, device=index.device).long()
+        return torch.gather(grasp_preds_features, -1, index[if_flip, grasp_angles].expand_as(grasp_preds_features))
+    index = get_canonical_feature_index(num_angle, num_depth)
+    grasp_angles = np.asarray(grasp_angles).astype(np.int64) % num_angle
+    if_flip = np.asarray(if_flip).astype(np.int64)
+    return np.take_along_axis(grasp_preds_features, np.broadcast_to(index[if_flip, grasp_angles], grasp_preds_features.shape), axis=-1)
+
+def sparse_quantize(coords, reduction='first', feats=None, return_inverse=False):
+    ''' torch version of np_utils.sparse_quantize, computed on the device of coords. '''
+    if reduction not in ('first', 'random', 'mean'):
+        raise ValueError('Unknown reduction {}, only support \'first\', \'random\' or \'mean\'.'.format(reduction))
+    if reduction == 'mean' and feats is None:
+        raise ValueError('reduction \'mean\' needs feats.')
+    coords = coords.long()
+    if coords.size(0) == 0:
+        idxs = coords.new_zeros(0)
+        ret = (idxs,)
+        if reduction == 'mean':
+            ret += (feats[:0],)
+        if return_inverse:
+            ret += (coords.new_zeros(0),)
+        return ret[0] if len(ret) == 1 else ret
+    coords = coords - coords.min(dim=0)[0]
+    extents = coords.max(dim=0)[0] + 1
+    if float(torch.prod(extents.double())) >= 2.0 ** 63:
+        raise ValueError('voxel coords span too many voxels to be packed in 64 bits')
+    keys = coords[:, 0].clone()
+    for i in range(1, coords.size(1)):
+        keys = keys * extents[i] + coords[:, i]
+    _, voxels = torch.unique(keys, return_inverse=True)
+    num_voxels = int(voxels.max()) + 1
+    num_points = coords.size(0)
+    point_idxs = torch.arange(num_points, device=coords.device)
+    firsts = torch.full((num_voxels,), num_points, dtype=torch.long, device=coords.device)
+    firsts.scatter_reduce_(0, voxels, point_idxs, reduce='amin')
+    # voxels in order of their first point
+    voxel_order = torch.argsort(firsts)
+    idxs = firsts[voxel_order]
+    if reduction == 'random':
+        ranks = torch.randperm(num_points, device=coords.device)
+        picks = torch.full((num_voxels,), num_points, dtype=torch.long, device=coords.device)
+        picks.scatter_reduce_(0, voxels, ranks, reduce='amin')
+        rank_to_point = torch.empty_like(ranks)
+        rank_to_point[ranks] = point_idxs
+        idxs = rank_to_point[picks][voxel_order]
+    ret = (idxs,)
+    if reduction == 'mean':
+        counts = torch.bincount(voxels, minlength=num_voxels).to(feats.dtype)
+        sums = feats.new_zeros((num_voxels,) + feats.shape[1:]).index_add_(0, voxels, feats)
+        ret += ((sums / counts.view((-1,) + (1,) * (feats.dim() - 1)))[voxel_order],)
+    if return_inverse:
+        voxel_rank = torch.empty_like(voxel_order)
+        voxel_rank[voxel_order] = torch.arange(num_voxels, device=coords.device)
+        ret += (voxel_rank[voxels],)
+    return ret[0] if len(ret) == 1 else ret
+
+def sparse_collate(coords, feats, labels=None, dtype=torch.int32):
+    ''' ME.utils.sparse_collate without MinkowskiEngine, so that it can run in DataLoader workers.
+
+        Concatenates the lists of coords, feats and labels of the samples, the batch index is prepended
+        as the first column of the coords.
+    '''
+    def to_tensor(x):
+        return torch.from_numpy(x) if isinstance(x, np.ndarray) else x
+    coords = [to_tensor(c) for c in coords]
+    bcoords = torch.cat([torch.cat((c.new_full((c.size(0), 1), i), c), dim=1).to(dtype)
+                         for i, c in enumerate(coords)], dim=0)
+    feats = torch.cat([to_tensor(f) for f in feats], dim=0)
+    if labels is None:
+        return bcoords, feats
+    return bcoords, feats, torch.cat([to_tensor(l) for l in labels], dim=0)
+
+def decode_grasp_preds(end_points, max_grasp_width, grasp_height=0.03):
+    """ Decode the best grasp of every seed of the whole batch at once.
+
+        The score of an angle is the min of its two opposite directions, the best (angle, depth) of a
+        seed maximizes it, on ties the smallest depth then the smallest angle. The clouds without any
+        object seed are skipped.
+        Returns:
+            grasp_preds: (N, 17) [score, width, height, depth, rotation (9), center (3), object_id = -1]
+            batch_ids: (N,) int64, cloud index of every grasp
+            grasp_features: GraspFeatureBatch of the N grasps, a selection of the per seed columns
+    """
+    grasp_scores = end_points['stage3_grasp_scores']  # (B, Ns, A, D)
+    B, Ns, A, D = grasp_scores.size()
+    num_angle = A // 2
+    device = grasp_scores.device
+    # clouds with an object seed, the rows of cloud i in sinput are in the order of its points
+    batch = end_points['sinput'].C[:, 0].long().to(device)
+    rows = torch.argsort(batch, stable=True)
+    counts = torch.bincount(batch, minlength=B)
+    offsets = torch.cumsum(counts, dim=0) - counts
+    objectness_mask = torch.argmax(end_points['stage1_objectness_pred'], dim=1).bool()
+    seed_inds = end_points['stage2_seed_inds']  # (B, Ns)
+    keep = objectness_mask[rows[offsets.unsqueeze(1) + seed_inds]].any(dim=1)  # (B,)
+    batch_ids = torch.where(keep)[0].repeat_interleave(Ns)
+    seed_ids = torch.arange(Ns, device=device).repeat(batch_ids.size(0) // Ns)
+
+    # best angle and depth, depth major flat index for the tie order
+    scores = torch.minimum(grasp_scores[:, :, :num_angle], grasp_scores[:, :, num_angle:])
+    best_scores, best = scores.transpose(2, 3).reshape(B, Ns, -1).max(dim=2)  # (B, Ns)
+    depth_class = best // num_angle
+    angle_class = best % num_angle
+    widths = max_grasp_width * end_points['stage3_normalized_grasp_widths'].view(B, Ns, -1)
+    widths = widths.clamp(max=max_grasp_width)
+    widths_pos = torch.gather(widths, 2, (angle_class * D + depth_class).unsqueeze(2)).squeeze(2)
+    widths_neg = torch.gather(widths, 2, ((angle_class + num_angle) * D + depth_class).unsqueeze(2)).squeeze(2)
+    angles = (angle_class.float() - num_angle // 2) / num_angle * np.pi
+    depths = (depth_class.float() + 1) * 0.01 - 0.01
+    depths[depth_class == 0] = 0.005
+
+    N = batch_ids.size(0)
+    grasp_preds = torch.empty((N, 17), dtype=grasp_scores.dtype, device=device)
+    grasp_preds[:, 0] = best_scores[batch_ids, seed_ids]
+    grasp_preds[:, 1] = (widths_pos + widths_neg)[batch_ids, seed_ids]
+    grasp_preds[:, 2] = grasp_height
+    grasp_preds[:, 3] = depths[batch_ids, seed_ids]
+    view_xyz = end_points['stage2_view_xyz'][batch_ids, seed_ids]
+    grasp_preds[:, 4:13] = batch_viewpoint_params_to_matrix(-view_xyz, angles[batch_ids, seed_ids]).view(N, 9)
+    grasp_preds[:, 13:16] = end_points['stage2_seed_xyz'][batch_ids, seed_ids]
+    grasp_preds[:, 16] = -1
+
+    stage3_grasp_features = end_points['stage3_grasp_features'].reshape(B * Ns, -1)
+    sources = {'stage3_grasp_scores': grasp_scores.reshape(B * Ns, -1),
+               'grasp_preds_features': stage3_grasp_features[:, :2 * A * D],
+               'stage3_grasp_features': stage3_grasp_features[:, 2 * A * D:],
+               'before_generator': end_points['before_generator'].reshape(B * Ns, -1),
+               'point_features': end_points['point_features'].reshape(B * Ns, -1),
+               'view_inds': end_points['stage2_view_inds'].reshape(-1),
+               'view_score': end_points['stage2_view_scores'].reshape(-1),
+               'point_id': seed_inds.reshape(-1),
+               'grasp_angles': angle_class.reshape(-1),
+               'grasp_depths': depths.reshape(-1)}
+    return grasp_preds, batch_ids, GraspFeatureBatch(sources, batch_ids * Ns + seed_ids)
@@ -0,0 +1,102 @@
+import os
+import json
+import numpy as np
+import open3d as o3d
+
+class HandTemplateStore():
+    ''' Compiled store of the hand template point clouds.
+
+        The per-width .ply files under meshes/source_pointclouds/voxel_size_<n>/<grasp type>/ are packed
+        once into voxel_size_<n>.npy, the float32 (P,3) points of all templates back to back, and
+        voxel_size_<n>.json, the index table of '<grasp type>_<width>' -> [start, length].
+        The points are memory-mapped on first use and every template is a view into them.
+    '''
+    def __init__(self, pointcloud_path, rebuild=False):
+        ''' Init function.
+            Input:
+                pointcloud_path: [str]
+                        the meshes/source_pointclouds/voxel_size_<n> directory of a hand
+                rebuild: [bool]
+                        if True, repack the .ply files even if the bundle is up to date
+        '''
+        pointcloud_path = os.path.normpath(pointcloud_path)
+        self.pointcloud_path = pointcloud_path
+        self.points_path = pointcloud_path + '.npy'
+        self.index_path = pointcloud_path + '.json'
+        if rebuild or self._is_stale():
+            self.build()
+        with open(self.index_path, 'r', encoding='UTF-8') as f:
+            self.index = json.load(f)
+        self._points = None
+
+    def _is_stale(self):
+        if not (os.path.exists(self.points_path) and os.path.exists(self.index_path)):
+            return True
+        if not os.path.isdir(self.pointcloud_path):
+            return False
+        bundle_mtime = min(os.path.getmtime(self.points_path), os.path.getmtime(self.index_path))
+        return self._source_mtime() > bundle_mtime
+
+    def _source_mtime(self):
+        ''' Newest mtime of the grasp type directories and of the .ply files, a .ply rewritten in place does not
+            touch the mtime of its directory. '''
+        newest = os.path.getmtime(self.pointcloud_path)
+        for grasp_type in os.listdir(self.pointcloud_path):
+            type_path = os.path.join(self.pointcloud_path, grasp_type)
+            if not os.path.isdir(type_path):
+                continue
+            newest = max(newest, os.path.getmtime(type_path))
+            with os.scandir(type_path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.ply'):
+                        newest = max(newest, entry.stat().st_mtime)
+        return newest
+
+    def build(self):
+        ''' Pack the .ply files into the .npy/.json bundle. '''
+        index = dict()
+        points = []
+        start = 0
+        for grasp_type in sorted(os.listdir(self.pointcloud_path)):
+            type_path = os.path.join(self.pointcloud_path, grasp_type)
+            if not os.path.isdir(type_path):
+                continue
+            for name in sorted(os.listdir(type_path)):
+                if not name.endswith('.ply'):
+                    continue
+                template = np.asarray(o3d.io.read_point_cloud(os.path.join(type_path, name)).points, dtype=np.float32)
+                index[grasp_type + '_' + name[:-4]] = [start, len(template)]
+                points.append(template)
+                start += len(template)
+        points = np.concatenate(points, axis=0) if len(points) > 0 else np.zeros((0, 3), dtype=np.float32)
+
+        # write next to the bundle and rename, so readers never see a partial file
+        np.save(self.points_path + '.tmp.npy', np.ascontiguousarray(points))
+        os.replace(self.points_path + '.tmp.npy', self.points_path)
+        with open(self.index_path + '.tmp', 'w') as handle:
+            handle.write(json.dumps(index))
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    @property
+    def points(self):
+        ''' Memory-mapped (P,3) float32 points of all templates. '''
+        if self._points is None:
+            self._points = np.load(self.points_path, mmap_mode='r')
+        return self._points
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, key):
+        ''' Zero-copy (K,3) float32 view of the template points of key. '''
+        start, length = self.index[key]
+        return self.points[start:start + length]